@@ -0,0 +1,16 @@
+CREATE DATABASE IF NOT EXISTS stock_market_app;
+
+USE stock_market_app;
+
+CREATE TABLE IF NOT EXISTS backfill_journal (
+    run_id VARCHAR(64) NOT NULL,
+    symbol VARCHAR(12) NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error VARCHAR(1024),
+    next_attempt_at BIGINT NOT NULL DEFAULT 0,
+    updated_at BIGINT NOT NULL,
+    PRIMARY KEY (run_id, symbol)
+);
+
+-- DROP TABLE backfill_journal;
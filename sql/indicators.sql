@@ -0,0 +1,24 @@
+CREATE DATABASE IF NOT EXISTS stock_market_app;
+
+USE stock_market_app;
+
+CREATE TABLE IF NOT EXISTS indicator_state (
+    symbol VARCHAR(12) NOT NULL,
+    time_window VARCHAR(256) NOT NULL,
+    indicator VARCHAR(32) NOT NULL,
+    last_open_date BIGINT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (symbol, time_window, indicator)
+);
+
+CREATE TABLE IF NOT EXISTS indicator_values (
+    symbol VARCHAR(12) NOT NULL,
+    time_window VARCHAR(256) NOT NULL,
+    indicator VARCHAR(32) NOT NULL,
+    open_date BIGINT NOT NULL,
+    value DOUBLE,
+    PRIMARY KEY (symbol, time_window, indicator, open_date)
+);
+
+-- DROP TABLE indicator_state;
+-- DROP TABLE indicator_values;
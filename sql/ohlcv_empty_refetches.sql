@@ -0,0 +1,14 @@
+CREATE DATABASE IF NOT EXISTS stock_market_app;
+
+USE stock_market_app;
+
+-- Last open_date a gap repair asked yfinance for without getting any bar of
+-- the symbol, so its trailing gap is not planned again
+CREATE TABLE IF NOT EXISTS ohlcv_empty_refetches (
+    symbol VARCHAR(12) NOT NULL,
+    time_window VARCHAR(256) NOT NULL,
+    checked_until BIGINT NOT NULL,
+    PRIMARY KEY (symbol, time_window)
+);
+
+-- DROP TABLE ohlcv_empty_refetches;
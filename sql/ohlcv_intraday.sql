@@ -0,0 +1,53 @@
+CREATE DATABASE IF NOT EXISTS stock_market_app;
+
+USE stock_market_app;
+
+-- One table per intraday time window, partitioned by UTC day of open_date,
+-- or by UTC month for ohlcv_1h, whose bars are kept for years. Bars are only
+-- appended, and old days are removed by dropping their partition.
+-- Partitions are split off p_future ahead of time by data_ingestion.intraday.
+CREATE TABLE IF NOT EXISTS ohlcv_1m (
+    symbol VARCHAR(12) NOT NULL,
+    open_date INT UNSIGNED NOT NULL,
+    open FLOAT NOT NULL,
+    high FLOAT NOT NULL,
+    low FLOAT NOT NULL,
+    close FLOAT NOT NULL,
+    volume BIGINT NOT NULL,
+    PRIMARY KEY (symbol, open_date)
+)
+PARTITION BY RANGE (open_date) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS ohlcv_5m (
+    symbol VARCHAR(12) NOT NULL,
+    open_date INT UNSIGNED NOT NULL,
+    open FLOAT NOT NULL,
+    high FLOAT NOT NULL,
+    low FLOAT NOT NULL,
+    close FLOAT NOT NULL,
+    volume BIGINT NOT NULL,
+    PRIMARY KEY (symbol, open_date)
+)
+PARTITION BY RANGE (open_date) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS ohlcv_1h (
+    symbol VARCHAR(12) NOT NULL,
+    open_date INT UNSIGNED NOT NULL,
+    open FLOAT NOT NULL,
+    high FLOAT NOT NULL,
+    low FLOAT NOT NULL,
+    close FLOAT NOT NULL,
+    volume BIGINT NOT NULL,
+    PRIMARY KEY (symbol, open_date)
+)
+PARTITION BY RANGE (open_date) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- DROP TABLE ohlcv_1m;
+-- DROP TABLE ohlcv_5m;
+-- DROP TABLE ohlcv_1h;
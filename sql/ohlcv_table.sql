@@ -9,9 +9,12 @@ CREATE TABLE IF NOT EXISTS ohlcv_table (
     high FLOAT,
     low FLOAT,
     close FLOAT,
-    volume INT,
+    volume BIGINT,
     open_date BIGINT NOT NULL,
     PRIMARY KEY (symbol, time_window, open_date)
 );
 
+-- Monthly and quarterly volumes are sums of daily volumes and overflow INT
+-- ALTER TABLE ohlcv_table MODIFY volume BIGINT;
+
 -- DROP TABLE ohlcv_table;
\ No newline at end of file
@@ -0,0 +1,20 @@
+CREATE DATABASE IF NOT EXISTS stock_market_app;
+
+USE stock_market_app;
+
+CREATE TABLE IF NOT EXISTS ohlcv_watermarks (
+    symbol VARCHAR(12) NOT NULL,
+    time_window VARCHAR(256) NOT NULL,
+    last_open_date BIGINT NOT NULL,
+    PRIMARY KEY (symbol, time_window)
+);
+
+-- Seed the watermarks from the bars already stored
+INSERT INTO ohlcv_watermarks (symbol, time_window, last_open_date)
+SELECT symbol, time_window, MAX(open_date)
+FROM ohlcv_table
+GROUP BY symbol, time_window
+ON DUPLICATE KEY UPDATE
+    last_open_date = GREATEST(last_open_date, VALUES(last_open_date));
+
+-- DROP TABLE ohlcv_watermarks;
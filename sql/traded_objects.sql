@@ -8,7 +8,11 @@ CREATE TABLE IF NOT EXISTS traded_objects (
     exchange VARCHAR(256),
     exchange_short_name VARCHAR(256),
     object_type VARCHAR(256) NOT NULL,
+    delisted_at BIGINT,
     PRIMARY KEY (symbol, object_type)
 );
 
+-- Symbols dropped from the Financial Modeling Prep lists are soft-deleted
+-- ALTER TABLE traded_objects ADD COLUMN delisted_at BIGINT;
+
 -- DROP TABLE traded_objects;
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""Stage-level benchmarks of the MarketTradeDataCollector batch path.
+
+Every stage of a batch runs on synthetic yf.download frames, batch by batch
+as the collector does, with writes going to a SQLite stand-in for MySQL.
+Each symbol count runs in a fresh process so peak RSS is not inherited from
+a previous run. Results are compared with the stored baselines.
+
+Run with `PYTHONPATH=src python -m benchmarks.bench_ingestion_stages`.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from sqlalchemy import text
+
+from data_ingestion.market_trade_data_collection import BATCH_SIZE_DEFAULT, \
+    FetchedBatch, MarketTradeDataCollector
+from data_ingestion.ohlcv_diff import diff_ohlcv
+from data_ingestion.yfinance_frames import YFINANCE_PRICE_COLUMNS
+from tests.conftest import TABLE_DEFINITIONS
+from utils.data_models import TradedObject
+from utils.db_helpers import DbPoolConfig, dispose_mysql_connection, \
+    get_mysql_connection, save_new_traded_objects_in_db, \
+    save_trade_market_data_in_db
+from utils.enums import TradedObjectType, TradeTimeWindow, YFinanceIntervals
+
+TRADING_DAYS_PER_YEAR = 252
+SYMBOL_COUNTS_DEFAULT = [100, 1_000, 10_000]
+YEARS_DEFAULT = 5
+# Slower or larger than the baseline by more than this fraction is a regression
+TOLERANCE_DEFAULT = 0.5
+BASELINE_PATH = Path(__file__).parent / "baselines" / "ingestion_stages.json"
+STAGES = ["normalize", "clean_existing_symbols", "diff", "prepare", "write"]
+# Share of the stored bars whose close changed since they were written
+UPDATED_FRACTION = 0.01
+
+
+@dataclass
+class StageResult:
+    """ Totals of one stage over every batch of a run """
+    stage: str
+    symbols: int
+    rows: int
+    wall_seconds: float
+    peak_rss_mb: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.stage}/{self.symbols}"
+
+
+def _reset_peak_rss() -> None:
+    # Writing 5 to clear_refs resets VmHWM on Linux; elsewhere the peak
+    # stays the peak of the whole process
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024
+
+
+def build_download(symbols: List[str], number_of_days: int,
+                   seed: int = 0) -> DataFrame:
+    """ Builds a frame shaped like yf.download(..., group_by='ticker') """
+    rng = np.random.default_rng(seed=seed)
+    dates = pd.bdate_range("2019-01-02", periods=number_of_days, name="Date")
+    columns = pd.MultiIndex.from_product([symbols, YFINANCE_PRICE_COLUMNS],
+                                         names=["Ticker", "Price"])
+    values = rng.uniform(1, 500, (number_of_days, len(columns)))
+    return DataFrame(values, index=dates, columns=columns)
+
+
+def build_stored_data(fetched_data: DataFrame, seed: int = 0) -> DataFrame:
+    """ Stored bars of a daily run: all but the last fetched day, with a few
+    closes revised since they were written """
+    rng = np.random.default_rng(seed=seed)
+    stored_data = fetched_data[fetched_data["open_date"]
+                               < fetched_data["open_date"].max()].copy()
+    updated = rng.random(stored_data.shape[0]) < UPDATED_FRACTION
+    stored_data.loc[updated, "close"] = stored_data.loc[updated, "close"] * 1.01
+    return stored_data
+
+
+class _Stopwatch:
+    """ Adds up the wall time and peak RSS of each stage over the batches """
+
+    def __init__(self, symbols: int):
+        self.results = {stage: StageResult(stage=stage, symbols=symbols, rows=0,
+                                           wall_seconds=0.0, peak_rss_mb=0.0)
+                        for stage in STAGES}
+
+    def time(self, stage: str, rows: int, function: Callable[[], object]):
+        _reset_peak_rss()
+        start = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - start
+        result = self.results[stage]
+        result.rows += rows
+        result.wall_seconds += elapsed
+        result.peak_rss_mb = max(result.peak_rss_mb, _peak_rss_mb())
+        return output
+
+
+def run_stages(number_of_symbols: int, years: int = YEARS_DEFAULT,
+               batch_size: int = BATCH_SIZE_DEFAULT) -> List[StageResult]:
+    """ Runs every stage over `number_of_symbols` symbols, one batch at a time """
+    number_of_days = years * TRADING_DAYS_PER_YEAR
+    symbols = [f"SYM{index}" for index in range(number_of_symbols)]
+    stopwatch = _Stopwatch(number_of_symbols)
+
+    with tempfile.TemporaryDirectory() as database_dir, \
+            patch("utils.db_helpers._get_database_uri",
+                  return_value=f"sqlite:///{database_dir}/stock_market_app.db"):
+        dispose_mysql_connection()
+        engine = get_mysql_connection(DbPoolConfig(pool_size=1, max_overflow=0))
+        with engine.connect() as connection:
+            for table_definition in TABLE_DEFINITIONS:
+                connection.execute(text(table_definition))
+            connection.commit()
+        save_new_traded_objects_in_db({
+            TradedObject(name=symbol, symbol=symbol, exchange="NASDAQ",
+                         exchange_short_name="NASDAQ",
+                         object_type=TradedObjectType.STOCK)
+            for symbol in symbols})
+
+        try:
+            collector = MarketTradeDataCollector(batch_size=batch_size,
+                                                 lookback_period_days=1)
+            for batch_index, start in enumerate(range(0, number_of_symbols,
+                                                      batch_size)):
+                download = build_download(symbols[start:start + batch_size],
+                                          number_of_days, seed=batch_index)
+                _run_batch(stopwatch, collector, download)
+            # Every symbol now has bars, so this is the daily run's filter
+            watermarks = {symbol: int(time.time()) for symbol in symbols}
+            stopwatch.time("clean_existing_symbols", number_of_symbols,
+                           lambda: collector._clean_existing_symbols(symbols,
+                                                                     watermarks))
+        finally:
+            dispose_mysql_connection()
+    return list(stopwatch.results.values())
+
+
+def _run_batch(stopwatch: _Stopwatch, collector: MarketTradeDataCollector,
+               download: DataFrame) -> None:
+    symbols = download.columns.get_level_values(0).unique().tolist()
+    rows = download.shape[0] * len(symbols)
+
+    fetched_data = stopwatch.time(
+        "normalize", rows,
+        lambda: MarketTradeDataCollector._fetch_yfinance_data(
+            symbols, YFinanceIntervals.FIVE_YEARS, TradeTimeWindow.DAILY,
+            downloader=lambda *args, **kwargs: download))
+    fetched_batch = FetchedBatch(fetched_data=fetched_data,
+                                 stored_data=build_stored_data(fetched_data),
+                                 time_window=TradeTimeWindow.DAILY,
+                                 symbols=symbols)
+    stopwatch.time(
+        "diff", rows,
+        lambda: diff_ohlcv(fetched_data=fetched_batch.fetched_data.dropna(),
+                           stored_data=fetched_batch.stored_data))
+    # A back fill writes every fetched bar, which is the heaviest write
+    ohlcv_batch = stopwatch.time(
+        "prepare", rows,
+        lambda: collector._prepare_symbols_for_update(
+            data=fetched_data, time_window=TradeTimeWindow.DAILY))
+    stopwatch.time("write", len(ohlcv_batch),
+                   lambda: save_trade_market_data_in_db(ohlcv_batch))
+
+
+def _quiet_logging() -> None:
+    # Per-batch progress logs would dominate the output
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_in_subprocess(number_of_symbols: int, years: int,
+                      batch_size: int) -> List[StageResult]:
+    with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_quiet_logging) as executor:
+        return executor.submit(run_stages, number_of_symbols, years,
+                               batch_size).result()
+
+
+def load_baselines(path: Path = BASELINE_PATH) -> Dict[str, StageResult]:
+    if not path.exists():
+        return {}
+    results = [StageResult(**result)
+               for result in json.loads(path.read_text())["results"]]
+    return {result.key: result for result in results}
+
+
+def save_baselines(results: List[StageResult], years: int,
+                   path: Path = BASELINE_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    merged = load_baselines(path)
+    merged.update({result.key: result for result in results})
+    path.write_text(json.dumps({
+        "years": years,
+        "results": [asdict(result) for result in
+                    sorted(merged.values(), key=lambda result: (
+                        result.symbols, STAGES.index(result.stage)))]
+    }, indent=2) + "\n")
+
+
+def find_regressions(results: List[StageResult],
+                     baselines: Dict[str, StageResult],
+                     tolerance: float = TOLERANCE_DEFAULT
+                     ) -> List[Tuple[StageResult, str]]:
+    """ Stages slower or using more memory than their baseline allows """
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result.key)
+        if baseline is None:
+            continue
+        if result.rows_per_second < baseline.rows_per_second / (1 + tolerance):
+            regressions.append((result, f"{result.rows_per_second:,.0f} rows/s "
+                                        f"vs {baseline.rows_per_second:,.0f}"))
+        if result.peak_rss_mb > baseline.peak_rss_mb * (1 + tolerance):
+            regressions.append((result, f"{result.peak_rss_mb:,.1f} MB peak "
+                                        f"vs {baseline.peak_rss_mb:,.1f}"))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, nargs="+",
+                        default=SYMBOL_COUNTS_DEFAULT)
+    parser.add_argument("--years", type=int, default=YEARS_DEFAULT)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE_DEFAULT)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE_DEFAULT)
+    parser.add_argument("--update-baselines", action="store_true",
+                        help="store these results as the new baselines")
+    args = parser.parse_args(argv)
+
+    baselines = load_baselines()
+    results: List[StageResult] = []
+    for number_of_symbols in args.symbols:
+        print(f"{number_of_symbols} symbols x {args.years} years")
+        for result in run_in_subprocess(number_of_symbols, args.years,
+                                        args.batch_size):
+            baseline = baselines.get(result.key)
+            change = (f"{result.wall_seconds / baseline.wall_seconds - 1:+7.1%}"
+                      if baseline is not None and baseline.wall_seconds > 0
+                      else "    new")
+            print(f"{result.stage:>24}: {result.wall_seconds:9.3f} s {change}  "
+                  f"{result.peak_rss_mb:8.1f} MB peak  "
+                  f"{result.rows_per_second:14,.0f} rows/s")
+            results.append(result)
+
+    if args.update_baselines:
+        save_baselines(results, args.years)
+        print(f"Stored baselines in {BASELINE_PATH}")
+        return 0
+
+    regressions = find_regressions(results, baselines, args.tolerance)
+    for result, reason in regressions:
+        print(f"Regression in {result.key}: {reason}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Compares the per-row OHLCV objects with the columnar OHLCVBatch.
+
+Run with `PYTHONPATH=src python -m benchmarks.bench_ohlcv_batch`.
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from utils.data_models import OHLCV, OHLCVBatch
+from utils.enums import TradeTimeWindow
+
+TRADING_DAYS_PER_YEAR = 252
+WRITE_CHUNK_SIZE = 5000
+
+
+def build_frame(number_of_symbols: int, number_of_days: int) -> DataFrame:
+    rng = np.random.default_rng(seed=0)
+    rows = number_of_symbols * number_of_days
+    close = rng.uniform(1, 500, rows)
+    return DataFrame({
+        "symbol": np.repeat([f"SYM{index}" for index in range(number_of_symbols)],
+                            number_of_days),
+        "open_date": np.tile(1_600_000_000 + 86_400 * np.arange(number_of_days),
+                             number_of_symbols),
+        "open": close * 0.99,
+        "high": close * 1.01,
+        "low": close * 0.98,
+        "close": close,
+        "volume": rng.integers(0, 10_000_000, rows),
+        "time_window": TradeTimeWindow.DAILY.value.yfinance_notation
+    })
+
+
+def per_row_objects(data: DataFrame) -> int:
+    """ Previous path: one OHLCV per bar, then one dict per bar for the writer """
+    ohlcv_list: List[OHLCV] = []
+    for symbol, group in data.groupby('symbol'):
+        ohlcv_list.extend(OHLCV(
+            symbol=str(symbol),
+            time_window=TradeTimeWindow.DAILY,
+            open=ohlcv['open'],
+            high=ohlcv['high'],
+            low=ohlcv['low'],
+            close=ohlcv['close'],
+            volume=ohlcv['volume'],
+            open_date=ohlcv['open_date']
+        ) for _, ohlcv in group.iterrows())
+    values = [
+        {
+            "symbol": ohlcv.symbol,
+            "time_window": ohlcv.time_window.value.yfinance_notation,
+            "open": ohlcv.open,
+            "high": ohlcv.high,
+            "low": ohlcv.low,
+            "close": ohlcv.close,
+            "volume": ohlcv.volume,
+            "open_date": ohlcv.open_date
+        }
+        for ohlcv in ohlcv_list
+    ]
+    return len(values)
+
+
+def columnar_batch(data: DataFrame) -> int:
+    """ Current path: one OHLCVBatch, parameter rows built chunk by chunk """
+    ohlcv_batch = OHLCVBatch.from_frame(data=data,
+                                        time_window=TradeTimeWindow.DAILY)
+    return sum(len(chunk) for chunk in
+               ohlcv_batch.iter_parameter_chunks(WRITE_CHUNK_SIZE))
+
+
+def measure(function: Callable[[DataFrame], int],
+            data: DataFrame) -> Tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args()
+
+    data = build_frame(args.symbols, args.years * TRADING_DAYS_PER_YEAR)
+    print(f"{len(data)} rows ({args.symbols} symbols x {args.years} years)")
+    for name, function in (("per-row OHLCV", per_row_objects),
+                           ("OHLCVBatch", columnar_batch)):
+        elapsed, peak_mb = measure(function, data)
+        print(f"{name:>14}: {elapsed:8.3f} s  {peak_mb:8.1f} MB peak  "
+              f"{len(data) / elapsed:12,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Micro-benchmarks for normalising yf.download frames.
+
+Run with `PYTHONPATH=src python -m benchmarks.bench_yfinance_normalization`.
+"""
+import argparse
+import time
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from data_ingestion.yfinance_frames import normalize_yfinance_frame
+from utils.enums import TradeTimeWindow
+
+TRADING_DAYS_PER_YEAR = 252
+REPEATS = 3
+
+
+def build_download(number_of_symbols: int, number_of_days: int) -> DataFrame:
+    """ Builds a frame shaped like yf.download(..., group_by='ticker') """
+    rng = np.random.default_rng(seed=0)
+    dates = pd.bdate_range("2000-01-03", periods=number_of_days, name="Date")
+    tickers = [f"SYM{index}" for index in range(number_of_symbols)]
+    prices = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+    columns = pd.MultiIndex.from_product([tickers, prices],
+                                         names=["Ticker", "Price"])
+    values = rng.uniform(1, 500, (number_of_days, len(columns)))
+    return DataFrame(values, index=dates, columns=columns)
+
+
+def legacy_normalization(data: DataFrame, symbols: List[str]) -> DataFrame:
+    """ Previous _fetch_yfinance_data body, kept for comparison """
+    df = (data.stack(level=0, future_stack=True)
+          .reset_index().rename(columns={"level_1": "symbol"}))
+    df["open_date"] = df["Date"].apply(lambda x: int(x.timestamp()))
+    df["time_window"] = TradeTimeWindow.DAILY.value.yfinance_notation
+    return df[["Ticker", 'open_date', "Open",
+               "High", "Low", "Close", "Volume", "time_window"]].rename(
+        columns={"Open": "open", "High": "high", "Low": "low", "Close": "close",
+                 "Volume": "volume", "Ticker": "symbol"}
+    ).dropna()
+
+
+def vectorized_normalization(data: DataFrame, symbols: List[str]) -> DataFrame:
+    return normalize_yfinance_frame(data=data, symbols=symbols,
+                                    time_window=TradeTimeWindow.DAILY)
+
+
+def best_time(function: Callable[[DataFrame, List[str]], DataFrame],
+              data: DataFrame, symbols: List[str]) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(data, symbols)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args()
+
+    number_of_days = args.years * TRADING_DAYS_PER_YEAR
+    multi_ticker = build_download(args.symbols, number_of_days)
+    single_ticker = build_download(1, number_of_days)
+    layouts = (("multi-ticker", multi_ticker,
+                [f"SYM{index}" for index in range(args.symbols)]),
+               ("single-ticker", single_ticker, ["SYM0"]),
+               ("single-flat", single_ticker.droplevel(0, axis=1), ["SYM0"]))
+
+    for layout, data, symbols in layouts:
+        rows = data.shape[0] * len(symbols)
+        for name, function in (("legacy", legacy_normalization),
+                               ("vectorized", vectorized_normalization)):
+            if (function is legacy_normalization
+                    and not isinstance(data.columns, pd.MultiIndex)):
+                # The previous code only handled two-level columns
+                continue
+            elapsed = best_time(function, data, symbols)
+            print(f"{layout:>13} {name:>10}: {elapsed * 1000:9.2f} ms  "
+                  f"{rows / elapsed:14,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Import time budgets of the job entry points.
+
+Every entry point is imported in a fresh interpreter with `-X importtime`, so
+nothing is cached from an earlier import, and the report is parsed into the
+self and cumulative time of each module. An entry point fails its budget when
+its import takes longer than allowed or loads a module it should only load
+on the code paths that use it.
+
+Run with `PYTHONPATH=src python -m benchmarks.import_time`.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+SOURCE_PATH = Path(__file__).resolve().parents[1]
+RUNS_DEFAULT = 3
+# Budgets are multiplied by this, for machines slower than the usual ones
+BUDGET_SCALE_DEFAULT = 1.0
+
+_REPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$")
+
+
+@dataclass
+class ImportTiming:
+    """ One line of an -X importtime report """
+    module: str
+    self_seconds: float
+    cumulative_seconds: float
+    depth: int
+
+
+@dataclass(frozen=True)
+class ImportBudget:
+    """ Longest import allowed for an entry point and the modules it must
+    not load while importing """
+    module: str
+    max_seconds: float
+    forbidden_modules: Tuple[str, ...] = ()
+
+
+IMPORT_BUDGETS = [
+    # Fetches two lists over HTTP and only touches the database when one
+    # changed
+    ImportBudget(module="data_ingestion.symbol_list_collection", max_seconds=0.4,
+                 forbidden_modules=("pandas", "numpy", "pyarrow", "sqlalchemy",
+                                    "yfinance")),
+    ImportBudget(module="data_ingestion.market_trade_data_collection",
+                 max_seconds=1.8, forbidden_modules=("yfinance",)),
+    ImportBudget(module="data_ingestion.intraday", max_seconds=1.2,
+                 forbidden_modules=("yfinance",)),
+]
+
+
+def parse_importtime(report: str) -> Dict[str, ImportTiming]:
+    """ Timings by module; lines that are not part of the report are skipped """
+    timings = {}
+    for line in report.splitlines():
+        match = _REPORT_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        timings[module] = ImportTiming(module=module,
+                                       self_seconds=int(self_us) / 1e6,
+                                       cumulative_seconds=int(cumulative_us) / 1e6,
+                                       depth=len(indent) // 2)
+    return timings
+
+
+def measure_import(module: str, runs: int = RUNS_DEFAULT) -> Dict[str, ImportTiming]:
+    """ Timings of the fastest of `runs` imports in fresh interpreters """
+    environment = {**os.environ, "PYTHONPATH": str(SOURCE_PATH)}
+    fastest: Optional[Dict[str, ImportTiming]] = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                 f"import {module}"],
+                                capture_output=True, text=True, env=environment,
+                                check=True)
+        timings = parse_importtime(result.stderr)
+        if (fastest is None or timings[module].cumulative_seconds
+                < fastest[module].cumulative_seconds):
+            fastest = timings
+    assert fastest is not None
+    return fastest
+
+
+def check_import_time(budget: ImportBudget, timings: Dict[str, ImportTiming],
+                      scale: float = BUDGET_SCALE_DEFAULT) -> List[str]:
+    """ The import's overrun of its time budget, if any; depends on the host """
+    seconds = timings[budget.module].cumulative_seconds
+    if seconds > budget.max_seconds * scale:
+        return [f"took {seconds:.3f}s, over the budget of "
+                f"{budget.max_seconds * scale:.3f}s"]
+    return []
+
+
+def check_forbidden_modules(budget: ImportBudget,
+                            timings: Dict[str, ImportTiming]) -> List[str]:
+    """ Forbidden modules the import loaded; the same on every host """
+    return [f"loaded {module}" for module in budget.forbidden_modules
+            if module in timings]
+
+
+def check_budget(budget: ImportBudget, timings: Dict[str, ImportTiming],
+                 scale: float = BUDGET_SCALE_DEFAULT) -> List[str]:
+    """ Reasons the import breaks its budget, none when it keeps to it """
+    return (check_import_time(budget, timings, scale)
+            + check_forbidden_modules(budget, timings))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=RUNS_DEFAULT)
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of slowest modules to list per entry point")
+    parser.add_argument("--scale", type=float, default=float(os.environ.get(
+        "IMPORT_TIME_BUDGET_SCALE", BUDGET_SCALE_DEFAULT)))
+    args = parser.parse_args(argv)
+
+    failed = False
+    for budget in IMPORT_BUDGETS:
+        timings = measure_import(budget.module, runs=args.runs)
+        print(f"{budget.module}: "
+              f"{timings[budget.module].cumulative_seconds:.3f}s")
+        for timing in sorted(timings.values(), key=lambda timing: timing.self_seconds,
+                             reverse=True)[:args.top]:
+            print(f"{timing.self_seconds:>10.4f}s self "
+                  f"{timing.cumulative_seconds:>8.4f}s total  {timing.module}")
+        for violation in check_budget(budget, timings, args.scale):
+            failed = True
+            print(f"Budget exceeded by {budget.module}: {violation}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
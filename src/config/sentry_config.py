@@ -4,12 +4,24 @@ import sentry_sdk
 from sentry_sdk.integrations.logging import LoggingIntegration
 import logging
 
+# Ingestion runs sample their own batch spans (see utils.run_metrics) and send
+# them as already sampled transactions, so nothing else is traced by default
+TRACES_SAMPLE_RATE_DEFAULT = 0.0
+
+_initialized = False
+
 
 def init_sentry():
+    # Every job calls this on start; a daemon running many jobs sets up one client
+    global _initialized
+    if _initialized:
+        return
     sentry_logging = LoggingIntegration(level=logging.INFO, event_level=logging.INFO)
     sentry_sdk.init(
         dsn=os.environ.get("SENTRY_DSN"),
         integrations=[sentry_logging],
-        traces_sample_rate=1.0
+        traces_sample_rate=float(os.environ.get("SENTRY_TRACES_SAMPLE_RATE",
+                                                TRACES_SAMPLE_RATE_DEFAULT))
     )
+    _initialized = True
     logging.getLogger(__name__).info("Sentry initialized.")
@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from utils.db_helpers import add_backfill_journal_entries, \
+    delete_backfill_journal, get_backfill_journal, update_backfill_journal_entries
+from utils.enums import BackfillStatus
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS_DEFAULT = 3
+RETRY_BACKOFF_SECONDS_DEFAULT = 60
+MAX_RETRY_BACKOFF_SECONDS_DEFAULT = 15 * 60
+
+
+@dataclass
+class BackfillProgress:
+    """ Snapshot of a back fill run with its throughput since start """
+    total: int
+    completed: int
+    failed: int
+    elapsed_seconds: float
+    completed_this_run: int
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.completed
+
+    @property
+    def symbols_per_second(self) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.completed_this_run / self.elapsed_seconds
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        if self.symbols_per_second == 0:
+            return None
+        return self.remaining / self.symbols_per_second
+
+
+class BackfillJournal:
+    """ Persistent record of the symbols a back fill run has completed.
+
+    Every symbol of a run is journalled as pending, completed or failed with
+    the error and the number of attempts. A run that is started again only
+    gets the symbols that are still pending or whose retry is due, and a new
+    run is planned once nothing is left to do.
+    """
+
+    def __init__(self, run_id: str,
+                 max_attempts: int = MAX_ATTEMPTS_DEFAULT,
+                 retry_backoff_seconds: float = RETRY_BACKOFF_SECONDS_DEFAULT,
+                 max_retry_backoff_seconds: float = MAX_RETRY_BACKOFF_SECONDS_DEFAULT,
+                 clock: Callable[[], float] = time.time):
+        self.run_id = run_id
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.max_retry_backoff_seconds = max_retry_backoff_seconds
+        self._clock = clock
+        self._statuses: Dict[str, BackfillStatus] = {}
+        self._attempts: Dict[str, int] = {}
+        self._next_attempt_at: Dict[str, float] = {}
+        self._completed_at_start = 0
+        self._started_at = clock()
+        self._lock = threading.Lock()
+
+    def start(self, symbols: List[str]) -> List[str]:
+        """ Resumes the run, or plans a new one, and returns the symbols due """
+        journal = get_backfill_journal(self.run_id)
+        self._load(journal.to_dict("records"))
+        if self._statuses and not self._has_open_work():
+            logger.info(f"Back fill run {self.run_id} was finished, planning a "
+                        f"new one.")
+            delete_backfill_journal(self.run_id)
+            self._load([])
+
+        new_symbols = [symbol for symbol in symbols if symbol not in self._statuses]
+        add_backfill_journal_entries(self.run_id, new_symbols)
+        for symbol in new_symbols:
+            self._statuses[symbol] = BackfillStatus.PENDING
+            self._attempts[symbol] = 0
+            self._next_attempt_at[symbol] = 0
+
+        self._completed_at_start = self._count(BackfillStatus.COMPLETED)
+        self._started_at = self._clock()
+        logger.info(f"Back fill run {self.run_id}: {self._completed_at_start} of "
+                    f"{len(self._statuses)} symbols already completed, "
+                    f"{len(new_symbols)} newly planned.")
+        return self.symbols_due()
+
+    def symbols_due(self) -> List[str]:
+        now = self._clock()
+        with self._lock:
+            return [symbol for symbol, status in self._statuses.items()
+                    if status == BackfillStatus.PENDING
+                    or (self._is_retryable(symbol)
+                        and self._next_attempt_at[symbol] <= now)]
+
+    def next_retry_at(self) -> Optional[float]:
+        """ Time of the earliest retry still allowed, None when there is none """
+        with self._lock:
+            retry_times = [self._next_attempt_at[symbol]
+                           for symbol in self._statuses
+                           if self._is_retryable(symbol)]
+        return min(retry_times) if retry_times else None
+
+    def mark_completed(self, symbols: List[str]) -> None:
+        symbols = [symbol for symbol in symbols if symbol in self._statuses]
+        if not symbols:
+            return
+        update_backfill_journal_entries(self.run_id, symbols,
+                                        status=BackfillStatus.COMPLETED)
+        with self._lock:
+            for symbol in symbols:
+                self._statuses[symbol] = BackfillStatus.COMPLETED
+        self._log_progress()
+
+    def mark_failed(self, symbols: List[str], error: Exception) -> None:
+        symbols = [symbol for symbol in symbols if symbol in self._statuses]
+        now = self._clock()
+        # Symbols are grouped by attempt so each group gets its own backoff
+        by_attempts: Dict[int, List[str]] = {}
+        with self._lock:
+            for symbol in symbols:
+                self._attempts[symbol] += 1
+                by_attempts.setdefault(self._attempts[symbol], []).append(symbol)
+
+        for attempts, attempt_symbols in by_attempts.items():
+            next_attempt_at = now + min(
+                self.max_retry_backoff_seconds,
+                self.retry_backoff_seconds * 2 ** (attempts - 1))
+            update_backfill_journal_entries(
+                self.run_id, attempt_symbols, status=BackfillStatus.FAILED,
+                attempts=attempts, last_error=f"{type(error).__name__}: {error}",
+                next_attempt_at=int(next_attempt_at))
+            with self._lock:
+                for symbol in attempt_symbols:
+                    self._statuses[symbol] = BackfillStatus.FAILED
+                    self._next_attempt_at[symbol] = next_attempt_at
+        logger.warning(f"Back fill of {len(symbols)} symbols failed: {error}")
+
+    def progress(self) -> BackfillProgress:
+        with self._lock:
+            completed = self._count(BackfillStatus.COMPLETED)
+            return BackfillProgress(
+                total=len(self._statuses),
+                completed=completed,
+                failed=self._count(BackfillStatus.FAILED),
+                elapsed_seconds=self._clock() - self._started_at,
+                completed_this_run=completed - self._completed_at_start)
+
+    def _log_progress(self) -> None:
+        progress = self.progress()
+        eta = (f"{progress.eta_seconds / 60:.1f} min"
+               if progress.eta_seconds is not None else "unknown")
+        logger.info(f"Back fill progress: {progress.completed} of "
+                    f"{progress.total} symbols completed, {progress.failed} "
+                    f"failed, {progress.symbols_per_second:.2f} symbols/s, "
+                    f"ETA {eta}.")
+
+    def _load(self, entries: List[Dict]) -> None:
+        with self._lock:
+            self._statuses = {entry["symbol"]: BackfillStatus(entry["status"])
+                              for entry in entries}
+            self._attempts = {entry["symbol"]: int(entry["attempts"])
+                              for entry in entries}
+            self._next_attempt_at = {entry["symbol"]: float(entry["next_attempt_at"])
+                                     for entry in entries}
+
+    def _has_open_work(self) -> bool:
+        return any(status == BackfillStatus.PENDING
+                   or self._is_retryable(symbol)
+                   for symbol, status in self._statuses.items())
+
+    def _is_retryable(self, symbol: str) -> bool:
+        return (self._statuses[symbol] == BackfillStatus.FAILED
+                and self._attempts[symbol] < self.max_attempts)
+
+    def _count(self, status: BackfillStatus) -> int:
+        return sum(1 for value in self._statuses.values() if value == status)
@@ -0,0 +1,222 @@
+import datetime as dt
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from utils.db_helpers import SECONDS_PER_DAY
+from utils.market_calendar import MarketCalendar
+
+MAX_SYMBOLS_PER_REQUEST_DEFAULT = 100
+# Stored sessions a request may download again, so that gaps close to each
+# other are repaired by one request instead of several
+MAX_EXTRA_SESSIONS_DEFAULT = 5
+
+_EPOCH = dt.date(1970, 1, 1)
+
+
+def session_days(open_dates: np.ndarray) -> np.ndarray:
+    """ Days since the epoch of the sessions that daily bars belong to.
+
+    Daily bars open at midnight of their day, which yfinance reports in the
+    exchange's timezone or in UTC. Half a day later is on that day in UTC
+    either way, for any exchange less than twelve hours from UTC.
+    """
+    return (np.asarray(open_dates, dtype=np.int64) + SECONDS_PER_DAY // 2) // SECONDS_PER_DAY
+
+
+def day_to_date(day: int) -> dt.date:
+    return _EPOCH + dt.timedelta(days=int(day))
+
+
+@dataclass
+class GapIndex:
+    """ Runs of consecutive sessions without a stored bar, one row per run.
+
+    Runs are kept as positions in `session_days`, the sessions that were
+    checked, so their length in sessions is a subtraction.
+    """
+    session_days: np.ndarray
+    symbols: np.ndarray
+    first_sessions: np.ndarray
+    last_sessions: np.ndarray
+
+    @classmethod
+    def empty(cls, session_days: np.ndarray) -> "GapIndex":
+        return cls(session_days=session_days, symbols=np.array([], dtype=object),
+                   first_sessions=np.array([], dtype=np.int64),
+                   last_sessions=np.array([], dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @property
+    def missing_sessions(self) -> np.ndarray:
+        return self.last_sessions - self.first_sessions + 1
+
+    @property
+    def symbols_with_gaps(self) -> int:
+        return len(np.unique(self.symbols))
+
+    def to_frame(self) -> DataFrame:
+        return DataFrame({
+            "symbol": self.symbols,
+            "first_open_date": self.session_days[self.first_sessions] * SECONDS_PER_DAY,
+            "last_open_date": self.session_days[self.last_sessions] * SECONDS_PER_DAY,
+            "missing_sessions": self.missing_sessions
+        })
+
+
+def detect_gaps(bars: DataFrame, calendar: MarketCalendar,
+                start_date: dt.date, end_date: dt.date,
+                empty_refetches: Optional[Dict[str, int]] = None) -> GapIndex:
+    """ Finds the sessions from start_date to end_date that a symbol has no
+    daily bar for.
+
+    `bars` holds the symbol and open_date of the stored bars. Sessions before
+    a symbol's first bar in the window are taken as before its listing, and
+    symbols without any bar are left to the back fill. Bars on days without a
+    session are ignored. Every step works on whole arrays, so checking the
+    universe costs a sort of its bars.
+
+    `empty_refetches` maps symbols to the last open_date a refetch found no
+    bars up to. A trailing gap starting by then is skipped, as the symbol
+    stopped trading or yfinance has nothing for it, until a newer bar is
+    stored.
+    """
+    days = np.array([(session.date - _EPOCH).days
+                     for session in calendar.sessions(start_date, end_date)],
+                    dtype=np.int64)
+    if len(days) == 0 or bars.shape[0] == 0:
+        return GapIndex.empty(days)
+
+    codes, symbols = pd.factorize(bars["symbol"], sort=True)
+    bar_days = session_days(bars["open_date"].to_numpy())
+    positions = np.searchsorted(days, bar_days)
+    on_session = (positions < len(days)) & (
+        days[np.minimum(positions, len(days) - 1)] == bar_days)
+    codes, positions = codes[on_session], positions[on_session]
+    if len(codes) == 0:
+        return GapIndex.empty(days)
+
+    order = np.lexsort((positions, codes))
+    codes, positions = codes[order], positions[order]
+    same_symbol = codes[1:] == codes[:-1]
+    # Holes between two bars of a symbol
+    inner = same_symbol & (positions[1:] - positions[:-1] > 1)
+    # Holes after a symbol's last bar, up to the last session checked
+    last_bar = np.append(~same_symbol, True)
+    trailing = last_bar & (positions < len(days) - 1)
+    if empty_refetches:
+        checked_until = np.array([empty_refetches.get(symbol, -1) for symbol in symbols],
+                                 dtype=np.int64)
+        trailing_start = days[np.minimum(positions + 1, len(days) - 1)] * SECONDS_PER_DAY
+        trailing &= trailing_start > checked_until[codes]
+
+    gap_codes = np.concatenate([codes[1:][inner], codes[trailing]])
+    first_sessions = np.concatenate([positions[:-1][inner] + 1,
+                                     positions[trailing] + 1])
+    last_sessions = np.concatenate([positions[1:][inner] - 1,
+                                    np.full(trailing.sum(), len(days) - 1)])
+    order = np.lexsort((first_sessions, gap_codes))
+    return GapIndex(session_days=days,
+                    symbols=np.asarray(symbols, dtype=object)[gap_codes[order]],
+                    first_sessions=first_sessions[order].astype(np.int64),
+                    last_sessions=last_sessions[order].astype(np.int64))
+
+
+@dataclass
+class RefetchRequest:
+    """ One download of the same sessions for a group of symbols """
+    symbols: List[str]
+    first_day: int
+    last_day: int
+
+    @property
+    def start(self) -> str:
+        return day_to_date(self.first_day).isoformat()
+
+    @property
+    def end(self) -> str:
+        # yfinance stops before its end date
+        return day_to_date(self.last_day + 1).isoformat()
+
+    @property
+    def start_open_date(self) -> int:
+        return self.first_day * SECONDS_PER_DAY
+
+    @property
+    def end_open_date(self) -> int:
+        """ Last second of the last day, so bars opening at local midnight
+        are included """
+        return (self.last_day + 1) * SECONDS_PER_DAY - 1
+
+
+def _requests_needed(symbols: int, max_symbols_per_request: int) -> int:
+    return -(-symbols // max_symbols_per_request)
+
+
+def plan_refetch(gap_index: GapIndex,
+                 max_symbols_per_request: int = MAX_SYMBOLS_PER_REQUEST_DEFAULT,
+                 max_extra_sessions: int = MAX_EXTRA_SESSIONS_DEFAULT
+                 ) -> List[RefetchRequest]:
+    """ Groups the gaps into few downloads that fetch little besides them.
+
+    A symbol's gaps at most `max_extra_sessions` apart become one range.
+    Symbols with the same range share requests, and ranges are merged
+    greedily while that saves a request and no symbol downloads more than
+    `max_extra_sessions` sessions it has already.
+    """
+    if len(gap_index) == 0:
+        return []
+
+    symbols, first, last = (gap_index.symbols, gap_index.first_sessions,
+                            gap_index.last_sessions)
+    # The index is sorted by symbol and first session
+    new_range = np.append(True, (symbols[1:] != symbols[:-1])
+                          | (first[1:] - last[:-1] - 1 > max_extra_sessions))
+    range_starts = np.flatnonzero(new_range)
+    range_ends = np.append(range_starts[1:], len(symbols)) - 1
+
+    symbols_by_range: Dict[Tuple[int, int], List[str]] = {}
+    for symbol, first_session, last_session in zip(
+            symbols[range_starts], first[range_starts], last[range_ends]):
+        symbols_by_range.setdefault((int(first_session), int(last_session)),
+                                    []).append(symbol)
+
+    clusters: List[Tuple[int, int, int, List[str]]] = []
+    for (first_session, last_session), range_symbols in sorted(symbols_by_range.items()):
+        length = last_session - first_session + 1
+        if clusters:
+            cluster_first, cluster_last, shortest, cluster_symbols = clusters[-1]
+            merged_last = max(cluster_last, last_session)
+            merged_length = merged_last - cluster_first + 1
+            saves_request = (_requests_needed(len(cluster_symbols) + len(range_symbols),
+                                              max_symbols_per_request)
+                             < _requests_needed(len(cluster_symbols), max_symbols_per_request)
+                             + _requests_needed(len(range_symbols), max_symbols_per_request))
+            if (saves_request
+                    and merged_length - min(shortest, length) <= max_extra_sessions):
+                clusters[-1] = (cluster_first, merged_last, min(shortest, length),
+                                cluster_symbols + range_symbols)
+                continue
+        clusters.append((first_session, last_session, length, list(range_symbols)))
+
+    days = gap_index.session_days
+    return [RefetchRequest(symbols=cluster_symbols[start:start + max_symbols_per_request],
+                           first_day=int(days[cluster_first]),
+                           last_day=int(days[cluster_last]))
+            for cluster_first, cluster_last, _, cluster_symbols in clusters
+            for start in range(0, len(cluster_symbols), max_symbols_per_request)]
+
+
+def last_closed_session_date(calendar: MarketCalendar, timestamp: float) -> dt.date:
+    """ Date of the last session that closed before the timestamp """
+    date = calendar.local_date(timestamp)
+    while True:
+        session = calendar.session(date)
+        if session is not None and session.close_date <= timestamp:
+            return date
+        date -= dt.timedelta(days=1)
@@ -0,0 +1,437 @@
+import argparse
+import datetime as dt
+import json
+import logging
+import signal
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config.sentry_config import init_sentry
+from data_ingestion.market_trade_data_collection import back_fill_trade_market_data, \
+    collect_save_new_market_data, repair_trade_market_data_gaps
+from data_ingestion.symbol_list_collection import main_symbol_list_collection
+from utils.db_helpers import dispose_mysql_connection, get_traded_object_rows, \
+    get_connection_pool_stats
+from utils.market_calendar import MarketCalendar
+from utils.run_metrics import METRIC_PREFIX
+from utils.symbol_registry import SymbolRegistry
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PORT_DEFAULT = 8080
+MAX_CONCURRENT_JOBS_DEFAULT = 2
+# Same time as the symbol list cron job this replaces
+SYMBOL_LIST_TIME_OF_DAY = dt.time(7, 0)
+# yfinance serves the final daily bar a little after the close
+NEW_DATA_DELAY_AFTER_CLOSE_SECONDS = 30 * 60
+# Back fills download whole histories, so they run while the market is closed
+BACK_FILL_TIME_OF_DAY = dt.time(6, 0)
+# After the back fill, so symbols it completed are not repaired again
+REPAIR_GAPS_TIME_OF_DAY = dt.time(18, 0)
+YFINANCE_LOCK_GROUP = "yfinance"
+# The scheduler wakes up at least this often, so a changed clock is noticed
+SCHEDULER_MAX_SLEEP_SECONDS = 60.0
+# The daemon is unhealthy when the scheduler has not woken up for this long
+SCHEDULER_STALE_SECONDS = 3 * SCHEDULER_MAX_SLEEP_SECONDS
+
+
+class Trigger(ABC):
+    """ When a scheduled job is due """
+
+    @abstractmethod
+    def next_run_after(self, timestamp: float) -> float:
+        """ First run strictly after the timestamp, as epoch seconds """
+
+
+class DailyTrigger(Trigger):
+    """ Every day at a time of day """
+
+    def __init__(self, time_of_day: dt.time, timezone: dt.tzinfo = dt.timezone.utc):
+        self.time_of_day = time_of_day
+        self.timezone = timezone
+
+    def next_run_after(self, timestamp: float) -> float:
+        date = dt.datetime.fromtimestamp(timestamp, tz=self.timezone).date()
+        run_at = dt.datetime.combine(date, self.time_of_day, tzinfo=self.timezone)
+        if run_at.timestamp() <= timestamp:
+            run_at = dt.datetime.combine(date + dt.timedelta(days=1), self.time_of_day,
+                                         tzinfo=self.timezone)
+        return run_at.timestamp()
+
+
+class SessionCloseTrigger(Trigger):
+    """ A delay after the close of every trading session, early closes
+    included, so nothing runs on weekends and holidays """
+
+    def __init__(self, calendar: MarketCalendar, delay_seconds: float = 0.0):
+        self.calendar = calendar
+        self.delay_seconds = delay_seconds
+
+    def next_run_after(self, timestamp: float) -> float:
+        # The first session closing after timestamp - delay is the first one
+        # whose run is after the timestamp
+        session = self.calendar.next_session(timestamp - self.delay_seconds)
+        return session.close_date + self.delay_seconds
+
+
+class ClosedDayTrigger(Trigger):
+    """ At a time of day, in the exchange's timezone, on days without a
+    session """
+
+    def __init__(self, calendar: MarketCalendar, time_of_day: dt.time):
+        self.calendar = calendar
+        self.time_of_day = time_of_day
+
+    def next_run_after(self, timestamp: float) -> float:
+        date = self.calendar.local_date(timestamp)
+        # Every week has a weekend
+        for offset in range(8):
+            day = date + dt.timedelta(days=offset)
+            if self.calendar.is_trading_day(day):
+                continue
+            run_at = dt.datetime.combine(day, self.time_of_day,
+                                         tzinfo=self.calendar.timezone).timestamp()
+            if run_at > timestamp:
+                return run_at
+        raise AssertionError("A week always has a day without a session.")
+
+
+@dataclass
+class JobStatus:
+    """ Runs of a scheduled job since the daemon started """
+    runs: int = 0
+    failures: int = 0
+    skipped_runs: int = 0
+    running: bool = False
+    next_run_at: Optional[float] = None
+    last_started_at: Optional[float] = None
+    last_succeeded_at: Optional[float] = None
+    last_duration_seconds: float = 0.0
+    last_error: Optional[str] = None
+
+
+@dataclass
+class ScheduledJob:
+    """ A job and when it runs; jobs of one lock group never run at the
+    same time, and a job never overlaps with its own previous run """
+    name: str
+    run: Callable[[], Any]
+    trigger: Trigger
+    lock_group: Optional[str] = None
+    status: JobStatus = field(default_factory=JobStatus)
+
+
+class IngestionScheduler:
+    """ Runs scheduled jobs in a pool of threads.
+
+    A job that is due while its previous run, or another job of its lock
+    group, is still going is skipped rather than queued, and its next run is
+    scheduled as usual. Every collection job catches up on the symbols it
+    missed, so a skipped run delays data instead of losing it.
+    """
+
+    def __init__(self, jobs: List[ScheduledJob],
+                 max_concurrent_jobs: int = MAX_CONCURRENT_JOBS_DEFAULT,
+                 clock: Callable[[], float] = time.time):
+        self.jobs: Dict[str, ScheduledJob] = {job.name: job for job in jobs}
+        self._clock = clock
+        self._locks = {job.lock_group or job.name: threading.Lock() for job in jobs}
+        self._status_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs,
+                                            thread_name_prefix="ingestion-job")
+        self._stopped = threading.Event()
+        self.last_tick_at: Optional[float] = None
+
+    def start(self, now: Optional[float] = None) -> None:
+        now = self._clock() if now is None else now
+        for job in self.jobs.values():
+            job.status.next_run_at = job.trigger.next_run_after(now)
+            logger.info(f"Scheduled {job.name} for "
+                        f"{dt.datetime.fromtimestamp(job.status.next_run_at, dt.timezone.utc)}.")
+
+    def run_due_jobs(self, now: Optional[float] = None) -> List[Future]:
+        """ Starts the jobs that are due and schedules their next runs """
+        now = self._clock() if now is None else now
+        self.last_tick_at = now
+        futures = []
+        for job in self.jobs.values():
+            if job.status.next_run_at is None or job.status.next_run_at > now:
+                continue
+            job.status.next_run_at = job.trigger.next_run_after(now)
+            future = self.run_job(job.name)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def run_job(self, name: str) -> Optional[Future]:
+        """ Starts a job now, unless it would overlap with a running one """
+        job = self.jobs[name]
+        lock = self._locks[job.lock_group or job.name]
+        # Taken here rather than in the worker, so a second due run sees it
+        # even before the first one got a thread
+        if not lock.acquire(blocking=False):
+            with self._status_lock:
+                job.status.skipped_runs += 1
+            logger.warning(f"Skipped {job.name}: a run of lock group "
+                           f"{job.lock_group or job.name} is still going.")
+            return None
+        with self._status_lock:
+            job.status.running = True
+        return self._executor.submit(self._run, job, lock)
+
+    def _run(self, job: ScheduledJob, lock: threading.Lock) -> None:
+        started_at = self._clock()
+        with self._status_lock:
+            job.status.last_started_at = started_at
+        logger.info(f"Started {job.name}.")
+        error: Optional[str] = None
+        try:
+            job.run()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"{job.name} failed: {error}")
+        finally:
+            lock.release()
+            finished_at = self._clock()
+            with self._status_lock:
+                job.status.running = False
+                job.status.runs += 1
+                job.status.last_duration_seconds = finished_at - started_at
+                if error is None:
+                    job.status.last_succeeded_at = finished_at
+                else:
+                    job.status.failures += 1
+                    job.status.last_error = error
+        logger.info(f"Finished {job.name} in {finished_at - started_at:.1f}s.")
+
+    def seconds_until_next_run(self, now: Optional[float] = None) -> float:
+        now = self._clock() if now is None else now
+        next_run_at = min((job.status.next_run_at for job in self.jobs.values()
+                           if job.status.next_run_at is not None),
+                          default=now + SCHEDULER_MAX_SLEEP_SECONDS)
+        return min(max(0.0, next_run_at - now), SCHEDULER_MAX_SLEEP_SECONDS)
+
+    def run_forever(self) -> None:
+        self.start()
+        while not self._stopped.is_set():
+            self.run_due_jobs()
+            self._stopped.wait(self.seconds_until_next_run())
+
+    def stop(self, wait: bool = True) -> None:
+        """ Stops scheduling; running jobs finish unless the process exits """
+        self._stopped.set()
+        self._executor.shutdown(wait=wait)
+
+    def status(self) -> Dict[str, JobStatus]:
+        with self._status_lock:
+            return {name: JobStatus(**asdict(job.status))
+                    for name, job in self.jobs.items()}
+
+
+class IngestionDaemon:
+    """ Symbol list, new data, back fill and gap repair runs in one warm
+    process.
+
+    Cron started a process per job, each importing everything, creating an
+    engine and reading the whole traded universe again. Here every job uses
+    the one connection pool of the process, and the symbol registry is read
+    once and only read again after a symbol list run changed the universe.
+    """
+
+    def __init__(self, calendar: Optional[MarketCalendar] = None,
+                 max_concurrent_jobs: int = MAX_CONCURRENT_JOBS_DEFAULT,
+                 clock: Callable[[], float] = time.time):
+        self.calendar = calendar or MarketCalendar()
+        self._clock = clock
+        self.started_at = clock()
+        self._symbol_registry: Optional[SymbolRegistry] = None
+        self._registry_lock = threading.Lock()
+        self.scheduler = IngestionScheduler(self._build_jobs(),
+                                            max_concurrent_jobs=max_concurrent_jobs,
+                                            clock=clock)
+
+    def _build_jobs(self) -> List[ScheduledJob]:
+        return [
+            ScheduledJob(name="symbol_list", run=self.collect_symbol_lists,
+                         trigger=DailyTrigger(SYMBOL_LIST_TIME_OF_DAY)),
+            ScheduledJob(name="new_data", run=lambda: collect_save_new_market_data(
+                symbol_registry=self.symbol_registry, dispose_connection=False),
+                trigger=SessionCloseTrigger(
+                    self.calendar, delay_seconds=NEW_DATA_DELAY_AFTER_CLOSE_SECONDS),
+                lock_group=YFINANCE_LOCK_GROUP),
+            ScheduledJob(name="back_fill", run=lambda: back_fill_trade_market_data(
+                symbol_registry=self.symbol_registry, dispose_connection=False),
+                trigger=ClosedDayTrigger(self.calendar, BACK_FILL_TIME_OF_DAY),
+                lock_group=YFINANCE_LOCK_GROUP),
+            ScheduledJob(name="repair_gaps", run=lambda: repair_trade_market_data_gaps(
+                symbol_registry=self.symbol_registry, dispose_connection=False),
+                trigger=ClosedDayTrigger(self.calendar, REPAIR_GAPS_TIME_OF_DAY),
+                lock_group=YFINANCE_LOCK_GROUP),
+        ]
+
+    @property
+    def symbol_registry(self) -> SymbolRegistry:
+        with self._registry_lock:
+            if self._symbol_registry is None:
+                self._symbol_registry = SymbolRegistry.from_rows(
+                    get_traded_object_rows())
+                logger.info(f"Loaded {len(self._symbol_registry)} symbols.")
+            return self._symbol_registry
+
+    def collect_symbol_lists(self) -> None:
+        collector = main_symbol_list_collection(dispose_connection=False)
+        if collector.delta is not None and not collector.delta.is_empty:
+            # Runs that already started keep the registry they were given
+            with self._registry_lock:
+                self._symbol_registry = None
+            logger.info(f"Symbol universe changed, "
+                        f"{len(self.symbol_registry)} symbols now.")
+
+    def health(self) -> Tuple[HTTPStatus, Dict[str, Any]]:
+        now = self._clock()
+        last_tick_at = self.scheduler.last_tick_at
+        healthy = last_tick_at is not None and now - last_tick_at < SCHEDULER_STALE_SECONDS
+        with self._registry_lock:
+            symbols = (len(self._symbol_registry)
+                       if self._symbol_registry is not None else None)
+        return (HTTPStatus.OK if healthy else HTTPStatus.SERVICE_UNAVAILABLE, {
+            "status": "ok" if healthy else "stalled",
+            "uptime_seconds": now - self.started_at,
+            "symbols": symbols,
+            "jobs": {name: asdict(status)
+                     for name, status in self.scheduler.status().items()}
+        })
+
+    def to_prometheus(self) -> str:
+        """ Renders job and connection pool state in the Prometheus text
+        exposition format """
+        _, health = self.health()
+        pool_stats = get_connection_pool_stats()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_daemon_uptime_seconds Time since the daemon started.",
+            f"# TYPE {METRIC_PREFIX}_daemon_uptime_seconds gauge",
+            f"{METRIC_PREFIX}_daemon_uptime_seconds {health['uptime_seconds']:.0f}",
+            f"# HELP {METRIC_PREFIX}_daemon_symbols Symbols in the cached registry.",
+            f"# TYPE {METRIC_PREFIX}_daemon_symbols gauge",
+            f"{METRIC_PREFIX}_daemon_symbols {health['symbols'] or 0}",
+        ]
+        for field_name, name, metric_type, help_text in (
+                ("runs", "job_runs_total", "counter", "Finished runs of a job."),
+                ("failures", "job_failures_total", "counter", "Runs of a job that raised."),
+                ("skipped_runs", "job_skipped_runs_total", "counter",
+                 "Runs of a job skipped to avoid an overlap."),
+                ("running", "job_running", "gauge", "Whether a job is running."),
+                ("last_duration_seconds", "job_last_duration_seconds", "gauge",
+                 "Wall time of the last run of a job."),
+                ("last_succeeded_at", "job_last_success_timestamp_seconds", "gauge",
+                 "Time the last successful run of a job finished."),
+                ("next_run_at", "job_next_run_timestamp_seconds", "gauge",
+                 "Time a job is due next.")):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            lines.extend(f'{METRIC_PREFIX}_{name}{{job="{job}"}} '
+                         f'{float(status[field_name] or 0):.6g}'
+                         for job, status in health["jobs"].items())
+        for field_name, name, help_text in (
+                ("connections_opened", "db_connections_opened_total",
+                 "Database connections opened by the pool."),
+                ("checkouts", "db_checkouts_total", "Connections checked out of the pool."),
+                ("total_wait_time_seconds", "db_checkout_wait_seconds_total",
+                 "Time spent waiting for a pooled connection.")):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            lines.append(f"{METRIC_PREFIX}_{name} {getattr(pool_stats, field_name)}")
+        return "\n".join(lines) + "\n"
+
+    def serve_forever(self, health_port: int = HEALTH_PORT_DEFAULT) -> None:
+        """ Runs the scheduler until SIGTERM or SIGINT, with the health server
+        in a background thread """
+        server = HealthServer(("", health_port), self)
+        threading.Thread(target=server.serve_forever, name="health-server",
+                         daemon=True).start()
+        logger.info(f"Serving /health and /metrics on port {server.server_port}.")
+
+        def stop(signal_number: int, frame: Any) -> None:
+            logger.info(f"Stopping on signal {signal_number}.")
+            self.scheduler.stop(wait=False)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        try:
+            self.scheduler.run_forever()
+        finally:
+            # Waits for running jobs, so they release their connections first
+            self.scheduler.stop(wait=True)
+            server.shutdown()
+            dispose_mysql_connection()
+
+
+class _HealthRequestHandler(BaseHTTPRequestHandler):
+    server: "HealthServer"
+
+    def do_GET(self) -> None:
+        ingestion_daemon = self.server.ingestion_daemon
+        if self.path == "/health":
+            status, health = ingestion_daemon.health()
+            self._respond(status, "application/json", json.dumps(health))
+        elif self.path == "/metrics":
+            self._respond(HTTPStatus.OK, "text/plain; version=0.0.4",
+                          ingestion_daemon.to_prometheus())
+        else:
+            self._respond(HTTPStatus.NOT_FOUND, "text/plain", "Not found\n")
+
+    def _respond(self, status: HTTPStatus, content_type: str, body: str) -> None:
+        content = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Probes come every few seconds, so they are not logged at INFO
+        logger.debug(format % args)
+
+
+class HealthServer(ThreadingHTTPServer):
+    """ Serves /health as JSON and /metrics for Prometheus to scrape """
+    daemon_threads = True
+
+    def __init__(self, server_address: Tuple[str, int],
+                 ingestion_daemon: IngestionDaemon):
+        super().__init__(server_address, _HealthRequestHandler)
+        self.ingestion_daemon = ingestion_daemon
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run symbol list, new data, back fill and gap repair "
+                    "collection on schedule in one process.")
+    parser.add_argument("--health-port", type=int, default=HEALTH_PORT_DEFAULT)
+    parser.add_argument("--max-concurrent-jobs", type=int,
+                        default=MAX_CONCURRENT_JOBS_DEFAULT)
+    parser.add_argument("--run-now", nargs="*", default=[],
+                        choices=["symbol_list", "new_data", "back_fill",
+                                 "repair_gaps"],
+                        help="jobs to run once right after start up")
+    args = parser.parse_args()
+
+    init_sentry()
+    ingestion_daemon = IngestionDaemon(max_concurrent_jobs=args.max_concurrent_jobs)
+    for name in args.run_now:
+        ingestion_daemon.scheduler.run_job(name)
+    ingestion_daemon.serve_forever(health_port=args.health_port)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
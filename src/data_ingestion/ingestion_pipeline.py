@@ -0,0 +1,117 @@
+import logging
+import threading
+from dataclasses import dataclass
+from queue import Queue
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_QUEUE_SIZE_DEFAULT = 2
+PIPELINE_MEMORY_CAP_BYTES_DEFAULT = 512 * 1024 * 1024
+
+_STOP = object()
+
+
+@dataclass
+class PipelineStage:
+    """ Step of a StagedPipeline; returning None drops the item """
+    name: str
+    function: Callable[[Any], Any]
+
+
+class MemoryBudget:
+    """ Blocks producers while the bytes held by in-flight items exceed a cap """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size_bytes: int) -> None:
+        with self._condition:
+            # An item larger than the whole cap is still let through once the
+            # pipeline is empty, otherwise it would block forever.
+            while (self.used_bytes > 0
+                   and self.used_bytes + size_bytes > self.max_bytes):
+                self._condition.wait()
+            self.used_bytes += size_bytes
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+
+    def release(self, size_bytes: int) -> None:
+        with self._condition:
+            self.used_bytes -= size_bytes
+            self._condition.notify_all()
+
+
+class StagedPipeline:
+    """ Runs items through stages connected by bounded queues.
+
+    Every stage runs in its own thread. A queue holds at most `queue_size`
+    items and every item handed between stages is charged against a shared
+    memory budget, so a slow stage throttles the stages in front of it.
+    """
+
+    def __init__(self,
+                 stages: List[PipelineStage],
+                 size_of: Callable[[Any], int],
+                 queue_size: int = PIPELINE_QUEUE_SIZE_DEFAULT,
+                 memory_cap_bytes: int = PIPELINE_MEMORY_CAP_BYTES_DEFAULT):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage.")
+        self.stages = stages
+        self.size_of = size_of
+        self.queues: List[Queue] = [Queue(maxsize=max(1, queue_size))
+                                    for _ in stages]
+        self.memory_budget = MemoryBudget(max_bytes=memory_cap_bytes)
+
+    def run(self, items: Iterable[Any]) -> None:
+        threads = [
+            threading.Thread(target=self._run_stage, args=(stage_index,),
+                             name=f"pipeline-{stage.name}", daemon=True)
+            for stage_index, stage in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                self.queues[0].put((item, 0))
+        finally:
+            self.queues[0].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        logger.info(f"Pipeline finished with a peak of "
+                    f"{self.memory_budget.peak_bytes / 1024 / 1024:.1f} MB "
+                    f"in flight.")
+
+    def _run_stage(self, stage_index: int) -> None:
+        stage = self.stages[stage_index]
+        input_queue = self.queues[stage_index]
+        output_queue: Optional[Queue] = (
+            self.queues[stage_index + 1]
+            if stage_index + 1 < len(self.stages) else None)
+
+        while True:
+            message = input_queue.get()
+            if message is _STOP:
+                if output_queue is not None:
+                    output_queue.put(_STOP)
+                return
+
+            item, item_size = message
+            try:
+                result = stage.function(item)
+            except Exception as e:
+                logger.error(f"Error in pipeline stage {stage.name}: {e}")
+                result = None
+            finally:
+                self.memory_budget.release(item_size)
+
+            if result is None or output_queue is None:
+                continue
+
+            result_size = self.size_of(result)
+            self.memory_budget.acquire(result_size)
+            output_queue.put((result, result_size))
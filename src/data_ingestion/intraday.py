@@ -0,0 +1,106 @@
+import argparse
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from pandas import DataFrame
+
+from utils.db_helpers import SECONDS_PER_DAY, create_intraday_partitions, \
+    dispose_mysql_connection, drop_intraday_partitions
+from utils.enums import TradeTimeWindow, YFinanceIntervals
+
+logger = logging.getLogger(__name__)
+
+INTRADAY_TIME_WINDOWS = [time_window for time_window in TradeTimeWindow
+                         if time_window.is_intraday]
+# Longest period yfinance serves in one request of each interval
+INTRADAY_MAX_PERIODS: Dict[TradeTimeWindow, YFinanceIntervals] = {
+    TradeTimeWindow.ONE_MINUTE: YFinanceIntervals.FIVE_DAYS,
+    TradeTimeWindow.FIVE_MINUTES: YFinanceIntervals.ONE_MONTH,
+    TradeTimeWindow.ONE_HOUR: YFinanceIntervals.ONE_YEAR,
+}
+# How far back yfinance has bars of each interval at all
+INTRADAY_LOOKBACK_LIMIT_DAYS: Dict[TradeTimeWindow, int] = {
+    TradeTimeWindow.ONE_MINUTE: 30,
+    TradeTimeWindow.FIVE_MINUTES: 60,
+    TradeTimeWindow.ONE_HOUR: 730,
+}
+INTRADAY_RETENTION_DAYS_DEFAULT: Dict[TradeTimeWindow, int] = {
+    TradeTimeWindow.ONE_MINUTE: 90,
+    TradeTimeWindow.FIVE_MINUTES: 365,
+    TradeTimeWindow.ONE_HOUR: 365 * 5,
+}
+# Hourly bars are kept for years, which would be thousands of daily
+# partitions, so their table is partitioned by month
+INTRADAY_MONTHLY_PARTITIONS = {TradeTimeWindow.ONE_HOUR}
+PARTITIONS_AHEAD_DAYS = 2
+
+
+def clamp_period(period: YFinanceIntervals,
+                 time_window: TradeTimeWindow) -> YFinanceIntervals:
+    """ Shortens the period to what yfinance allows for the interval """
+    max_period = INTRADAY_MAX_PERIODS.get(time_window)
+    if (max_period is None
+            or period.value.time_in_seconds <= max_period.value.time_in_seconds):
+        return period
+    return max_period
+
+
+def drop_stored_and_open_bars(data: DataFrame, watermarks: Dict[str, int],
+                              time_window: TradeTimeWindow,
+                              now: Optional[float] = None) -> DataFrame:
+    """ Keeps the closed bars after each symbol's watermark. The bar still
+    forming would change after it was appended, and bars up to the
+    watermark are stored already. """
+    now = time.time() if now is None else now
+    open_dates = data["open_date"].to_numpy(dtype=np.int64)
+    last_open_dates = (data["symbol"].astype(object).map(watermarks)
+                       .fillna(-1).to_numpy(dtype=np.int64))
+    closed = open_dates + time_window.value.time_in_seconds <= now
+    return data[closed & (open_dates > last_open_dates)]
+
+
+def maintain_intraday_partitions(time_window: TradeTimeWindow,
+                                 retention_days: Optional[int] = None,
+                                 now: Optional[float] = None) -> None:
+    """ Creates the partitions of the coming days and drops the ones past
+    retention """
+    now = time.time() if now is None else now
+    retention_days = (retention_days if retention_days is not None
+                      else INTRADAY_RETENTION_DAYS_DEFAULT[time_window])
+    created = create_intraday_partitions(
+        time_window,
+        from_open_date=int(now - INTRADAY_LOOKBACK_LIMIT_DAYS[time_window]
+                           * SECONDS_PER_DAY),
+        until_open_date=int(now + PARTITIONS_AHEAD_DAYS * SECONDS_PER_DAY),
+        by_month=time_window in INTRADAY_MONTHLY_PARTITIONS)
+    dropped = drop_intraday_partitions(
+        time_window, before_open_date=int(now - retention_days * SECONDS_PER_DAY))
+    logger.info(f"Maintained {time_window.value.yfinance_notation} partitions: "
+                f"{len(created)} created and {len(dropped)} dropped.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Create and expire the partitions of intraday bars.")
+    parser.add_argument("--time-window", default="5m",
+                        choices=[time_window.value.yfinance_notation
+                                 for time_window in INTRADAY_TIME_WINDOWS])
+    parser.add_argument("--retention-days", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        maintain_intraday_partitions(
+            TradeTimeWindow.get_trade_time_window_from_name(args.time_window),
+            retention_days=args.retention_days)
+    finally:
+        dispose_mysql_connection()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
@@ -0,0 +1,100 @@
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator, Union
+
+STREAM_CHUNK_SIZE_DEFAULT = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+_NUMBER_CHARACTERS = frozenset("0123456789+-.eE")
+
+Chunk = Union[bytes, bytearray, memoryview]
+
+
+class _TextBuffer:
+    """ Decoded text of a byte stream, read one chunk at a time """
+
+    def __init__(self, chunks: Iterable[Chunk]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.position = 0
+        self.exhausted = False
+        self.bytes_read = 0
+
+    def read_more(self) -> None:
+        """ Appends the next chunk, dropping the text already consumed """
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            tail = self._decoder.decode(b"", final=True)
+        else:
+            self.bytes_read += len(chunk)
+            tail = self._decoder.decode(chunk)
+        self.text = self.text[self.position:] + tail
+        self.position = 0
+
+    def next_token(self) -> str:
+        """ Skips whitespace and returns the next character, '' at the end """
+        while True:
+            match = _WHITESPACE.match(self.text, self.position)
+            self.position = match.end() if match else self.position
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if self.exhausted:
+                return ""
+            self.read_more()
+
+    def decode_value(self, decoder: json.JSONDecoder) -> Any:
+        self.next_token()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.position)
+                # A number running to the end of the text, or followed by
+                # more of a number, may have been split between two chunks
+                if self.exhausted or (end < len(self.text)
+                                      and self.text[end] not in _NUMBER_CHARACTERS):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self.read_more()
+
+
+def iter_json_array(chunks: Iterable[Chunk]) -> Iterator[Any]:
+    """ Yields the elements of a UTF-8 JSON array as its chunks arrive.
+
+    Only the element being decoded and the rest of the current chunk are
+    held in memory, never the whole array. Raises ValueError when the input
+    is not a single well formed array; the elements before the error have
+    been yielded by then.
+    """
+    buffer = _TextBuffer(chunks)
+    decoder = json.JSONDecoder()
+    if buffer.next_token() != "[":
+        raise ValueError("Unexpected response format; expected a list.")
+    buffer.position += 1
+    if buffer.next_token() == "]":
+        buffer.position += 1
+    else:
+        while True:
+            yield buffer.decode_value(decoder)
+            token = buffer.next_token()
+            buffer.position += 1
+            if token == "]":
+                break
+            if token != ",":
+                raise ValueError(f"Expected ',' or ']' in the list after "
+                                 f"{buffer.bytes_read} bytes, got {token!r}.")
+    if buffer.next_token():
+        raise ValueError("Unexpected data after the list.")
+
+
+def iter_chunks(content: bytes,
+                chunk_size: int = STREAM_CHUNK_SIZE_DEFAULT) -> Iterator[memoryview]:
+    """ Slices of a body without copying it """
+    view = memoryview(content)
+    return (view[start:start + chunk_size]
+            for start in range(0, len(view), chunk_size))
@@ -1,21 +1,51 @@
+import datetime as dt
 import logging
+import os
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from http.client import HTTPException
-from random import shuffle
-from typing import Dict, Generator, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, List, Optional, \
+    Tuple, Union
 
+import numpy as np
 import pandas as pd
-import yfinance as yf  # type: ignore
 from pandas import DataFrame
 from requests import Timeout
 from tenacity import retry, retry_if_exception_type, wait_exponential, \
     stop_after_attempt
 
 from config.sentry_config import init_sentry
-from utils.data_models import DataTradedObject, OHLCV
-from utils.db_helpers import get_all_traded_objects_from_db, get_market_trade_data, \
-    save_trade_market_data_in_db
-from utils.enums import YFinanceIntervals, TradeTimeWindow
+from data_ingestion.backfill_journal import BackfillJournal
+from data_ingestion.gap_detection import GapIndex, RefetchRequest, detect_gaps, \
+    last_closed_session_date, plan_refetch
+from data_ingestion.ingestion_pipeline import PipelineStage, StagedPipeline, \
+    PIPELINE_MEMORY_CAP_BYTES_DEFAULT, PIPELINE_QUEUE_SIZE_DEFAULT
+from data_ingestion.intraday import INTRADAY_MAX_PERIODS, clamp_period, \
+    drop_stored_and_open_bars, maintain_intraday_partitions
+from data_ingestion.ohlcv_diff import OHLCVDiffCounters, diff_ohlcv
+from data_ingestion.ohlcv_resampler import RESAMPLED_TIME_WINDOWS, \
+    update_resampled_bars
+from data_ingestion.rate_limiting import AdaptiveBatchSizer, BatchOutcome, \
+    TokenBucket
+from data_ingestion.yfinance_frames import normalize_yfinance_frame
+from indicators.indicator_engine import IndicatorEngine
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import get_traded_object_rows, \
+    get_ingestion_watermarks, get_ohlcv_bars, save_trade_market_data_in_db, \
+    dispose_mysql_connection, bulk_load_trade_market_data, append_intraday_bars, \
+    get_ohlcv_open_dates, get_empty_refetches, save_empty_refetches
+from utils.enums import YFinanceIntervals, TradeTimeWindow, OHLCVWriteMode
+from utils.market_calendar import MarketCalendar
+from utils.run_metrics import RunMetrics, count_retry
+from utils.symbol_registry import SymbolRegistry
+
+# yfinance and pyarrow take a large share of the start up time, so they are
+# only imported once a download or a local store needs them
+if TYPE_CHECKING:
+    from utils.ohlcv_store import OHLCVStore
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,7 +57,47 @@ logger = logging.getLogger(__name__)
 BATCH_SIZE_DEFAULT = 100
 LOOKBACK_PERIOD_BACK_FILL_DAYS = 365
 MAX_BACK_FILL_PERIOD_YEARS = 5
+BACK_FILL_RUN_ID = "back_fill_1d"
+NEW_DATA_RUN_NAME = "new_data_1d"
+INTRADAY_RUN_NAME = "intraday"
+REPAIR_GAPS_RUN_NAME = "repair_gaps_1d"
+GAP_LOOKBACK_DAYS_DEFAULT = 365
 LOOKBACK_PERIOD_DEFAULT_DAYS = 1
+MAX_WORKERS_DEFAULT = 4
+MAX_IN_FLIGHT_REQUESTS_DEFAULT = 8
+# Fetch a day more than strictly needed so the bar at the watermark is included
+WATERMARK_OVERLAP_SECONDS = 60 * 60 * 24
+
+# yf.download keeps its results in module-level state (yfinance.shared), so two
+# downloads running at the same time would mix up each other's tickers. Downloads
+# are serialised and the in-flight limit is applied through yfinance's own
+# per-ticker threads instead.
+_YFINANCE_DOWNLOAD_LOCK = threading.Lock()
+
+
+def symbol_shard(symbol: str, num_shards: int) -> int:
+    """ Stable shard of a symbol; the same in every process and on every node """
+    return zlib.crc32(symbol.encode("utf-8")) % num_shards
+
+
+@dataclass
+class FetchedBatch:
+    """ Output of the fetch stage: downloaded bars and the stored bars they
+    overlap with """
+    fetched_data: DataFrame
+    stored_data: DataFrame
+    time_window: TradeTimeWindow
+    symbols: List[str] = field(default_factory=list)
+    batch_index: int = 0
+
+
+@dataclass
+class PreparedBatch:
+    """ Output of the transform stage: rows to write and the symbols they
+    complete """
+    ohlcv_batch: OHLCVBatch
+    symbols: List[str] = field(default_factory=list)
+    batch_index: int = 0
 
 
 class MarketTradeDataCollector:
@@ -38,13 +108,57 @@ class MarketTradeDataCollector:
     MIN_RETRY_WAIT_TIME = 2
     MAX_RETRY_WAIT_TIME = 10
 
-    def __init__(self, batch_size: int, lookback_period_days: int):
+    def __init__(self, batch_size: int, lookback_period_days: int,
+                 max_workers: int = 1,
+                 max_in_flight_requests: int = MAX_IN_FLIGHT_REQUESTS_DEFAULT,
+                 pipelined: bool = False,
+                 pipeline_queue_size: int = PIPELINE_QUEUE_SIZE_DEFAULT,
+                 pipeline_memory_cap_bytes: int = PIPELINE_MEMORY_CAP_BYTES_DEFAULT,
+                 write_mode: OHLCVWriteMode = OHLCVWriteMode.EXECUTEMANY,
+                 ohlcv_store: Optional["OHLCVStore"] = None,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 batch_sizer: Optional[AdaptiveBatchSizer] = None,
+                 downloader: Optional[Callable[..., DataFrame]] = None,
+                 journal: Optional[BackfillJournal] = None,
+                 shard_index: int = 0,
+                 num_shards: int = 1,
+                 resampled_time_windows: Optional[List[TradeTimeWindow]] = None,
+                 indicator_engine: Optional[IndicatorEngine] = None,
+                 metrics: Optional[RunMetrics] = None,
+                 symbol_registry: Optional[SymbolRegistry] = None):
         try:
-            self.symbols_to_update_map: Dict[str, DataTradedObject] = (
-                self._get_symbols_to_update_strings())
+            if not 0 <= shard_index < num_shards:
+                raise ValueError(f"Shard index {shard_index} is out of range "
+                                 f"for {num_shards} shards.")
+            self.shard_index: int = shard_index
+            self.num_shards: int = num_shards
+            if symbol_registry is None:
+                symbol_registry = self._load_symbol_registry()
+            self.symbol_registry: SymbolRegistry = symbol_registry.select(
+                np.flatnonzero([symbol_shard(symbol, num_shards) == shard_index
+                                for symbol in symbol_registry.symbols]))
             self.batch_size: int = batch_size
             self.lookback_period = 60 * 60 * 24 * lookback_period_days
-            logger.info("MarketTradeDataCollector initialised successfully.")
+            self.max_workers: int = max(1, max_workers)
+            self.max_in_flight_requests: int = max(1, max_in_flight_requests)
+            self.pipelined: bool = pipelined
+            self.pipeline_queue_size: int = pipeline_queue_size
+            self.pipeline_memory_cap_bytes: int = pipeline_memory_cap_bytes
+            self.write_mode: OHLCVWriteMode = write_mode
+            self.ohlcv_store: Optional["OHLCVStore"] = ohlcv_store
+            self.diff_counters = OHLCVDiffCounters()
+            self.rate_limiter: Optional[TokenBucket] = rate_limiter
+            self.batch_sizer: Optional[AdaptiveBatchSizer] = batch_sizer
+            self.downloader: Optional[Callable[..., DataFrame]] = downloader
+            self.journal: Optional[BackfillJournal] = journal
+            self.resampled_time_windows: List[TradeTimeWindow] = (
+                resampled_time_windows or [])
+            self.indicator_engine: Optional[IndicatorEngine] = indicator_engine
+            self.metrics: RunMetrics = metrics or RunMetrics(
+                run_name="market_trade_data")
+            logger.info(f"MarketTradeDataCollector initialised successfully "
+                        f"with {len(self.symbol_registry)} symbols in "
+                        f"shard {shard_index + 1} of {num_shards}.")
         except Exception as e:
             logger.error(f"Failed to initialise MarketTradeDataCollector: {e}")
             raise
@@ -53,65 +167,504 @@ class MarketTradeDataCollector:
                                        period: YFinanceIntervals,
                                        time_window: TradeTimeWindow) -> None:
 
-        total_batches = int(len(self.symbols_to_update_map) / self.batch_size)
-
-        for batch_index, symbols_batch in enumerate(self._build_symbol_batches()):
-            logger.info(f"Processing batch {batch_index + 1} of "
-                        f"{total_batches} "
-                        f"with {len(symbols_batch)} symbols.")
+        self.diff_counters = OHLCVDiffCounters()
+        clamped_period = clamp_period(period, time_window)
+        if clamped_period != period:
+            logger.info(f"Requesting {clamped_period.value.yfinance_notation} "
+                        f"instead of {period.value.yfinance_notation} of "
+                        f"{time_window.value.yfinance_notation} bars, the most "
+                        f"yfinance serves per request.")
+            period = clamped_period
+
+        if self.journal is None:
+            self._collect_symbols(self.symbol_registry.ids, period, time_window)
+        else:
+            self._collect_journalled(self.journal, period, time_window)
+
+        logger.info(f"Collection finished: {self.diff_counters.new_rows} new, "
+                    f"{self.diff_counters.updated_rows} updated, "
+                    f"{self.diff_counters.unchanged_rows} unchanged and "
+                    f"{self.diff_counters.expired_rows} expired rows "
+                    f"({self.diff_counters.written_fraction:.1%} written).")
+        if self.batch_sizer is not None:
+            logger.info(f"Final batch size {self.batch_sizer.batch_size} after "
+                        f"{self.batch_sizer.increases} increases and "
+                        f"{self.batch_sizer.decreases} decreases; smoothed "
+                        f"latency {self.batch_sizer.latency_seconds:.1f}s, "
+                        f"error rate {self.batch_sizer.error_rate:.1%}, "
+                        f"empty rate {self.batch_sizer.empty_rate:.1%}.")
+        if self.rate_limiter is not None:
+            logger.info(f"Waited {self.rate_limiter.total_wait_seconds:.1f}s "
+                        f"for the yfinance rate limiter.")
+        self.metrics.log_summary()
+        try:
+            self.metrics.write_summary()
+        except OSError as e:
+            logger.error(f"Error writing the run metrics summary: {e}")
+
+    def repair_gaps(self, time_window: TradeTimeWindow = TradeTimeWindow.DAILY,
+                    lookback_days: int = GAP_LOOKBACK_DAYS_DEFAULT,
+                    calendar: Optional[MarketCalendar] = None,
+                    now: Optional[float] = None) -> GapIndex:
+        """ Downloads only the sessions missing from the stored bars of the
+        last `lookback_days` days; returns the gaps that were found """
+        if time_window != TradeTimeWindow.DAILY:
+            raise ValueError(f"Gaps are detected in daily bars, not "
+                             f"{time_window.value.yfinance_notation} bars.")
+        calendar = calendar or MarketCalendar()
+        now = time.time() if now is None else now
+        self.diff_counters = OHLCVDiffCounters()
+
+        end_date = last_closed_session_date(calendar, now)
+        start_date = end_date - dt.timedelta(days=lookback_days)
+        symbols = self.symbol_registry.symbols.tolist()
+        with self.metrics.span("db_read"):
+            bars = get_ohlcv_open_dates(
+                symbols=symbols, time_window=time_window,
+                start_open_date=int(dt.datetime.combine(
+                    start_date, dt.time(), tzinfo=dt.timezone.utc).timestamp()))
+            empty_refetches = get_empty_refetches(symbols, time_window)
+        with self.metrics.span("detect_gaps"):
+            gap_index = detect_gaps(bars, calendar, start_date, end_date,
+                                    empty_refetches=empty_refetches)
+            refetch_requests = plan_refetch(gap_index,
+                                            max_symbols_per_request=self.batch_size)
+        self.metrics.increment("gaps", len(gap_index))
+        self.metrics.increment("missing_sessions", int(gap_index.missing_sessions.sum()))
+        self.metrics.increment("refetch_requests", len(refetch_requests))
+        logger.info(f"Found {len(gap_index)} gaps of "
+                    f"{int(gap_index.missing_sessions.sum())} sessions in "
+                    f"{gap_index.symbols_with_gaps} symbols between {start_date} "
+                    f"and {end_date}, repaired by {len(refetch_requests)} requests.")
+
+        for batch_index, refetch_request in enumerate(refetch_requests):
+            logger.info(f"Repairing {len(refetch_request.symbols)} symbols from "
+                        f"{refetch_request.start} until {refetch_request.end}.")
             try:
-                self._process_batch(symbols_batch, period, time_window)
+                fetched_batch = self._fetch_refetch_request(
+                    refetch_request, time_window, batch_index=batch_index,
+                    trailing=refetch_request.last_day == int(gap_index.session_days[-1]))
+                if fetched_batch is not None:
+                    self._write_batch(self._transform_batch(fetched_batch))
             except Exception as e:
-                logger.error(f"Error processing batch {batch_index + 1} "
-                             f"of {total_batches}: {e}")
-                continue
+                logger.error(f"Error repairing gaps of batch {batch_index + 1} "
+                             f"of {len(refetch_requests)}: {e}")
+            finally:
+                self.metrics.finish_batch(batch_index)
+
+        logger.info(f"Gap repair finished: {self.diff_counters.new_rows} new and "
+                    f"{self.diff_counters.updated_rows} updated rows.")
+        self.metrics.log_summary()
+        try:
+            self.metrics.write_summary()
+        except OSError as e:
+            logger.error(f"Error writing the run metrics summary: {e}")
+        return gap_index
+
+    def _fetch_refetch_request(self, refetch_request: RefetchRequest,
+                               time_window: TradeTimeWindow,
+                               batch_index: int = 0,
+                               trailing: bool = False) -> Optional[FetchedBatch]:
+        """ Downloads the sessions of the request. When it reaches the last
+        session checked, symbols without any bar are recorded so that their
+        trailing gap is not planned again """
+        with self.metrics.span("fetch", batch_index):
+            fetched_data = self._fetch_yfinance_data(
+                symbols=refetch_request.symbols,
+                period=YFinanceIntervals.MAX,
+                time_window=time_window,
+                max_in_flight_requests=self.max_in_flight_requests,
+                rate_limiter=self.rate_limiter,
+                downloader=self.downloader,
+                date_range=(refetch_request.start, refetch_request.end))
+        self.metrics.increment("rows_fetched", fetched_data.shape[0])
+        if trailing:
+            fetched_symbols = (set(fetched_data["symbol"].unique())
+                               if fetched_data.shape[0] else set())
+            empty_symbols = [symbol for symbol in refetch_request.symbols
+                             if symbol not in fetched_symbols]
+            if empty_symbols:
+                logger.info(f"No data returned by yfinance for {len(empty_symbols)} "
+                            f"symbols until {refetch_request.end}, their trailing "
+                            f"gaps are skipped until a newer bar is stored.")
+                save_empty_refetches(empty_symbols, time_window,
+                                     refetch_request.end_open_date)
+                self.metrics.increment("empty_refetches", len(empty_symbols))
+        if fetched_data.shape[0] == 0:
+            logger.info("No data returned by yfinance for the missing sessions.")
+            return None
+        with self.metrics.span("db_read", batch_index):
+            stored_data = get_ohlcv_bars(symbols=refetch_request.symbols,
+                                         time_window=time_window,
+                                         start_open_date=refetch_request.start_open_date,
+                                         end_open_date=refetch_request.end_open_date)
+        return FetchedBatch(fetched_data=fetched_data, stored_data=stored_data,
+                            time_window=time_window,
+                            symbols=refetch_request.symbols,
+                            batch_index=batch_index)
+
+    def _collect_journalled(self, journal: BackfillJournal,
+                            period: YFinanceIntervals,
+                            time_window: TradeTimeWindow) -> None:
+        """ Resumes the journalled run and retries failed symbols once their
+        backoff has passed """
+        symbols = journal.start(self.symbol_registry.symbols.tolist())
+        while symbols:
+            self._collect_symbols(self.symbol_registry.ids_of(symbols), period,
+                                  time_window)
+            next_retry_at = journal.next_retry_at()
+            if next_retry_at is None:
+                break
+            wait_seconds = max(0.0, next_retry_at - time.time())
+            logger.info(f"Retrying failed symbols in {wait_seconds:.0f}s.")
+            time.sleep(wait_seconds)
+            symbols = journal.symbols_due()
+            self.metrics.increment("symbols_retried", len(symbols))
+
+        progress = journal.progress()
+        logger.info(f"Back fill run {journal.run_id}: {progress.completed} of "
+                    f"{progress.total} symbols completed, {progress.failed} "
+                    f"failed.")
+
+    def _collect_symbols(self, symbol_ids: np.ndarray, period: YFinanceIntervals,
+                         time_window: TradeTimeWindow) -> None:
+        total_batches = -(-len(symbol_ids) // self.batch_size)
+
+        if self.pipelined:
+            self._collect_pipelined(symbol_ids, total_batches, period, time_window)
+        elif self.max_workers == 1:
+            for batch_index, symbols_batch in enumerate(
+                    self._build_symbol_batches(symbol_ids)):
+                self._run_batch(batch_index, total_batches, symbols_batch,
+                                period, time_window)
+        else:
+            self._collect_concurrently(symbol_ids, total_batches, period,
+                                       time_window)
+
+    def _collect_concurrently(self, symbol_ids: np.ndarray, total_batches: int,
+                              period: YFinanceIntervals,
+                              time_window: TradeTimeWindow) -> None:
+        logger.info(f"Processing batches with {self.max_workers} workers and "
+                    f"up to {self.max_in_flight_requests} in-flight requests.")
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="market-data") as executor:
+            futures = [
+                executor.submit(self._run_batch, batch_index, total_batches,
+                                symbols_batch, period, time_window)
+                for batch_index, symbols_batch in enumerate(
+                    self._build_symbol_batches(symbol_ids))
+            ]
+            for future in futures:
+                future.result()
+
+    def _collect_pipelined(self, symbol_ids: np.ndarray, total_batches: int,
+                           period: YFinanceIntervals,
+                           time_window: TradeTimeWindow) -> None:
+
+        def fetch_stage(work: Tuple[int, List[str]]) -> Optional[FetchedBatch]:
+            batch_index, symbols_batch = work
+            logger.info(f"Fetching batch {batch_index + 1} of {total_batches} "
+                        f"with {len(symbols_batch)} symbols.")
+            return self._fetch_batch(symbols_batch, period, time_window,
+                                     batch_index=batch_index)
+
+        def finishing_batches(function: Callable[[Any], Any],
+                              batch_index_of: Callable[[Any], int]
+                              ) -> Callable[[Any], Any]:
+            # A batch ends at the stage that raises or returns nothing for it,
+            # the write stage at the latest
+            def run(item: Any) -> Any:
+                try:
+                    result = function(item)
+                except Exception:
+                    self.metrics.finish_batch(batch_index_of(item))
+                    raise
+                if result is None:
+                    self.metrics.finish_batch(batch_index_of(item))
+                return result
+            return run
+
+        def batch_index_of(batch: Any) -> int:
+            return batch.batch_index
+
+        pipeline = StagedPipeline(
+            stages=[PipelineStage(name="fetch", function=finishing_batches(
+                        fetch_stage, lambda work: work[0])),
+                    PipelineStage(name="transform", function=finishing_batches(
+                        self._transform_batch, batch_index_of)),
+                    PipelineStage(name="write", function=finishing_batches(
+                        self._write_batch, batch_index_of))],
+            size_of=self._estimate_payload_bytes,
+            queue_size=self.pipeline_queue_size,
+            memory_cap_bytes=self.pipeline_memory_cap_bytes
+        )
+        pipeline.run(enumerate(self._build_symbol_batches(symbol_ids)))
+
+    def _run_batch(self, batch_index: int, total_batches: int,
+                   symbols_batch: List[str], period: YFinanceIntervals,
+                   time_window: TradeTimeWindow) -> None:
+        logger.info(f"Processing batch {batch_index + 1} of "
+                    f"{total_batches} "
+                    f"with {len(symbols_batch)} symbols.")
+        try:
+            self._process_batch(symbols_batch, period, time_window,
+                                batch_index=batch_index)
+        except Exception as e:
+            logger.error(f"Error processing batch {batch_index + 1} "
+                         f"of {total_batches}: {e}")
+        finally:
+            self.metrics.finish_batch(batch_index)
 
     def _process_batch(self, symbols_batch: List[str], period: YFinanceIntervals,
-                       time_window: TradeTimeWindow) -> None:
+                       time_window: TradeTimeWindow, batch_index: int = 0) -> None:
+        fetched_batch = self._fetch_batch(symbols_batch, period, time_window,
+                                          batch_index=batch_index)
+        if fetched_batch is None:
+            return
+        prepared_batch = self._transform_batch(fetched_batch)
+        self._write_batch(prepared_batch)
+
+    def _fetch_batch(self, symbols_batch: List[str], period: YFinanceIntervals,
+                     time_window: TradeTimeWindow,
+                     batch_index: int = 0) -> Optional[FetchedBatch]:
         try:
-            current_data = get_market_trade_data(symbols=symbols_batch,
-                                                 period=period,
-                                                 time_window=time_window)
+            with self.metrics.span("db_read", batch_index):
+                watermarks = get_ingestion_watermarks(symbols=symbols_batch,
+                                                      time_window=time_window)
         except Exception as e:
-            logger.error(f"Error retrieving current data for symbols batch: {e}")
-            return
+            logger.error(f"Error retrieving watermarks for symbols batch: {e}")
+            self._mark_failed(symbols_batch, e)
+            return None
 
+        up_to_date_symbols = set(symbols_batch)
         symbols_batch = self._clean_existing_symbols(symbols=symbols_batch,
-                                                     current_data=current_data)
-
+                                                     watermarks=watermarks)
+        self._mark_completed(sorted(up_to_date_symbols - set(symbols_batch)))
+        if not symbols_batch:
+            logger.info("All symbols in batch are up to date.")
+            return None
+
+        with self.metrics.span("fetch", batch_index):
+            fetched_data, fetched_symbols = self._fetch_period_groups(
+                symbols_batch, watermarks, period, time_window)
+        self.metrics.increment("rows_fetched", fetched_data.shape[0])
+        self.metrics.increment("bytes_fetched",
+                               int(fetched_data.memory_usage(index=False).sum()))
+
+        if time_window.is_intraday and fetched_data.shape[0] > 0:
+            fetched_data = drop_stored_and_open_bars(fetched_data, watermarks,
+                                                     time_window)
+
+        if fetched_data.shape[0] == 0:
+            logger.info("No data returned by yfinance for batch.")
+            self._mark_completed(fetched_symbols)
+            return None
+
+        if time_window.is_intraday:
+            # Intraday bars are append only, so they are not diffed against
+            # the stored ones
+            return FetchedBatch(fetched_data=fetched_data,
+                                stored_data=fetched_data.iloc[0:0],
+                                time_window=time_window,
+                                symbols=fetched_symbols,
+                                batch_index=batch_index)
+
+        return self._with_stored_bars(fetched_data, fetched_symbols,
+                                      [symbol for symbol in symbols_batch
+                                       if symbol in watermarks],
+                                      time_window, batch_index)
+
+    def _fetch_period_groups(self, symbols: List[str], watermarks: Dict[str, int],
+                             period: YFinanceIntervals, time_window: TradeTimeWindow
+                             ) -> Tuple[DataFrame, List[str]]:
+        """ Downloads every group of symbols sharing a period; returns the
+        bars and the symbols of the groups that were downloaded """
+        fetched_frames = []
+        fetched_symbols: List[str] = []
+        for group_period, symbols_group in self._group_symbols_by_period(
+                symbols=symbols, watermarks=watermarks, period=period).items():
+            try:
+                fetched_frames.append(self._fetch_yfinance_data(
+                    symbols=symbols_group,
+                    period=group_period,
+                    time_window=time_window,
+                    max_in_flight_requests=self.max_in_flight_requests,
+                    rate_limiter=self.rate_limiter,
+                    downloader=self.downloader,
+                    batch_sizer=self.batch_sizer))
+                fetched_symbols.extend(symbols_group)
+            except Exception as e:
+                # Failed groups are retried by the journal, not here
+                self._mark_failed(symbols_group, e)
+                logger.error(f"Error fetching data from yfinance for "
+                             f"{len(symbols_group)} symbols with period "
+                             f"{group_period.value.yfinance_notation}: {e}")
+
+        fetched_data = (pd.concat(fetched_frames, ignore_index=True)
+                        if fetched_frames else DataFrame(columns=['symbol']))
+        return fetched_data, fetched_symbols
+
+    def _with_stored_bars(self, fetched_data: DataFrame, fetched_symbols: List[str],
+                          stored_symbols: List[str], time_window: TradeTimeWindow,
+                          batch_index: int) -> Optional[FetchedBatch]:
+        """ Pairs the download with the stored bars it overlaps with, which
+        are all the diff needs """
+        try:
+            with self.metrics.span("db_read", batch_index):
+                stored_data = get_ohlcv_bars(
+                    symbols=stored_symbols,
+                    time_window=time_window,
+                    start_open_date=int(fetched_data['open_date'].min()))
+        except Exception as e:
+            logger.error(f"Error retrieving stored data for symbols batch: {e}")
+            self._mark_failed(fetched_symbols, e)
+            return None
+
+        return FetchedBatch(fetched_data=fetched_data,
+                            stored_data=stored_data,
+                            time_window=time_window,
+                            symbols=fetched_symbols,
+                            batch_index=batch_index)
+
+    def _transform_batch(self, fetched_batch: FetchedBatch) -> PreparedBatch:
+        back_fill_limit = int(time.time()
+                              - 60 * 60 * 24 * 365 * MAX_BACK_FILL_PERIOD_YEARS)
         try:
-            fetched_data = self._fetch_yfinance_data(symbols=symbols_batch,
-                                                     period=period,
-                                                     time_window=time_window)
+            with self.metrics.span("diff", fetched_batch.batch_index):
+                ohlcv_diff = diff_ohlcv(
+                    fetched_data=fetched_batch.fetched_data.dropna(),
+                    stored_data=fetched_batch.stored_data,
+                    back_fill_limit=back_fill_limit)
+            with self.metrics.span("prepare", fetched_batch.batch_index):
+                ohlcv_batch = self._prepare_symbols_for_update(
+                    data=ohlcv_diff.changed_data,
+                    time_window=fetched_batch.time_window)
         except Exception as e:
-            logger.error(f"Error fetching data from yfinance for batch: {e}")
+            self._mark_failed(fetched_batch.symbols, e)
+            raise
+        self.diff_counters.add(ohlcv_diff)
+        self.metrics.increment("rows_skipped", ohlcv_diff.unchanged_rows
+                               + ohlcv_diff.expired_rows)
+        logger.info(f"Batch diff: {ohlcv_diff.new_rows} new, "
+                    f"{ohlcv_diff.updated_rows} updated and "
+                    f"{ohlcv_diff.unchanged_rows} unchanged rows.")
+        return PreparedBatch(ohlcv_batch=ohlcv_batch,
+                             symbols=fetched_batch.symbols,
+                             batch_index=fetched_batch.batch_index)
+
+    def _write_batch(self, prepared_batch: PreparedBatch) -> None:
+        ohlcv_batch = prepared_batch.ohlcv_batch
+        if len(ohlcv_batch) == 0:
+            logger.info("No new market data to save for batch.")
+            self._mark_completed(prepared_batch.symbols)
             return
-
-        current_data = current_data[current_data['symbol'].isin(symbols_batch)]
-        merged_data = self._merge_and_clean_data(new_data=fetched_data,
-                                                 existing_data=current_data)
-
         try:
-            symbols_to_update = (
-                self._prepare_symbols_for_update(data=merged_data,
-                                                 time_window=time_window))
-            save_trade_market_data_in_db(symbols_to_update)
-            logger.info("Batch saved successfully to database.")
+            with self.metrics.span("write", prepared_batch.batch_index):
+                self._save_ohlcv_batch(ohlcv_batch)
+            self.metrics.increment("rows_written", len(ohlcv_batch))
+            self.metrics.increment("bytes_written", ohlcv_batch.nbytes)
+            logger.info(f"Batch of {len(ohlcv_batch)} rows saved successfully "
+                        f"to database.")
         except Exception as e:
             logger.error(f"Error saving batch data to database: {e}")
+            self._mark_failed(prepared_batch.symbols, e)
+            return
+        self._mark_completed(prepared_batch.symbols)
+        if ohlcv_batch.time_window.is_intraday:
+            # Resampled bars, indicators and the local store derive from
+            # ohlcv_table only
+            return
 
-    def _clean_existing_symbols(self, symbols: List[str],
-                                current_data: DataFrame) -> List[str]:
+        written_batches = [ohlcv_batch] + self._update_resampled_bars(ohlcv_batch)
+        self._update_indicators(ohlcv_batch)
+        self._update_local_store(written_batches)
+
+    def _save_ohlcv_batch(self, ohlcv_batch: OHLCVBatch) -> None:
+        """ Writes the batch the way its time window and the write mode ask
+        for; ohlcv_table writes move the watermarks with them """
+        if ohlcv_batch.time_window.is_intraday:
+            append_intraday_bars(ohlcv_batch)
+        elif self.write_mode == OHLCVWriteMode.EXECUTEMANY:
+            save_trade_market_data_in_db(ohlcv_batch)
+        else:
+            bulk_load_trade_market_data(ohlcv_batch, write_mode=self.write_mode)
+
+    def _update_resampled_bars(self, ohlcv_batch: OHLCVBatch) -> List[OHLCVBatch]:
+        """ Returns the resampled batches that were written """
+        if not (self.resampled_time_windows
+                and ohlcv_batch.time_window == TradeTimeWindow.DAILY):
+            return []
         try:
-            time_threshold = int(time.time() - self.lookback_period)
+            return update_resampled_bars(ohlcv_batch,
+                                         time_windows=self.resampled_time_windows)
+        except Exception as e:
+            logger.error(f"Error resampling batch data: {e}")
+            return []
 
-            already_present_symbols = current_data[
-                current_data['open_date'] >= time_threshold]['symbol'].unique().tolist()
+    def _update_indicators(self, ohlcv_batch: OHLCVBatch) -> None:
+        if (self.indicator_engine is None
+                or ohlcv_batch.time_window != self.indicator_engine.time_window):
+            return
+        try:
+            self.indicator_engine.update(ohlcv_batch.to_frame())
+        except Exception as e:
+            logger.error(f"Error updating indicators for batch: {e}")
 
-            return list(set(symbols).difference(set(already_present_symbols)))
+    def _update_local_store(self, written_batches: List[OHLCVBatch]) -> None:
+        if self.ohlcv_store is None:
+            return
+        try:
+            for written_batch in written_batches:
+                self.ohlcv_store.write(written_batch)
         except Exception as e:
-            logger.error(f"Error cleaning existing symbols: {e}")
-            return symbols  # Return all symbols in case of error
+            logger.error(f"Error saving batch data to the local store: {e}")
+
+    def _mark_completed(self, symbols: List[str]) -> None:
+        if self.journal is not None and symbols:
+            self.journal.mark_completed(symbols)
+
+    def _mark_failed(self, symbols: List[str], error: Exception) -> None:
+        if self.journal is not None and symbols:
+            self.journal.mark_failed(symbols, error)
+
+    @staticmethod
+    def _estimate_payload_bytes(payload: Union[FetchedBatch, PreparedBatch]) -> int:
+        if isinstance(payload, FetchedBatch):
+            return int(payload.fetched_data.memory_usage(deep=True).sum()
+                       + payload.stored_data.memory_usage(deep=True).sum())
+        return payload.ohlcv_batch.nbytes
+
+    def _clean_existing_symbols(self, symbols: List[str],
+                                watermarks: Dict[str, int]) -> List[str]:
+        time_threshold = int(time.time() - self.lookback_period)
+        return [symbol for symbol in symbols
+                if watermarks.get(symbol, -1) < time_threshold]
+
+    @staticmethod
+    def _group_symbols_by_period(
+            symbols: List[str],
+            watermarks: Dict[str, int],
+            period: YFinanceIntervals) -> Dict[YFinanceIntervals, List[str]]:
+        """ Groups symbols by the shortest period that reaches back to their
+        watermark, never exceeding the requested period """
+        now = time.time()
+        candidate_periods = sorted(
+            (candidate for candidate in YFinanceIntervals
+             if candidate.value.time_in_seconds <= period.value.time_in_seconds),
+            key=lambda candidate: candidate.value.time_in_seconds)
+
+        groups: Dict[YFinanceIntervals, List[str]] = {}
+        for symbol in symbols:
+            group_period = period
+            if symbol in watermarks:
+                missing_seconds = (now - watermarks[symbol]
+                                   + WATERMARK_OVERLAP_SECONDS)
+                group_period = next(
+                    (candidate for candidate in candidate_periods
+                     if candidate.value.time_in_seconds >= missing_seconds),
+                    period)
+            groups.setdefault(group_period, []).append(symbol)
+        return groups
 
     @staticmethod
     @retry(
@@ -119,111 +672,227 @@ class MarketTradeDataCollector:
         wait=wait_exponential(multiplier=1, min=MIN_RETRY_WAIT_TIME,
                               max=MAX_RETRY_WAIT_TIME),
         stop=stop_after_attempt(MAX_RETRY),
+        before_sleep=count_retry,
         reraise=True
     )
-    def _fetch_yfinance_data(symbols: List[str],
-                             period: YFinanceIntervals,
-                             time_window: TradeTimeWindow) -> DataFrame:
-
-        df = yf.download(symbols,
-                         period=period.value.yfinance_notation,
-                         interval=time_window.value.yfinance_notation,
-                         group_by='ticker')
-        df = (df.stack(level=0, future_stack=True)
-              .reset_index().rename(columns={"level_1": "symbol"}))
-        df["open_date"] = df["Date"].apply(lambda x: int(x.timestamp()))
-        df["time_window"] = time_window.value.yfinance_notation
-        df = df[["Ticker", 'open_date', "Open",
-                 "High", "Low", "Close", "Volume", "time_window"]].rename(
-            columns={"Open": "open", "High": "high", "Low": "low", "Close": "close",
-                     "Volume": "volume", "Ticker": "symbol"}
-        )
+    def _fetch_yfinance_data(
+            symbols: List[str],
+            period: YFinanceIntervals,
+            time_window: TradeTimeWindow,
+            max_in_flight_requests: int = MAX_IN_FLIGHT_REQUESTS_DEFAULT,
+            rate_limiter: Optional[TokenBucket] = None,
+            downloader: Optional[Callable[..., DataFrame]] = None,
+            date_range: Optional[Tuple[str, str]] = None,
+            batch_sizer: Optional[AdaptiveBatchSizer] = None
+    ) -> DataFrame:
+        """ Downloads the period up to now, or the dates from start until
+        before end when a date range is given.
+
+        Every download, retries included, is reported to the batch sizer with
+        the time spent in the download call alone, leaving out the waits for
+        the lock, the rate limiter and the retry backoff.
+        """
+
+        if downloader is None:
+            import yfinance as yf  # type: ignore
+            downloader = yf.download
+        dates: Dict[str, str] = (
+            {"start": date_range[0], "end": date_range[1]} if date_range is not None
+            else {"period": period.value.yfinance_notation})
+        with _YFINANCE_DOWNLOAD_LOCK:
+            # Taking the token under the lock spaces out the actual calls
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            started_at = time.perf_counter()
+            try:
+                df = downloader(symbols,
+                                **dates,
+                                interval=time_window.value.yfinance_notation,
+                                group_by='ticker',
+                                threads=max_in_flight_requests)
+            except Exception:
+                if batch_sizer is not None:
+                    batch_sizer.record(BatchOutcome(
+                        symbols=len(symbols),
+                        latency_seconds=time.perf_counter() - started_at,
+                        failed=True, empty_symbols=0))
+                raise
+            latency_seconds = time.perf_counter() - started_at
+        df = normalize_yfinance_frame(data=df, symbols=symbols,
+                                      time_window=time_window)
+        if batch_sizer is not None:
+            # Yahoo throttling mostly shows up as tickers without any data
+            batch_sizer.record(BatchOutcome(
+                symbols=len(symbols), latency_seconds=latency_seconds, failed=False,
+                empty_symbols=len(set(symbols) - set(df['symbol'].unique()))))
         logger.info(f"Successfully fetched data for {len(symbols)} symbols.")
         return df
 
-    @staticmethod
-    def _merge_and_clean_data(new_data: DataFrame,
-                              existing_data: DataFrame) -> DataFrame:
-        if existing_data.shape[0] > 0:
-            combined_data = pd.concat([new_data, existing_data], ignore_index=True)
-        else:
-            combined_data = new_data
-        combined_data = combined_data[combined_data['open_date'] >= time.time()
-                                      - 60 * 60 * 24 * 365 * MAX_BACK_FILL_PERIOD_YEARS]
-        return combined_data.drop_duplicates(subset=['symbol', 'time_window',
-                                                     'open_date'],
-                                             keep=False)
-
     def _prepare_symbols_for_update(
             self,
             data: DataFrame,
-            time_window: TradeTimeWindow) -> List[DataTradedObject]:
-
-        symbols_to_update = list()
+            time_window: TradeTimeWindow) -> OHLCVBatch:
 
-        # Make a copy of the symbol keys to avoid modifying the dictionary
-        # during iteration
-        symbols_copy = list(self.symbols_to_update_map.keys())
         data = data.dropna()
-        grouped_data = data.groupby('symbol')
-        for symbol, group in grouped_data:
-
-            if symbol not in symbols_copy:
-                continue  # Skip any symbols not in the original map
-
-            list_ohlcv = [OHLCV(
-                symbol=str(symbol),
-                time_window=time_window,
-                open=ohlcv['open'],
-                high=ohlcv['high'],
-                low=ohlcv['low'],
-                close=ohlcv['close'],
-                volume=ohlcv['volume'],
-                open_date=ohlcv['open_date']
-            ) for _, ohlcv in group.iterrows()]
-
-            data_object = self.symbols_to_update_map[str(symbol)]
-            data_object.ohlcv_list = list_ohlcv
-            symbols_to_update.append(data_object)
-        return symbols_to_update
-
-    def _build_symbol_batches(self) -> Generator[List[str], None, None]:
-        keys_list = list(self.symbols_to_update_map.keys())
-        shuffle(keys_list)
-        for i in range(0, len(keys_list), self.batch_size):
-            yield keys_list[i:i + self.batch_size]
+        # Skip any symbols not in the registry
+        data = data[self.symbol_registry.ids_of(data['symbol']) >= 0]
+        return OHLCVBatch.from_frame(data=data, time_window=time_window)
+
+    def _build_symbol_batches(self, symbol_ids: np.ndarray
+                              ) -> Generator[List[str], None, None]:
+        """ Shuffles the IDs and resolves them to symbols one batch at a time """
+        shuffled_ids = np.random.default_rng().permutation(symbol_ids)
+        # The size is read per batch so an adaptive sizer can change it mid-run
+        start = 0
+        while start < len(shuffled_ids):
+            batch_size = (self.batch_sizer.batch_size if self.batch_sizer
+                          is not None else self.batch_size)
+            yield self.symbol_registry.symbols_of(
+                shuffled_ids[start:start + batch_size])
+            start += batch_size
 
     @staticmethod
-    def _get_symbols_to_update_strings() -> Dict[str, DataTradedObject]:
-        traded_objects = get_all_traded_objects_from_db()
-        traded_objects_map = {traded_object.symbol: DataTradedObject(
-            traded_object=traded_object, ohlcv_list=list())
-                              for traded_object in traded_objects}
-        return traded_objects_map
+    def _load_symbol_registry() -> SymbolRegistry:
+        return SymbolRegistry.from_rows(get_traded_object_rows())
 
 
-def back_fill_trade_market_data():
-    init_sentry()
-    collector = MarketTradeDataCollector(
-        batch_size=BATCH_SIZE_DEFAULT,
-        lookback_period_days=LOOKBACK_PERIOD_BACK_FILL_DAYS
-    )
-    collector.collect_save_trade_market_data(
-        period=YFinanceIntervals.MAX,
-        time_window=TradeTimeWindow.DAILY
-    )
+def _ohlcv_store_from_environment() -> Optional["OHLCVStore"]:
+    if not os.environ.get("OHLCV_STORE_PATH"):
+        return None
+    from utils.ohlcv_store import OHLCVStore
+    return OHLCVStore.from_environment()
 
 
-def collect_save_new_market_data():
+def back_fill_trade_market_data(
+        shard_index: int = 0, num_shards: int = 1,
+        call_interval_seconds: float = MarketTradeDataCollector.CALL_WAIT_TIME_SECONDS,
+        symbol_registry: Optional[SymbolRegistry] = None,
+        dispose_connection: bool = True
+) -> MarketTradeDataCollector:
     init_sentry()
-    collector = MarketTradeDataCollector(
-        batch_size=BATCH_SIZE_DEFAULT,
-        lookback_period_days=LOOKBACK_PERIOD_DEFAULT_DAYS
-    )
-    collector.collect_save_trade_market_data(
-        period=YFinanceIntervals.ONE_MONTH,
-        time_window=TradeTimeWindow.DAILY
-    )
+    try:
+        run_id = (BACK_FILL_RUN_ID if num_shards == 1
+                  else f"{BACK_FILL_RUN_ID}_{shard_index}_of_{num_shards}")
+        collector = MarketTradeDataCollector(
+            batch_size=BATCH_SIZE_DEFAULT,
+            lookback_period_days=LOOKBACK_PERIOD_BACK_FILL_DAYS,
+            pipelined=True,
+            write_mode=OHLCVWriteMode.STAGING_TABLE,
+            ohlcv_store=_ohlcv_store_from_environment(),
+            rate_limiter=TokenBucket.from_call_interval(call_interval_seconds),
+            batch_sizer=AdaptiveBatchSizer(initial_batch_size=BATCH_SIZE_DEFAULT),
+            journal=BackfillJournal(run_id=run_id),
+            shard_index=shard_index,
+            num_shards=num_shards,
+            resampled_time_windows=RESAMPLED_TIME_WINDOWS,
+            indicator_engine=IndicatorEngine(),
+            metrics=RunMetrics.from_environment(run_name=run_id),
+            symbol_registry=symbol_registry
+        )
+        collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.MAX,
+            time_window=TradeTimeWindow.DAILY
+        )
+        return collector
+    finally:
+        if dispose_connection:
+            dispose_mysql_connection()
+
+
+def collect_save_new_market_data(
+        shard_index: int = 0, num_shards: int = 1,
+        call_interval_seconds: float = MarketTradeDataCollector.CALL_WAIT_TIME_SECONDS,
+        symbol_registry: Optional[SymbolRegistry] = None,
+        dispose_connection: bool = True
+) -> MarketTradeDataCollector:
+    init_sentry()
+    try:
+        collector = MarketTradeDataCollector(
+            batch_size=BATCH_SIZE_DEFAULT,
+            lookback_period_days=LOOKBACK_PERIOD_DEFAULT_DAYS,
+            max_workers=MAX_WORKERS_DEFAULT,
+            ohlcv_store=_ohlcv_store_from_environment(),
+            rate_limiter=TokenBucket.from_call_interval(call_interval_seconds),
+            shard_index=shard_index,
+            num_shards=num_shards,
+            resampled_time_windows=RESAMPLED_TIME_WINDOWS,
+            indicator_engine=IndicatorEngine(),
+            metrics=RunMetrics.from_environment(
+                run_name=NEW_DATA_RUN_NAME if num_shards == 1
+                else f"{NEW_DATA_RUN_NAME}_{shard_index}_of_{num_shards}"),
+            symbol_registry=symbol_registry
+        )
+        collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH,
+            time_window=TradeTimeWindow.DAILY
+        )
+        return collector
+    finally:
+        if dispose_connection:
+            dispose_mysql_connection()
+
+
+def collect_save_intraday_market_data(
+        shard_index: int = 0, num_shards: int = 1,
+        call_interval_seconds: float = MarketTradeDataCollector.CALL_WAIT_TIME_SECONDS,
+        time_window: TradeTimeWindow = TradeTimeWindow.FIVE_MINUTES,
+        symbol_registry: Optional[SymbolRegistry] = None,
+        dispose_connection: bool = True
+) -> MarketTradeDataCollector:
+    init_sentry()
+    try:
+        maintain_intraday_partitions(time_window)
+        run_name = f"{INTRADAY_RUN_NAME}_{time_window.value.yfinance_notation}"
+        collector = MarketTradeDataCollector(
+            batch_size=BATCH_SIZE_DEFAULT,
+            # Every symbol is behind by a bar or more on each run
+            lookback_period_days=0,
+            max_workers=MAX_WORKERS_DEFAULT,
+            rate_limiter=TokenBucket.from_call_interval(call_interval_seconds),
+            shard_index=shard_index,
+            num_shards=num_shards,
+            metrics=RunMetrics.from_environment(
+                run_name=run_name if num_shards == 1
+                else f"{run_name}_{shard_index}_of_{num_shards}"),
+            symbol_registry=symbol_registry
+        )
+        collector.collect_save_trade_market_data(
+            period=INTRADAY_MAX_PERIODS[time_window],
+            time_window=time_window
+        )
+        return collector
+    finally:
+        if dispose_connection:
+            dispose_mysql_connection()
+
+
+def repair_trade_market_data_gaps(
+        shard_index: int = 0, num_shards: int = 1,
+        call_interval_seconds: float = MarketTradeDataCollector.CALL_WAIT_TIME_SECONDS,
+        symbol_registry: Optional[SymbolRegistry] = None,
+        dispose_connection: bool = True
+) -> MarketTradeDataCollector:
+    init_sentry()
+    try:
+        collector = MarketTradeDataCollector(
+            batch_size=BATCH_SIZE_DEFAULT,
+            lookback_period_days=0,
+            ohlcv_store=_ohlcv_store_from_environment(),
+            rate_limiter=TokenBucket.from_call_interval(call_interval_seconds),
+            shard_index=shard_index,
+            num_shards=num_shards,
+            resampled_time_windows=RESAMPLED_TIME_WINDOWS,
+            indicator_engine=IndicatorEngine(),
+            metrics=RunMetrics.from_environment(
+                run_name=REPAIR_GAPS_RUN_NAME if num_shards == 1
+                else f"{REPAIR_GAPS_RUN_NAME}_{shard_index}_of_{num_shards}"),
+            symbol_registry=symbol_registry
+        )
+        collector.repair_gaps(time_window=TradeTimeWindow.DAILY)
+        return collector
+    finally:
+        if dispose_connection:
+            dispose_mysql_connection()
 
 
 if __name__ == '__main__':
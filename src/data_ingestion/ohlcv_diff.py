@@ -0,0 +1,103 @@
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# FLOAT columns hold single precision values, so a round trip through the
+# database only keeps about 7 significant digits.
+PRICE_RELATIVE_TOLERANCE = 1e-6
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+KEY_COLUMNS = ["symbol", "open_date"]
+
+
+@dataclass
+class OHLCVDiff:
+    """ Fetched bars split by how they compare with the stored ones """
+    inserts: DataFrame
+    updates: DataFrame
+    unchanged_rows: int
+    expired_rows: int
+
+    @property
+    def new_rows(self) -> int:
+        return int(self.inserts.shape[0])
+
+    @property
+    def updated_rows(self) -> int:
+        return int(self.updates.shape[0])
+
+    @property
+    def changed_data(self) -> DataFrame:
+        """ Rows that have to be written: inserts followed by updates """
+        return pd.concat([self.inserts, self.updates], ignore_index=True)
+
+
+@dataclass
+class OHLCVDiffCounters:
+    """ Running totals of the diffs computed during a collection run """
+    new_rows: int = 0
+    updated_rows: int = 0
+    unchanged_rows: int = 0
+    expired_rows: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, ohlcv_diff: OHLCVDiff) -> None:
+        with self._lock:
+            self.new_rows += ohlcv_diff.new_rows
+            self.updated_rows += ohlcv_diff.updated_rows
+            self.unchanged_rows += ohlcv_diff.unchanged_rows
+            self.expired_rows += ohlcv_diff.expired_rows
+
+    @property
+    def written_fraction(self) -> float:
+        total = (self.new_rows + self.updated_rows + self.unchanged_rows
+                 + self.expired_rows)
+        if total == 0:
+            return 0.0
+        return (self.new_rows + self.updated_rows) / total
+
+
+def diff_ohlcv(fetched_data: DataFrame, stored_data: DataFrame,
+               back_fill_limit: Optional[int] = None,
+               relative_tolerance: float = PRICE_RELATIVE_TOLERANCE) -> OHLCVDiff:
+    """ Compares fetched bars with the stored bars of the same time window.
+
+    Bars are matched on (symbol, open_date). A matched bar is an update when
+    any price differs by more than `relative_tolerance` or the volume
+    differs. Unmatched bars older than `back_fill_limit` are not inserted.
+    """
+    if stored_data.shape[0] == 0:
+        is_stored = np.zeros(fetched_data.shape[0], dtype=bool)
+        is_changed = np.zeros(fetched_data.shape[0], dtype=bool)
+    else:
+        stored_values = stored_data[KEY_COLUMNS + PRICE_COLUMNS + ["volume"]]
+        merged = fetched_data[KEY_COLUMNS].merge(
+            stored_values.astype({"symbol": object}),
+            how="left", on=KEY_COLUMNS, indicator=True, sort=False)
+        is_stored = (merged["_merge"] == "both").to_numpy()
+
+        is_changed = ~np.isclose(merged["volume"].to_numpy(dtype=np.float64),
+                                 fetched_data["volume"].to_numpy(dtype=np.float64),
+                                 rtol=0, atol=0.5)
+        for column in PRICE_COLUMNS:
+            is_changed |= ~np.isclose(
+                merged[column].to_numpy(dtype=np.float64),
+                fetched_data[column].to_numpy(dtype=np.float64),
+                rtol=relative_tolerance, atol=0)
+
+    is_new = ~is_stored
+    is_expired = np.zeros(fetched_data.shape[0], dtype=bool)
+    if back_fill_limit is not None:
+        is_expired = is_new & (fetched_data["open_date"].to_numpy() < back_fill_limit)
+
+    return OHLCVDiff(
+        inserts=fetched_data[is_new & ~is_expired],
+        updates=fetched_data[is_stored & is_changed],
+        unchanged_rows=int((is_stored & ~is_changed).sum()),
+        expired_rows=int(is_expired.sum())
+    )
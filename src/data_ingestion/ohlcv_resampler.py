@@ -0,0 +1,137 @@
+import logging
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import get_ohlcv_bars, save_trade_market_data_in_db
+from utils.enums import TradeTimeWindow
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 60 * 60 * 24
+RESAMPLED_TIME_WINDOWS = [TradeTimeWindow.WEEKLY, TradeTimeWindow.MONTHLY,
+                          TradeTimeWindow.THREE_MONTHS]
+# 1970-01-01 was a Thursday, three days after the start of its exchange week
+_EPOCH_WEEKDAY_OFFSET = 3
+
+
+def period_start_dates(open_dates: np.ndarray,
+                       time_window: TradeTimeWindow) -> np.ndarray:
+    """ Open date of the week, month or quarter each daily open date falls in.
+
+    Weeks start on Monday and months and quarters on their first calendar
+    day, which are the open dates yfinance uses for these intervals.
+    """
+    days = open_dates.astype(np.int64) // SECONDS_PER_DAY
+    if time_window == TradeTimeWindow.DAILY:
+        return days * SECONDS_PER_DAY
+    if time_window == TradeTimeWindow.WEEKLY:
+        return (days - (days + _EPOCH_WEEKDAY_OFFSET) % 7) * SECONDS_PER_DAY
+
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    if time_window == TradeTimeWindow.THREE_MONTHS:
+        months -= months % 3
+    return (months.astype("datetime64[M]").astype("datetime64[D]")
+            .astype(np.int64) * SECONDS_PER_DAY)
+
+
+def resample_daily_bars(data: DataFrame, time_window: TradeTimeWindow) -> DataFrame:
+    """ Aggregates daily bars into bars of a longer time window.
+
+    Open is the first daily open of the period, close the last close, high
+    and low the extremes and volume the sum.
+    """
+    if data.shape[0] == 0:
+        return DataFrame(columns=["symbol", "open_date", "open", "high", "low",
+                                  "close", "volume"])
+
+    symbol_codes, symbols = pd.factorize(data["symbol"])
+    open_dates = data["open_date"].to_numpy(dtype=np.int64)
+    periods = period_start_dates(open_dates, time_window)
+
+    order = np.lexsort((open_dates, periods, symbol_codes))
+    symbol_codes, periods = symbol_codes[order], periods[order]
+    is_start = np.ones(len(order), dtype=bool)
+    is_start[1:] = ((symbol_codes[1:] != symbol_codes[:-1])
+                    | (periods[1:] != periods[:-1]))
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(order)) - 1
+
+    def column(name: str) -> np.ndarray:
+        return data[name].to_numpy()[order]
+
+    return DataFrame({
+        "symbol": np.asarray(symbols, dtype=object)[symbol_codes[starts]],
+        "open_date": periods[starts],
+        "open": column("open")[starts],
+        "high": np.maximum.reduceat(column("high"), starts),
+        "low": np.minimum.reduceat(column("low"), starts),
+        "close": column("close")[ends],
+        "volume": np.add.reduceat(column("volume").astype(np.int64), starts)
+    })
+
+
+def update_resampled_bars(
+        daily_batch: OHLCVBatch,
+        time_windows: List[TradeTimeWindow] = RESAMPLED_TIME_WINDOWS
+) -> List[OHLCVBatch]:
+    """ Recomputes the periods touched by freshly written daily bars.
+
+    For every symbol in the batch the stored daily bars are read back from
+    the start of its earliest touched period, so only those periods are
+    rebuilt and written. Symbols touching the same periods share one read.
+    Returns the batches written per time window.
+    """
+    if len(daily_batch) == 0:
+        return []
+    if daily_batch.time_window != TradeTimeWindow.DAILY:
+        raise ValueError("Only daily bars can be resampled.")
+
+    first_open_dates = _first_open_dates(daily_batch)
+    daily_data = _read_daily_bars(first_open_dates, time_windows)
+
+    resampled_batches = []
+    for time_window in time_windows:
+        resampled = resample_daily_bars(daily_data, time_window)
+        first_periods = period_start_dates(
+            resampled["symbol"].map(first_open_dates).to_numpy(dtype=np.int64),
+            time_window)
+        resampled = resampled[resampled["open_date"].to_numpy() >= first_periods]
+
+        resampled_batch = OHLCVBatch.from_frame(resampled, time_window=time_window)
+        save_trade_market_data_in_db(resampled_batch)
+        resampled_batches.append(resampled_batch)
+        logger.info(f"Resampled {len(resampled_batch)} "
+                    f"{time_window.value.yfinance_notation} bars.")
+    return resampled_batches
+
+
+def _first_open_dates(ohlcv_batch: OHLCVBatch) -> Dict[str, int]:
+    first_open_dates = np.full(len(ohlcv_batch.symbols), np.iinfo(np.int64).max,
+                               dtype=np.int64)
+    np.minimum.at(first_open_dates, ohlcv_batch.symbol_codes, ohlcv_batch.open_date)
+    present = first_open_dates != np.iinfo(np.int64).max
+    return dict(zip(ohlcv_batch.symbols[present].tolist(),
+                    first_open_dates[present].tolist()))
+
+
+def _read_daily_bars(first_open_dates: Dict[str, int],
+                     time_windows: List[TradeTimeWindow]) -> DataFrame:
+    """ Reads the stored daily bars of every symbol from the start of the
+    longest period its first open date falls in """
+    symbols = list(first_open_dates)
+    open_dates = np.array(list(first_open_dates.values()), dtype=np.int64)
+    read_from = np.min([period_start_dates(open_dates, time_window)
+                        for time_window in time_windows], axis=0)
+
+    symbols_by_read_from: Dict[int, List[str]] = {}
+    for symbol, symbol_read_from in zip(symbols, read_from.tolist()):
+        symbols_by_read_from.setdefault(symbol_read_from, []).append(symbol)
+    return pd.concat([get_ohlcv_bars(symbols=group_symbols,
+                                     time_window=TradeTimeWindow.DAILY,
+                                     start_open_date=group_read_from)
+                      for group_read_from, group_symbols
+                      in sorted(symbols_by_read_from.items())], ignore_index=True)
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+MIN_BATCH_SIZE_DEFAULT = 10
+MAX_BATCH_SIZE_DEFAULT = 500
+BATCH_SIZE_INCREASE_DEFAULT = 10
+BATCH_SIZE_DECREASE_FACTOR_DEFAULT = 0.5
+TARGET_LATENCY_SECONDS_DEFAULT = 30.0
+MAX_EMPTY_FRACTION_DEFAULT = 0.2
+# Weight of the latest outcome in the smoothed rates reported by the sizer
+SMOOTHING_FACTOR = 0.3
+
+
+class TokenBucket:
+    """ Thread safe token bucket; acquire blocks until enough tokens refill """
+
+    def __init__(self, rate_per_second: float, capacity: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be positive.")
+        if capacity < 1:
+            raise ValueError("capacity must be at least one token.")
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.total_wait_seconds = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_call_interval(cls, call_interval_seconds: float) -> "TokenBucket":
+        return cls(rate_per_second=1 / call_interval_seconds)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """ Takes `tokens` from the bucket and returns the seconds waited """
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        with self._lock:
+            while True:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens
+                                   + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    self.total_wait_seconds += waited
+                    return waited
+                wait_seconds = (tokens - self._tokens) / self.rate_per_second
+                self._sleep(wait_seconds)
+                waited += wait_seconds
+
+
+@dataclass
+class BatchOutcome:
+    """ What a single batch download looked like from the outside """
+    symbols: int
+    latency_seconds: float
+    failed: bool
+    empty_symbols: int
+
+    @property
+    def empty_fraction(self) -> float:
+        return self.empty_symbols / self.symbols if self.symbols else 0.0
+
+
+class AdaptiveBatchSizer:
+    """ Sizes yfinance batches with additive increase, multiplicative decrease.
+
+    Every batch that finishes within the latency target, without errors and
+    with few empty results grows the next batch by `additive_increase`
+    symbols. Anything that looks like throttling shrinks it by
+    `decrease_factor`, so the size settles just under what Yahoo tolerates.
+    """
+
+    def __init__(self, initial_batch_size: int,
+                 min_batch_size: int = MIN_BATCH_SIZE_DEFAULT,
+                 max_batch_size: int = MAX_BATCH_SIZE_DEFAULT,
+                 additive_increase: int = BATCH_SIZE_INCREASE_DEFAULT,
+                 decrease_factor: float = BATCH_SIZE_DECREASE_FACTOR_DEFAULT,
+                 target_latency_seconds: float = TARGET_LATENCY_SECONDS_DEFAULT,
+                 max_empty_fraction: float = MAX_EMPTY_FRACTION_DEFAULT):
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1.")
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.target_latency_seconds = target_latency_seconds
+        self.max_empty_fraction = max_empty_fraction
+        self.increases = 0
+        self.decreases = 0
+        self.latency_seconds = 0.0
+        self.error_rate = 0.0
+        self.empty_rate = 0.0
+        self._batch_size = self._clamp(initial_batch_size)
+        self._lock = threading.Lock()
+
+    @property
+    def batch_size(self) -> int:
+        with self._lock:
+            return self._batch_size
+
+    def record(self, outcome: BatchOutcome) -> int:
+        """ Updates the batch size from a finished batch and returns it """
+        with self._lock:
+            self.latency_seconds = self._smooth(self.latency_seconds,
+                                                outcome.latency_seconds)
+            self.error_rate = self._smooth(self.error_rate, float(outcome.failed))
+            self.empty_rate = self._smooth(self.empty_rate, outcome.empty_fraction)
+
+            if (outcome.failed
+                    or outcome.empty_fraction > self.max_empty_fraction
+                    or outcome.latency_seconds > self.target_latency_seconds):
+                self._batch_size = self._clamp(
+                    int(self._batch_size * self.decrease_factor))
+                self.decreases += 1
+                logger.info(f"Throttling suspected, batch size reduced to "
+                            f"{self._batch_size}.")
+            else:
+                self._batch_size = self._clamp(
+                    self._batch_size + self.additive_increase)
+                self.increases += 1
+            return self._batch_size
+
+    def _clamp(self, batch_size: int) -> int:
+        return min(self.max_batch_size, max(self.min_batch_size, batch_size))
+
+    def _smooth(self, current: float, observed: float) -> float:
+        if self.increases + self.decreases == 0:
+            return observed
+        return SMOOTHING_FACTOR * observed + (1 - SMOOTHING_FACTOR) * current
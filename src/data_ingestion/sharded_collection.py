@@ -0,0 +1,220 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from data_ingestion.intraday import INTRADAY_TIME_WINDOWS
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector, \
+    back_fill_trade_market_data, collect_save_intraday_market_data, \
+    collect_save_new_market_data, repair_trade_market_data_gaps
+from utils.db_helpers import get_connection_pool_stats
+
+logger = logging.getLogger(__name__)
+
+ShardJob = Callable[[int, int, float], MarketTradeDataCollector]
+
+SHARD_JOBS: Dict[str, ShardJob] = {
+    "back_fill": back_fill_trade_market_data,
+    "new_data": collect_save_new_market_data,
+    "repair_gaps": repair_trade_market_data_gaps,
+    **{f"intraday_{time_window.value.yfinance_notation}": partial(
+        collect_save_intraday_market_data, time_window=time_window)
+       for time_window in INTRADAY_TIME_WINDOWS},
+}
+
+
+@dataclass
+class ShardReport:
+    """ Metrics of one shard of a sharded collection run """
+    shard_index: int
+    num_shards: int
+    symbols: int = 0
+    new_rows: int = 0
+    updated_rows: int = 0
+    unchanged_rows: int = 0
+    expired_rows: int = 0
+    completed_symbols: int = 0
+    failed_symbols: int = 0
+    elapsed_seconds: float = 0.0
+    db_checkouts: int = 0
+    db_wait_seconds: float = 0.0
+    rate_limiter_wait_seconds: float = 0.0
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @classmethod
+    def from_collector(cls, collector: MarketTradeDataCollector,
+                       elapsed_seconds: float) -> "ShardReport":
+        report = cls(shard_index=collector.shard_index,
+                     num_shards=collector.num_shards,
+                     symbols=len(collector.symbol_registry),
+                     new_rows=collector.diff_counters.new_rows,
+                     updated_rows=collector.diff_counters.updated_rows,
+                     unchanged_rows=collector.diff_counters.unchanged_rows,
+                     expired_rows=collector.diff_counters.expired_rows,
+                     elapsed_seconds=elapsed_seconds,
+                     stage_seconds={
+                         stage: timing["total_seconds"] for stage, timing
+                         in collector.metrics.summary()["stages"].items()})
+        if collector.journal is not None:
+            progress = collector.journal.progress()
+            report.completed_symbols = progress.completed
+            report.failed_symbols = progress.failed
+        if collector.rate_limiter is not None:
+            report.rate_limiter_wait_seconds = collector.rate_limiter.total_wait_seconds
+        return report
+
+
+@dataclass
+class RunReport:
+    """ Shard reports of a run merged into totals """
+    shards: List[ShardReport] = field(default_factory=list)
+
+    @property
+    def written_rows(self) -> int:
+        return sum(shard.new_rows + shard.updated_rows for shard in self.shards)
+
+    @property
+    def elapsed_seconds(self) -> float:
+        # Shards run side by side, so the run takes as long as the slowest one
+        return max((shard.elapsed_seconds for shard in self.shards), default=0.0)
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.elapsed_seconds == 0:
+            return 0.0
+        return self.written_rows / self.elapsed_seconds
+
+    @property
+    def failed_shards(self) -> List[int]:
+        return [shard.shard_index for shard in self.shards if shard.error]
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for shard in self.shards:
+            for name, value in asdict(shard).items():
+                if name not in ("shard_index", "num_shards", "elapsed_seconds",
+                                "stage_seconds", "error"):
+                    totals[name] = totals.get(name, 0) + value
+            for stage, seconds in shard.stage_seconds.items():
+                # Summed over shards, i.e. process time rather than wall time
+                totals[f"{stage}_seconds"] = totals.get(f"{stage}_seconds", 0) + seconds
+        totals["elapsed_seconds"] = self.elapsed_seconds
+        totals["rows_per_second"] = self.rows_per_second
+        return totals
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "shards": [asdict(shard) for shard in
+                       sorted(self.shards, key=lambda shard: shard.shard_index)],
+            "totals": self.totals(),
+            "failed_shards": self.failed_shards
+        }, indent=2)
+
+    @classmethod
+    def from_json(cls, content: str) -> "RunReport":
+        return cls(shards=[ShardReport(**shard)
+                           for shard in json.loads(content)["shards"]])
+
+    @classmethod
+    def merge(cls, reports: List["RunReport"]) -> "RunReport":
+        return cls(shards=[shard for report in reports for shard in report.shards])
+
+
+def run_shard(job: ShardJob, shard_index: int, num_shards: int,
+              call_interval_seconds: float) -> ShardReport:
+    """ Runs one shard and reports on it; errors end up in the report """
+    started_at = time.perf_counter()
+    try:
+        collector = job(shard_index, num_shards, call_interval_seconds)
+        report = ShardReport.from_collector(
+            collector, elapsed_seconds=time.perf_counter() - started_at)
+    except Exception as e:
+        logger.error(f"Shard {shard_index + 1} of {num_shards} failed: {e}")
+        report = ShardReport(shard_index=shard_index, num_shards=num_shards,
+                             elapsed_seconds=time.perf_counter() - started_at,
+                             error=f"{type(e).__name__}: {e}")
+
+    # Every shard process has its own engine, so these are its own pool stats
+    pool_stats = get_connection_pool_stats()
+    report.db_checkouts = pool_stats.checkouts
+    report.db_wait_seconds = pool_stats.total_wait_time_seconds
+    return report
+
+
+def run_sharded(job: ShardJob, num_shards: int,
+                max_workers: Optional[int] = None,
+                call_interval_seconds: float = MarketTradeDataCollector.CALL_WAIT_TIME_SECONDS
+                ) -> RunReport:
+    """ Runs every shard of a job in a pool of processes on this machine.
+
+    The processes share one IP address, so each one calls yfinance
+    `max_workers` times less often to keep the overall request rate.
+    """
+    max_workers = min(num_shards, max_workers or num_shards)
+    # Spawned processes start without the parent's engine and its sockets
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(run_shard, job, shard_index, num_shards,
+                                   call_interval_seconds * max_workers)
+                   for shard_index in range(num_shards)]
+        report = RunReport(shards=[future.result() for future in futures])
+
+    logger.info(f"Sharded run finished: {report.written_rows} rows written by "
+                f"{num_shards} shards in {report.elapsed_seconds:.1f}s "
+                f"({report.rows_per_second:.1f} rows/s), failed shards: "
+                f"{report.failed_shards}.")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run market data collection split into shards of symbols.")
+    parser.add_argument("job", choices=sorted(SHARD_JOBS) + ["merge"])
+    parser.add_argument("--shard", type=int,
+                        help="index of the single shard to run, e.g. in a container")
+    parser.add_argument("--num-shards", type=int,
+                        help="total number of shards across every node")
+    parser.add_argument("--workers", type=int,
+                        help="run all shards in this many local processes")
+    parser.add_argument("--report-path", type=Path,
+                        help="where to write the JSON run report")
+    parser.add_argument("reports", nargs="*", type=Path,
+                        help="shard reports to merge with the merge job")
+    args = parser.parse_args()
+
+    if args.job == "merge":
+        report = RunReport.merge([RunReport.from_json(path.read_text())
+                                  for path in args.reports])
+    elif args.shard is not None:
+        if args.num_shards is None:
+            parser.error("--shard requires --num-shards")
+        report = RunReport(shards=[run_shard(
+            SHARD_JOBS[args.job], args.shard, args.num_shards,
+            MarketTradeDataCollector.CALL_WAIT_TIME_SECONDS)])
+    else:
+        workers = args.workers or 1
+        report = run_sharded(SHARD_JOBS[args.job],
+                             num_shards=args.num_shards or workers,
+                             max_workers=workers)
+
+    if args.report_path is not None:
+        args.report_path.write_text(report.to_json())
+    else:
+        print(report.to_json())
+    if report.failed_shards:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
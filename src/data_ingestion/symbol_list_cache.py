@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from data_ingestion.json_stream import STREAM_CHUNK_SIZE_DEFAULT, Chunk, iter_chunks, \
+    iter_json_array
+from utils.enums import TradedObjectType
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _iter_file(path: Path, chunk_size: int = STREAM_CHUNK_SIZE_DEFAULT
+               ) -> Iterator[bytes]:
+    with path.open("rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+@dataclass
+class SymbolListResponse:
+    """ Body of a symbol list response and its validators.
+
+    The body is either held as `content` or kept on disk at `path`, which is
+    where a downloaded or cached list of tens of megabytes lives. A response
+    still arriving from the API carries its body as `chunks` instead, read
+    once by `spool` or iter_records; both hash the chunks as they go, so the
+    body is never held as a whole.
+    """
+    content: bytes = b""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    path: Optional[Path] = None
+    chunks: Optional[Iterator[bytes]] = field(default=None, repr=False, compare=False)
+    digest: Optional[str] = field(default=None, repr=False, compare=False)
+    length: Optional[int] = field(default=None, repr=False, compare=False)
+
+    @property
+    def content_hash(self) -> str:
+        if self.digest is None:
+            if self.chunks is not None:
+                raise ValueError("The body of the response has not been read yet.")
+            digest = hashlib.sha256()
+            for chunk in self.iter_body():
+                digest.update(chunk)
+            self.digest = digest.hexdigest()
+        return self.digest
+
+    @property
+    def size(self) -> int:
+        if self.length is None:
+            if self.chunks is not None:
+                raise ValueError("The body of the response has not been read yet.")
+            self.length = (self.path.stat().st_size if self.path is not None
+                           else len(self.content))
+        return self.length
+
+    def iter_body(self, chunk_size: int = STREAM_CHUNK_SIZE_DEFAULT) -> Iterator[Chunk]:
+        if self.chunks is not None:
+            return self._read_chunks()
+        if self.path is not None:
+            return _iter_file(self.path, chunk_size)
+        return iter_chunks(self.content, chunk_size)
+
+    def iter_records(self, chunk_size: int = STREAM_CHUNK_SIZE_DEFAULT
+                     ) -> Iterator[Any]:
+        """ Decodes the entries one at a time; raises ValueError unless the
+        body is a JSON list """
+        return iter_json_array(self.iter_body(chunk_size))
+
+    def spool(self, path: Path) -> None:
+        """ Writes the arriving body to `path`, which then holds it """
+        with path.open("wb") as file:
+            for chunk in self._read_chunks():
+                file.write(chunk)
+        self.path = path
+
+    def _read_chunks(self) -> Iterator[bytes]:
+        chunks, self.chunks = self.chunks, None
+        digest = hashlib.sha256()
+        length = 0
+        for chunk in chunks or ():
+            digest.update(chunk)
+            length += len(chunk)
+            yield chunk
+        self.digest, self.length = digest.hexdigest(), length
+
+
+@dataclass
+class CachedSymbolList:
+    """ What is known about the last symbol list that was applied """
+    content_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class SymbolListCache:
+    """ Raw symbol list responses on disk, one per object type.
+
+    Each type keeps the raw body as <type>.json next to a <type>.meta.json
+    with its content hash and HTTP validators. A downloaded body is spooled
+    to <type>.json.part first and only moved into place after the list was
+    applied to the database, so a failed sync is retried in full on the
+    next run.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+
+    @classmethod
+    def from_environment(cls) -> Optional["SymbolListCache"]:
+        cache_dir = os.environ.get("SYMBOL_LIST_CACHE_DIR")
+        return cls(cache_dir) if cache_dir else None
+
+    def get(self, object_type: TradedObjectType) -> Optional[CachedSymbolList]:
+        meta_path = self._path(object_type, "meta.json")
+        if not (meta_path.exists() and self._path(object_type, "json").exists()):
+            return None
+        try:
+            return CachedSymbolList(**json.loads(meta_path.read_text()))
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable symbol list cache entry "
+                           f"{meta_path}: {e}")
+            return None
+
+    def read(self, object_type: TradedObjectType) -> Optional[SymbolListResponse]:
+        cached = self.get(object_type)
+        if cached is None:
+            return None
+        return SymbolListResponse(path=self._path(object_type, "json"),
+                                  etag=cached.etag,
+                                  last_modified=cached.last_modified,
+                                  digest=cached.content_hash)
+
+    def spool(self, object_type: TradedObjectType, response: SymbolListResponse) -> None:
+        """ Writes the body still arriving to the cache directory, next to
+        the entry it may replace """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        response.spool(self._path(object_type, "json.part"))
+
+    def discard(self, object_type: TradedObjectType) -> None:
+        """ Removes a spooled body that was not put """
+        self._path(object_type, "json.part").unlink(missing_ok=True)
+
+    def put(self, object_type: TradedObjectType, response: SymbolListResponse) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        body_path = self._path(object_type, "json")
+        # The body goes first, so metadata never describes a body that is not there
+        if response.path is None:
+            self._write(body_path, response.content)
+        elif response.path != body_path:
+            os.replace(response.path, body_path)
+            response.path = body_path
+        self._write(self._path(object_type, "meta.json"), json.dumps(asdict(
+            CachedSymbolList(content_hash=response.content_hash,
+                             etag=response.etag,
+                             last_modified=response.last_modified))).encode())
+
+    def _path(self, object_type: TradedObjectType, suffix: str) -> Path:
+        return self.cache_dir / f"{object_type.name.lower()}.{suffix}"
+
+    @staticmethod
+    def _write(path: Path, content: bytes) -> None:
+        temporary_path = path.with_name(f".{path.name}.tmp")
+        temporary_path.write_bytes(content)
+        os.replace(temporary_path, path)
@@ -1,18 +1,25 @@
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
 
 import requests
 import logging
-from typing import Set, List, Optional
+from typing import Any, Dict, Iterable, Iterator, Set, Optional, Tuple
 from tenacity import (retry, stop_after_attempt, wait_exponential,
                       retry_if_exception_type)
 
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 
 from config.sentry_config import init_sentry
 from data_ingestion.data_ingestion_constants import MAIN_FINANCIAL_MODELING_PREP_URL
+from data_ingestion.json_stream import STREAM_CHUNK_SIZE_DEFAULT
+from data_ingestion.symbol_list_cache import CachedSymbolList, SymbolListCache, \
+    SymbolListResponse
 from utils.data_models import TradedObject
-from utils.db_helpers import get_all_traded_objects_from_db, \
-    save_new_traded_objects_in_db
 from utils.enums import TradedObjectType
 
 # Set up logger for the module
@@ -22,86 +29,265 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MAX_CONCURRENT_REQUESTS_DEFAULT = 4
+CONNECT_TIMEOUT_SECONDS_DEFAULT = 5
+# The stock list is tens of megabytes
+READ_TIMEOUT_SECONDS_DEFAULT = 60
+
+
+class NotModifiedWithoutCacheError(Exception):
+    """ The API answered not modified to a request without validators, so
+    there is no list to use; retrying would get the same answer """
+
+
+@dataclass
+class SymbolListDelta:
+    """ Changes between the stored traded objects and the fetched lists;
+    `changed` holds the fetched version of renamed or re-exchanged objects """
+    added: Set[TradedObject] = field(default_factory=set)
+    removed: Set[TradedObject] = field(default_factory=set)
+    changed: Set[TradedObject] = field(default_factory=set)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+
+@dataclass
+class SymbolListParseStats:
+    """ Throughput and rejected entries of parsing one symbol list """
+    object_type: TradedObjectType
+    entries: int = 0
+    invalid_entries: int = 0
+    duplicate_entries: int = 0
+    parsed_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def entries_per_second(self) -> float:
+        return self.entries / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.parsed_bytes / 1e6 / self.seconds if self.seconds > 0 else 0.0
+
+
+def _interned(value: Any) -> Any:
+    # Tens of thousands of entries share a handful of exchange names
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _listing(traded_object: TradedObject) -> Tuple[str, str, str]:
+    return (traded_object.name, traded_object.exchange,
+            traded_object.exchange_short_name)
+
+
+def compute_symbol_list_delta(current_symbol_list: Set[TradedObject],
+                              new_symbol_list: Set[TradedObject]) -> SymbolListDelta:
+    # Traded objects are equal when symbol and type match, whatever their names
+    current_by_key = {traded_object: traded_object
+                      for traded_object in current_symbol_list}
+    return SymbolListDelta(
+        added=new_symbol_list - current_symbol_list,
+        removed=current_symbol_list - new_symbol_list,
+        changed={traded_object for traded_object in new_symbol_list
+                 if traded_object in current_by_key
+                 and _listing(current_by_key[traded_object]) != _listing(traded_object)})
+
 
 class SymbolListCollector:
-    """ Class to update the list of symbols if required """
+    """ Class to update the list of symbols if required.
+
+    Raw responses are cached on disk with their content hash, so a run where
+    neither list changed stops before parsing them or reading the database.
+    Bodies are streamed to the cache directory and hashed on the way, so an
+    unchanged list is not parsed even when the API sends it in full.
+    Otherwise the fetched lists are diffed against the listed traded objects
+    and the delta is applied as one upsert and soft-delete.
+    """
 
     MAX_RETRY = 3
     MIN_RETRY_WAIT_TIME = 2
     MAX_RETRY_WAIT_TIME = 10
+    # Every type with an endpoint has a list; adding one to TradedObjectType
+    # is enough to fetch it
+    SYMBOL_LIST_TYPES = tuple(object_type for object_type in TradedObjectType
+                              if object_type.value['endpoint_name'])
+    # A list shrinking by more than this is more likely a bad response than
+    # a wave of delistings, so nothing is soft-deleted
+    MAX_REMOVED_FRACTION = 0.2
 
-    def __init__(self):
-        self.current_symbol_list: Set[TradedObject] = get_all_traded_objects_from_db()
+    def __init__(self, cache: Optional[SymbolListCache] = None,
+                 max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS_DEFAULT,
+                 connect_timeout_seconds: float = CONNECT_TIMEOUT_SECONDS_DEFAULT,
+                 read_timeout_seconds: float = READ_TIMEOUT_SECONDS_DEFAULT,
+                 base_url: str = MAIN_FINANCIAL_MODELING_PREP_URL):
+        self.cache = cache
+        self.max_concurrent_requests = max(1, max_concurrent_requests)
+        self.timeout = (connect_timeout_seconds, read_timeout_seconds)
+        self.base_url = base_url
+        # One pooled session keeps the connections to the API alive between
+        # the concurrent requests and across retries
+        self.session = requests.Session()
+        self.session.mount(base_url, HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_concurrent_requests))
+        self.current_symbol_list: Optional[Set[TradedObject]] = None
         self.new_symbol_list: Optional[Set[TradedObject]] = None
+        self.responses: Dict[TradedObjectType, SymbolListResponse] = {}
+        self.parsed_lists: Dict[TradedObjectType, Set[TradedObject]] = {}
+        self.parse_stats: Dict[TradedObjectType, SymbolListParseStats] = {}
+        self.delta: Optional[SymbolListDelta] = None
+
+    def close(self) -> None:
+        self.session.close()
 
     def update_traded_objects(self) -> None:
         try:
-            self._get_traded_objects_from_online()
-            self._save_new_traded_objects()
+            if not self._get_traded_objects_from_online():
+                logger.info("Symbol lists are unchanged since the last sync.")
+                return
+            if self._save_new_traded_objects() and self.cache is not None:
+                for object_type, response in self.responses.items():
+                    self.cache.put(object_type, response)
         except Exception as e:
             logger.error(f"Error updating traded objects: {e}")
+        finally:
+            if self.cache is not None:
+                for object_type in self.SYMBOL_LIST_TYPES:
+                    self.cache.discard(object_type)
+
+    def _save_new_traded_objects(self) -> bool:
+        """ Applies the delta to the database; returns whether the fetched
+        lists are now reflected there """
+        # Imported here so a run where no list changed never loads the
+        # database layer
+        from utils.db_helpers import apply_traded_objects_delta, \
+            get_all_traded_objects_from_db
 
-    def _save_new_traded_objects(self) -> None:
         if not self.new_symbol_list:
             logger.warning(
                 "No new traded objects found or an error occurred while fetching.")
-            return
-        objects_to_save = self.new_symbol_list.difference(self.current_symbol_list)
-        if len(objects_to_save):
-            save_new_traded_objects_in_db(traded_objects=objects_to_save)
-            logger.info(f"Saved {len(objects_to_save)} new traded objects to the "
-                        f"database.")
-        else:
+            return False
+        if self.current_symbol_list is None:
+            self.current_symbol_list = get_all_traded_objects_from_db()
+
+        self.delta = compute_symbol_list_delta(self.current_symbol_list,
+                                               self.new_symbol_list)
+        if self.delta.is_empty:
             logger.warning("All traded objects are available in the database already")
+            return True
+        if (len(self.delta.removed)
+                > self.MAX_REMOVED_FRACTION * len(self.current_symbol_list)):
+            logger.error(f"Refusing to soft-delete {len(self.delta.removed)} of "
+                         f"{len(self.current_symbol_list)} traded objects.")
+            return False
 
-    def _get_traded_objects_from_online(self) -> None:
-        stock_set = self._get_traded_objects_by_type(
-            trade_object_type=TradedObjectType.STOCK
-        )
+        apply_traded_objects_delta(upserted=self.delta.added | self.delta.changed,
+                                   removed=self.delta.removed,
+                                   delisted_at=int(time.time()))
+        logger.info(f"Applied symbol list delta: {len(self.delta.added)} added, "
+                    f"{len(self.delta.changed)} renamed or re-exchanged and "
+                    f"{len(self.delta.removed)} removed traded objects.")
+        return True
 
-        etf_set = self._get_traded_objects_by_type(
-            trade_object_type=TradedObjectType.ETF
-        )
+    def _get_traded_objects_from_online(self) -> bool:
+        """ Fetches every list and parses them unless none changed since the
+        last sync, which is returned as False """
+        cached_lists = {object_type: self.cache.get(object_type)
+                        if self.cache is not None else None
+                        for object_type in self.SYMBOL_LIST_TYPES}
+        self.parsed_lists = {}
+        # Each endpoint retries on its own, and the first one to give up
+        # fails the sync since removals need every list
+        with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrent_requests, len(cached_lists)),
+                thread_name_prefix="symbol-lists") as executor:
+            futures = {object_type: executor.submit(self._fetch_symbol_list,
+                                                    object_type, cached)
+                       for object_type, cached in cached_lists.items()}
+            self.responses = {object_type: future.result()
+                              for object_type, future in futures.items()}
+        if all(cached is not None
+               and self.responses[object_type].content_hash == cached.content_hash
+               for object_type, cached in cached_lists.items()):
+            return False
 
-        self.new_symbol_list = stock_set.union(etf_set)
+        # The stock list also carries ETFs and trusts, so removals are only
+        # known from the union of both lists, changed or not
+        self.new_symbol_list = set().union(*(
+            self.parsed_lists[object_type] if object_type in self.parsed_lists
+            else self._parse_symbol_list(object_type, response)
+            for object_type, response in self.responses.items()))
         logger.info(
             f"Fetched {len(self.new_symbol_list)} availble traded objects.")
+        return True
 
-    @staticmethod
-    def _fetch_data_from_api(url: str) -> list:
+    def _fetch_data_from_api(self, url: str,
+                             headers: Optional[Dict[str, str]] = None
+                             ) -> Optional[SymbolListResponse]:
+        """ Returns the response with its body still streaming, or None when
+        the server answers that it has not changed """
         try:
-            response = requests.get(url, timeout=30)
+            response = self.session.get(url, timeout=self.timeout,
+                                        headers=headers or {}, stream=True)
+            if response.status_code == HTTPStatus.NOT_MODIFIED or not response.ok:
+                response.close()
+            if response.status_code == HTTPStatus.NOT_MODIFIED:
+                return None
             response.raise_for_status()
-            data = response.json()
-            if not isinstance(data, list):
-                raise ValueError("Unexpected response format; expected a list.")
-            return data
+            return SymbolListResponse(chunks=_iter_body(response),
+                                      etag=response.headers.get("ETag"),
+                                      last_modified=response.headers.get("Last-Modified"))
         except RequestException as req_err:
             logger.error(f"Request error: {req_err}")
             raise
-        except ValueError as val_err:
-            logger.error(f"Data format error: {val_err}")
-            raise
+
+    def _parse_symbol_list(self, trade_object_type: TradedObjectType,
+                           response: SymbolListResponse) -> Set[TradedObject]:
+        """ Decodes the body entry by entry, so the parsed JSON is never held
+        as a whole next to the traded objects built from it """
+        stats = SymbolListParseStats(object_type=trade_object_type)
+        started_at = time.perf_counter()
+        traded_objects = self._process_traded_objects(
+            response_data=response.iter_records(),
+            trade_object_type=trade_object_type, stats=stats)
+        stats.seconds = time.perf_counter() - started_at
+        # A streamed body is only complete once it has been parsed
+        stats.parsed_bytes = response.size
+        self.parse_stats[trade_object_type] = stats
+        logger.info(f"Parsed {stats.entries} {trade_object_type.name.lower()} "
+                    f"entries in {stats.seconds:.2f}s "
+                    f"({stats.entries_per_second:,.0f} entries/s, "
+                    f"{stats.megabytes_per_second:.1f} MB/s): "
+                    f"{stats.invalid_entries} invalid, "
+                    f"{stats.duplicate_entries} duplicate.")
+        return traded_objects
 
     @staticmethod
     def _process_traded_objects(
-            response_data: List,
-            trade_object_type: TradedObjectType
+            response_data: Iterable,
+            trade_object_type: TradedObjectType,
+            stats: Optional[SymbolListParseStats] = None
     ) -> Set[TradedObject]:
 
-        valid_traded_objects = set()
+        valid_traded_objects: Set[TradedObject] = set()
         invalid_entries = 0
+        duplicate_entries = 0
+        entries = 0
 
         for data in response_data:
+            entries += 1
             try:
                 traded_object = TradedObject(
                     name=data['name'],
                     symbol=data['symbol'],
-                    exchange=data['exchange'],
-                    exchange_short_name=data['exchangeShortName'],
+                    exchange=_interned(data['exchange']),
+                    exchange_short_name=_interned(data['exchangeShortName']),
                     object_type=TradedObjectType.get_traded_object_type_from_name(
                         data['type'])
                 )
+                if traded_object in valid_traded_objects:
+                    duplicate_entries += 1
                 valid_traded_objects.add(traded_object)
 
             except KeyError as e:
@@ -114,6 +300,10 @@ class SymbolListCollector:
         if invalid_entries > 0:
             logger.warning(f"Skipped {invalid_entries} invalid "
                            f"{trade_object_type.name.lower()} objects.")
+        if stats is not None:
+            stats.entries += entries
+            stats.invalid_entries += invalid_entries
+            stats.duplicate_entries += duplicate_entries
 
         logger.info(f"Fetched {len(valid_traded_objects)} "
                     f"{trade_object_type.name.lower()} objects.")
@@ -126,25 +316,69 @@ class SymbolListCollector:
                               max=MAX_RETRY_WAIT_TIME),
         retry=retry_if_exception_type((RequestException, ValueError))
     )
-    def _get_traded_objects_by_type(self, trade_object_type: TradedObjectType) -> (
-            Set)[TradedObject]:
+    def _fetch_symbol_list(self, trade_object_type: TradedObjectType,
+                           cached: Optional[CachedSymbolList] = None
+                           ) -> SymbolListResponse:
 
         api_token = os.environ.get('FINANCIAL_MODELING_PREP_TOKEN')
         if not api_token:
             raise EnvironmentError("API token not found.")
 
-        endpoint_url = (f"{MAIN_FINANCIAL_MODELING_PREP_URL}/"
+        endpoint_url = (f"{self.base_url}/"
                         f"{trade_object_type.value['endpoint_name']}/list?"
                         f"apikey={api_token}")
 
-        response_data = self._fetch_data_from_api(endpoint_url)
-        return self._process_traded_objects(response_data=response_data,
-                                            trade_object_type=trade_object_type)
+        conditional_headers = cached.conditional_headers() if cached is not None else {}
+        response = self._fetch_data_from_api(endpoint_url, headers=conditional_headers)
+        if response is None and self.cache is not None:
+            response = self.cache.read(trade_object_type)
+        if response is None and conditional_headers:
+            # The cached body went missing after its validators were read
+            logger.warning(f"Got not modified for the {trade_object_type.name.lower()} "
+                           f"list without a cached body, fetching it in full.")
+            response = self._fetch_data_from_api(endpoint_url)
+        if response is None:
+            raise NotModifiedWithoutCacheError(
+                f"Got not modified for the {trade_object_type.name.lower()} list "
+                f"without sending validators.")
+        if response.chunks is not None and self.cache is not None:
+            # Spooled next to the cached body, so it is hashed before parsing
+            self.cache.spool(trade_object_type, response)
+        # Without a cache a body is parsed as it arrives, otherwise only when
+        # it differs from the cached one
+        if (response.chunks is not None or cached is None
+                or response.content_hash != cached.content_hash):
+            try:
+                # Parsed here so a malformed list is fetched again
+                self.parsed_lists[trade_object_type] = self._parse_symbol_list(
+                    trade_object_type, response)
+            except ValueError as val_err:
+                logger.error(f"Data format error: {val_err}")
+                raise
+        return response
+
+
+def _iter_body(response: requests.Response,
+               chunk_size: int = STREAM_CHUNK_SIZE_DEFAULT) -> Iterator[bytes]:
+    """ Body chunks as they arrive; the connection goes back to the pool
+    once they are read or abandoned """
+    try:
+        yield from response.iter_content(chunk_size=chunk_size)
+    finally:
+        response.close()
 
 
-def main_symbol_list_collection():
+def main_symbol_list_collection(dispose_connection: bool = True) -> SymbolListCollector:
     init_sentry()
-    SymbolListCollector().update_traded_objects()
+    collector = SymbolListCollector(cache=SymbolListCache.from_environment())
+    try:
+        collector.update_traded_objects()
+        return collector
+    finally:
+        collector.close()
+        if dispose_connection:
+            from utils.db_helpers import dispose_mysql_connection
+            dispose_mysql_connection()
 
 
 if __name__ == '__main__':
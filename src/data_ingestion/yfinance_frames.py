@@ -0,0 +1,101 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from utils.enums import TradeTimeWindow
+
+YFINANCE_PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+NORMALIZED_PRICE_COLUMNS = ["open", "high", "low", "close"]
+
+
+def empty_normalized_frame(time_window: TradeTimeWindow) -> DataFrame:
+    return _build_frame(symbols=pd.Index([], dtype=object),
+                        symbol_codes=np.array([], dtype=np.int32),
+                        open_dates=np.array([], dtype=np.int64),
+                        values=np.empty((0, len(YFINANCE_PRICE_COLUMNS))),
+                        time_window=time_window)
+
+
+def normalize_yfinance_frame(data: DataFrame, symbols: List[str],
+                             time_window: TradeTimeWindow) -> DataFrame:
+    """ Turns a yf.download frame into one row per (symbol, bar).
+
+    Accepts the flat single-ticker layout as well as the two-level layouts
+    produced by group_by='ticker' and group_by='column'. The wide frame is
+    copied once into a (dates, tickers, prices) array, reshaped to long format
+    and rows without a complete bar are dropped. Prices are float32 to match
+    the FLOAT columns of ohlcv_table.
+    """
+    if data.shape[0] == 0 or data.shape[1] == 0:
+        return empty_normalized_frame(time_window)
+
+    number_of_dates = data.shape[0]
+    number_of_prices = len(YFINANCE_PRICE_COLUMNS)
+
+    if isinstance(data.columns, pd.MultiIndex):
+        ticker_level = _get_ticker_level(data.columns)
+        tickers = data.columns.get_level_values(ticker_level).unique()
+        if ticker_level == 0:
+            columns = pd.MultiIndex.from_product([tickers, YFINANCE_PRICE_COLUMNS])
+            cube = (data.reindex(columns=columns).to_numpy(dtype=np.float64)
+                    .reshape(number_of_dates, len(tickers), number_of_prices))
+        else:
+            columns = pd.MultiIndex.from_product([YFINANCE_PRICE_COLUMNS, tickers])
+            cube = (data.reindex(columns=columns).to_numpy(dtype=np.float64)
+                    .reshape(number_of_dates, number_of_prices, len(tickers))
+                    .transpose(0, 2, 1))
+    else:
+        tickers = pd.Index(symbols[:1], dtype=object)
+        cube = (data.reindex(columns=YFINANCE_PRICE_COLUMNS)
+                .to_numpy(dtype=np.float64)
+                .reshape(number_of_dates, 1, number_of_prices))
+
+    number_of_tickers = len(tickers)
+    # Symbol-major order keeps every symbol's bars contiguous
+    values = cube.transpose(1, 0, 2).reshape(number_of_tickers * number_of_dates,
+                                             number_of_prices)
+    symbol_codes = np.repeat(np.arange(number_of_tickers, dtype=np.int32),
+                             number_of_dates)
+    open_dates = np.tile(_to_epoch_seconds(data.index), number_of_tickers)
+
+    complete_rows = ~np.isnan(values).any(axis=1)
+    return _build_frame(symbols=tickers,
+                        symbol_codes=symbol_codes[complete_rows],
+                        open_dates=open_dates[complete_rows],
+                        values=values[complete_rows],
+                        time_window=time_window)
+
+
+def _get_ticker_level(columns: pd.MultiIndex) -> int:
+    if "Ticker" in columns.names:
+        return columns.names.index("Ticker")
+    if "Close" in columns.get_level_values(0):
+        return 1
+    return 0
+
+
+def _to_epoch_seconds(index: pd.Index) -> np.ndarray:
+    dates = pd.DatetimeIndex(index)
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+    return dates.as_unit("s").asi8.astype(np.int64, copy=False)
+
+
+def _build_frame(symbols: pd.Index, symbol_codes: np.ndarray,
+                 open_dates: np.ndarray, values: np.ndarray,
+                 time_window: TradeTimeWindow) -> DataFrame:
+    prices = values[:, :4].astype(np.float32)
+    frame = DataFrame({
+        "symbol": pd.Categorical.from_codes(symbol_codes,
+                                            categories=symbols.astype(object)),
+        "open_date": open_dates
+    })
+    for column_index, column in enumerate(NORMALIZED_PRICE_COLUMNS):
+        frame[column] = prices[:, column_index]
+    frame["volume"] = values[:, 4].astype(np.int64)
+    frame["time_window"] = pd.Categorical.from_codes(
+        np.zeros(len(frame), dtype=np.int8),
+        categories=pd.Index([time_window.value.yfinance_notation]))
+    return frame
@@ -0,0 +1,308 @@
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from indicators.technical_indicators import ATR, BarStep, EMA, Indicator, RSI, \
+    SMA, VWAP
+from utils.db_helpers import get_indicator_states, get_ohlcv_bars, \
+    save_indicator_states, save_indicator_values
+from utils.enums import TradeTimeWindow
+
+logger = logging.getLogger(__name__)
+
+INDICATOR_VALUE_COLUMNS = ["symbol", "indicator", "open_date", "value"]
+# States kept for the latest bars of every symbol, so that a revision of one
+# of them is refolded from the state before it instead of the full history
+INDICATOR_CHECKPOINTS_DEFAULT = 10
+
+_NO_OPEN_DATE = np.iinfo(np.int64).min
+
+
+def default_indicators() -> List[Indicator]:
+    return [SMA(), EMA(), RSI(), ATR(), VWAP()]
+
+
+@dataclass
+class IndicatorStates:
+    """ Folded state of one indicator for a set of symbols.
+
+    `checkpoint_dates` and `checkpoints` hold, oldest first, the states after
+    each of a symbol's latest bars, with empty slots at _NO_OPEN_DATE.
+    """
+    symbols: List[str]
+    last_open_dates: np.ndarray
+    values: np.ndarray
+    checkpoint_dates: Optional[np.ndarray] = None
+    checkpoints: Optional[np.ndarray] = None
+
+
+def _push_checkpoints(checkpoint_dates: np.ndarray, checkpoints: np.ndarray,
+                      mask: np.ndarray, open_dates: np.ndarray,
+                      state: np.ndarray) -> None:
+    """ Appends the state of the masked symbols, dropping their oldest one """
+    if not mask.any():
+        return
+    checkpoint_dates[mask, :-1] = checkpoint_dates[mask, 1:]
+    checkpoints[mask, :-1] = checkpoints[mask, 1:]
+    checkpoint_dates[mask, -1] = open_dates[mask]
+    checkpoints[mask, -1] = state[mask]
+
+
+def fold_indicator(indicator: Indicator, data: DataFrame,
+                   states: Optional[IndicatorStates] = None,
+                   checkpoints: int = 0) -> Tuple[DataFrame, IndicatorStates]:
+    """ Folds bars into the indicator state of their symbols.
+
+    Bars at or before a symbol's last folded open date are skipped, so
+    folding is idempotent. Symbols are processed side by side: bars are
+    laid out as a (symbol, step) grid and every step is one vectorised
+    update over all symbols, so a daily run is a single step. The states
+    after each of a symbol's latest `checkpoints` bars are kept as well.
+    """
+    symbols = sorted(set(data["symbol"]) | set(states.symbols if states else []))
+    symbol_index = {symbol: index for index, symbol in enumerate(symbols)}
+    state = indicator.initial_state(len(symbols))
+    last_open_dates = np.full(len(symbols), _NO_OPEN_DATE, dtype=np.int64)
+    checkpoint_dates = np.full((len(symbols), checkpoints), _NO_OPEN_DATE, dtype=np.int64)
+    checkpoint_values = np.full((len(symbols), checkpoints, indicator.state_size), np.nan)
+    if states is not None:
+        rows = np.array([symbol_index[symbol] for symbol in states.symbols], dtype=np.int64)
+        state[rows] = states.values
+        last_open_dates[rows] = states.last_open_dates
+        if states.checkpoint_dates is not None and states.checkpoints is not None:
+            kept = min(checkpoints, states.checkpoint_dates.shape[1])
+            if kept:
+                checkpoint_dates[rows, -kept:] = states.checkpoint_dates[:, -kept:]
+                checkpoint_values[rows, -kept:] = states.checkpoints[:, -kept:]
+
+    codes = data["symbol"].map(symbol_index).to_numpy(dtype=np.int64)
+    open_dates = data["open_date"].to_numpy(dtype=np.int64)
+    is_new = open_dates > last_open_dates[codes]
+    order = np.flatnonzero(is_new)[np.lexsort((open_dates[is_new], codes[is_new]))]
+    codes, open_dates = codes[order], open_dates[order]
+
+    # Position of every bar within its symbol, i.e. its step in the grid
+    group_starts = np.searchsorted(codes, codes, side="left")
+    steps = np.arange(len(order)) - group_starts
+    number_of_steps = int(steps.max()) + 1 if len(order) else 0
+
+    def grid(column: str) -> np.ndarray:
+        values = np.full((len(symbols), number_of_steps), np.nan)
+        values[codes, steps] = data[column].to_numpy(dtype=np.float64)[order]
+        return values
+
+    high, low, close, volume = grid("high"), grid("low"), grid("close"), grid("volume")
+    has_bar = np.zeros((len(symbols), number_of_steps), dtype=bool)
+    has_bar[codes, steps] = True
+    step_open_dates = np.zeros((len(symbols), number_of_steps), dtype=np.int64)
+    step_open_dates[codes, steps] = open_dates
+    # Only a symbol's latest bars leave a checkpoint
+    is_checkpoint = has_bar & (np.arange(number_of_steps) >= (
+        np.bincount(codes, minlength=len(symbols)) - checkpoints)[:, None])
+    results = np.full((len(symbols), number_of_steps), np.nan)
+    for step in range(number_of_steps):
+        results[:, step] = indicator.step(
+            state,
+            BarStep(high=high[:, step], low=low[:, step], close=close[:, step],
+                    volume=volume[:, step]),
+            has_bar[:, step])
+        if checkpoints:
+            _push_checkpoints(checkpoint_dates, checkpoint_values,
+                              is_checkpoint[:, step], step_open_dates[:, step], state)
+
+    if len(order):
+        np.maximum.at(last_open_dates, codes, open_dates)
+    values = DataFrame({
+        "symbol": np.asarray(symbols, dtype=object)[codes],
+        "indicator": indicator.name,
+        "open_date": open_dates,
+        "value": results[codes, steps]
+    })
+    return (values[values["value"].notna()].reset_index(drop=True),
+            IndicatorStates(symbols=symbols, last_open_dates=last_open_dates,
+                            values=state,
+                            checkpoint_dates=checkpoint_dates if checkpoints else None,
+                            checkpoints=checkpoint_values if checkpoints else None))
+
+
+def _encode_state(states: IndicatorStates, row: int) -> str:
+    checkpoints: List[Any] = []
+    if states.checkpoint_dates is not None and states.checkpoints is not None:
+        kept = states.checkpoint_dates[row] != _NO_OPEN_DATE
+        checkpoints = [[int(open_date), checkpoint.tolist()] for open_date, checkpoint
+                       in zip(states.checkpoint_dates[row][kept],
+                              states.checkpoints[row][kept])]
+    return json.dumps({"state": states.values[row].tolist(),
+                       "checkpoints": checkpoints})
+
+
+def _decode_state(text: str) -> Tuple[List[float], List[Tuple[int, List[float]]]]:
+    """ Returns the state and its checkpoints, oldest first """
+    decoded = json.loads(text)
+    if isinstance(decoded, list):
+        # Persisted before checkpoints were kept
+        return decoded, []
+    return decoded["state"], [(int(open_date), checkpoint)
+                              for open_date, checkpoint in decoded["checkpoints"]]
+
+
+class IndicatorEngine:
+    """ Keeps technical indicators up to date from newly written bars.
+
+    The state of every (symbol, indicator) is persisted with the last open
+    date folded into it, so an update only reads the state and folds in the
+    new bars. Symbols without a stored state are bootstrapped once from their
+    full stored history. A state cannot take bars from before or at its last
+    open date, so when a symbol gets such bars, e.g. a revision of its latest
+    bars or a gap repair, it is rewound to the checkpoint before them and the
+    stored bars since are folded again. Only bars older than every checkpoint
+    recompute the symbol from its full stored history.
+    """
+
+    def __init__(self, indicators: Optional[List[Indicator]] = None,
+                 time_window: TradeTimeWindow = TradeTimeWindow.DAILY,
+                 checkpoints: int = INDICATOR_CHECKPOINTS_DEFAULT):
+        self.indicators = indicators if indicators is not None else default_indicators()
+        self.time_window = time_window
+        self.checkpoints = checkpoints
+
+    def update(self, data: DataFrame) -> DataFrame:
+        """ Folds new bars in, persists states and values and returns the values """
+        if data.shape[0] == 0:
+            return DataFrame(columns=INDICATOR_VALUE_COLUMNS)
+
+        symbols = sorted(set(data["symbol"]))
+        stored_states, refold_from = self._rewound_states(
+            data, get_indicator_states(symbols, self.time_window))
+        data = self._with_refold_history(data, refold_from)
+        data = self._with_bootstrap_history(data, symbols, stored_states)
+
+        value_frames = []
+        state_rows: List[Dict[str, Any]] = []
+        for indicator in self.indicators:
+            indicator_states = stored_states[stored_states["indicator"] == indicator.name]
+            values, states = fold_indicator(indicator, data, self._to_states(
+                indicator, indicator_states, self.checkpoints),
+                checkpoints=self.checkpoints)
+            value_frames.append(values)
+            state_rows.extend(
+                {"symbol": symbol, "indicator": indicator.name,
+                 "last_open_date": int(last_open_date),
+                 "state": _encode_state(states, row)}
+                for row, (symbol, last_open_date)
+                in enumerate(zip(states.symbols, states.last_open_dates))
+                if last_open_date != _NO_OPEN_DATE)
+
+        values = pd.concat(value_frames, ignore_index=True)
+        save_indicator_values(values, self.time_window)
+        save_indicator_states(state_rows, self.time_window)
+        logger.info(f"Updated {len(self.indicators)} indicators for "
+                    f"{len(symbols)} symbols with {values.shape[0]} new values.")
+        return values
+
+    @staticmethod
+    def _rewound_states(data: DataFrame, stored_states: DataFrame
+                        ) -> Tuple[DataFrame, Dict[str, int]]:
+        """ Rewinds the states that bars at or before their last open date
+        arrived for to their latest checkpoint before those bars.
+
+        Returns the states and the open date every rewound symbol is folded
+        again after. Symbols with a state that has no such checkpoint lose
+        all their states, so they are bootstrapped again.
+        """
+        if stored_states.shape[0] == 0:
+            return stored_states, {}
+        first_open_dates = data.groupby("symbol")["open_date"].min()
+        is_revised = (stored_states["symbol"].map(first_open_dates).to_numpy()
+                      <= stored_states["last_open_date"].to_numpy())
+        if not is_revised.any():
+            return stored_states, {}
+
+        symbols = stored_states["symbol"].tolist()
+        last_open_dates = stored_states["last_open_date"].to_numpy(dtype=np.int64, copy=True)
+        texts = stored_states["state"].tolist()
+        refold_from: Dict[str, int] = {}
+        rebuilt_symbols = set()
+        for row in np.flatnonzero(is_revised):
+            symbol = symbols[row]
+            _, checkpoints = _decode_state(texts[row])
+            earlier = [checkpoint for checkpoint in checkpoints
+                       if checkpoint[0] < first_open_dates[symbol]]
+            if not earlier:
+                rebuilt_symbols.add(symbol)
+                continue
+            open_date, checkpoint = earlier[-1]
+            last_open_dates[row] = open_date
+            texts[row] = json.dumps({"state": checkpoint,
+                                     "checkpoints": [[int(date), values]
+                                                     for date, values in earlier]})
+            refold_from[symbol] = min(open_date, refold_from.get(symbol, open_date))
+
+        for symbol in rebuilt_symbols:
+            refold_from.pop(symbol, None)
+        logger.info(f"Refolding indicators of {len(refold_from)} symbols from "
+                    f"their checkpoints and recomputing {len(rebuilt_symbols)} "
+                    f"symbols from their full history, as they got bars from "
+                    f"before their last update.")
+        stored_states = stored_states.assign(last_open_date=last_open_dates,
+                                             state=texts)
+        return (stored_states[~stored_states["symbol"].isin(rebuilt_symbols)],
+                refold_from)
+
+    def _with_refold_history(self, data: DataFrame,
+                             refold_from: Dict[str, int]) -> DataFrame:
+        """ Adds the stored bars after the checkpoint of every rewound symbol,
+        read once per checkpoint date """
+        if not refold_from:
+            return data
+        symbols_by_open_date: Dict[int, List[str]] = {}
+        for symbol, open_date in refold_from.items():
+            symbols_by_open_date.setdefault(open_date, []).append(symbol)
+        history = [get_ohlcv_bars(symbols=sorted(symbols), time_window=self.time_window,
+                                  start_open_date=open_date + 1)
+                   for open_date, symbols in sorted(symbols_by_open_date.items())]
+        return (pd.concat([*history, data], ignore_index=True)
+                .drop_duplicates(subset=["symbol", "open_date"], keep="last"))
+
+    def _with_bootstrap_history(self, data: DataFrame, symbols: List[str],
+                                stored_states: DataFrame) -> DataFrame:
+        state_counts = stored_states.groupby("symbol")["indicator"].nunique()
+        bootstrap_symbols = [symbol for symbol in symbols
+                             if state_counts.get(symbol, 0) < len(self.indicators)]
+        if not bootstrap_symbols:
+            return data
+
+        logger.info(f"Bootstrapping indicators of {len(bootstrap_symbols)} "
+                    f"symbols from their stored history.")
+        history = get_ohlcv_bars(symbols=bootstrap_symbols, time_window=self.time_window)
+        return (pd.concat([history, data], ignore_index=True)
+                .drop_duplicates(subset=["symbol", "open_date"], keep="last"))
+
+    @staticmethod
+    def _to_states(indicator: Indicator, stored_states: DataFrame,
+                   checkpoints: int = 0) -> Optional[IndicatorStates]:
+        if stored_states.shape[0] == 0:
+            return None
+        decoded = [_decode_state(state) for state in stored_states["state"]]
+        values = np.array([state for state, _ in decoded],
+                          dtype=np.float64).reshape(-1, indicator.state_size)
+        checkpoint_dates = np.full((len(decoded), checkpoints), _NO_OPEN_DATE,
+                                   dtype=np.int64)
+        checkpoint_values = np.full((len(decoded), checkpoints, indicator.state_size),
+                                    np.nan)
+        for row, (_, row_checkpoints) in enumerate(decoded):
+            kept = row_checkpoints[-checkpoints:] if checkpoints else []
+            for slot, (open_date, checkpoint) in enumerate(
+                    kept, start=checkpoints - len(kept)):
+                checkpoint_dates[row, slot] = open_date
+                checkpoint_values[row, slot] = checkpoint
+        return IndicatorStates(
+            symbols=stored_states["symbol"].tolist(),
+            last_open_dates=stored_states["last_open_date"].to_numpy(dtype=np.int64),
+            values=values, checkpoint_dates=checkpoint_dates,
+            checkpoints=checkpoint_values)
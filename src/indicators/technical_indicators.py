@@ -0,0 +1,190 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+import numpy as np
+
+SMA_PERIOD_DEFAULT = 20
+EMA_PERIOD_DEFAULT = 20
+RSI_PERIOD_DEFAULT = 14
+ATR_PERIOD_DEFAULT = 14
+VWAP_PERIOD_DEFAULT = 20
+
+
+@dataclass
+class BarStep:
+    """ One bar per symbol; rows without a bar at this step are masked out """
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+
+class Indicator(ABC):
+    """ Technical indicator folded over bars one step at a time.
+
+    The state of every symbol is a row of floats whose first value is the
+    number of bars folded in so far. A step updates the state of the masked
+    symbols in place and returns their indicator value, NaN until `period`
+    bars have been seen.
+    """
+
+    def __init__(self, period: int):
+        if period < 1:
+            raise ValueError("period must be positive.")
+        self.period = period
+
+    @property
+    def name(self) -> str:
+        return f"{type(self).__name__.lower()}_{self.period}"
+
+    @property
+    @abstractmethod
+    def state_size(self) -> int:
+        ...
+
+    def initial_state(self, number_of_symbols: int) -> np.ndarray:
+        state = np.full((number_of_symbols, self.state_size), np.nan)
+        state[:, 0] = 0
+        return state
+
+    @abstractmethod
+    def step(self, state: np.ndarray, bars: BarStep, mask: np.ndarray) -> np.ndarray:
+        ...
+
+    def _warmed_up(self, values: np.ndarray, count: np.ndarray) -> np.ndarray:
+        return np.where(count >= self.period, values, np.nan)
+
+
+class _WindowIndicator(Indicator):
+    """ Keeps the last `period` values of each input in the state """
+
+    inputs = 1
+
+    @property
+    def state_size(self) -> int:
+        return 1 + self.inputs * self.period
+
+    def _push(self, state: np.ndarray, mask: np.ndarray, *values: np.ndarray) -> None:
+        for index, value in enumerate(values):
+            start = 1 + index * self.period
+            window = state[:, start:start + self.period]
+            window[mask, :-1] = window[mask, 1:]
+            window[mask, -1] = value[mask]
+        state[mask, 0] += 1
+
+    def _window(self, state: np.ndarray, index: int = 0) -> np.ndarray:
+        start = 1 + index * self.period
+        return state[:, start:start + self.period]
+
+
+class SMA(_WindowIndicator):
+    """ Simple moving average of the close """
+
+    def __init__(self, period: int = SMA_PERIOD_DEFAULT):
+        super().__init__(period)
+
+    def step(self, state: np.ndarray, bars: BarStep, mask: np.ndarray) -> np.ndarray:
+        self._push(state, mask, bars.close)
+        return self._warmed_up(self._window(state).mean(axis=1), state[:, 0])
+
+
+class VWAP(_WindowIndicator):
+    """ Volume weighted average of the typical price over `period` bars """
+
+    inputs = 2
+
+    def __init__(self, period: int = VWAP_PERIOD_DEFAULT):
+        super().__init__(period)
+
+    def step(self, state: np.ndarray, bars: BarStep, mask: np.ndarray) -> np.ndarray:
+        typical_price = (bars.high + bars.low + bars.close) / 3
+        self._push(state, mask, typical_price * bars.volume, bars.volume)
+        volume = self._window(state, 1).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(volume > 0,
+                              self._window(state, 0).sum(axis=1) / volume, np.nan)
+        return self._warmed_up(values, state[:, 0])
+
+
+class EMA(Indicator):
+    """ Exponential moving average of the close, seeded with the simple
+    moving average of the first `period` closes """
+
+    state_size = 2
+
+    def __init__(self, period: int = EMA_PERIOD_DEFAULT):
+        super().__init__(period)
+        self.alpha = 2 / (period + 1)
+
+    def step(self, state: np.ndarray, bars: BarStep, mask: np.ndarray) -> np.ndarray:
+        count, ema = state[:, 0], state[:, 1]
+        ema[mask] = _seeded_average(ema[mask], bars.close[mask], count[mask] + 1,
+                                    self.period, self.alpha)
+        count[mask] += 1
+        return self._warmed_up(ema.copy(), count)
+
+
+class RSI(Indicator):
+    """ Relative strength index with Wilder's smoothing of gains and losses,
+    seeded with their simple average over the first `period` deltas """
+
+    state_size = 4
+
+    def __init__(self, period: int = RSI_PERIOD_DEFAULT):
+        super().__init__(period)
+
+    def step(self, state: np.ndarray, bars: BarStep, mask: np.ndarray) -> np.ndarray:
+        count, previous_close = state[:, 0], state[:, 1]
+        average_gain, average_loss = state[:, 2], state[:, 3]
+
+        # The first bar only gives a previous close, not a delta
+        has_delta = mask & (count >= 1)
+        delta = bars.close - previous_close
+        gain, loss = np.clip(delta, 0, None), np.clip(-delta, 0, None)
+
+        average_gain[has_delta] = _seeded_average(
+            average_gain[has_delta], gain[has_delta], count[has_delta],
+            self.period, 1 / self.period)
+        average_loss[has_delta] = _seeded_average(
+            average_loss[has_delta], loss[has_delta], count[has_delta],
+            self.period, 1 / self.period)
+        previous_close[mask] = bars.close[mask]
+        count[mask] += 1
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(average_loss == 0, 100.0,
+                              100 - 100 / (1 + average_gain / average_loss))
+        return self._warmed_up(values, count - 1)
+
+
+class ATR(Indicator):
+    """ Average true range with Wilder's smoothing, seeded with the simple
+    average of the first `period` true ranges """
+
+    state_size = 3
+
+    def __init__(self, period: int = ATR_PERIOD_DEFAULT):
+        super().__init__(period)
+
+    def step(self, state: np.ndarray, bars: BarStep, mask: np.ndarray) -> np.ndarray:
+        count, previous_close, atr = state[:, 0], state[:, 1], state[:, 2]
+
+        true_range = np.where(
+            count == 0, bars.high - bars.low,
+            np.maximum.reduce([bars.high - bars.low,
+                               np.abs(bars.high - previous_close),
+                               np.abs(bars.low - previous_close)]))
+        atr[mask] = _seeded_average(atr[mask], true_range[mask], count[mask] + 1,
+                                    self.period, 1 / self.period)
+        previous_close[mask] = bars.close[mask]
+        count[mask] += 1
+        return self._warmed_up(atr.copy(), count)
+
+
+def _seeded_average(average: np.ndarray, value: np.ndarray, count: np.ndarray,
+                    period: int, alpha: float) -> np.ndarray:
+    """ Running mean of the first `period` values, then exponential smoothing
+    with `alpha`; `count` is the number of values including this one """
+    previous = np.where(count == 1, 0.0, average)
+    return np.where(count <= period, previous + (value - previous) / count,
+                    previous + alpha * (value - previous))
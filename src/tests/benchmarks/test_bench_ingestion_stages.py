@@ -0,0 +1,32 @@
+from benchmarks.bench_ingestion_stages import STAGES, StageResult, \
+    find_regressions, load_baselines, run_stages, save_baselines
+
+
+def test_run_stages_reports_every_stage():
+    """Test a small run times every stage over all of its rows."""
+
+    results = {result.stage: result
+               for result in run_stages(number_of_symbols=5, years=1, batch_size=2)}
+
+    assert list(results) == STAGES
+    assert results["normalize"].rows == 5 * 252
+    assert results["write"].rows == 5 * 252
+    assert results["clean_existing_symbols"].rows == 5
+    assert all(result.peak_rss_mb > 0 for result in results.values())
+
+
+def test_regressions_are_reported_against_baselines(tmp_path):
+    """Test slower or larger stages beyond the tolerance are regressions."""
+
+    baseline_path = tmp_path / "baselines.json"
+    save_baselines([StageResult("diff", 100, 1_000, 1.0, 100.0),
+                    StageResult("write", 100, 1_000, 1.0, 100.0)], years=5,
+                   path=baseline_path)
+    results = [StageResult("diff", 100, 1_000, 1.2, 120.0),
+               StageResult("write", 100, 1_000, 2.0, 200.0),
+               StageResult("prepare", 100, 1_000, 9.0, 900.0)]
+
+    regressions = find_regressions(results, load_baselines(baseline_path),
+                                   tolerance=0.5)
+
+    assert [result.key for result, _ in regressions] == ["write/100", "write/100"]
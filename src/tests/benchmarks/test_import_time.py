@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from benchmarks.import_time import IMPORT_BUDGETS, ImportBudget, check_budget, \
+    check_forbidden_modules, check_import_time, measure_import, parse_importtime
+
+# Wall time budgets depend on the host, so they are only checked on request
+timing_benchmark = pytest.mark.skipif(
+    os.environ.get("IMPORT_TIME_BENCHMARKS") != "1",
+    reason="set IMPORT_TIME_BENCHMARKS=1 to check the import time budgets")
+
+MOCK_REPORT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      2500 |       3100 |     requests.adapters
+import time:      1000 |       4100 |   requests
+import time:       300 |       4400 | data_ingestion.symbol_list_collection
+unrelated warning line
+"""
+
+
+def test_parse_importtime_reads_self_and_cumulative_times():
+    """Test each module of the report is parsed with its depth and times."""
+
+    timings = parse_importtime(MOCK_REPORT)
+
+    assert list(timings) == ["_io", "requests.adapters", "requests",
+                             "data_ingestion.symbol_list_collection"]
+    assert timings["requests.adapters"].self_seconds == pytest.approx(0.0025)
+    assert timings["requests"].cumulative_seconds == pytest.approx(0.0041)
+    assert timings["requests.adapters"].depth == 2
+    assert timings["data_ingestion.symbol_list_collection"].depth == 0
+
+
+def test_check_budget_reports_slow_imports_and_forbidden_modules():
+    """Test an import over its budget or loading a forbidden module fails."""
+
+    timings = parse_importtime(MOCK_REPORT)
+    budget = ImportBudget(module="data_ingestion.symbol_list_collection",
+                          max_seconds=0.004, forbidden_modules=("requests", "pandas"))
+
+    assert check_budget(budget, timings) == [
+        "took 0.004s, over the budget of 0.004s", "loaded requests"]
+    assert check_budget(budget, timings, scale=2.0) == ["loaded requests"]
+
+
+@pytest.mark.parametrize("budget", IMPORT_BUDGETS,
+                         ids=[budget.module for budget in IMPORT_BUDGETS])
+def test_entry_points_do_not_load_forbidden_modules(budget):
+    """Test a cold import of each job leaves its heavy dependencies unloaded."""
+
+    timings = measure_import(budget.module, runs=1)
+
+    assert check_forbidden_modules(budget, timings) == []
+
+
+@timing_benchmark
+@pytest.mark.parametrize("budget", IMPORT_BUDGETS,
+                         ids=[budget.module for budget in IMPORT_BUDGETS])
+def test_entry_points_keep_to_their_import_time_budget(budget):
+    """Test a cold import of each job stays within its startup budget."""
+
+    timings = measure_import(budget.module)
+
+    assert check_import_time(budget, timings, scale=float(
+        os.environ.get("IMPORT_TIME_BUDGET_SCALE", 1.0))) == []
@@ -0,0 +1,127 @@
+from unittest.mock import patch
+
+import pytest
+from pandas import DataFrame
+from sqlalchemy import text
+
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import DbPoolConfig, dispose_mysql_connection, \
+    get_mysql_connection, reset_connection_pool_stats
+from utils.enums import TradeTimeWindow
+
+TABLE_DEFINITIONS = [
+    """
+    CREATE TABLE traded_objects (
+        name VARCHAR(256),
+        symbol VARCHAR(256) NOT NULL,
+        exchange VARCHAR(256),
+        exchange_short_name VARCHAR(256),
+        object_type VARCHAR(256) NOT NULL,
+        delisted_at BIGINT,
+        PRIMARY KEY (symbol, object_type)
+    )""",
+    """
+    CREATE TABLE ohlcv_table (
+        symbol VARCHAR(12) NOT NULL,
+        time_window VARCHAR(256) NOT NULL,
+        open FLOAT,
+        high FLOAT,
+        low FLOAT,
+        close FLOAT,
+        volume BIGINT,
+        open_date BIGINT NOT NULL,
+        PRIMARY KEY (symbol, time_window, open_date)
+    )""",
+    """
+    CREATE TABLE ohlcv_watermarks (
+        symbol VARCHAR(12) NOT NULL,
+        time_window VARCHAR(256) NOT NULL,
+        last_open_date BIGINT NOT NULL,
+        PRIMARY KEY (symbol, time_window)
+    )""",
+    """
+    CREATE TABLE ohlcv_empty_refetches (
+        symbol VARCHAR(12) NOT NULL,
+        time_window VARCHAR(256) NOT NULL,
+        checked_until BIGINT NOT NULL,
+        PRIMARY KEY (symbol, time_window)
+    )""",
+    """
+    CREATE TABLE backfill_journal (
+        run_id VARCHAR(64) NOT NULL,
+        symbol VARCHAR(12) NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        last_error VARCHAR(1024),
+        next_attempt_at BIGINT NOT NULL DEFAULT 0,
+        updated_at BIGINT NOT NULL,
+        PRIMARY KEY (run_id, symbol)
+    )""",
+    """
+    CREATE TABLE indicator_state (
+        symbol VARCHAR(12) NOT NULL,
+        time_window VARCHAR(256) NOT NULL,
+        indicator VARCHAR(32) NOT NULL,
+        last_open_date BIGINT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (symbol, time_window, indicator)
+    )""",
+    """
+    CREATE TABLE indicator_values (
+        symbol VARCHAR(12) NOT NULL,
+        time_window VARCHAR(256) NOT NULL,
+        indicator VARCHAR(32) NOT NULL,
+        open_date BIGINT NOT NULL,
+        value DOUBLE,
+        PRIMARY KEY (symbol, time_window, indicator, open_date)
+    )""",
+]
+TABLE_DEFINITIONS += [
+    f"""
+    CREATE TABLE ohlcv_{notation} (
+        symbol VARCHAR(12) NOT NULL,
+        open_date INT NOT NULL,
+        open FLOAT NOT NULL,
+        high FLOAT NOT NULL,
+        low FLOAT NOT NULL,
+        close FLOAT NOT NULL,
+        volume BIGINT NOT NULL,
+        PRIMARY KEY (symbol, open_date)
+    )""" for notation in ("1m", "5m", "1h")]
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """Fixture pointing the shared engine to a SQLite database."""
+    database_uri = f"sqlite:///{tmp_path / 'stock_market_app.db'}"
+    with patch('utils.db_helpers._get_database_uri', return_value=database_uri):
+        dispose_mysql_connection()
+        reset_connection_pool_stats()
+        engine = get_mysql_connection(DbPoolConfig(pool_size=2, max_overflow=1))
+        with engine.connect() as connection:
+            for table_definition in TABLE_DEFINITIONS:
+                connection.execute(text(table_definition))
+            connection.commit()
+        yield engine
+        dispose_mysql_connection()
+
+
+@pytest.fixture
+def make_ohlcv_batch():
+    """Fixture returning a builder of synthetic daily OHLCV batches."""
+
+    def build(number_of_symbols, number_of_days, close=1.0,
+              first_open_date=1_700_000_000):
+        data = DataFrame({
+            "symbol": [f"SYM{index}" for index in range(number_of_symbols)
+                       for _ in range(number_of_days)],
+            "open_date": [first_open_date + 86_400 * day
+                          for _ in range(number_of_symbols)
+                          for day in range(number_of_days)],
+        })
+        for column in ("open", "high", "low", "close"):
+            data[column] = close
+        data["volume"] = 100
+        return OHLCVBatch.from_frame(data, time_window=TradeTimeWindow.DAILY)
+
+    return build
@@ -0,0 +1,115 @@
+from unittest.mock import patch
+
+import pytest
+
+from data_ingestion.backfill_journal import BackfillJournal
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows
+from tests.data_ingestion.test_rate_limiting import FakeClock, \
+    FakeYFinanceDownloader
+from utils.db_helpers import get_backfill_journal
+from utils.enums import YFinanceIntervals, TradeTimeWindow
+
+SYMBOLS = [f"SYM{index}" for index in range(6)]
+
+
+@pytest.fixture
+def clock():
+    fake_clock = FakeClock()
+    fake_clock.now = 1_700_000_000.0
+    return fake_clock
+
+
+def test_restarted_run_resumes_open_symbols(sqlite_engine, clock):
+    """Test a new journal for the same run only returns unfinished symbols."""
+
+    journal = BackfillJournal(run_id="test", retry_backoff_seconds=60, clock=clock)
+    assert sorted(journal.start(SYMBOLS)) == SYMBOLS
+
+    journal.mark_completed(["SYM0", "SYM1"])
+    journal.mark_failed(["SYM2"], TimeoutError("read timed out"))
+
+    resumed = BackfillJournal(run_id="test", retry_backoff_seconds=60, clock=clock)
+    assert sorted(resumed.start(SYMBOLS)) == ["SYM3", "SYM4", "SYM5"]
+
+    stored = get_backfill_journal("test").set_index("symbol")
+    assert stored.loc["SYM2", "status"] == "failed"
+    assert stored.loc["SYM2", "attempts"] == 1
+    assert stored.loc["SYM2", "last_error"] == "TimeoutError: read timed out"
+
+
+def test_failed_symbols_are_retried_with_backoff(sqlite_engine, clock):
+    """Test failed symbols become due after an exponential backoff."""
+
+    journal = BackfillJournal(run_id="test", max_attempts=3,
+                              retry_backoff_seconds=10, clock=clock)
+    journal.start(["SYM0"])
+
+    journal.mark_failed(["SYM0"], ValueError("empty"))
+    assert journal.symbols_due() == []
+    assert journal.next_retry_at() == clock.now + 10
+
+    clock.now += 10
+    assert journal.symbols_due() == ["SYM0"]
+    journal.mark_failed(["SYM0"], ValueError("empty"))
+    assert journal.next_retry_at() == clock.now + 20
+
+    clock.now += 20
+    journal.mark_failed(["SYM0"], ValueError("empty"))
+    assert journal.next_retry_at() is None
+    assert journal.progress().failed == 1
+
+
+def test_finished_run_is_planned_again(sqlite_engine, clock):
+    """Test a run with nothing left to do starts over on the next start."""
+
+    journal = BackfillJournal(run_id="test", max_attempts=1, clock=clock)
+    journal.start(SYMBOLS[:2])
+    journal.mark_completed(["SYM0"])
+    journal.mark_failed(["SYM1"], ValueError("delisted"))
+
+    next_run = BackfillJournal(run_id="test", max_attempts=1, clock=clock)
+    assert sorted(next_run.start(SYMBOLS[:2])) == ["SYM0", "SYM1"]
+    assert get_backfill_journal("test")["attempts"].sum() == 0
+
+
+def test_progress_reports_throughput_and_eta(sqlite_engine, clock):
+    """Test throughput only counts symbols completed in this run."""
+
+    journal = BackfillJournal(run_id="test", clock=clock)
+    journal.start(SYMBOLS)
+    journal.mark_completed(["SYM0", "SYM1"])
+    journal = BackfillJournal(run_id="test", clock=clock)
+    journal.start(SYMBOLS)
+
+    clock.now += 10
+    journal.mark_completed(["SYM2", "SYM3"])
+    progress = journal.progress()
+
+    assert progress.completed == 4
+    assert progress.symbols_per_second == pytest.approx(0.2)
+    assert progress.eta_seconds == pytest.approx(10)
+
+
+def test_collector_resumes_and_retries_failed_symbols(sqlite_engine):
+    """Test a journalled collection skips completed symbols and retries failures."""
+
+    traded_objects = mock_traded_object_rows(len(SYMBOLS))
+    interrupted_run = BackfillJournal(run_id="test")
+    interrupted_run.start(SYMBOLS)
+    interrupted_run.mark_completed(["SYM0", "SYM1"])
+
+    downloader = FakeYFinanceDownloader(failing_calls={0})
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows', return_value=traded_objects):
+        collector = MarketTradeDataCollector(
+            batch_size=2, lookback_period_days=1, downloader=downloader,
+            journal=BackfillJournal(run_id="test", retry_backoff_seconds=0))
+    collector.collect_save_trade_market_data(period=YFinanceIntervals.ONE_MONTH,
+                                             time_window=TradeTimeWindow.DAILY)
+
+    assert downloader.batch_sizes == [2, 2, 2]
+    stored = get_backfill_journal("test").set_index("symbol")
+    assert (stored["status"] == "completed").all()
+    assert stored["attempts"].sum() == 2
@@ -0,0 +1,252 @@
+import datetime as dt
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from data_ingestion.gap_detection import GapIndex, detect_gaps, plan_refetch, \
+    session_days
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector
+from data_ingestion.yfinance_frames import YFINANCE_PRICE_COLUMNS
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import get_empty_refetches, get_ohlcv_bars, \
+    save_trade_market_data_in_db
+from utils.enums import TradeTimeWindow
+from utils.market_calendar import MarketCalendar
+
+START_DATE = dt.date(2024, 1, 2)
+END_DATE = dt.date(2024, 3, 28)
+
+
+def session_dates(start=START_DATE, end=END_DATE):
+    return [session.date for session in MarketCalendar().sessions(start, end)]
+
+
+def utc_midnight(date):
+    return int(dt.datetime.combine(date, dt.time(), tzinfo=dt.timezone.utc).timestamp())
+
+
+def new_york_midnight(date):
+    return int(dt.datetime.combine(date, dt.time(),
+                                   tzinfo=MarketCalendar().timezone).timestamp())
+
+
+def stored_bars(dates_by_symbol, to_open_date=utc_midnight):
+    return DataFrame({
+        "symbol": [symbol for symbol, dates in dates_by_symbol.items() for _ in dates],
+        "open_date": [to_open_date(date) for dates in dates_by_symbol.values()
+                      for date in dates]})
+
+
+def gap_dates(gap_index):
+    return [(symbol, str(first.date()), str(last.date()), missing)
+            for symbol, first, last, missing in zip(
+                gap_index.symbols,
+                pd.to_datetime(gap_index.to_frame()["first_open_date"], unit="s"),
+                pd.to_datetime(gap_index.to_frame()["last_open_date"], unit="s"),
+                gap_index.missing_sessions)]
+
+
+def test_session_days_accept_utc_and_exchange_midnights():
+    """Test bars opening at either midnight map to the same session day."""
+
+    dates = session_dates()[:3]
+
+    assert (session_days(np.array([utc_midnight(date) for date in dates])).tolist()
+            == session_days(np.array([new_york_midnight(date)
+                                      for date in dates])).tolist())
+
+
+def test_detect_gaps_finds_missing_sessions_between_and_after_bars():
+    """Test holes inside and at the end of a symbol's bars are indexed."""
+
+    sessions = session_dates()
+    bars = stored_bars({
+        "AAPL": sessions[:10] + sessions[12:],
+        # Listed on the 20th session, so nothing before it is missing
+        "MSFT": sessions[20:-3],
+        "TSLA": sessions,
+        # A Saturday bar is ignored
+        "GOOG": sessions[:5] + [dt.date(2024, 1, 13)] + sessions[6:],
+    }, to_open_date=new_york_midnight)
+
+    gap_index = detect_gaps(bars, MarketCalendar(), START_DATE, END_DATE)
+
+    assert gap_dates(gap_index) == [
+        ("AAPL", str(sessions[10]), str(sessions[11]), 2),
+        ("GOOG", str(sessions[5]), str(sessions[5]), 1),
+        ("MSFT", str(sessions[-3]), str(sessions[-1]), 3)]
+    assert gap_index.symbols_with_gaps == 3
+
+
+def test_detect_gaps_skips_trailing_gaps_refetched_without_data():
+    """Test a trailing gap already refetched in vain is not indexed again."""
+
+    sessions = session_dates()
+    bars = stored_bars({
+        "AAPL": sessions[:10] + sessions[12:-5],
+        # Refetched before its last bar, so the refetch does not cover its gap
+        "MSFT": sessions[:-3],
+        "TSLA": sessions[:-5],
+    })
+
+    gap_index = detect_gaps(bars, MarketCalendar(), START_DATE, END_DATE,
+                            empty_refetches={"AAPL": utc_midnight(sessions[-1]),
+                                             "MSFT": utc_midnight(sessions[-5])})
+
+    assert gap_dates(gap_index) == [
+        ("AAPL", str(sessions[10]), str(sessions[11]), 2),
+        ("MSFT", str(sessions[-3]), str(sessions[-1]), 3),
+        ("TSLA", str(sessions[-5]), str(sessions[-1]), 5)]
+
+
+def test_detect_gaps_matches_a_set_difference():
+    """Test the vectorized index matches a per symbol set difference."""
+
+    sessions = session_dates()
+    rng = np.random.default_rng(7)
+    dates_by_symbol = {f"SYM{index}": [date for date in sessions if rng.random() > 0.1]
+                       for index in range(200)}
+
+    gap_index = detect_gaps(stored_bars(dates_by_symbol), MarketCalendar(),
+                            START_DATE, END_DATE)
+
+    missing = {(symbol, session_days(np.array([utc_midnight(date)]))[0])
+               for symbol, dates in dates_by_symbol.items()
+               for date in sessions if dates[0] < date and date not in dates}
+    indexed = {(symbol, day) for symbol, first, last in zip(
+        gap_index.symbols, gap_index.first_sessions, gap_index.last_sessions)
+        for day in gap_index.session_days[first:last + 1]}
+    assert indexed == missing
+
+
+def test_plan_refetch_groups_symbols_with_the_same_missing_range():
+    """Test a failed batch is repaired by as few requests as its size allows."""
+
+    sessions = session_dates()
+    failed_batch = {f"SYM{index}": sessions[:30] + sessions[32:] for index in range(250)}
+    gap_index = detect_gaps(stored_bars(failed_batch), MarketCalendar(),
+                            START_DATE, END_DATE)
+
+    requests = plan_refetch(gap_index, max_symbols_per_request=100)
+
+    assert [len(request.symbols) for request in requests] == [100, 100, 50]
+    assert {(request.start, request.end) for request in requests} == {
+        (str(sessions[30]), str(sessions[31] + dt.timedelta(days=1)))}
+
+
+def test_plan_refetch_merges_nearby_gaps_and_ranges():
+    """Test close gaps share a request while distant ones stay separate."""
+
+    sessions = session_dates()
+    gap_index = detect_gaps(stored_bars({
+        # Two gaps three sessions apart become one range
+        "AAPL": sessions[:10] + sessions[11:14] + sessions[15:],
+        # Shifted by a session from AAPL's range, so one request covers both
+        "MSFT": sessions[:11] + sessions[12:14] + sessions[16:],
+        # Far from the others, so it gets a request of its own
+        "TSLA": sessions[:40] + sessions[45:],
+    }), MarketCalendar(), START_DATE, END_DATE)
+
+    requests = plan_refetch(gap_index, max_symbols_per_request=100,
+                            max_extra_sessions=3)
+    strict_requests = plan_refetch(gap_index, max_symbols_per_request=100,
+                                   max_extra_sessions=0)
+
+    assert [(request.symbols, request.start, request.end) for request in requests] == [
+        (["AAPL", "MSFT"], str(sessions[10]), str(sessions[15] + dt.timedelta(days=1))),
+        (["TSLA"], str(sessions[40]), str(sessions[44] + dt.timedelta(days=1)))]
+    assert len(strict_requests) == 5
+    assert plan_refetch(GapIndex.empty(np.array([], dtype=np.int64))) == []
+
+
+class RangeDownloader:
+    """ Stand-in for yf.download serving every session of the requested
+    range, indexed at midnight in New York like yfinance does """
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, symbols, start=None, end=None, **kwargs):
+        self.requests.append((sorted(symbols), start, end))
+        dates = pd.DatetimeIndex(
+            [dt.datetime.combine(date, dt.time()) for date in session_dates(
+                dt.date.fromisoformat(start),
+                dt.date.fromisoformat(end) - dt.timedelta(days=1))]
+        ).tz_localize("America/New_York")
+        columns = pd.MultiIndex.from_product([symbols, YFINANCE_PRICE_COLUMNS])
+        return pd.DataFrame(np.ones((len(dates), len(columns))), index=dates,
+                            columns=columns)
+
+
+def test_repair_gaps_downloads_only_the_missing_sessions(sqlite_engine):
+    """Test a repair run fills the holes and requests nothing else."""
+
+    sessions = session_dates()
+    dates_by_symbol = {f"SYM{index}": sessions for index in range(4)}
+    dates_by_symbol["SYM1"] = sessions[:20] + sessions[23:]
+    dates_by_symbol["SYM2"] = sessions[:20] + sessions[23:]
+    bars = stored_bars(dates_by_symbol, to_open_date=new_york_midnight)
+    for column in ["open", "high", "low", "close"]:
+        bars[column] = 1.0
+    bars["volume"] = 1
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(
+        data=bars, time_window=TradeTimeWindow.DAILY))
+    downloader = RangeDownloader()
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows',
+               return_value=mock_traded_object_rows(4)):
+        collector = MarketTradeDataCollector(batch_size=10, lookback_period_days=0,
+                                             downloader=downloader)
+
+    gap_index = collector.repair_gaps(
+        lookback_days=(END_DATE - START_DATE).days,
+        now=new_york_midnight(END_DATE + dt.timedelta(days=1)))
+
+    assert len(gap_index) == 2
+    assert downloader.requests == [(["SYM1", "SYM2"], str(sessions[20]),
+                                    str(sessions[22] + dt.timedelta(days=1)))]
+    assert collector.diff_counters.new_rows == 6
+    stored = get_ohlcv_bars(["SYM1", "SYM2"], TradeTimeWindow.DAILY)
+    assert stored.shape[0] == 2 * len(sessions)
+
+
+class EmptyRangeDownloader(RangeDownloader):
+    """ Stand-in for yf.download of symbols no longer traded """
+
+    def __call__(self, symbols, start=None, end=None, **kwargs):
+        return super().__call__(symbols, start=start, end=end, **kwargs).iloc[:0]
+
+
+def test_repair_gaps_records_symbols_without_data(sqlite_engine):
+    """Test a trailing gap yfinance has no bars for is refetched only once."""
+
+    sessions = session_dates()
+    dates_by_symbol = {"SYM0": sessions, "SYM1": sessions[:-3]}
+    bars = stored_bars(dates_by_symbol, to_open_date=new_york_midnight)
+    for column in ["open", "high", "low", "close"]:
+        bars[column] = 1.0
+    bars["volume"] = 1
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(
+        data=bars, time_window=TradeTimeWindow.DAILY))
+    downloader = EmptyRangeDownloader()
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows',
+               return_value=mock_traded_object_rows(2)):
+        collector = MarketTradeDataCollector(batch_size=10, lookback_period_days=0,
+                                             downloader=downloader)
+    lookback_days = (END_DATE - START_DATE).days
+    now = new_york_midnight(END_DATE + dt.timedelta(days=1))
+
+    first_gaps = collector.repair_gaps(lookback_days=lookback_days, now=now)
+    second_gaps = collector.repair_gaps(lookback_days=lookback_days, now=now)
+
+    assert len(first_gaps) == 1
+    assert len(second_gaps) == 0
+    assert downloader.requests == [(["SYM1"], str(sessions[-3]),
+                                    str(sessions[-1] + dt.timedelta(days=1)))]
+    assert get_empty_refetches(["SYM0", "SYM1"], TradeTimeWindow.DAILY) == {
+        "SYM1": utc_midnight(sessions[-1] + dt.timedelta(days=1)) - 1}
@@ -0,0 +1,169 @@
+import datetime as dt
+import json
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from data_ingestion.ingestion_daemon import ClosedDayTrigger, DailyTrigger, \
+    HealthServer, IngestionDaemon, IngestionScheduler, ScheduledJob, \
+    SessionCloseTrigger
+from data_ingestion.symbol_list_collection import SymbolListDelta
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows, mock_traded_objects
+from tests.utils.test_market_calendar import new_york_timestamp
+from utils.market_calendar import MarketCalendar
+
+
+class FixedTrigger:
+    """ Due every `interval` seconds """
+
+    def __init__(self, interval=60.0):
+        self.interval = interval
+
+    def next_run_after(self, timestamp):
+        return timestamp + self.interval
+
+
+def test_session_close_trigger_skips_closed_days():
+    """Test runs follow session closes, early and holiday closes included."""
+
+    trigger = SessionCloseTrigger(MarketCalendar(), delay_seconds=30 * 60)
+
+    assert (trigger.next_run_after(new_york_timestamp(2024, 3, 28, 16, 10))
+            == new_york_timestamp(2024, 3, 28, 16, 30))
+    # Good Friday and the weekend have no session
+    assert (trigger.next_run_after(new_york_timestamp(2024, 3, 28, 16, 30))
+            == new_york_timestamp(2024, 4, 1, 16, 30))
+    assert (trigger.next_run_after(new_york_timestamp(2024, 11, 29, 9))
+            == new_york_timestamp(2024, 11, 29, 13, 30))
+
+
+def test_closed_day_and_daily_triggers():
+    """Test closed day runs land on holidays and weekends only."""
+
+    closed_day = ClosedDayTrigger(MarketCalendar(), time_of_day=dt.time(6, 0))
+    daily = DailyTrigger(dt.time(7, 0))
+
+    assert (closed_day.next_run_after(new_york_timestamp(2024, 3, 27, 12))
+            == new_york_timestamp(2024, 3, 29, 6))
+    assert (closed_day.next_run_after(new_york_timestamp(2024, 3, 29, 6))
+            == new_york_timestamp(2024, 3, 30, 6))
+    midnight = dt.datetime(2024, 3, 27, tzinfo=dt.timezone.utc).timestamp()
+    assert daily.next_run_after(midnight) == midnight + 7 * 3600
+    assert daily.next_run_after(midnight + 7 * 3600) == midnight + 31 * 3600
+
+
+def test_overlapping_runs_are_skipped():
+    """Test a due job is skipped while it or its lock group is running."""
+
+    release = threading.Event()
+    blocking_job = ScheduledJob(name="back_fill", run=release.wait,
+                                trigger=FixedTrigger(), lock_group="yfinance")
+    grouped_job = ScheduledJob(name="new_data", run=MagicMock(),
+                               trigger=FixedTrigger(), lock_group="yfinance")
+    other_job = ScheduledJob(name="symbol_list", run=MagicMock(),
+                             trigger=FixedTrigger())
+    scheduler = IngestionScheduler([blocking_job, grouped_job, other_job],
+                                   max_concurrent_jobs=3, clock=lambda: 0.0)
+    scheduler.start(now=0.0)
+
+    first = scheduler.run_due_jobs(now=60.0)
+    second = scheduler.run_due_jobs(now=120.0)
+    release.set()
+    for future in first + second:
+        future.result()
+    status = scheduler.status()
+    scheduler.stop()
+
+    assert len(first) == 2
+    assert status["back_fill"].runs == 1
+    assert status["back_fill"].skipped_runs == 1
+    assert status["new_data"].runs == 0
+    assert status["new_data"].skipped_runs == 2
+    assert status["symbol_list"].runs == 2
+    assert status["back_fill"].next_run_at == 180.0
+
+
+def test_failed_run_is_recorded_and_rescheduled():
+    """Test a raising job counts as failed without stopping the scheduler."""
+
+    job = ScheduledJob(name="new_data", run=MagicMock(side_effect=RuntimeError("down")),
+                       trigger=FixedTrigger())
+    scheduler = IngestionScheduler([job], clock=lambda: 0.0)
+    scheduler.start(now=0.0)
+
+    for future in scheduler.run_due_jobs(now=60.0):
+        future.result()
+    status = scheduler.status()["new_data"]
+    scheduler.stop()
+
+    assert (status.runs, status.failures) == (1, 1)
+    assert status.last_error == "RuntimeError: down"
+    assert status.last_succeeded_at is None
+    assert status.next_run_at == 120.0
+
+
+@pytest.fixture
+def ingestion_daemon():
+    with patch('data_ingestion.ingestion_daemon.get_traded_object_rows',
+               return_value=mock_traded_object_rows(5)) as get_traded_objects:
+        ingestion_daemon = IngestionDaemon()
+        ingestion_daemon.get_traded_objects = get_traded_objects
+        yield ingestion_daemon
+        ingestion_daemon.scheduler.stop()
+
+
+def test_jobs_share_one_cached_symbol_registry(ingestion_daemon):
+    """Test the registry is read once and again only after a changed list."""
+
+    collector = MagicMock(delta=SymbolListDelta())
+    with patch('data_ingestion.ingestion_daemon.collect_save_new_market_data') as new_data, \
+            patch('data_ingestion.ingestion_daemon.main_symbol_list_collection',
+                  return_value=collector):
+        for name in ["new_data", "new_data", "symbol_list"]:
+            ingestion_daemon.scheduler.run_job(name).result()
+        first_registry = new_data.call_args.kwargs["symbol_registry"]
+        collector.delta = SymbolListDelta(added=mock_traded_objects(6) - mock_traded_objects(5))
+        ingestion_daemon.get_traded_objects.return_value = mock_traded_object_rows(6)
+        ingestion_daemon.scheduler.run_job("symbol_list").result()
+        ingestion_daemon.scheduler.run_job("new_data").result()
+
+    assert ingestion_daemon.get_traded_objects.call_count == 2
+    assert new_data.call_args_list[0].kwargs["symbol_registry"] is first_registry
+    assert len(first_registry) == 5
+    assert len(new_data.call_args.kwargs["symbol_registry"]) == 6
+    assert new_data.call_args.kwargs["dispose_connection"] is False
+
+
+def test_health_and_metrics_endpoints(ingestion_daemon):
+    """Test /health reports scheduler liveness and /metrics the job counters."""
+
+    server = HealthServer(("127.0.0.1", 0), ingestion_daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with pytest.raises(urllib.error.HTTPError) as not_started:
+            urllib.request.urlopen(f"{url}/health")
+
+        with patch('data_ingestion.ingestion_daemon.collect_save_new_market_data'):
+            ingestion_daemon.scheduler.start()
+            ingestion_daemon.scheduler.run_job("new_data").result()
+            ingestion_daemon.scheduler.run_due_jobs()
+        with urllib.request.urlopen(f"{url}/health") as response:
+            health = json.loads(response.read())
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            metrics = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert not_started.value.code == 503
+    assert health["status"] == "ok"
+    assert health["symbols"] == 5
+    assert health["jobs"]["new_data"]["runs"] == 1
+    assert 'ingestion_job_runs_total{job="new_data"} 1' in metrics
+    assert 'ingestion_job_skipped_runs_total{job="back_fill"} 0' in metrics
+    assert "ingestion_daemon_symbols 5" in metrics
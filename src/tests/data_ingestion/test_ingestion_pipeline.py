@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from data_ingestion.ingestion_pipeline import MemoryBudget, PipelineStage, \
+    StagedPipeline
+
+ITEM_SIZE_BYTES = 100
+
+
+def build_pipeline(fetch, transform, write, queue_size=1,
+                   memory_cap_bytes=10 * ITEM_SIZE_BYTES):
+    return StagedPipeline(
+        stages=[PipelineStage(name="fetch", function=fetch),
+                PipelineStage(name="transform", function=transform),
+                PipelineStage(name="write", function=write)],
+        size_of=lambda item: ITEM_SIZE_BYTES,
+        queue_size=queue_size,
+        memory_cap_bytes=memory_cap_bytes
+    )
+
+
+def test_pipeline_processes_every_item_in_order():
+    """Test items flow through every stage in order."""
+
+    written = []
+    pipeline = build_pipeline(fetch=lambda item: item * 2,
+                              transform=lambda item: item + 1,
+                              write=written.append)
+    pipeline.run(range(20))
+
+    assert written == [item * 2 + 1 for item in range(20)]
+    assert pipeline.memory_budget.used_bytes == 0
+
+
+def test_stalled_writer_throttles_fetcher():
+    """Test a slow write stage keeps the fetch stage from running ahead."""
+
+    lock = threading.Lock()
+    counters = {"fetched": 0, "written": 0, "max_ahead": 0}
+
+    def fetch(item):
+        with lock:
+            counters["fetched"] += 1
+            counters["max_ahead"] = max(counters["max_ahead"],
+                                        counters["fetched"] - counters["written"])
+        return item
+
+    def write(item):
+        time.sleep(0.01)
+        with lock:
+            counters["written"] += 1
+
+    pipeline = build_pipeline(fetch=fetch, transform=lambda item: item,
+                              write=write, memory_cap_bytes=3 * ITEM_SIZE_BYTES)
+    pipeline.run(range(30))
+
+    assert counters["written"] == 30
+    # Three items fit in the memory budget, plus the one being fetched.
+    assert counters["max_ahead"] <= 4
+    assert pipeline.memory_budget.peak_bytes <= 3 * ITEM_SIZE_BYTES
+
+
+def test_failing_item_is_dropped():
+    """Test an error in a stage drops the item and keeps the pipeline going."""
+
+    written = []
+
+    def transform(item):
+        if item == 3:
+            raise RuntimeError("transform failed")
+        return item
+
+    pipeline = build_pipeline(fetch=lambda item: item, transform=transform,
+                              write=written.append)
+    pipeline.run(range(6))
+
+    assert written == [0, 1, 2, 4, 5]
+
+
+def test_memory_budget_lets_oversized_item_through_when_empty():
+    """Test an item larger than the cap does not block an empty budget."""
+
+    budget = MemoryBudget(max_bytes=10)
+    budget.acquire(50)
+
+    assert budget.used_bytes == 50
+    budget.release(50)
+    assert budget.used_bytes == 0
+
+
+def test_pipeline_requires_stages():
+    """Test a pipeline without stages is rejected."""
+
+    with pytest.raises(ValueError):
+        StagedPipeline(stages=[], size_of=lambda item: 0)
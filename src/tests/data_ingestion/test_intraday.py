@@ -0,0 +1,91 @@
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from data_ingestion.intraday import clamp_period, drop_stored_and_open_bars
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector
+from data_ingestion.yfinance_frames import YFINANCE_PRICE_COLUMNS
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows
+from utils.db_helpers import get_intraday_bars, get_ohlcv_bars
+from utils.enums import TradeTimeWindow, YFinanceIntervals
+
+
+class IntradayDownloader:
+    """ Stand-in for yf.download returning the last bars up to the one
+    still forming, with the tz-aware index yfinance uses for intraday data """
+
+    def __init__(self, now, number_of_bars=12):
+        self.now = now
+        self.number_of_bars = number_of_bars
+        self.calls = []
+
+    def __call__(self, symbols, **kwargs):
+        self.calls.append(kwargs)
+        seconds = TradeTimeWindow.get_trade_time_window_from_name(
+            kwargs["interval"]).value.time_in_seconds
+        last_open_date = self.now - self.now % seconds
+        dates = pd.to_datetime(
+            np.arange(last_open_date - seconds * (self.number_of_bars - 1),
+                      last_open_date + 1, seconds), unit="s", utc=True
+        ).tz_convert("America/New_York")
+        columns = pd.MultiIndex.from_product([symbols, YFINANCE_PRICE_COLUMNS])
+        return pd.DataFrame(np.ones((len(dates), len(columns))), index=dates,
+                            columns=columns)
+
+
+def test_period_is_clamped_to_the_interval_limit():
+    """Test intraday periods never exceed what yfinance serves per request."""
+
+    assert clamp_period(YFinanceIntervals.MAX, TradeTimeWindow.ONE_MINUTE) \
+        == YFinanceIntervals.FIVE_DAYS
+    assert clamp_period(YFinanceIntervals.ONE_YEAR, TradeTimeWindow.FIVE_MINUTES) \
+        == YFinanceIntervals.ONE_MONTH
+    assert clamp_period(YFinanceIntervals.ONE_DAY, TradeTimeWindow.ONE_HOUR) \
+        == YFinanceIntervals.ONE_DAY
+    assert clamp_period(YFinanceIntervals.MAX, TradeTimeWindow.DAILY) \
+        == YFinanceIntervals.MAX
+
+
+def test_stored_and_forming_bars_are_dropped():
+    """Test only closed bars after the watermark are kept."""
+
+    data = pd.DataFrame({"symbol": pd.Categorical(["A", "A", "A", "B", "B"]),
+                         "open_date": [0, 60, 120, 60, 120]})
+
+    kept = drop_stored_and_open_bars(data, watermarks={"A": 60},
+                                     time_window=TradeTimeWindow.ONE_MINUTE,
+                                     now=150)
+
+    assert list(zip(kept["symbol"], kept["open_date"])) == [("B", 60)]
+
+
+def test_intraday_collection_appends_closed_bars(sqlite_engine):
+    """Test an intraday run writes closed bars to its table and resumes from them."""
+
+    now = int(time.time())
+    downloader = IntradayDownloader(now=now - 600)
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows',
+               return_value=mock_traded_object_rows(5)):
+        collector = MarketTradeDataCollector(batch_size=2, lookback_period_days=0,
+                                             downloader=downloader)
+
+    collector.collect_save_trade_market_data(period=YFinanceIntervals.MAX,
+                                             time_window=TradeTimeWindow.FIVE_MINUTES)
+    downloader.now = now
+    collector.collect_save_trade_market_data(period=YFinanceIntervals.MAX,
+                                             time_window=TradeTimeWindow.FIVE_MINUTES)
+
+    symbols = [f"SYM{index}" for index in range(5)]
+    stored = get_intraday_bars(symbols, TradeTimeWindow.FIVE_MINUTES)
+    assert {call["period"] for call in downloader.calls} <= {"1d", "5d", "1mo"}
+    assert downloader.calls[0]["period"] == "1mo"
+    # 12 closed bars on the first run and the one that closed since; the
+    # bar still forming is left for the next run
+    assert stored.groupby("symbol").size().tolist() == [13] * 5
+    assert stored["open_date"].max() + 300 <= now
+    assert collector.diff_counters.new_rows == 5
+    assert get_ohlcv_bars(symbols, TradeTimeWindow.FIVE_MINUTES).empty
@@ -0,0 +1,84 @@
+import json
+import random
+import tracemalloc
+
+import pytest
+
+from data_ingestion.json_stream import iter_chunks, iter_json_array
+
+
+def build_symbol_list(number_of_entries):
+    return [{"symbol": f"SYM{index}", "name": f"Company {index} é",
+             "price": index * 1.5, "exchange": "NASDAQ Global Select",
+             "exchangeShortName": "NASDAQ", "type": "stock"}
+            for index in range(number_of_entries)]
+
+
+def test_elements_match_json_loads_for_any_chunk_size():
+    """Test splitting the body anywhere, even inside a character, changes nothing."""
+
+    records = build_symbol_list(200) + [[1, [2]], "a,]b", -1.5e3, None, True]
+    content = json.dumps(records, indent=1).encode()
+
+    for chunk_size in [1, 2, 7, 64, 1024, len(content)]:
+        assert list(iter_json_array(iter_chunks(content, chunk_size))) == records
+
+
+@pytest.mark.parametrize("content", [b"", b"{}", b"[1,]", b"[1 2]", b"[1",
+                                     b"[1] [2]", b"[\"\xff\"]"])
+def test_malformed_body_raises_value_error(content):
+    """Test anything but one well formed list is a ValueError."""
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(iter_chunks(content, 2)))
+
+
+def test_large_list_is_parsed_in_bounded_memory():
+    """Test streaming a large list keeps a small fraction of it in memory."""
+
+    content = json.dumps(build_symbol_list(100_000)).encode()
+
+    tracemalloc.start()
+    try:
+        entries = sum(1 for _ in iter_json_array(iter_chunks(content)))
+        _, streaming_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        assert len(json.loads(content)) == entries
+        _, loads_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert entries == 100_000
+    assert streaming_peak < len(content) / 20
+    assert streaming_peak < loads_peak / 50
+
+
+def test_elements_are_yielded_before_the_body_is_complete():
+    """Test elements come out as soon as their chunk arrived."""
+
+    chunks_read = []
+
+    def chunks():
+        for chunk in [b'[{"a": 1},', b' {"a": 2}', b']']:
+            chunks_read.append(chunk)
+            yield chunk
+
+    elements = iter_json_array(chunks())
+    assert next(elements) == {"a": 1}
+    assert len(chunks_read) == 1
+    assert list(elements) == [{"a": 2}]
+
+
+def test_random_chunking_of_nested_values():
+    """Test nested values survive random chunk boundaries."""
+
+    rng = random.Random(0)
+    records = [{"values": [rng.random() for _ in range(rng.randint(0, 20))],
+                "nested": {"text": "x" * rng.randint(0, 300)}}
+               for _ in range(500)]
+    content = json.dumps(records).encode()
+    boundaries = sorted(rng.sample(range(1, len(content)), 300))
+    chunks = [content[start:end] for start, end in
+              zip([0] + boundaries, boundaries + [len(content)])]
+
+    assert list(iter_json_array(chunks)) == records
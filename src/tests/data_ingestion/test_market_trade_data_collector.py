@@ -0,0 +1,213 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from data_ingestion.market_trade_data_collection import FetchedBatch, \
+    MarketTradeDataCollector
+from utils.data_models import TradedObject
+from utils.enums import TradedObjectType, YFinanceIntervals, TradeTimeWindow
+
+NUMBER_OF_SYMBOLS = 50
+BATCH_SIZE = 10
+
+
+def mock_traded_objects(number_of_symbols=NUMBER_OF_SYMBOLS):
+    return {
+        TradedObject(
+            name=f"Test Object {index}",
+            symbol=f"SYM{index}",
+            exchange="NYSE",
+            exchange_short_name="NYSE",
+            object_type=TradedObjectType.STOCK
+        ) for index in range(number_of_symbols)
+    }
+
+
+def mock_traded_object_rows(number_of_symbols=NUMBER_OF_SYMBOLS):
+    """ Rows of traded_objects as get_traded_object_rows reads them """
+    return [(traded_object.name, traded_object.symbol, traded_object.exchange,
+             traded_object.exchange_short_name,
+             traded_object.object_type.name.lower())
+            for traded_object in mock_traded_objects(number_of_symbols)]
+
+
+@pytest.fixture
+def market_collector():
+    """Fixture to initialize a concurrent MarketTradeDataCollector."""
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows',
+               return_value=mock_traded_object_rows()):
+        yield MarketTradeDataCollector(batch_size=BATCH_SIZE,
+                                       lookback_period_days=1,
+                                       max_workers=4,
+                                       max_in_flight_requests=3)
+
+
+def test_concurrent_batches_processed(market_collector):
+    """Test every batch is processed once and runs overlap in concurrent mode."""
+
+    processed_symbols = []
+    lock = threading.Lock()
+    running = {"current": 0, "max": 0}
+
+    def fake_process_batch(symbols_batch, period, time_window, batch_index=0):
+        with lock:
+            running["current"] += 1
+            running["max"] = max(running["max"], running["current"])
+            processed_symbols.extend(symbols_batch)
+        time.sleep(0.05)
+        with lock:
+            running["current"] -= 1
+
+    with patch.object(market_collector, '_process_batch',
+                      side_effect=fake_process_batch):
+        market_collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH,
+            time_window=TradeTimeWindow.DAILY)
+
+    assert sorted(processed_symbols) == sorted(
+        market_collector.symbol_registry.symbols.tolist())
+    assert 1 < running["max"] <= 4
+
+
+def test_concurrent_batch_errors_are_isolated(market_collector):
+    """Test a failing batch is logged without stopping the other batches."""
+
+    calls = []
+
+    def fake_process_batch(symbols_batch, period, time_window, batch_index=0):
+        calls.append(symbols_batch)
+        if len(calls) == 1:
+            raise RuntimeError("batch failed")
+
+    with patch.object(market_collector, '_process_batch',
+                      side_effect=fake_process_batch), \
+            patch('data_ingestion.market_trade_data_collection.logger') as logger:
+        market_collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH,
+            time_window=TradeTimeWindow.DAILY)
+
+    assert len(calls) == NUMBER_OF_SYMBOLS // BATCH_SIZE
+    assert logger.error.call_count == 1
+
+
+@patch('yfinance.download')
+def test_yfinance_downloads_are_serialised(mock_download):
+    """Test downloads never overlap and respect the in-flight request limit."""
+
+    lock = threading.Lock()
+    running = {"current": 0, "max": 0}
+
+    def fake_download(symbols, **kwargs):
+        with lock:
+            running["current"] += 1
+            running["max"] = max(running["max"], running["current"])
+        time.sleep(0.02)
+        with lock:
+            running["current"] -= 1
+        raise TimeoutError("stop after download")
+
+    mock_download.side_effect = fake_download
+
+    def fetch():
+        with pytest.raises(TimeoutError):
+            MarketTradeDataCollector._fetch_yfinance_data(
+                symbols=["SYM1"], period=YFinanceIntervals.ONE_MONTH,
+                time_window=TradeTimeWindow.DAILY, max_in_flight_requests=3)
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert running["max"] == 1
+    assert mock_download.call_args.kwargs["threads"] == 3
+
+
+def test_pipelined_mode_runs_every_stage(market_collector):
+    """Test pipelined mode fetches, transforms and writes every batch."""
+
+    market_collector.pipelined = True
+    written = []
+
+    with patch.object(market_collector, '_fetch_batch',
+                      side_effect=lambda symbols, period, time_window,
+                      batch_index: symbols), \
+            patch.object(market_collector, '_transform_batch',
+                         side_effect=lambda symbols: symbols), \
+            patch.object(market_collector, '_write_batch',
+                         side_effect=written.extend), \
+            patch.object(market_collector, '_estimate_payload_bytes',
+                         return_value=1):
+        market_collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.MAX,
+            time_window=TradeTimeWindow.DAILY)
+
+    assert sorted(written) == sorted(market_collector.symbol_registry.symbols.tolist())
+
+
+def test_symbols_grouped_by_period_since_watermark():
+    """Test symbols are fetched with the shortest period covering their gap."""
+
+    now = time.time()
+    watermarks = {"FRESH": int(now - 2 * 86_400),
+                  "WEEK": int(now - 20 * 86_400),
+                  "OLD": int(now - 3 * 365 * 86_400)}
+
+    groups = MarketTradeDataCollector._group_symbols_by_period(
+        symbols=["FRESH", "WEEK", "OLD", "NEW"], watermarks=watermarks,
+        period=YFinanceIntervals.MAX)
+
+    assert groups == {YFinanceIntervals.FIVE_DAYS: ["FRESH"],
+                      YFinanceIntervals.ONE_MONTH: ["WEEK"],
+                      YFinanceIntervals.FIVE_YEARS: ["OLD"],
+                      YFinanceIntervals.MAX: ["NEW"]}
+
+
+def test_group_period_never_exceeds_requested_period():
+    """Test an old watermark falls back to the requested period."""
+
+    groups = MarketTradeDataCollector._group_symbols_by_period(
+        symbols=["OLD"], watermarks={"OLD": int(time.time() - 365 * 86_400)},
+        period=YFinanceIntervals.ONE_MONTH)
+
+    assert groups == {YFinanceIntervals.ONE_MONTH: ["OLD"]}
+
+
+def test_up_to_date_symbols_are_skipped(market_collector):
+    """Test symbols whose watermark is recent are not fetched again."""
+
+    now = int(time.time())
+    symbols = market_collector._clean_existing_symbols(
+        symbols=["SYM1", "SYM2", "SYM3"],
+        watermarks={"SYM1": now - 2 * 86_400, "SYM3": now})
+
+    assert symbols == ["SYM1", "SYM2"]
+
+
+def test_transform_writes_only_changed_bars(market_collector):
+    """Test only new and revised bars reach the writer."""
+
+    now = int(time.time())
+    fetched_data = pd.DataFrame({
+        "symbol": ["SYM1", "SYM1", "SYM1", "SYM2"],
+        "open_date": [now - 2 * 86_400, now - 86_400, now, now],
+        "open": 1.0, "high": 1.0, "low": 1.0, "close": [1.0, 1.5, 1.0, 1.0],
+        "volume": 10, "time_window": "1d"
+    })
+    stored_data = fetched_data.iloc[:2].assign(close=1.0)
+
+    ohlcv_batch = market_collector._transform_batch(FetchedBatch(
+        fetched_data=fetched_data, stored_data=stored_data,
+        time_window=TradeTimeWindow.DAILY)).ohlcv_batch
+
+    assert sorted(zip(ohlcv_batch.symbols[ohlcv_batch.symbol_codes].tolist(),
+                      ohlcv_batch.open_date.tolist())) == [
+        ("SYM1", now - 86_400), ("SYM1", now), ("SYM2", now)]
+    assert market_collector.diff_counters.new_rows == 2
+    assert market_collector.diff_counters.updated_rows == 1
+    assert market_collector.diff_counters.unchanged_rows == 1
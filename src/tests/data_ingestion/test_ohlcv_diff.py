@@ -0,0 +1,80 @@
+import pandas as pd
+
+from data_ingestion.ohlcv_diff import OHLCVDiff, OHLCVDiffCounters, diff_ohlcv
+
+FIRST_OPEN_DATE = 1_700_000_000
+
+
+def make_bars(symbol, number_of_days, close=1.0, first_open_date=FIRST_OPEN_DATE):
+    return pd.DataFrame({
+        "symbol": symbol,
+        "open_date": [first_open_date + day * 86_400 for day in range(number_of_days)],
+        "open": 1.0, "high": 1.0, "low": 1.0, "close": close, "volume": 100,
+        "time_window": "1d"
+    })
+
+
+def test_diff_against_empty_store_inserts_everything():
+    """Test every bar is new when nothing is stored yet."""
+
+    ohlcv_diff = diff_ohlcv(fetched_data=make_bars("AAPL", 3),
+                            stored_data=make_bars("AAPL", 0))
+
+    assert ohlcv_diff.new_rows == 3
+    assert ohlcv_diff.updated_rows == 0
+    assert ohlcv_diff.unchanged_rows == 0
+
+
+def test_diff_splits_new_updated_and_unchanged_bars():
+    """Test bars are classified against the stored ones."""
+
+    stored_data = pd.concat([make_bars("AAPL", 2), make_bars("MSFT", 2)],
+                            ignore_index=True)
+    fetched_data = pd.concat([make_bars("AAPL", 3),
+                              make_bars("MSFT", 2, close=2.0)],
+                             ignore_index=True)
+
+    ohlcv_diff = diff_ohlcv(fetched_data=fetched_data, stored_data=stored_data)
+
+    assert ohlcv_diff.inserts["open_date"].tolist() == [FIRST_OPEN_DATE + 2 * 86_400]
+    assert ohlcv_diff.updates["symbol"].tolist() == ["MSFT", "MSFT"]
+    assert ohlcv_diff.unchanged_rows == 2
+    assert ohlcv_diff.changed_data.shape[0] == 3
+
+
+def test_float_round_trip_is_not_an_update():
+    """Test single precision noise from the database is ignored."""
+
+    stored_data = make_bars("AAPL", 2, close=float(pd.Series([123.456]).astype("float32")[0]))
+    fetched_data = make_bars("AAPL", 2, close=123.456)
+
+    ohlcv_diff = diff_ohlcv(fetched_data=fetched_data, stored_data=stored_data)
+
+    assert ohlcv_diff.updated_rows == 0
+    assert ohlcv_diff.unchanged_rows == 2
+
+
+def test_bars_before_back_fill_limit_are_expired():
+    """Test unstored bars older than the back fill limit are not inserted."""
+
+    ohlcv_diff = diff_ohlcv(fetched_data=make_bars("AAPL", 4),
+                            stored_data=make_bars("AAPL", 0),
+                            back_fill_limit=FIRST_OPEN_DATE + 2 * 86_400)
+
+    assert ohlcv_diff.new_rows == 2
+    assert ohlcv_diff.expired_rows == 2
+
+
+def test_counters_accumulate_diffs():
+    """Test the run counters add up every batch diff."""
+
+    counters = OHLCVDiffCounters()
+    ohlcv_diff = OHLCVDiff(inserts=make_bars("AAPL", 1), updates=make_bars("AAPL", 0),
+                           unchanged_rows=3, expired_rows=0)
+
+    counters.add(ohlcv_diff)
+    counters.add(ohlcv_diff)
+
+    assert counters.new_rows == 2
+    assert counters.unchanged_rows == 6
+    assert counters.written_fraction == 0.25
@@ -0,0 +1,134 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_ingestion.ohlcv_resampler import period_start_dates, \
+    resample_daily_bars, update_resampled_bars
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import get_ohlcv_bars, save_trade_market_data_in_db
+from utils.enums import TradeTimeWindow
+
+
+def epoch(date):
+    return int(pd.Timestamp(date).timestamp())
+
+
+def make_daily_bars(symbols, start="2024-01-01", periods=130, seed=0):
+    random = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=periods)
+    data = pd.DataFrame({
+        "symbol": np.repeat(symbols, len(dates)),
+        "open_date": np.tile(dates.as_unit("s").asi8, len(symbols)),
+    })
+    data["open"] = random.uniform(10, 20, len(data)).astype(np.float32)
+    data["close"] = random.uniform(10, 20, len(data)).astype(np.float32)
+    data["high"] = np.maximum(data["open"], data["close"]) + 1
+    data["low"] = np.minimum(data["open"], data["close"]) - 1
+    data["volume"] = random.integers(10 ** 6, 10 ** 9, len(data))
+    return data
+
+
+def pandas_resample(data, rule):
+    frames = []
+    for symbol, bars in data.groupby("symbol"):
+        bars = bars.set_index(pd.to_datetime(bars["open_date"], unit="s")).sort_index()
+        resampled = bars.resample(rule).agg({"open": "first", "high": "max",
+                                             "low": "min", "close": "last",
+                                             "volume": "sum"}).dropna()
+        resampled["open_date"] = resampled.index.as_unit("s").asi8
+        resampled["symbol"] = symbol
+        frames.append(resampled.reset_index(drop=True))
+    return (pd.concat(frames).sort_values(["symbol", "open_date"])
+            .reset_index(drop=True))
+
+
+@pytest.mark.parametrize("time_window, expected", [
+    (TradeTimeWindow.WEEKLY, "2024-02-26"),
+    (TradeTimeWindow.MONTHLY, "2024-02-01"),
+    (TradeTimeWindow.THREE_MONTHS, "2024-01-01"),
+])
+def test_period_start_dates(time_window, expected):
+    """Test open dates are mapped to the start of their week, month or quarter."""
+
+    open_dates = np.array([epoch("2024-02-29"), epoch("2024-03-01")])
+
+    assert period_start_dates(open_dates[:1], time_window)[0] == epoch(expected)
+
+
+@pytest.mark.parametrize("time_window, rule", [
+    (TradeTimeWindow.WEEKLY, "W-SUN"),
+    (TradeTimeWindow.MONTHLY, "MS"),
+    (TradeTimeWindow.THREE_MONTHS, "QS"),
+])
+def test_resampling_matches_pandas(time_window, rule):
+    """Test the vectorised aggregation matches a pandas resample."""
+
+    data = make_daily_bars(["AAPL", "MSFT"]).sample(frac=1, random_state=1)
+
+    resampled = resample_daily_bars(data, time_window)
+    expected = pandas_resample(data, rule)
+    # Weekly bins are labelled with their Sunday, yfinance uses the Monday
+    if time_window == TradeTimeWindow.WEEKLY:
+        expected["open_date"] -= 6 * 86_400
+
+    resampled = resampled.sort_values(["symbol", "open_date"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(resampled[expected.columns], expected,
+                                  check_dtype=False)
+
+
+def test_three_months_does_not_collide_with_monthly():
+    """Test THREE_MONTHS is its own time window."""
+
+    assert TradeTimeWindow.THREE_MONTHS is not TradeTimeWindow.MONTHLY
+    assert TradeTimeWindow.get_trade_time_window_from_name("3mo") == \
+        TradeTimeWindow.THREE_MONTHS
+
+
+def test_incremental_update_matches_full_recomputation(sqlite_engine):
+    """Test updating from new daily bars gives the same bars as a full rebuild."""
+
+    data = make_daily_bars(["AAPL", "MSFT"])
+    history = data[data["open_date"] < epoch("2024-05-15")]
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(history, TradeTimeWindow.DAILY))
+    update_resampled_bars(OHLCVBatch.from_frame(history, TradeTimeWindow.DAILY))
+
+    new_bars = OHLCVBatch.from_frame(data[data["open_date"] >= epoch("2024-05-15")],
+                                     TradeTimeWindow.DAILY)
+    save_trade_market_data_in_db(new_bars)
+    written = update_resampled_bars(new_bars)
+
+    assert [len(batch) for batch in written] == [2 * 7, 2 * 2, 2 * 1]
+    for time_window in (TradeTimeWindow.WEEKLY, TradeTimeWindow.MONTHLY,
+                        TradeTimeWindow.THREE_MONTHS):
+        stored = (get_ohlcv_bars(["AAPL", "MSFT"], time_window)
+                  .sort_values(["symbol", "open_date"]).reset_index(drop=True))
+        expected = resample_daily_bars(data, time_window)
+        assert stored.shape[0] == expected.shape[0]
+        np.testing.assert_array_equal(stored["volume"], expected["volume"])
+        np.testing.assert_allclose(stored["high"], expected["high"], rtol=1e-6)
+
+
+def test_update_reads_each_symbol_from_its_own_periods(sqlite_engine):
+    """Test an old revision of one symbol does not widen the read of the others."""
+
+    data = make_daily_bars(["AAPL", "MSFT"])
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(data, TradeTimeWindow.DAILY))
+    update_resampled_bars(OHLCVBatch.from_frame(data, TradeTimeWindow.DAILY))
+    revised = data[((data["symbol"] == "AAPL") & (data["open_date"] == epoch("2024-01-10")))
+                   | ((data["symbol"] == "MSFT") & (data["open_date"] >= epoch("2024-05-15")))]
+
+    with patch("data_ingestion.ohlcv_resampler.get_ohlcv_bars",
+               wraps=get_ohlcv_bars) as read_bars:
+        update_resampled_bars(OHLCVBatch.from_frame(revised, TradeTimeWindow.DAILY))
+
+    assert sorted((call.kwargs["symbols"], call.kwargs["start_open_date"])
+                  for call in read_bars.call_args_list) == [
+        (["AAPL"], epoch("2024-01-01")), (["MSFT"], epoch("2024-04-01"))]
+    for time_window in (TradeTimeWindow.WEEKLY, TradeTimeWindow.MONTHLY,
+                        TradeTimeWindow.THREE_MONTHS):
+        stored = (get_ohlcv_bars(["AAPL", "MSFT"], time_window)
+                  .sort_values(["symbol", "open_date"]).reset_index(drop=True))
+        np.testing.assert_array_equal(
+            stored["volume"], resample_daily_bars(data, time_window)["volume"])
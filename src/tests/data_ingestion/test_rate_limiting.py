@@ -0,0 +1,201 @@
+import threading
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector
+from data_ingestion.rate_limiting import AdaptiveBatchSizer, BatchOutcome, \
+    TokenBucket
+from data_ingestion.yfinance_frames import YFINANCE_PRICE_COLUMNS
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows
+from utils.enums import YFinanceIntervals, TradeTimeWindow
+
+
+class FakeClock:
+    """ Clock whose sleep only moves time forward """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeYFinanceDownloader:
+    """ Stand-in for yf.download that injects latency, errors and throttling.
+
+    Calls listed in `failing_calls` raise, calls in `throttled_calls` return
+    no data for any ticker, like Yahoo does once it starts blocking.
+    """
+
+    def __init__(self, latency_seconds=0.0, failing_calls=(), throttled_calls=()):
+        self.latency_seconds = latency_seconds
+        self.failing_calls = set(failing_calls)
+        self.throttled_calls = set(throttled_calls)
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def __call__(self, symbols, **kwargs):
+        with self._lock:
+            call_index = len(self.batch_sizes)
+            self.batch_sizes.append(len(symbols))
+        time.sleep(self.latency_seconds)
+        if call_index in self.failing_calls:
+            raise RuntimeError("Injected download error")
+
+        dates = pd.date_range("2024-01-01", periods=3, freq="D")
+        columns = pd.MultiIndex.from_product([symbols, YFINANCE_PRICE_COLUMNS])
+        values = np.ones((len(dates), len(columns)))
+        if call_index in self.throttled_calls:
+            values[:] = np.nan
+        return pd.DataFrame(values, index=dates, columns=columns)
+
+
+def collect_with_fake_downloader(downloader, batch_sizer, number_of_symbols=200):
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows',
+               return_value=mock_traded_object_rows(number_of_symbols)):
+        collector = MarketTradeDataCollector(batch_size=20,
+                                             lookback_period_days=1,
+                                             batch_sizer=batch_sizer,
+                                             downloader=downloader)
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_ingestion_watermarks', return_value={}), \
+            patch.object(collector, '_write_batch') as write_batch:
+        collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH,
+            time_window=TradeTimeWindow.DAILY)
+    return collector, write_batch
+
+
+def test_token_bucket_spaces_out_calls():
+    """Test tokens refill at the configured rate after the initial burst."""
+
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=0.5, capacity=2, clock=clock,
+                         sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(4)]
+
+    assert waits == [0.0, 0.0, 2.0, 2.0]
+    assert clock.now == 4.0
+    assert bucket.total_wait_seconds == 4.0
+
+
+def test_token_bucket_refills_while_idle():
+    """Test idle time is credited up to the bucket capacity."""
+
+    clock = FakeClock()
+    bucket = TokenBucket(rate_per_second=1, capacity=3, clock=clock,
+                         sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+
+    clock.now += 100
+
+    assert [bucket.acquire() for _ in range(4)] == [0.0, 0.0, 0.0, 1.0]
+
+
+def test_token_bucket_limits_concurrent_callers():
+    """Test threads sharing a bucket never exceed its rate."""
+
+    bucket = TokenBucket(rate_per_second=100, capacity=1)
+    started_at = time.monotonic()
+
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.monotonic() - started_at >= 0.09
+
+
+def test_sizer_increases_additively_and_decreases_multiplicatively():
+    """Test AIMD steps on healthy and throttled batches."""
+
+    sizer = AdaptiveBatchSizer(initial_batch_size=100, additive_increase=10,
+                               decrease_factor=0.5, target_latency_seconds=5)
+    healthy = BatchOutcome(symbols=100, latency_seconds=1.0, failed=False,
+                           empty_symbols=0)
+
+    assert sizer.record(healthy) == 110
+    assert sizer.record(healthy) == 120
+    assert sizer.record(BatchOutcome(symbols=120, latency_seconds=1.0,
+                                     failed=True, empty_symbols=0)) == 60
+    assert sizer.record(BatchOutcome(symbols=60, latency_seconds=9.0,
+                                     failed=False, empty_symbols=0)) == 30
+    assert sizer.record(BatchOutcome(symbols=30, latency_seconds=1.0,
+                                     failed=False, empty_symbols=20)) == 15
+    assert sizer.increases == 2
+    assert sizer.decreases == 3
+
+
+def test_sizer_stays_within_bounds():
+    """Test the batch size never leaves the configured range."""
+
+    sizer = AdaptiveBatchSizer(initial_batch_size=1000, min_batch_size=5,
+                               max_batch_size=50)
+    assert sizer.batch_size == 50
+
+    for _ in range(10):
+        sizer.record(BatchOutcome(symbols=10, latency_seconds=0.0, failed=True,
+                                  empty_symbols=0))
+
+    assert sizer.batch_size == 5
+    assert sizer.error_rate == pytest.approx(1.0)
+
+
+def test_collector_shrinks_batches_when_throttled():
+    """Test batch sizes react to injected errors and empty downloads."""
+
+    downloader = FakeYFinanceDownloader(failing_calls={2}, throttled_calls={4})
+    sizer = AdaptiveBatchSizer(initial_batch_size=20, min_batch_size=5,
+                               additive_increase=10)
+
+    collector, write_batch = collect_with_fake_downloader(downloader, sizer)
+
+    assert downloader.batch_sizes[:6] == [20, 30, 40, 20, 30, 15]
+    assert sum(downloader.batch_sizes) == 200
+    written_rows = sum(len(call.args[0].ohlcv_batch)
+                       for call in write_batch.call_args_list)
+    assert written_rows == 3 * (200 - 40 - 30)
+    assert sizer.decreases == 2
+
+
+def test_collector_shrinks_batches_on_slow_downloads():
+    """Test downloads slower than the latency target shrink the batches."""
+
+    downloader = FakeYFinanceDownloader(latency_seconds=0.02)
+    sizer = AdaptiveBatchSizer(initial_batch_size=40, min_batch_size=10,
+                               target_latency_seconds=0.01)
+
+    collect_with_fake_downloader(downloader, sizer, number_of_symbols=100)
+
+    assert downloader.batch_sizes == [40, 20, 10, 10, 10, 10]
+    assert sizer.latency_seconds >= 0.02
+
+
+def test_batch_sizer_sees_only_the_download_time():
+    """Test rate limiter waits are left out of the reported latency."""
+
+    downloader = FakeYFinanceDownloader()
+    sizer = AdaptiveBatchSizer(initial_batch_size=10, target_latency_seconds=0.05)
+    rate_limiter = TokenBucket(rate_per_second=10, capacity=1)
+    rate_limiter.acquire()
+
+    # The second token is a tenth of a second away
+    MarketTradeDataCollector._fetch_yfinance_data(
+        symbols=[f"SYM{index}" for index in range(10)],
+        period=YFinanceIntervals.ONE_MONTH, time_window=TradeTimeWindow.DAILY,
+        rate_limiter=rate_limiter, downloader=downloader, batch_sizer=sizer)
+
+    assert sizer.latency_seconds < 0.05
+    assert (sizer.increases, sizer.decreases) == (1, 0)
@@ -0,0 +1,98 @@
+from unittest.mock import patch
+
+import pytest
+
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector, \
+    symbol_shard
+from data_ingestion.sharded_collection import RunReport, ShardReport, run_sharded
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows
+from tests.data_ingestion.test_rate_limiting import FakeYFinanceDownloader
+from utils.enums import YFinanceIntervals, TradeTimeWindow
+
+NUMBER_OF_SYMBOLS = 40
+
+
+def build_collector(shard_index, num_shards, **kwargs):
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows',
+               return_value=mock_traded_object_rows(NUMBER_OF_SYMBOLS)):
+        return MarketTradeDataCollector(batch_size=5, lookback_period_days=1,
+                                        shard_index=shard_index,
+                                        num_shards=num_shards, **kwargs)
+
+
+def fake_shard_job(shard_index, num_shards, call_interval_seconds):
+    """ Shard job run in a spawned process against a fake downloader """
+    if shard_index == 2:
+        raise RuntimeError("Injected shard failure")
+
+    collector = build_collector(shard_index, num_shards,
+                                downloader=FakeYFinanceDownloader())
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_ingestion_watermarks', return_value={}), \
+            patch.object(collector, '_write_batch'):
+        collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH, time_window=TradeTimeWindow.DAILY)
+    return collector
+
+
+def test_symbol_shard_is_stable_and_balanced():
+    """Test symbols always map to the same shard and shards are even."""
+
+    symbols = [f"SYM{index}" for index in range(4000)]
+    shards = [symbol_shard(symbol, 4) for symbol in symbols]
+
+    assert shards == [symbol_shard(symbol, 4) for symbol in symbols]
+    assert symbol_shard("AAPL", 4) == 0
+    assert all(900 < shards.count(shard) < 1100 for shard in range(4))
+
+
+def test_collectors_split_the_universe_between_shards():
+    """Test every symbol is owned by exactly one shard."""
+
+    shard_symbols = [set(build_collector(shard_index, 3).symbol_registry.symbols)
+                     for shard_index in range(3)]
+
+    assert sum(len(symbols) for symbols in shard_symbols) == NUMBER_OF_SYMBOLS
+    assert set.union(*shard_symbols) == {f"SYM{index}"
+                                         for index in range(NUMBER_OF_SYMBOLS)}
+
+
+def test_shard_index_out_of_range_is_rejected():
+    """Test a shard index outside the number of shards fails early."""
+
+    with pytest.raises(ValueError, match="out of range"):
+        build_collector(shard_index=3, num_shards=3)
+
+
+def test_run_report_merges_shards():
+    """Test shard reports are summed and survive a JSON round trip."""
+
+    reports = [RunReport(shards=[ShardReport(shard_index=index, num_shards=2,
+                                             symbols=10, new_rows=100,
+                                             elapsed_seconds=10.0 * (index + 1))])
+               for index in range(2)]
+
+    merged = RunReport.from_json(RunReport.merge(reports).to_json())
+
+    assert merged.written_rows == 200
+    assert merged.elapsed_seconds == 20.0
+    assert merged.rows_per_second == 10.0
+    assert merged.totals()["symbols"] == 20
+    assert merged.failed_shards == []
+
+
+def test_shards_run_in_separate_processes():
+    """Test a process pool runs every shard and reports failed ones."""
+
+    report = run_sharded(fake_shard_job, num_shards=3, max_workers=2,
+                         call_interval_seconds=0.0001)
+
+    assert sorted(shard.shard_index for shard in report.shards) == [0, 1, 2]
+    assert report.failed_shards == [2]
+    assert "Injected shard failure" in report.shards[2].error
+    assert report.totals()["symbols"] == sum(
+        1 for index in range(NUMBER_OF_SYMBOLS)
+        if symbol_shard(f"SYM{index}", 3) != 2)
+    assert report.totals()["new_rows"] == 3 * report.totals()["symbols"]
@@ -1,12 +1,19 @@
+import json
 import os
-from unittest.mock import patch
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, PropertyMock, patch
 
 import pytest
 import requests
 from pymysql.constants.ER import WRONG_VALUE_FOR_TYPE
 from tenacity import RetryError
 
-from data_ingestion.symbol_list_collection import SymbolListCollector
+from data_ingestion.json_stream import iter_chunks
+from data_ingestion.symbol_list_cache import SymbolListCache, SymbolListResponse
+from data_ingestion.symbol_list_collection import NotModifiedWithoutCacheError, \
+    SymbolListCollector, compute_symbol_list_delta
 from utils.data_models import TradedObject
 from utils.enums import TradedObjectType
 
@@ -27,6 +34,104 @@ MOCK_API_RESPONSE_WRONG = [
     {"symbol": "INVALID", "name": "Invalid Object"}
 ]
 
+MOCK_ETF_RESPONSE = [
+    {"symbol": "SPY", "name": "SPDR S&P 500", "exchange": "NYSE Arca",
+     "exchangeShortName": "AMEX", "type": "etf"},
+]
+
+
+def mock_response(data, status_code=200, headers=None):
+    response = MagicMock()
+    body = json.dumps(data).encode()
+    response.iter_content.side_effect = lambda chunk_size: iter_chunks(body, 16)
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def mock_list_responses(stock_data=MOCK_API_RESPONSE, etf_data=MOCK_ETF_RESPONSE):
+    """ Session.get side effect answering with the list of each endpoint """
+
+    def get(url, **kwargs):
+        return mock_response(etf_data if "/etf/" in url else stock_data)
+
+    return get
+
+
+class FakeFinancialModelingPrepServer:
+    """ Local HTTP server answering the symbol list endpoints.
+
+    Records the path and client port of every request and the most requests
+    it handled at the same time. Each endpoint can be delayed or made to
+    fail a number of times before it answers.
+    """
+
+    def __init__(self, lists, delay_seconds=0.0):
+        self.lists = lists
+        self.delay_seconds = delay_seconds
+        self.failures = {}
+        self.requests = []
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive needs HTTP/1.1
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                endpoint = self.path.split("?")[0].strip("/").split("/")[0]
+                with server._lock:
+                    server.requests.append((endpoint, self.client_address[1]))
+                    server._in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight,
+                                                server._in_flight)
+                    failing = server.failures.get(endpoint, 0) > 0
+                    if failing:
+                        server.failures[endpoint] -= 1
+                try:
+                    time.sleep(server.delay_seconds)
+                    status, body = ((503, b"") if failing
+                                    else (200, json.dumps(server.lists[endpoint]).encode()))
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def fake_api():
+    with FakeFinancialModelingPrepServer(
+            {"available-traded": MOCK_API_RESPONSE, "etf": MOCK_ETF_RESPONSE},
+            delay_seconds=0.2) as server:
+        yield server
+
 
 # Helper to mock a traded object
 def mock_traded_object(symbol, name="Test Object", exchange="NYSE",
@@ -43,21 +148,20 @@ def mock_traded_object(symbol, name="Test Object", exchange="NYSE",
 @pytest.fixture
 def symbol_collector():
     """Fixture to initialize SymbolListCollector."""
-    with patch('data_ingestion.symbol_list_collection'
+    with patch('utils.db_helpers'
                '.get_all_traded_objects_from_db',
                return_value=set()):
         yield SymbolListCollector()
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 @patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
-@patch('data_ingestion.symbol_list_collection.save_new_traded_objects_in_db')
+@patch('utils.db_helpers.apply_traded_objects_delta')
 def test_update_traded_objects(mock_save_db, mock_requests, symbol_collector):
     """Test update_traded_objects fetches and saves new symbols."""
 
     # Mock API response
-    mock_requests.return_value.json.return_value = MOCK_API_RESPONSE
-    mock_requests.return_value.status_code = 200
+    mock_requests.return_value = mock_response(MOCK_API_RESPONSE)
 
     # Execute the method
     symbol_collector.update_traded_objects()
@@ -67,9 +171,9 @@ def test_update_traded_objects(mock_save_db, mock_requests, symbol_collector):
     assert mock_save_db.called
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 @patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
-@patch('data_ingestion.symbol_list_collection.save_new_traded_objects_in_db')
+@patch('utils.db_helpers.apply_traded_objects_delta')
 def test_api_fetch_failures_retries(mock_save_db, mock_requests, symbol_collector):
     """Test retry behavior on API failure."""
 
@@ -78,11 +182,13 @@ def test_api_fetch_failures_retries(mock_save_db, mock_requests, symbol_collecto
 
     symbol_collector.update_traded_objects()
 
-    assert mock_requests.call_count == NUMBER_OF_RETRY_TIMES
+    # Every endpoint is retried on its own
+    assert mock_requests.call_count == (NUMBER_OF_RETRY_TIMES
+                                        * len(SymbolListCollector.SYMBOL_LIST_TYPES))
     assert not mock_save_db.called
 
 
-@patch('data_ingestion.symbol_list_collection.get_all_traded_objects_from_db')
+@patch('utils.db_helpers.get_all_traded_objects_from_db')
 def test_no_new_traded_objects(symbol_collector):
     """Test behavior when no new traded objects are fetched."""
 
@@ -94,8 +200,8 @@ def test_no_new_traded_objects(symbol_collector):
         mock_traded_object(symbol="AAPL")
     }
 
-    with patch('data_ingestion.symbol_list_collection'
-               '.save_new_traded_objects_in_db') as mock_save_db:
+    with patch('utils.db_helpers'
+               '.apply_traded_objects_delta') as mock_save_db:
         symbol_collector._save_new_traded_objects()
         mock_save_db.assert_not_called()
 
@@ -105,7 +211,7 @@ def test_missing_api_token(symbol_collector):
     """Test that missing API token raises EnvironmentError."""
 
     with pytest.raises(EnvironmentError, match="API token not found"):
-        symbol_collector._get_traded_objects_by_type(TradedObjectType.STOCK)
+        symbol_collector._fetch_symbol_list(TradedObjectType.STOCK)
 
 
 def test_new_traded_objects(symbol_collector):
@@ -117,21 +223,274 @@ def test_new_traded_objects(symbol_collector):
     new_object = mock_traded_object(symbol="TSLA")
     symbol_collector.new_symbol_list = {existing_object, new_object}
 
-    with patch('data_ingestion.symbol_list_collection'
-               '.save_new_traded_objects_in_db') as mock_save_db:
+    with patch('utils.db_helpers'
+               '.apply_traded_objects_delta') as mock_save_db:
         symbol_collector._save_new_traded_objects()
 
         # Assert that the new object was saved
-        mock_save_db.assert_called_once_with(traded_objects={new_object})
+        assert mock_save_db.call_args.kwargs["upserted"] == {new_object}
+        assert mock_save_db.call_args.kwargs["removed"] == set()
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 @patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
 def test_handle_invalid_data(mock_requests, symbol_collector):
     """Test behavior when invalid data is received from the API."""
 
-    mock_requests.return_value.json.return_value = WRONG_VALUE_FOR_TYPE
-    mock_requests.return_value.status_code = 200
+    mock_requests.return_value = mock_response(WRONG_VALUE_FOR_TYPE)
 
     with pytest.raises(RetryError):
         symbol_collector._get_traded_objects_from_online()
+
+
+def test_delta_detects_added_removed_and_renamed_objects():
+    """Test the delta splits added, removed and renamed or moved objects."""
+
+    current = {mock_traded_object("AAPL"), mock_traded_object("GOOG"),
+               mock_traded_object("META", name="Facebook")}
+    new = {mock_traded_object("AAPL"), mock_traded_object("META", name="Meta"),
+           mock_traded_object("TSLA")}
+
+    delta = compute_symbol_list_delta(current, new)
+
+    assert {o.symbol for o in delta.added} == {"TSLA"}
+    assert {o.symbol for o in delta.removed} == {"GOOG"}
+    assert [o.name for o in delta.changed] == ["Meta"]
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_unchanged_lists_skip_parsing_and_database(tmp_path):
+    """Test a second sync of the same lists stops after hashing them."""
+
+    collector = SymbolListCollector(cache=SymbolListCache(str(tmp_path)))
+    with patch('requests.Session.get', side_effect=mock_list_responses()), \
+            patch('utils.db_helpers'
+                  '.get_all_traded_objects_from_db', return_value=set()) as mock_read, \
+            patch('utils.db_helpers'
+                  '.apply_traded_objects_delta') as mock_apply:
+        collector.update_traded_objects()
+        collector = SymbolListCollector(cache=SymbolListCache(str(tmp_path)))
+        with patch.object(collector, '_process_traded_objects') as mock_parse:
+            collector.update_traded_objects()
+
+    assert mock_apply.call_count == 1
+    assert mock_read.call_count == 1
+    assert collector.delta is None
+    mock_parse.assert_not_called()
+    # Spooled bodies of unchanged lists are not left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "etf.json", "etf.meta.json", "stock.json", "stock.meta.json"]
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_not_modified_lists_are_not_parsed(tmp_path):
+    """Test lists answered with 304 are neither parsed nor applied."""
+
+    cache = SymbolListCache(str(tmp_path))
+    with patch('requests.Session.get', side_effect=mock_list_responses()), \
+            patch('utils.db_helpers'
+                  '.get_all_traded_objects_from_db', return_value=set()), \
+            patch('utils.db_helpers.apply_traded_objects_delta'):
+        SymbolListCollector(cache=cache).update_traded_objects()
+
+    collector = SymbolListCollector(cache=cache)
+    with patch('requests.Session.get',
+               return_value=mock_response(None, status_code=304)), \
+            patch.object(collector, '_process_traded_objects') as mock_parse:
+        assert not collector._get_traded_objects_from_online()
+
+    mock_parse.assert_not_called()
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_list_is_parsed_from_the_streamed_body(tmp_path):
+    """Test the body is spooled chunk by chunk and decoded from the cache dir."""
+
+    response = mock_response(MOCK_API_RESPONSE)
+    type(response).content = PropertyMock(side_effect=AssertionError(
+        "the body is read as a whole"))
+    collector = SymbolListCollector(cache=SymbolListCache(str(tmp_path)))
+
+    with patch('requests.Session.get', return_value=response) as mock_get:
+        fetched = collector._fetch_symbol_list(TradedObjectType.STOCK)
+
+    assert mock_get.call_args.kwargs["stream"] is True
+    assert {o.symbol for o in collector.parsed_lists[TradedObjectType.STOCK]} == {
+        "AAPL", "GOOG"}
+    body = json.dumps(MOCK_API_RESPONSE).encode()
+    assert fetched.content == b""
+    assert fetched.path.read_bytes() == body
+    assert fetched.content_hash == SymbolListResponse(content=body).content_hash
+    assert collector.parse_stats[TradedObjectType.STOCK].parsed_bytes == len(body)
+    response.close.assert_called_once()
+
+    collector.cache.put(TradedObjectType.STOCK, fetched)
+    assert collector.cache.read(TradedObjectType.STOCK).path.read_bytes() == body
+    assert not (tmp_path / "stock.json.part").exists()
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_not_modified_list_is_read_from_cache(tmp_path):
+    """Test a 304 for one list still diffs the union with its cached body."""
+
+    cache = SymbolListCache(str(tmp_path))
+    with patch('requests.Session.get', side_effect=mock_list_responses()), \
+            patch('utils.db_helpers'
+                  '.get_all_traded_objects_from_db', return_value=set()), \
+            patch('utils.db_helpers.apply_traded_objects_delta'):
+        SymbolListCollector(cache=cache).update_traded_objects()
+    stored_stocks = cache.read(TradedObjectType.STOCK)
+    stored_stocks.etag = "v1"
+    cache.put(TradedObjectType.STOCK, stored_stocks)
+
+    new_etfs = MOCK_ETF_RESPONSE + [
+        {"symbol": "QQQ", "name": "Invesco QQQ", "exchange": "NASDAQ",
+         "exchangeShortName": "NASDAQ", "type": "etf"}]
+
+    def get(url, headers, **kwargs):
+        if "/etf/" in url:
+            return mock_response(new_etfs)
+        assert headers == {"If-None-Match": "v1"}
+        return mock_response(None, status_code=304)
+
+    listed = SymbolListCollector._process_traded_objects(
+        MOCK_API_RESPONSE + MOCK_ETF_RESPONSE, TradedObjectType.STOCK)
+    with patch('requests.Session.get', side_effect=get), \
+            patch('utils.db_helpers'
+                  '.get_all_traded_objects_from_db', return_value=listed), \
+            patch('utils.db_helpers'
+                  '.apply_traded_objects_delta') as mock_apply:
+        SymbolListCollector(cache=cache).update_traded_objects()
+
+    assert {o.symbol for o in mock_apply.call_args.kwargs["upserted"]} == {"QQQ"}
+    assert mock_apply.call_args.kwargs["removed"] == set()
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_not_modified_without_cached_body_is_fetched_in_full(tmp_path):
+    """Test a 304 whose cached body is gone is answered by a plain request."""
+
+    cache = SymbolListCache(str(tmp_path))
+    stock_response = SymbolListResponse(content=json.dumps(MOCK_API_RESPONSE).encode(),
+                                        etag="v1")
+    cache.put(TradedObjectType.STOCK, stock_response)
+    cached = cache.get(TradedObjectType.STOCK)
+    sent_headers = []
+
+    def get(url, headers=None, **kwargs):
+        sent_headers.append(headers)
+        if headers:
+            return mock_response(None, status_code=304)
+        return mock_response(MOCK_API_RESPONSE)
+
+    collector = SymbolListCollector(cache=cache)
+    with patch('requests.Session.get', side_effect=get), \
+            patch.object(cache, 'read', return_value=None):
+        response = collector._fetch_symbol_list(TradedObjectType.STOCK, cached)
+
+    assert sent_headers == [{"If-None-Match": "v1"}, {}]
+    # The body comes from the second response, which carried no ETag
+    assert response.content_hash == stock_response.content_hash
+    assert response.etag is None
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_not_modified_to_a_plain_request_is_not_retried(symbol_collector):
+    """Test a 304 without validators sent fails at once."""
+
+    with patch('requests.Session.get',
+               return_value=mock_response(None, status_code=304)) as mock_get:
+        with pytest.raises(NotModifiedWithoutCacheError):
+            symbol_collector._fetch_symbol_list(TradedObjectType.STOCK)
+
+    assert mock_get.call_count == 1
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_mass_removal_is_refused_and_not_cached(tmp_path):
+    """Test a list that lost most symbols is neither applied nor cached."""
+
+    listed = {mock_traded_object(f"SYM{index}") for index in range(10)}
+    collector = SymbolListCollector(cache=SymbolListCache(str(tmp_path)))
+    with patch('requests.Session.get', side_effect=mock_list_responses()), \
+            patch('utils.db_helpers'
+                  '.get_all_traded_objects_from_db', return_value=listed), \
+            patch('utils.db_helpers'
+                  '.apply_traded_objects_delta') as mock_apply:
+        collector.update_traded_objects()
+
+    mock_apply.assert_not_called()
+    assert collector.cache.get(TradedObjectType.STOCK) is None
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_lists_are_fetched_concurrently(fake_api):
+    """Test every endpoint is requested at the same time."""
+
+    collector = SymbolListCollector(base_url=fake_api.base_url)
+    try:
+        assert collector._get_traded_objects_from_online()
+    finally:
+        collector.close()
+
+    assert sorted(endpoint for endpoint, _ in fake_api.requests) == [
+        "available-traded", "etf"]
+    assert fake_api.peak_in_flight == 2
+    assert {o.symbol for o in collector.new_symbol_list} == {"AAPL", "GOOG", "SPY"}
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_concurrency_cap_and_keep_alive(fake_api):
+    """Test a cap of one request sends the lists one by one over one connection."""
+
+    collector = SymbolListCollector(base_url=fake_api.base_url,
+                                    max_concurrent_requests=1)
+    try:
+        collector._get_traded_objects_from_online()
+        collector._get_traded_objects_from_online()
+    finally:
+        collector.close()
+
+    assert fake_api.peak_in_flight == 1
+    assert len(fake_api.requests) == 4
+    assert len({port for _, port in fake_api.requests}) == 1
+
+
+@patch.dict(os.environ, {"FINANCIAL_MODELING_PREP_TOKEN": MOCK_API_TOKEN})
+def test_failing_endpoint_is_retried_alone(fake_api):
+    """Test a failed endpoint is retried without fetching the others again."""
+
+    fake_api.failures["etf"] = 1
+    collector = SymbolListCollector(base_url=fake_api.base_url)
+    try:
+        assert collector._get_traded_objects_from_online()
+    finally:
+        collector.close()
+
+    assert [endpoint for endpoint, _ in fake_api.requests].count("etf") == 2
+    assert [endpoint for endpoint, _ in fake_api.requests].count(
+        "available-traded") == 1
+    assert "SPY" in {o.symbol for o in collector.new_symbol_list}
+
+
+def test_large_list_parse_reports_invalid_and_duplicate_entries():
+    """Test a large list is deduplicated on the fly and its counts reported."""
+
+    entries = [{"symbol": f"SYM{index}", "name": f"Company {index}",
+                "exchange": "NASDAQ", "exchangeShortName": "NASDAQ",
+                "type": "stock"} for index in range(50_000)]
+    entries += entries[:1_000] + [{"symbol": "BROKEN"}] * 10
+    response = SymbolListResponse(content=json.dumps(entries).encode())
+    collector = SymbolListCollector()
+
+    traded_objects = collector._parse_symbol_list(TradedObjectType.STOCK, response)
+    collector.close()
+
+    stats = collector.parse_stats[TradedObjectType.STOCK]
+    assert len(traded_objects) == 50_000
+    assert (stats.entries, stats.invalid_entries, stats.duplicate_entries) == (
+        51_010, 10, 1_000)
+    assert stats.parsed_bytes == len(response.content)
+    assert stats.entries_per_second > 0
+    # Exchange names are shared rather than copied per entry
+    assert len({id(o.exchange) for o in traded_objects}) == 1
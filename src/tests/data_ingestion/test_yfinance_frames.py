@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas import DataFrame
+
+from data_ingestion.yfinance_frames import normalize_yfinance_frame
+from utils.enums import TradeTimeWindow
+
+DATES = pd.DatetimeIndex(["2024-01-02", "2024-01-03", "2024-01-04"], name="Date")
+PRICES = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+def mock_ticker_frame(offset):
+    return DataFrame({
+        "Open": [offset + 1.0, offset + 2.0, np.nan],
+        "High": [offset + 1.5, offset + 2.5, np.nan],
+        "Low": [offset + 0.5, offset + 1.5, np.nan],
+        "Close": [offset + 1.25, offset + 2.25, np.nan],
+        "Adj Close": [offset + 1.25, offset + 2.25, np.nan],
+        "Volume": [100.0, 200.0, np.nan],
+    }, index=DATES)
+
+
+def mock_multi_ticker_frame(group_by):
+    frame = pd.concat({"AAPL": mock_ticker_frame(0), "GOOG": mock_ticker_frame(10)},
+                      axis=1, names=["Ticker", "Price"])
+    if group_by == "column":
+        frame = frame.swaplevel(axis=1).sort_index(axis=1)
+        frame.columns.names = [None, None]
+    return frame
+
+
+def expected_rows(symbols_offsets):
+    epochs = [int(date.timestamp()) for date in DATES[:2]]
+    return [(symbol, epoch, np.float32(offset + close), volume)
+            for symbol, offset in symbols_offsets
+            for epoch, close, volume in zip(epochs, [1.25, 2.25], [100, 200])]
+
+
+def as_rows(frame):
+    return list(zip(frame["symbol"].astype(str), frame["open_date"],
+                    frame["close"], frame["volume"]))
+
+
+@pytest.mark.parametrize("group_by", ["ticker", "column"])
+def test_multi_ticker_layouts(group_by):
+    """Test both two-level column layouts give the same long frame."""
+
+    frame = normalize_yfinance_frame(mock_multi_ticker_frame(group_by),
+                                     symbols=["AAPL", "GOOG"],
+                                     time_window=TradeTimeWindow.DAILY)
+
+    assert as_rows(frame) == expected_rows([("AAPL", 0), ("GOOG", 10)])
+    assert frame["symbol"].dtype == "category"
+    assert frame["close"].dtype == np.float32
+    assert frame["volume"].dtype == np.int64
+    assert (frame["time_window"] == "1d").all()
+
+
+def test_single_ticker_flat_layout():
+    """Test a flat single-ticker frame uses the requested symbol."""
+
+    frame = normalize_yfinance_frame(mock_ticker_frame(0), symbols=["AAPL"],
+                                     time_window=TradeTimeWindow.DAILY)
+
+    assert as_rows(frame) == expected_rows([("AAPL", 0)])
+
+
+def test_timezone_aware_index_matches_timestamp():
+    """Test epochs match Timestamp.timestamp() for timezone-aware dates."""
+
+    data = mock_ticker_frame(0)
+    data.index = data.index.tz_localize("America/New_York")
+
+    frame = normalize_yfinance_frame(data, symbols=["AAPL"],
+                                     time_window=TradeTimeWindow.DAILY)
+
+    assert frame["open_date"].tolist() == [int(date.timestamp())
+                                           for date in data.index[:2]]
+
+
+def test_empty_download():
+    """Test an empty download gives an empty frame with the final columns."""
+
+    frame = normalize_yfinance_frame(DataFrame(), symbols=["AAPL"],
+                                     time_window=TradeTimeWindow.DAILY)
+
+    assert frame.shape[0] == 0
+    assert list(frame.columns) == ["symbol", "open_date", "open", "high", "low",
+                                   "close", "volume", "time_window"]
@@ -0,0 +1,239 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators.indicator_engine import IndicatorEngine, fold_indicator
+from indicators.technical_indicators import ATR, EMA, RSI, SMA, VWAP
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import get_indicator_states, get_ohlcv_bars, \
+    save_trade_market_data_in_db
+from utils.enums import TradeTimeWindow
+
+NUMBER_OF_DAYS = 120
+
+
+def make_daily_bars(symbols=("AAPL", "MSFT", "TSLA"), number_of_days=NUMBER_OF_DAYS):
+    random = np.random.default_rng(7)
+    frames = []
+    for offset, symbol in enumerate(symbols):
+        # Symbols start on different days so the fold sees ragged histories
+        days = number_of_days - 5 * offset
+        close = 100 + np.cumsum(random.normal(0, 1, days))
+        frames.append(pd.DataFrame({
+            "symbol": symbol,
+            "open_date": 1_700_000_000 + 86_400 * np.arange(5 * offset, number_of_days),
+            "open": close + random.normal(0, 0.5, days),
+            "high": close + 2,
+            "low": close - 2,
+            "close": close,
+            "volume": random.integers(1_000, 100_000, days)
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def seeded_average(values, period, alpha):
+    """ Textbook seeding: the simple average of the first `period` values,
+    then exponential smoothing, computed one value at a time """
+    averages = [np.nan] * len(values)
+    if len(values) < period:
+        return averages
+    average = sum(values[:period]) / period
+    averages[period - 1] = average
+    for index in range(period, len(values)):
+        average += alpha * (values[index] - average)
+        averages[index] = average
+    return averages
+
+
+def reference_values(indicator, bars):
+    """ Full recomputation of an indicator with pandas and plain loops """
+    close, high, low = bars["close"], bars["high"], bars["low"]
+    period = indicator.period
+    if isinstance(indicator, SMA):
+        return close.rolling(period).mean()
+    if isinstance(indicator, EMA):
+        return pd.Series(seeded_average(close.tolist(), period, 2 / (period + 1)))
+    if isinstance(indicator, RSI):
+        delta = close.diff().iloc[1:]
+        average_gain = np.array(seeded_average(delta.clip(lower=0).tolist(),
+                                               period, 1 / period))
+        average_loss = np.array(seeded_average((-delta).clip(lower=0).tolist(),
+                                               period, 1 / period))
+        rsi = 100 - 100 / (1 + average_gain / average_loss)
+        return pd.Series([np.nan] + rsi.tolist())
+    if isinstance(indicator, ATR):
+        previous_close = close.shift()
+        true_range = pd.concat([high - low, (high - previous_close).abs(),
+                                (low - previous_close).abs()], axis=1).max(axis=1)
+        return pd.Series(seeded_average(true_range.tolist(), period, 1 / period))
+    typical_price = (high + low + close) / 3
+    return ((typical_price * bars["volume"]).rolling(period).sum()
+            / bars["volume"].rolling(period).sum())
+
+
+def as_series(values):
+    return values.set_index(["symbol", "open_date"])["value"].sort_index()
+
+
+@pytest.mark.parametrize("indicator", [SMA(), EMA(), RSI(), ATR(), VWAP()],
+                         ids=lambda indicator: indicator.name)
+def test_fold_matches_full_recomputation(indicator):
+    """Test a single fold over the history matches pandas."""
+
+    data = make_daily_bars()
+    values, _ = fold_indicator(indicator, data.sample(frac=1, random_state=3))
+
+    expected = pd.concat(
+        [pd.DataFrame({"symbol": symbol, "open_date": bars["open_date"],
+                       "value": reference_values(indicator, bars.reset_index(drop=True))
+                       .to_numpy()})
+         for symbol, bars in data.groupby("symbol")]).dropna()
+    pd.testing.assert_series_equal(as_series(values), as_series(expected),
+                                   check_exact=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize("indicator", [SMA(), EMA(), RSI(), ATR(), VWAP()],
+                         ids=lambda indicator: indicator.name)
+def test_daily_folds_match_single_fold(indicator):
+    """Test folding one day at a time from the state gives the same values."""
+
+    data = make_daily_bars()
+    full_values, full_states = fold_indicator(indicator, data)
+
+    states = None
+    daily_values = []
+    for _, day in data.groupby("open_date"):
+        values, states = fold_indicator(indicator, day, states)
+        daily_values.append(values)
+
+    pd.testing.assert_series_equal(as_series(pd.concat(daily_values)),
+                                   as_series(full_values), check_exact=False,
+                                   rtol=1e-9)
+    np.testing.assert_allclose(states.values, full_states.values, rtol=1e-9)
+
+
+def test_engine_bootstraps_then_folds_only_new_bars(sqlite_engine):
+    """Test the engine persists state and only folds bars it has not seen."""
+
+    data = make_daily_bars()
+    last_day = data["open_date"].max()
+    history, new_bars = data[data["open_date"] < last_day], data[data["open_date"] == last_day]
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(history, TradeTimeWindow.DAILY))
+    engine = IndicatorEngine()
+
+    bootstrap_values = engine.update(history[history["open_date"] == history["open_date"].max()])
+    new_values = engine.update(new_bars)
+    repeated_values = engine.update(new_bars)
+
+    # Bars at the last open date are revisions, folded again from a checkpoint
+    pd.testing.assert_frame_equal(repeated_values, new_values)
+    assert (new_values["open_date"] == last_day).all()
+    assert new_values.shape[0] == 3 * len(engine.indicators)
+    for indicator in engine.indicators:
+        expected, _ = fold_indicator(indicator, data)
+        expected = expected[expected["open_date"] == last_day]
+        pd.testing.assert_series_equal(
+            as_series(new_values[new_values["indicator"] == indicator.name]),
+            as_series(expected), check_exact=False, rtol=1e-5)
+    assert bootstrap_values["open_date"].nunique() > 1
+    states = get_indicator_states(["AAPL", "MSFT", "TSLA"], TradeTimeWindow.DAILY)
+    assert (states["last_open_date"] == last_day).all()
+    assert states.shape[0] == 3 * len(engine.indicators)
+
+
+def test_wilder_smoothing_starts_from_the_simple_average():
+    """Test RSI and ATR equal the plain average of their first period."""
+
+    closes = [44.34, 44.09, 44.15, 43.61, 44.33, 44.83, 45.10, 45.42, 45.84,
+              46.08, 45.89, 46.03, 45.61, 46.28, 46.28, 46.00]
+    bars = pd.DataFrame({"symbol": "AAPL",
+                         "open_date": 1_700_000_000 + 86_400 * np.arange(len(closes)),
+                         "high": np.array(closes) + 0.5, "low": np.array(closes) - 0.5,
+                         "close": closes, "volume": 1_000})
+
+    rsi, _ = fold_indicator(RSI(14), bars)
+    atr, _ = fold_indicator(ATR(3), bars.iloc[:3])
+
+    deltas = np.diff(closes[:15])
+    average_gain = deltas.clip(min=0).mean()
+    average_loss = (-deltas).clip(min=0).mean()
+    assert rsi["value"].iloc[0] == pytest.approx(100 - 100 / (1 + average_gain / average_loss))
+    assert rsi["value"].iloc[0] == pytest.approx(70.46, abs=0.01)
+    assert atr["value"].tolist() == pytest.approx([1.0])
+
+
+def test_engine_recomputes_symbols_given_older_bars(sqlite_engine):
+    """Test a bar filled in behind the states recomputes its symbol only."""
+
+    data = make_daily_bars()
+    filled_in = (data["symbol"] == "AAPL") & (
+        data["open_date"] == data["open_date"].iloc[60])
+    history = data[~filled_in]
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(history, TradeTimeWindow.DAILY))
+    engine = IndicatorEngine()
+    engine.update(history[history["open_date"] == history["open_date"].max()])
+
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(data[filled_in],
+                                                       TradeTimeWindow.DAILY))
+    values = engine.update(data[filled_in])
+
+    assert set(values["symbol"]) == {"AAPL"}
+    states = get_indicator_states(["AAPL"], TradeTimeWindow.DAILY)
+    for indicator in engine.indicators:
+        expected, _ = fold_indicator(indicator, data[data["symbol"] == "AAPL"])
+        pd.testing.assert_series_equal(
+            as_series(values[values["indicator"] == indicator.name]),
+            as_series(expected), check_exact=False, rtol=1e-5)
+        state = states[states["indicator"] == indicator.name]
+        assert state["last_open_date"].iloc[0] == data["open_date"].max()
+
+
+def test_engine_refolds_a_revised_latest_bar(sqlite_engine):
+    """Test a revision of the last folded bar replaces its indicator value."""
+
+    bars = pd.DataFrame({"symbol": "AAPL",
+                         "open_date": 1_700_000_000 + 86_400 * np.arange(3),
+                         "open": 1.0, "high": 60.0, "low": 1.0,
+                         "close": [3.0, 4.0, 5.0], "volume": 1_000})
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(bars, TradeTimeWindow.DAILY))
+    engine = IndicatorEngine(indicators=[SMA(3)])
+    assert engine.update(bars)["value"].tolist() == [4.0]
+
+    revised = bars.iloc[2:].assign(close=50.0)
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(revised, TradeTimeWindow.DAILY))
+    values = engine.update(revised)
+
+    assert values["value"].tolist() == [19.0]
+    assert values["open_date"].tolist() == [bars["open_date"].iloc[2]]
+    states = get_indicator_states(["AAPL"], TradeTimeWindow.DAILY)
+    assert states["last_open_date"].tolist() == [bars["open_date"].iloc[2]]
+
+
+def test_engine_refolds_revised_bars_from_their_checkpoint(sqlite_engine):
+    """Test recent revisions read only the bars since the checkpoint before them."""
+
+    data = make_daily_bars()
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(data, TradeTimeWindow.DAILY))
+    engine = IndicatorEngine()
+    engine.update(data)
+    open_dates = np.sort(data["open_date"].unique())
+    revised = data[data["open_date"] >= open_dates[-3]].assign(
+        close=lambda bars: bars["close"] + 1)
+    revised_data = pd.concat([data[data["open_date"] < open_dates[-3]], revised])
+    save_trade_market_data_in_db(OHLCVBatch.from_frame(revised, TradeTimeWindow.DAILY))
+
+    with patch("indicators.indicator_engine.get_ohlcv_bars",
+               wraps=get_ohlcv_bars) as read_bars:
+        values = engine.update(revised[revised["open_date"] == open_dates[-3]])
+
+    assert [call.kwargs["start_open_date"] for call in read_bars.call_args_list] == [
+        open_dates[-4] + 1]
+    assert set(values["open_date"]) == set(open_dates[-3:])
+    for indicator in engine.indicators:
+        expected, _ = fold_indicator(indicator, revised_data)
+        expected = expected[expected["open_date"] >= open_dates[-3]]
+        pd.testing.assert_series_equal(
+            as_series(values[values["indicator"] == indicator.name]),
+            as_series(expected), check_exact=False, rtol=1e-5)
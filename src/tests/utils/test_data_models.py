@@ -0,0 +1,50 @@
+import numpy as np
+from pandas import DataFrame
+
+from utils.data_models import OHLCVBatch
+from utils.enums import TradeTimeWindow
+
+MOCK_FRAME = DataFrame({
+    "symbol": ["AAPL", "AAPL", "GOOG"],
+    "open_date": [1_700_000_000, 1_700_086_400, 1_700_000_000],
+    "open": [1.0, 2.0, 3.0],
+    "high": [1.5, 2.5, 3.5],
+    "low": [0.5, 1.5, 2.5],
+    "close": [1.2, 2.2, 3.2],
+    "volume": [100.0, 200.0, 300.0],
+})
+
+
+def test_batch_from_frame_is_columnar():
+    """Test a batch stores each symbol once and keeps numeric columns."""
+
+    batch = OHLCVBatch.from_frame(MOCK_FRAME, time_window=TradeTimeWindow.DAILY)
+
+    assert len(batch) == 3
+    assert batch.symbols.tolist() == ["AAPL", "GOOG"]
+    assert batch.symbol_codes.tolist() == [0, 0, 1]
+    assert batch.volume.dtype == np.int64
+    assert batch.nbytes > 0
+    assert batch.to_frame()["symbol"].tolist() == ["AAPL", "AAPL", "GOOG"]
+
+
+def test_batch_parameter_chunks():
+    """Test parameter rows are produced in chunks with DB column names."""
+
+    batch = OHLCVBatch.from_frame(MOCK_FRAME, time_window=TradeTimeWindow.DAILY)
+    chunks = list(batch.iter_parameter_chunks(chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[1][0] == {"symbol": "GOOG", "time_window": "1d", "open": 3.0,
+                            "high": 3.5, "low": 2.5, "close": 3.2,
+                            "volume": 300, "open_date": 1_700_000_000}
+
+
+def test_empty_batch():
+    """Test an empty frame gives an empty batch."""
+
+    batch = OHLCVBatch.from_frame(MOCK_FRAME.iloc[0:0],
+                                  time_window=TradeTimeWindow.DAILY)
+
+    assert len(batch) == 0
+    assert list(batch.iter_parameter_chunks(chunk_size=10)) == []
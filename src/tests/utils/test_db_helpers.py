@@ -0,0 +1,291 @@
+import datetime as dt
+import time
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from utils import db_helpers
+from utils.db_helpers import dispose_mysql_connection, \
+    get_all_traded_objects_from_db, get_connection_pool_stats, \
+    get_mysql_connection, save_new_traded_objects_in_db, \
+    save_trade_market_data_in_db, bulk_load_trade_market_data, \
+    get_ingestion_watermarks, get_market_trade_data, apply_traded_objects_delta, \
+    append_intraday_bars, get_intraday_bars, create_intraday_partitions, \
+    drop_intraday_partitions
+from utils.data_models import OHLCVBatch
+from utils.data_models import TradedObject
+from utils.enums import TradedObjectType, TradeTimeWindow, OHLCVWriteMode, \
+    YFinanceIntervals
+
+
+def read_ohlcv_table():
+    with get_mysql_connection().connect() as connection:
+        return pd.read_sql(text("SELECT * FROM ohlcv_table"), connection)
+
+
+def test_engine_is_shared_between_helpers(sqlite_engine):
+    """Test every helper reuses one engine and its pooled connection."""
+
+    save_new_traded_objects_in_db({TradedObject(
+        name="Apple Inc.", symbol="AAPL", exchange="NASDAQ",
+        exchange_short_name="NASDAQ", object_type=TradedObjectType.STOCK)})
+
+    for _ in range(5):
+        traded_objects = get_all_traded_objects_from_db()
+
+    assert {traded_object.symbol for traded_object in traded_objects} == {"AAPL"}
+    assert get_mysql_connection() is sqlite_engine
+
+    stats = get_connection_pool_stats()
+    assert stats.engines_created == 1
+    assert stats.connections_opened == 1
+    assert stats.checkouts == 7
+    assert stats.total_wait_time_seconds >= stats.max_wait_time_seconds >= 0
+
+
+def test_dispose_releases_engine(sqlite_engine):
+    """Test disposing the engine forces a new one on next use."""
+
+    dispose_mysql_connection()
+    assert db_helpers._engine is None
+
+    get_all_traded_objects_from_db()
+
+    assert get_mysql_connection() is not sqlite_engine
+    assert get_connection_pool_stats().engines_created == 2
+
+
+def test_save_trade_market_data_upserts(sqlite_engine, make_ohlcv_batch):
+    """Test the executemany path inserts and then updates rows."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(3, 4), chunk_size=5)
+    save_trade_market_data_in_db(make_ohlcv_batch(3, 4, close=2.0), chunk_size=5)
+
+    stored = read_ohlcv_table()
+    assert stored.shape[0] == 12
+    assert (stored["close"] == 2.0).all()
+
+
+@pytest.mark.parametrize("transaction_rows", [7, 1000])
+def test_bulk_load_merges_through_staging_table(sqlite_engine, make_ohlcv_batch,
+                                                transaction_rows):
+    """Test the staging table loader upserts every row in chunks."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(2, 5))
+
+    report = bulk_load_trade_market_data(
+        make_ohlcv_batch(5, 5, close=3.0),
+        write_mode=OHLCVWriteMode.STAGING_TABLE,
+        chunk_size=3,
+        transaction_rows=transaction_rows)
+
+    stored = read_ohlcv_table()
+    assert stored.shape[0] == 25
+    assert (stored["close"] == 3.0).all()
+    assert report.rows == 25
+    assert report.transactions == -(-25 // max(transaction_rows, 3))
+    assert report.rows_per_second > 0
+
+
+def test_bulk_load_data_infile_requires_mysql(sqlite_engine, make_ohlcv_batch):
+    """Test LOAD DATA LOCAL INFILE is rejected on other databases."""
+
+    with pytest.raises(ValueError, match="only supported on MySQL"):
+        bulk_load_trade_market_data(make_ohlcv_batch(1, 1),
+                                    write_mode=OHLCVWriteMode.LOAD_DATA_INFILE)
+
+
+def test_watermarks_follow_writes(sqlite_engine, make_ohlcv_batch):
+    """Test both write paths keep the latest open_date per symbol."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(2, 5))
+    bulk_load_trade_market_data(make_ohlcv_batch(3, 2))
+
+    watermarks = get_ingestion_watermarks(["SYM0", "SYM1", "SYM2", "SYM3"],
+                                          time_window=TradeTimeWindow.DAILY)
+
+    assert watermarks == {"SYM0": 1_700_000_000 + 4 * 86_400,
+                          "SYM1": 1_700_000_000 + 4 * 86_400,
+                          "SYM2": 1_700_000_000 + 86_400}
+    assert get_ingestion_watermarks(["SYM0"], TradeTimeWindow.WEEKLY) == {}
+
+
+def test_upsert_clauses_of_both_dialects():
+    """Test one builder renders the upserts of SQLite and MySQL alike."""
+
+    sqlite_clause = db_helpers._on_conflict_update(
+        "sqlite", ["symbol", "time_window"], ["close"],
+        greatest_columns=["last_open_date"])
+    mysql_clause = db_helpers._on_conflict_update(
+        "mysql", ["symbol", "time_window"], ["close"],
+        greatest_columns=["last_open_date"])
+
+    assert sqlite_clause.strip() == (
+        "ON CONFLICT (symbol, time_window) DO UPDATE SET close = excluded.close, "
+        "last_open_date = MAX(last_open_date, excluded.last_open_date)")
+    assert mysql_clause.strip() == (
+        "ON DUPLICATE KEY UPDATE close = VALUES(close), "
+        "last_open_date = GREATEST(last_open_date, VALUES(last_open_date))")
+
+
+def test_intraday_partitions_are_planned_by_day_or_by_month():
+    """Test new partitions continue the existing ones at either granularity."""
+
+    def utc(year, month, day):
+        return int(dt.datetime(year, month, day, tzinfo=dt.timezone.utc).timestamp())
+
+    daily = db_helpers._plan_intraday_partitions(
+        {}, utc(2024, 2, 28) + 600, utc(2024, 3, 1) + 600, by_month=False)
+    monthly = db_helpers._plan_intraday_partitions(
+        {}, utc(2023, 11, 20), utc(2024, 2, 3), by_month=True)
+    # A table split by day so far continues by month from its last bound
+    after_daily = db_helpers._plan_intraday_partitions(
+        {"p20240114": utc(2024, 1, 15)}, utc(2023, 1, 1), utc(2024, 2, 3),
+        by_month=True)
+
+    assert daily == [("p20240228", utc(2024, 2, 29)), ("p20240229", utc(2024, 3, 1)),
+                     ("p20240301", utc(2024, 3, 2))]
+    assert monthly == [("p202311", utc(2023, 12, 1)), ("p202312", utc(2024, 1, 1)),
+                       ("p202401", utc(2024, 2, 1)), ("p202402", utc(2024, 3, 1))]
+    assert after_daily == [("p202401", utc(2024, 2, 1)), ("p202402", utc(2024, 3, 1))]
+
+
+def test_market_trade_data_query_is_parameterised(sqlite_engine, make_ohlcv_batch):
+    """Test symbols are bound as parameters instead of pasted into the SQL."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(1, 1, first_open_date=int(time.time())))
+
+    data = get_market_trade_data(["SYM0", "O'REILLY"], YFinanceIntervals.ONE_MONTH,
+                                 TradeTimeWindow.DAILY)
+
+    assert data["symbol"].tolist() == ["SYM0"]
+
+
+def test_traded_objects_delta_upserts_and_soft_deletes(sqlite_engine):
+    """Test renamed objects are updated and removed ones hidden until relisted."""
+
+    apple = TradedObject(name="Apple", symbol="AAPL", exchange="NASDAQ",
+                         exchange_short_name="NASDAQ", object_type=TradedObjectType.STOCK)
+    google = TradedObject(name="Google", symbol="GOOG", exchange="NASDAQ",
+                          exchange_short_name="NASDAQ", object_type=TradedObjectType.STOCK)
+    save_new_traded_objects_in_db({apple, google})
+
+    alphabet = TradedObject(name="Alphabet", symbol="GOOG", exchange="NASDAQ",
+                            exchange_short_name="NASDAQ",
+                            object_type=TradedObjectType.STOCK)
+    apply_traded_objects_delta(upserted={alphabet}, removed={apple}, delisted_at=1)
+    listed = get_all_traded_objects_from_db()
+    apply_traded_objects_delta(upserted={apple}, removed=set(), delisted_at=2)
+
+    assert [(o.symbol, o.name) for o in listed] == [("GOOG", "Alphabet")]
+    assert {o.symbol for o in get_all_traded_objects_from_db()} == {"AAPL", "GOOG"}
+
+
+def intraday_batch(symbols, first_open_date, number_of_bars, close=1.0,
+                   time_window=TradeTimeWindow.FIVE_MINUTES):
+    seconds = time_window.value.time_in_seconds
+    data = pd.DataFrame({
+        "symbol": [symbol for symbol in symbols for _ in range(number_of_bars)],
+        "open_date": [first_open_date + seconds * bar for _ in symbols
+                      for bar in range(number_of_bars)],
+    })
+    for column in ("open", "high", "low", "close"):
+        data[column] = close
+    data["volume"] = 100
+    return OHLCVBatch.from_frame(data, time_window=time_window)
+
+
+def test_intraday_bars_are_appended_once(sqlite_engine):
+    """Test intraday bars go to their own table and are never overwritten."""
+
+    append_intraday_bars(intraday_batch(["SYM0", "SYM1"], 1_700_000_000, 12))
+    append_intraday_bars(intraday_batch(["SYM0"], 1_700_000_000 + 300 * 10, 4,
+                                        close=2.0))
+
+    data = get_intraday_bars(["SYM0", "SYM1"], TradeTimeWindow.FIVE_MINUTES)
+    sym0 = data[data["symbol"] == "SYM0"].sort_values("open_date")
+    assert len(data) == 26
+    assert sym0["close"].tolist() == [1.0] * 12 + [2.0] * 2
+    assert set(data["time_window"]) == {"5m"}
+    assert len(read_ohlcv_table()) == 0
+    assert get_ingestion_watermarks(["SYM0", "SYM1"], TradeTimeWindow.FIVE_MINUTES) == {
+        "SYM0": 1_700_000_000 + 300 * 13, "SYM1": 1_700_000_000 + 300 * 11}
+
+
+def test_intraday_retention_without_partitions_deletes_whole_days(sqlite_engine):
+    """Test retention on an unpartitioned table removes the days before the cutoff."""
+
+    day = 86_400
+    first_day = 1_699_920_000
+    append_intraday_bars(intraday_batch(["SYM0"], first_day, 3 * 24,
+                                        time_window=TradeTimeWindow.ONE_HOUR))
+
+    dropped = drop_intraday_partitions(TradeTimeWindow.ONE_HOUR,
+                                       before_open_date=first_day + day + 3600)
+
+    data = get_intraday_bars(["SYM0"], TradeTimeWindow.ONE_HOUR)
+    assert dropped == []
+    assert data["open_date"].min() == first_day + day
+    assert len(data) == 2 * 24
+
+
+def test_daily_table_is_not_an_intraday_table(sqlite_engine):
+    """Test daily bars cannot be appended to an intraday table."""
+
+    with pytest.raises(ValueError):
+        append_intraday_bars(intraday_batch(["SYM0"], 1_700_000_000, 1,
+                                            time_window=TradeTimeWindow.DAILY))
+
+
+def mock_mysql_connection(partition_bounds):
+    connection = MagicMock()
+    connection.dialect.name = "mysql"
+    connection.execute.return_value.fetchall.return_value = [
+        (name, str(upper_bound)) for name, upper_bound in partition_bounds.items()]
+
+    @contextmanager
+    def connect():
+        yield connection
+
+    return connection, connect
+
+
+def test_partitions_are_split_off_the_catch_all_partition():
+    """Test daily partitions are added after the last one up to the given day."""
+
+    day = 86_400
+    first_day = 1_699_920_000
+    connection, connect = mock_mysql_connection({
+        "p20231114": first_day + day, "p_future": "MAXVALUE"})
+
+    with patch("utils.db_helpers._connect", connect):
+        created = create_intraday_partitions(
+            TradeTimeWindow.ONE_MINUTE, from_open_date=0,
+            until_open_date=first_day + 2 * day + 10)
+
+    ddl = str(connection.execute.call_args_list[-1].args[0])
+    assert created == ["p20231115", "p20231116"]
+    assert "ALTER TABLE ohlcv_1m REORGANIZE PARTITION p_future INTO" in ddl
+    assert f"PARTITION p20231116 VALUES LESS THAN ({first_day + 3 * day})" in ddl
+    assert ddl.rstrip().endswith("PARTITION p_future VALUES LESS THAN MAXVALUE\n    )")
+
+
+def test_expired_partitions_are_dropped():
+    """Test only days that ended by the cutoff are dropped."""
+
+    day = 86_400
+    first_day = 1_699_920_000
+    connection, connect = mock_mysql_connection({
+        "p20231114": first_day + day, "p20231115": first_day + 2 * day,
+        "p20231116": first_day + 3 * day})
+
+    with patch("utils.db_helpers._connect", connect):
+        dropped = drop_intraday_partitions(TradeTimeWindow.ONE_MINUTE,
+                                           before_open_date=first_day + 2 * day + 10)
+
+    assert dropped == ["p20231114", "p20231115"]
+    assert (str(connection.execute.call_args_list[-1].args[0])
+            == "ALTER TABLE ohlcv_1m DROP PARTITION p20231114, p20231115")
@@ -0,0 +1,57 @@
+import datetime as dt
+
+from utils.market_calendar import MarketCalendar
+
+
+def new_york_timestamp(year, month, day, hour, minute=0):
+    return dt.datetime(year, month, day, hour, minute,
+                       tzinfo=MarketCalendar().timezone).timestamp()
+
+
+def test_holidays_follow_the_exchange_rules():
+    """Test the holidays of a year match the published NYSE calendar."""
+
+    calendar = MarketCalendar()
+
+    assert sorted(calendar.holidays(2024)) == [
+        dt.date(2024, 1, 1), dt.date(2024, 1, 15), dt.date(2024, 2, 19),
+        dt.date(2024, 3, 29), dt.date(2024, 5, 27), dt.date(2024, 6, 19),
+        dt.date(2024, 7, 4), dt.date(2024, 9, 2), dt.date(2024, 11, 28),
+        dt.date(2024, 12, 25)]
+    # Observed on the Monday, but a Saturday New Year's Day is not observed
+    assert dt.date(2022, 6, 20) in calendar.holidays(2022)
+    assert dt.date(2022, 12, 26) in calendar.holidays(2022)
+    assert calendar.is_trading_day(dt.date(2021, 12, 31))
+    assert not calendar.is_trading_day(dt.date(2025, 1, 9))
+    assert not calendar.is_trading_day(dt.date(2024, 6, 15))
+
+
+def test_sessions_have_regular_and_early_closes():
+    """Test session hours are in New York time, with 13:00 early closes."""
+
+    calendar = MarketCalendar()
+
+    sessions = calendar.sessions(dt.date(2024, 11, 27), dt.date(2024, 12, 2))
+
+    assert [session.date for session in sessions] == [
+        dt.date(2024, 11, 27), dt.date(2024, 11, 29), dt.date(2024, 12, 2)]
+    assert sessions[0].open_date == new_york_timestamp(2024, 11, 27, 9, 30)
+    assert sessions[0].close_date == new_york_timestamp(2024, 11, 27, 16)
+    assert sessions[1].is_early_close
+    assert sessions[1].close_date == new_york_timestamp(2024, 11, 29, 13)
+    assert calendar.is_early_close(dt.date(2024, 12, 24))
+    assert not calendar.is_early_close(dt.date(2027, 12, 24))
+
+
+def test_next_session_skips_closed_days():
+    """Test the next session after a close is the next trading day's."""
+
+    calendar = MarketCalendar()
+
+    during = calendar.next_session(new_york_timestamp(2024, 3, 28, 12))
+    after_close = calendar.next_session(new_york_timestamp(2024, 3, 28, 16))
+
+    assert during.date == dt.date(2024, 3, 28)
+    assert after_close.date == dt.date(2024, 4, 1)
+    assert calendar.is_open(new_york_timestamp(2024, 3, 28, 12))
+    assert not calendar.is_open(new_york_timestamp(2024, 3, 29, 12))
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.data_models import OHLCVBatch, OHLCVPanel
+from utils.db_helpers import append_intraday_bars, save_trade_market_data_in_db
+from utils.enums import TradeTimeWindow
+from utils.ohlcv_panels import OHLCVPanelReader
+
+FIRST_OPEN_DATE = 1_700_000_000
+
+
+@pytest.fixture
+def panel_reader(sqlite_engine):
+    """Fixture returning a panel reader detached from writes after the test."""
+    reader = OHLCVPanelReader()
+    yield reader
+    reader.close()
+
+
+def test_panel_aligns_bars_on_date_symbol_grid():
+    """Test bars are scattered into a grid with a mask of missing bars."""
+
+    data = pd.DataFrame({
+        "symbol": ["MSFT", "AAPL", "AAPL", "OTHER"],
+        "open_date": [20, 10, 20, 10],
+        "open": 1.0, "high": 2.0, "low": 0.5,
+        "close": [3.0, 1.0, 2.0, 9.0],
+        "volume": [30, 10, 20, 90]
+    })
+
+    panel = OHLCVPanel.from_frame(data, symbols=["AAPL", "MSFT", "NVDA"],
+                                  time_window=TradeTimeWindow.DAILY)
+
+    assert panel.shape == (2, 3)
+    assert panel.open_dates.tolist() == [10, 20]
+    np.testing.assert_array_equal(panel.close, [[1.0, np.nan, np.nan],
+                                                [2.0, 3.0, np.nan]])
+    assert panel.volume.tolist() == [[10, 0, 0], [20, 30, 0]]
+    assert panel.missing.tolist() == [[False, True, True], [False, False, True]]
+    assert panel.column_of("MSFT") == 1
+
+
+def test_reader_serves_repeated_reads_from_cache(panel_reader, make_ohlcv_batch):
+    """Test a second read of the same key does not query the database."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(3, 5))
+
+    first = panel_reader.read_panel(["SYM0", "SYM1", "SYM2"], TradeTimeWindow.DAILY)
+    second = panel_reader.read_panel(["SYM0", "SYM1", "SYM2"], TradeTimeWindow.DAILY)
+
+    assert second is first
+    assert first.shape == (5, 3)
+    assert panel_reader.stats.hits == 1
+    assert panel_reader.stats.misses == 1
+    with pytest.raises(ValueError):
+        first.close[0, 0] = 0.0
+
+
+def test_writes_invalidate_overlapping_panels(panel_reader, make_ohlcv_batch):
+    """Test a write drops cached panels it touches and keeps the others."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(3, 5))
+    panel_reader.read_panel(["SYM0"], TradeTimeWindow.DAILY)
+    panel_reader.read_panel(["SYM2"], TradeTimeWindow.DAILY)
+    panel_reader.read_panel(["SYM0"], TradeTimeWindow.DAILY,
+                            end_open_date=FIRST_OPEN_DATE + 86_400)
+
+    save_trade_market_data_in_db(make_ohlcv_batch(
+        2, 1, close=5.0, first_open_date=FIRST_OPEN_DATE + 4 * 86_400))
+    panel = panel_reader.read_panel(["SYM0"], TradeTimeWindow.DAILY)
+
+    assert panel_reader.stats.invalidations == 1
+    assert panel.close[-1, 0] == 5.0
+    panel_reader.read_panel(["SYM2"], TradeTimeWindow.DAILY)
+    assert panel_reader.stats.hits == 1
+
+
+def test_intraday_panels_are_read_from_their_table(panel_reader, make_ohlcv_batch):
+    """Test hourly panels come from the intraday table and follow its appends."""
+
+    def hourly_batch(number_of_bars, first_open_date=FIRST_OPEN_DATE):
+        data = make_ohlcv_batch(2, number_of_bars,
+                                first_open_date=first_open_date).to_frame()
+        data["open_date"] = first_open_date + 3_600 * (
+            (data["open_date"] - first_open_date) // 86_400)
+        return OHLCVBatch.from_frame(data, TradeTimeWindow.ONE_HOUR)
+
+    append_intraday_bars(hourly_batch(4))
+    panel = panel_reader.read_panel(["SYM0", "SYM1"], TradeTimeWindow.ONE_HOUR)
+    append_intraday_bars(hourly_batch(1, first_open_date=FIRST_OPEN_DATE + 4 * 3_600))
+
+    assert panel.shape == (4, 2)
+    assert np.diff(panel.open_dates).tolist() == [3_600] * 3
+    assert panel_reader.stats.invalidations == 1
+    assert panel_reader.read_panel(["SYM0", "SYM1"],
+                                   TradeTimeWindow.ONE_HOUR).shape == (5, 2)
+    assert panel_reader.read_panel(["SYM0"], TradeTimeWindow.DAILY).shape[0] == 0
+
+
+def test_cache_evicts_least_recently_used_panels(sqlite_engine, make_ohlcv_batch):
+    """Test the cache stays within its byte budget."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(4, 10))
+    panel_size = OHLCVPanelReader().read_panel(["SYM0"], TradeTimeWindow.DAILY).nbytes
+    reader = OHLCVPanelReader(max_cache_bytes=2 * panel_size)
+
+    for symbol in ["SYM0", "SYM1", "SYM0", "SYM2"]:
+        reader.read_panel([symbol], TradeTimeWindow.DAILY)
+    reader.read_panel(["SYM0"], TradeTimeWindow.DAILY)
+    reader.close()
+
+    assert reader.stats.evictions == 1
+    assert reader.stats.hits == 2
+    assert reader.stats.cached_bytes == 0
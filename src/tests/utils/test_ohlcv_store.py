@@ -0,0 +1,140 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from utils.db_helpers import get_ohlcv_bars, save_trade_market_data_in_db
+from utils.enums import TradeTimeWindow
+from utils.ohlcv_store import OHLCVStore, MAX_PARTS_PER_BUCKET, symbol_bucket
+
+NUMBER_OF_BUCKETS = 4
+
+
+@pytest.fixture
+def ohlcv_store(tmp_path):
+    """Fixture to initialize an empty OHLCVStore."""
+    return OHLCVStore(root_path=str(tmp_path / "ohlcv_store"),
+                      number_of_buckets=NUMBER_OF_BUCKETS)
+
+
+def test_symbol_bucket_is_stable():
+    """Test symbols map to a fixed bucket, independent of hash seeding."""
+
+    assert symbol_bucket("AAPL", 64) == 28
+
+
+def test_write_and_read(ohlcv_store, make_ohlcv_batch):
+    """Test written bars are read back and filtered by symbol and dates."""
+
+    ohlcv_store.write(make_ohlcv_batch(6, 10))
+
+    data = ohlcv_store.read(["SYM1", "SYM4"], TradeTimeWindow.DAILY,
+                            start_open_date=1_700_000_000 + 86_400 * 5)
+
+    assert sorted(data["symbol"].unique()) == ["SYM1", "SYM4"]
+    assert data.shape[0] == 10
+    assert (data["time_window"] == "1d").all()
+    assert ohlcv_store.read(["SYM1"], TradeTimeWindow.WEEKLY).shape[0] == 0
+
+
+def test_later_writes_win_and_compaction(ohlcv_store, make_ohlcv_batch):
+    """Test rewritten bars keep the last version, also after compaction."""
+
+    for close in range(MAX_PARTS_PER_BUCKET + 2):
+        ohlcv_store.write(make_ohlcv_batch(1, 3, close=float(close)))
+
+    parts = ohlcv_store._list_parts(TradeTimeWindow.DAILY,
+                                    symbol_bucket("SYM0", NUMBER_OF_BUCKETS))
+    data = ohlcv_store.read(["SYM0"], TradeTimeWindow.DAILY)
+
+    assert len(parts) <= MAX_PARTS_PER_BUCKET
+    assert data.shape[0] == 3
+    assert (data["close"] == MAX_PARTS_PER_BUCKET + 1).all()
+
+
+def test_read_through_loads_uncovered_symbols(sqlite_engine, ohlcv_store,
+                                              make_ohlcv_batch):
+    """Test symbols the store does not cover are read from the database once."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(2, 3, close=2.0))
+    # Bars written by a collector do not make a symbol covered
+    ohlcv_store.write(make_ohlcv_batch(1, 3))
+
+    with patch('utils.ohlcv_store.get_ohlcv_bars', wraps=get_ohlcv_bars) as mock_read:
+        first = ohlcv_store.read_through(["SYM0", "SYM1"], TradeTimeWindow.DAILY)
+        second = ohlcv_store.read_through(["SYM0", "SYM1"], TradeTimeWindow.DAILY)
+
+    assert mock_read.call_count == 1
+    assert mock_read.call_args.kwargs["symbols"] == ["SYM0", "SYM1"]
+    assert first.shape[0] == second.shape[0] == 6
+    assert first["close"].tolist() == second["close"].tolist() == [2.0] * 6
+
+
+def test_read_through_reloads_history_before_the_coverage(sqlite_engine, ohlcv_store,
+                                                          make_ohlcv_batch):
+    """Test a read starting before a symbol's coverage goes to the database."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(1, 10))
+    recent = 1_700_000_000 + 86_400 * 5
+
+    with patch('utils.ohlcv_store.get_ohlcv_bars', wraps=get_ohlcv_bars) as mock_read:
+        ohlcv_store.read_through(["SYM0"], TradeTimeWindow.DAILY,
+                                 start_open_date=recent)
+        within = ohlcv_store.read_through(["SYM0"], TradeTimeWindow.DAILY,
+                                          start_open_date=recent + 86_400,
+                                          end_open_date=recent + 86_400 * 2)
+        assert mock_read.call_count == 1
+        full = ohlcv_store.read_through(["SYM0"], TradeTimeWindow.DAILY)
+
+    assert mock_read.call_count == 2
+    assert within.shape[0] == 2
+    assert full.shape[0] == 10
+    assert ohlcv_store.coverage(TradeTimeWindow.DAILY) == {"SYM0": 0}
+
+
+def test_sync_and_verify_against_database(sqlite_engine, ohlcv_store,
+                                          make_ohlcv_batch):
+    """Test sync copies the database and verify reports differences."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(5, 4))
+    ohlcv_store.write(make_ohlcv_batch(7, 2))
+
+    verification = ohlcv_store.verify(TradeTimeWindow.DAILY)
+    assert not verification.is_consistent
+    assert verification.extra_symbols == ["SYM5", "SYM6"]
+    assert len(verification.mismatched_symbols) == 5
+
+    ohlcv_store.sync(TradeTimeWindow.DAILY)
+
+    assert ohlcv_store.verify(TradeTimeWindow.DAILY).is_consistent
+    assert ohlcv_store.coverage(TradeTimeWindow.DAILY) == {
+        f"SYM{index}": 0 for index in range(5)}
+
+
+def test_sync_keeps_writes_made_while_it_runs(sqlite_engine, ohlcv_store,
+                                              make_ohlcv_batch):
+    """Test a bucket written during a sync keeps that write."""
+
+    save_trade_market_data_in_db(make_ohlcv_batch(1, 3))
+    later_batch = make_ohlcv_batch(1, 3, close=5.0,
+                                   first_open_date=1_700_000_000 + 86_400 * 3)
+
+    writers = []
+
+    def read_then_write(symbols, time_window):
+        stored = get_ohlcv_bars(symbols=symbols, time_window=time_window)
+        if "SYM0" in symbols:
+            writer = threading.Thread(target=ohlcv_store.write, args=(later_batch,))
+            writer.start()
+            # Give the write the time to reach the bucket the sync rebuilds
+            writer.join(timeout=0.2)
+            writers.append(writer)
+        return stored
+
+    with patch('utils.ohlcv_store.get_ohlcv_bars', side_effect=read_then_write):
+        ohlcv_store.sync(TradeTimeWindow.DAILY)
+    for writer in writers:
+        writer.join()
+
+    data = ohlcv_store.read(["SYM0"], TradeTimeWindow.DAILY)
+    assert data["close"].tolist() == [1.0] * 3 + [5.0] * 3
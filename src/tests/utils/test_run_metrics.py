@@ -0,0 +1,158 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from data_ingestion.market_trade_data_collection import MarketTradeDataCollector
+from tests.data_ingestion.test_market_trade_data_collector import \
+    mock_traded_object_rows
+from tests.data_ingestion.test_rate_limiting import FakeClock, \
+    FakeYFinanceDownloader
+from utils.enums import TradeTimeWindow, YFinanceIntervals
+from utils.run_metrics import RunMetrics, count_retry
+
+
+class Ticking(FakeClock):
+    """ Clock that moves a second forward every time it is read """
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+def test_spans_aggregate_per_stage():
+    """Test every span adds to its stage, including the ones that raise."""
+
+    metrics = RunMetrics(run_name="test", sample_rate=0.0, clock=Ticking())
+
+    with metrics.span("fetch"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.span("fetch"):
+            raise RuntimeError("Injected error")
+    with metrics.span("write"):
+        pass
+
+    fetch = metrics.stage_timing("fetch")
+    assert (fetch.count, fetch.total_seconds, fetch.errors) == (2, 2.0, 1)
+    assert metrics.stage_timing("write").count == 1
+    assert metrics.summary()["sampled_spans"] == []
+
+
+def test_sampling_is_decided_once_per_batch():
+    """Test only sampled batches keep span records, for all of their stages."""
+
+    draws = iter([0.01, 0.9, 0.02])
+    metrics = RunMetrics(run_name="test", sample_rate=0.05,
+                         random_source=lambda: next(draws))
+
+    for batch_index in range(3):
+        for stage in ("fetch", "diff", "write"):
+            with metrics.span(stage, batch_index):
+                pass
+
+    spans = metrics.summary()["sampled_spans"]
+    assert [(span["batch_index"], span["stage"]) for span in spans] == [
+        (0, "fetch"), (0, "diff"), (0, "write"),
+        (2, "fetch"), (2, "diff"), (2, "write")]
+    assert metrics.stage_timing("diff").count == 3
+
+
+def test_sampled_batch_is_one_transaction_with_a_child_per_stage():
+    """Test the stages of a batch become child spans of a single transaction."""
+
+    metrics = RunMetrics(run_name="test", sample_rate=1.0)
+    transactions = [MagicMock(), MagicMock()]
+
+    with patch('utils.run_metrics.sentry_sdk.start_transaction',
+               side_effect=transactions) as start_transaction:
+        for batch_index in range(2):
+            for stage in ("fetch", "diff", "write"):
+                with metrics.span(stage, batch_index):
+                    pass
+            metrics.finish_batch(batch_index)
+
+    assert start_transaction.call_count == 2
+    for batch_index, transaction in enumerate(transactions):
+        assert [call.kwargs["op"] for call in transaction.start_child.call_args_list] == [
+            "ingestion.fetch", "ingestion.diff", "ingestion.write"]
+        transaction.set_tag.assert_called_once_with("batch_index", batch_index)
+        transaction.finish.assert_called_once()
+
+
+def test_retries_count_towards_the_active_span():
+    """Test the tenacity hook counts retries of the run whose span is open."""
+
+    metrics = RunMetrics(run_name="test")
+
+    count_retry(None)
+    with metrics.span("fetch"):
+        count_retry(None)
+        count_retry(None)
+
+    assert metrics.counter("retries") == 2
+
+
+def test_summary_is_written_as_json_and_prometheus_textfile(tmp_path):
+    """Test both summaries are written and carry the stages and counters."""
+
+    metrics = RunMetrics(run_name="back_fill", output_dir=str(tmp_path))
+    with metrics.span("write"):
+        metrics.increment("rows_written", 120)
+
+    metrics.write_summary()
+
+    summary = json.loads((tmp_path / "back_fill.json").read_text())
+    assert summary["counters"] == {"rows_written": 120}
+    assert summary["stages"]["write"]["count"] == 1
+    textfile = (tmp_path / "back_fill.prom").read_text()
+    assert 'ingestion_rows_written_total{run="back_fill"} 120' in textfile
+    assert 'ingestion_stage_spans_total{run="back_fill",stage="write"} 1' in textfile
+    assert "# TYPE ingestion_stage_seconds_total counter" in textfile
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "back_fill.json", "back_fill.prom"]
+
+
+def test_collector_records_stage_spans_and_row_counters(sqlite_engine):
+    """Test a collection run times every stage and counts its rows."""
+
+    metrics = RunMetrics(run_name="test", sample_rate=1.0)
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows', return_value=mock_traded_object_rows(6)):
+        collector = MarketTradeDataCollector(
+            batch_size=3, lookback_period_days=1,
+            downloader=FakeYFinanceDownloader(), metrics=metrics)
+
+    for _ in range(2):
+        collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH, time_window=TradeTimeWindow.DAILY)
+
+    # The second run fetches the same bars again and writes none of them
+    assert metrics.counter("rows_fetched") == 2 * 6 * 3
+    assert metrics.counter("rows_written") == 6 * 3
+    assert metrics.counter("rows_skipped") == 6 * 3
+    assert metrics.counter("bytes_written") > 0
+    assert metrics.stage_timing("fetch").count == 4
+    assert metrics.stage_timing("write").count == 2
+    assert {span["stage"] for span in metrics.summary()["sampled_spans"]} == {
+        "db_read", "fetch", "diff", "prepare", "write"}
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_collector_finishes_every_sampled_batch(sqlite_engine, pipelined):
+    """Test each batch of a run is sent as one finished transaction."""
+
+    metrics = RunMetrics(run_name="test", sample_rate=1.0)
+    with patch('data_ingestion.market_trade_data_collection'
+               '.get_traded_object_rows', return_value=mock_traded_object_rows(6)):
+        collector = MarketTradeDataCollector(
+            batch_size=3, lookback_period_days=1, pipelined=pipelined,
+            downloader=FakeYFinanceDownloader(), metrics=metrics)
+
+    with patch('utils.run_metrics.sentry_sdk.start_transaction') as start_transaction:
+        collector.collect_save_trade_market_data(
+            period=YFinanceIntervals.ONE_MONTH, time_window=TradeTimeWindow.DAILY)
+
+    assert start_transaction.call_count == 2
+    assert start_transaction.return_value.finish.call_count == 2
+    assert metrics._transactions == {}
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.data_models import TradedObject
+from utils.db_helpers import get_traded_object_rows, save_new_traded_objects_in_db
+from utils.enums import TradedObjectType
+from utils.symbol_registry import SymbolRegistry
+
+
+def traded_object(symbol, object_type=TradedObjectType.STOCK, exchange="NASDAQ"):
+    return TradedObject(name=f"{symbol} Inc", symbol=symbol, exchange=exchange,
+                        exchange_short_name=exchange, object_type=object_type)
+
+
+def test_ids_are_dense_and_follow_symbol_order():
+    """Test IDs are positions in the sorted universe and resolve both ways."""
+
+    registry = SymbolRegistry.from_traded_objects(
+        {traded_object("MSFT"), traded_object("AAPL"), traded_object("TSLA")})
+
+    assert registry.symbols.tolist() == ["AAPL", "MSFT", "TSLA"]
+    assert registry.id_of("MSFT") == 1
+    assert registry.ids_of(pd.Series(["TSLA", "NVDA", "AAPL"])).tolist() == [2, -1, 0]
+    assert registry.symbols_of(np.array([2, 0])) == ["TSLA", "AAPL"]
+    assert "NVDA" not in registry
+    with pytest.raises(KeyError):
+        registry.id_of("NVDA")
+
+
+def test_symbol_listed_under_several_types_is_registered_once():
+    """Test a symbol keeps the first object type it is listed under."""
+
+    registry = SymbolRegistry.from_traded_objects(
+        {traded_object("SPY", TradedObjectType.ETF),
+         traded_object("SPY", TradedObjectType.STOCK)})
+
+    assert len(registry) == 1
+    assert registry.traded_object(0) == traded_object("SPY", TradedObjectType.STOCK)
+
+
+def test_registry_is_built_from_query_rows(sqlite_engine):
+    """Test rows read from traded_objects register like the objects they hold."""
+
+    traded_objects = {traded_object("SPY", TradedObjectType.ETF),
+                      traded_object("SPY", TradedObjectType.STOCK),
+                      traded_object("MSFT"), traded_object("QQQ", TradedObjectType.ETF)}
+    save_new_traded_objects_in_db(traded_objects)
+
+    registry = SymbolRegistry.from_rows(get_traded_object_rows())
+
+    expected = SymbolRegistry.from_traded_objects(traded_objects)
+    assert registry.symbols.tolist() == ["MSFT", "QQQ", "SPY"]
+    assert [registry.traded_object(symbol_id) for symbol_id in registry.ids] == [
+        expected.traded_object(symbol_id) for symbol_id in expected.ids]
+    assert registry.object_type_codes.tolist() == expected.object_type_codes.tolist()
+
+
+def test_repeated_strings_are_stored_once():
+    """Test equal exchange names from different rows share one string."""
+
+    exchanges = ["".join(["NY", "SE"]) for _ in range(3)]
+    registry = SymbolRegistry(symbols=["A", "B", "C"], exchanges=exchanges)
+
+    assert len({id(exchange) for exchange in registry.exchanges}) == 1
+
+
+def test_select_renumbers_a_subset():
+    """Test a subset registry has dense IDs of its own."""
+
+    registry = SymbolRegistry(symbols=["A", "B", "C", "D"])
+
+    subset = registry.select(np.array([3, 1]))
+
+    assert subset.symbols.tolist() == ["B", "D"]
+    assert subset.id_of("D") == 1
+
+
+def test_traded_objects_have_no_instance_dict():
+    """Test traded objects are slotted records."""
+
+    assert not hasattr(traded_object("AAPL"), "__dict__")
+
+
+def test_duplicate_symbols_are_rejected():
+    """Test a registry cannot give one symbol two IDs."""
+
+    with pytest.raises(ValueError):
+        SymbolRegistry(symbols=["A", "A"])
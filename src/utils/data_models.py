@@ -1,10 +1,30 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
 
 from utils.enums import TradedObjectType, TradeTimeWindow
 
+# NumPy and pandas are imported where they are used, so jobs that only deal
+# with traded objects never load them
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    from pandas import DataFrame
 
-@dataclass
+OHLCV_PRICE_COLUMNS = ("open", "high", "low", "close")
+
+
+def _as_float_array(column: pd.Series) -> np.ndarray:
+    import numpy as np
+
+    # float32 columns from the yfinance normaliser are kept as they are
+    if column.dtype == np.float32:
+        return column.to_numpy()
+    return column.to_numpy(dtype=np.float64)
+
+
+@dataclass(slots=True)
 class OHLCV:
     """ Market data point for a traded object """
     symbol: str
@@ -17,10 +37,135 @@ class OHLCV:
     open_date: int
 
 
+@dataclass
+class OHLCVBatch:
+    """ Columnar block of market data points sharing one time window.
+
+    Symbols are stored once in `symbols` and referenced by position from
+    `symbol_codes`, so a batch holds a handful of NumPy arrays instead of one
+    Python object per bar.
+    """
+    time_window: TradeTimeWindow
+    symbols: np.ndarray
+    symbol_codes: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    open_date: np.ndarray
+
+    @classmethod
+    def empty(cls, time_window: TradeTimeWindow) -> OHLCVBatch:
+        import numpy as np
+
+        return cls(time_window=time_window,
+                   symbols=np.array([], dtype=object),
+                   symbol_codes=np.array([], dtype=np.int32),
+                   open=np.array([], dtype=np.float64),
+                   high=np.array([], dtype=np.float64),
+                   low=np.array([], dtype=np.float64),
+                   close=np.array([], dtype=np.float64),
+                   volume=np.array([], dtype=np.int64),
+                   open_date=np.array([], dtype=np.int64))
+
+    @classmethod
+    def from_frame(cls, data: DataFrame,
+                   time_window: TradeTimeWindow) -> OHLCVBatch:
+        """ Builds a batch from a frame with symbol, OHLCV and open_date columns """
+        import numpy as np
+        import pandas as pd
+
+        if data.shape[0] == 0:
+            return cls.empty(time_window)
+        symbol_codes, symbols = pd.factorize(data["symbol"])
+        return cls(time_window=time_window,
+                   symbols=np.asarray(symbols, dtype=object),
+                   symbol_codes=symbol_codes.astype(np.int32, copy=False),
+                   open=_as_float_array(data["open"]),
+                   high=_as_float_array(data["high"]),
+                   low=_as_float_array(data["low"]),
+                   close=_as_float_array(data["close"]),
+                   volume=data["volume"].to_numpy(dtype=np.int64),
+                   open_date=data["open_date"].to_numpy(dtype=np.int64))
+
+    def __len__(self) -> int:
+        return int(self.symbol_codes.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, column).nbytes for column in
+                       ("symbol_codes", "volume", "open_date")
+                       + OHLCV_PRICE_COLUMNS)
+                   + sum(len(symbol) for symbol in self.symbols))
+
+    def last_open_dates(self) -> Dict[str, int]:
+        """ Returns the latest open_date of every symbol present in the batch """
+        import numpy as np
+
+        if len(self) == 0:
+            return {}
+        missing = np.iinfo(np.int64).min
+        last_open_dates = np.full(len(self.symbols), missing, dtype=np.int64)
+        np.maximum.at(last_open_dates, self.symbol_codes, self.open_date)
+        present = last_open_dates != missing
+        return dict(zip(self.symbols[present].tolist(),
+                        last_open_dates[present].tolist()))
+
+    def slice(self, start: int, end: int) -> OHLCVBatch:
+        """ Returns a view over rows [start, end) without copying the columns """
+        return OHLCVBatch(time_window=self.time_window,
+                          symbols=self.symbols,
+                          symbol_codes=self.symbol_codes[start:end],
+                          open=self.open[start:end],
+                          high=self.high[start:end],
+                          low=self.low[start:end],
+                          close=self.close[start:end],
+                          volume=self.volume[start:end],
+                          open_date=self.open_date[start:end])
+
+    def to_frame(self) -> DataFrame:
+        import numpy as np
+        from pandas import DataFrame
+
+        return DataFrame({
+            "symbol": self.symbols[self.symbol_codes] if len(self.symbols)
+            else np.array([], dtype=object),
+            "time_window": self.time_window.value.yfinance_notation,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "open_date": self.open_date
+        })
+
+    def iter_parameter_chunks(self, chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+        """ Yields DB-API parameter rows, materialising one chunk at a time """
+        time_window = self.time_window.value.yfinance_notation
+        for start in range(0, len(self), chunk_size):
+            end = start + chunk_size
+            columns = zip(self.symbols[self.symbol_codes[start:end]].tolist(),
+                          self.open[start:end].tolist(),
+                          self.high[start:end].tolist(),
+                          self.low[start:end].tolist(),
+                          self.close[start:end].tolist(),
+                          self.volume[start:end].tolist(),
+                          self.open_date[start:end].tolist())
+            yield [
+                {"symbol": symbol, "time_window": time_window, "open": open_,
+                 "high": high, "low": low, "close": close, "volume": volume,
+                 "open_date": open_date}
+                for symbol, open_, high, low, close, volume, open_date in columns
+            ]
+
+
 @dataclass
 class TradedObject:
     """ Class containing the object traded data """
 
+    __slots__ = ("name", "symbol", "exchange", "exchange_short_name", "object_type")
+
     def __init__(
             self,
             name: Optional[str],
@@ -57,6 +202,7 @@ class TradedObject:
 @dataclass
 class DataTradedObject(TradedObject):
     """ TradedObject including the trading data """
+    __slots__ = ("ohlcv_list",)
     ohlcv_list: List[OHLCV]
 
     def __init__(self, traded_object: TradedObject, ohlcv_list: List[OHLCV]):
@@ -69,3 +215,69 @@ class DataTradedObject(TradedObject):
         )
 
         self.ohlcv_list = ohlcv_list
+
+
+@dataclass
+class OHLCVPanel:
+    """ Market data of many symbols aligned on a date x symbol grid.
+
+    Every field is a (dates, symbols) array; `missing` is True where a symbol
+    has no bar on a date, and the price fields hold NaN and volume 0 there.
+    """
+    time_window: TradeTimeWindow
+    symbols: np.ndarray
+    open_dates: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    missing: np.ndarray
+
+    @classmethod
+    def from_frame(cls, data: DataFrame, symbols: List[str],
+                   time_window: TradeTimeWindow) -> OHLCVPanel:
+        """ Scatters long format bars into the grid; the columns follow
+        `symbols` and bars of other symbols are ignored """
+        import numpy as np
+        import pandas as pd
+
+        columns = pd.Index(symbols).get_indexer(data["symbol"])
+        known = columns >= 0
+        open_dates = data["open_date"].to_numpy(dtype=np.int64)[known]
+        columns = columns[known]
+        dates = np.unique(open_dates)
+        rows = np.searchsorted(dates, open_dates)
+        shape = (len(dates), len(symbols))
+
+        def scatter(column: str, fill_value: Any, dtype: Any) -> np.ndarray:
+            values = np.full(shape, fill_value, dtype=dtype)
+            values[rows, columns] = data[column].to_numpy(dtype=dtype)[known]
+            return values
+
+        missing = np.ones(shape, dtype=bool)
+        missing[rows, columns] = False
+        return cls(time_window=time_window,
+                   symbols=np.asarray(symbols, dtype=object),
+                   open_dates=dates,
+                   open=scatter("open", np.nan, np.float64),
+                   high=scatter("high", np.nan, np.float64),
+                   low=scatter("low", np.nan, np.float64),
+                   close=scatter("close", np.nan, np.float64),
+                   volume=scatter("volume", 0, np.int64),
+                   missing=missing)
+
+    @property
+    def shape(self) -> tuple:
+        return self.missing.shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, column).nbytes for column in
+                       ("open_dates", "volume", "missing") + OHLCV_PRICE_COLUMNS)
+                   + sum(len(symbol) for symbol in self.symbols))
+
+    def column_of(self, symbol: str) -> int:
+        import numpy as np
+
+        return int(np.flatnonzero(self.symbols == symbol)[0])
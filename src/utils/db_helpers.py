@@ -1,31 +1,194 @@
+from __future__ import annotations
+
+import calendar
+import logging
 import os
+import threading
+import tempfile
 import time
-from typing import Set, List
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, \
+    Optional, Sequence, Set, List, Tuple
 
-import pandas as pd
-from pandas import DataFrame
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.engine import Engine
 
-from utils.data_models import TradedObject, DataTradedObject
-from utils.enums import TradedObjectType, YFinanceIntervals, TradeTimeWindow
+from utils.data_models import TradedObject
+from utils.enums import TradedObjectType, YFinanceIntervals, TradeTimeWindow, \
+    OHLCVWriteMode, BackfillStatus
 
+# pandas is imported by the readers that return frames, so the symbol list
+# job, which only reads and writes traded objects, does not load it
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
-def get_mysql_connection():
+    from utils.data_models import OHLCVBatch
 
-    print("Connected to MySQL")
+logger = logging.getLogger(__name__)
 
-    database_uri = f"mysql+pymysql://{os.environ.get('AWS_RDS_USER')}:" \
-                   f"{os.environ.get('AWS_RDS_PASSWORD')}@" \
-                   f"{os.environ.get('AWS_RDS_HOST')}:" \
-                   f"{os.environ.get('AWS_RDS_PORT')}/" \
-                   f"{os.environ.get('AWS_RDS_DB')}"
+DB_POOL_SIZE_DEFAULT = 5
+DB_POOL_MAX_OVERFLOW_DEFAULT = 10
+DB_POOL_TIMEOUT_SECONDS_DEFAULT = 30
+DB_POOL_RECYCLE_SECONDS_DEFAULT = 1800
+DB_POOL_PRE_PING_DEFAULT = True
+WRITE_CHUNK_SIZE_DEFAULT = 5000
+BULK_CHUNK_SIZE_DEFAULT = 10000
+BULK_TRANSACTION_ROWS_DEFAULT = 100000
+READ_CHUNK_SIZE_DEFAULT = 1000
+MAX_OPEN_DATE = 2 ** 63 - 1
 
-    return create_engine(database_uri)
+INTRADAY_WRITE_CHUNK_SIZE_DEFAULT = 20000
+SECONDS_PER_DAY = 60 * 60 * 24
 
+OHLCV_TABLE_COLUMNS = "symbol, time_window, open, high, low, close, volume, open_date"
+OHLCV_KEY_COLUMNS = ["symbol", "time_window", "open_date"]
+OHLCV_PRICE_COLUMNS = ["open", "high", "low", "close", "volume"]
+INTRADAY_TABLE_COLUMNS = "symbol, open_date, open, high, low, close, volume"
+# Catch-all partition of the intraday tables that new days are split off from
+INTRADAY_FUTURE_PARTITION = "p_future"
+
+
+@dataclass
+class DbPoolConfig:
+    """ Connection pool settings of the shared database engine """
+    pool_size: int = DB_POOL_SIZE_DEFAULT
+    max_overflow: int = DB_POOL_MAX_OVERFLOW_DEFAULT
+    pool_timeout: int = DB_POOL_TIMEOUT_SECONDS_DEFAULT
+    pool_recycle: int = DB_POOL_RECYCLE_SECONDS_DEFAULT
+    pool_pre_ping: bool = DB_POOL_PRE_PING_DEFAULT
+    local_infile: bool = False
+
+    @classmethod
+    def from_environment(cls) -> "DbPoolConfig":
+        return cls(
+            pool_size=int(os.environ.get("DB_POOL_SIZE",
+                                         DB_POOL_SIZE_DEFAULT)),
+            max_overflow=int(os.environ.get("DB_POOL_MAX_OVERFLOW",
+                                            DB_POOL_MAX_OVERFLOW_DEFAULT)),
+            pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT_SECONDS",
+                                            DB_POOL_TIMEOUT_SECONDS_DEFAULT)),
+            pool_recycle=int(os.environ.get("DB_POOL_RECYCLE_SECONDS",
+                                            DB_POOL_RECYCLE_SECONDS_DEFAULT)),
+            pool_pre_ping=os.environ.get(
+                "DB_POOL_PRE_PING",
+                str(DB_POOL_PRE_PING_DEFAULT)).lower() in ("1", "true", "yes"),
+            local_infile=os.environ.get(
+                "DB_LOCAL_INFILE", "false").lower() in ("1", "true", "yes")
+        )
+
+
+@dataclass
+class PoolStats:
+    """ Usage counters of the shared database engine """
+    engines_created: int = 0
+    connections_opened: int = 0
+    checkouts: int = 0
+    total_wait_time_seconds: float = 0.0
+    max_wait_time_seconds: float = 0.0
+
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+_pool_stats = PoolStats()
+_pool_stats_lock = threading.Lock()
+_ohlcv_write_listeners: List[Callable[[OHLCVBatch], None]] = []
+
+
+def _get_database_uri() -> str:
+    return f"mysql+pymysql://{os.environ.get('AWS_RDS_USER')}:" \
+           f"{os.environ.get('AWS_RDS_PASSWORD')}@" \
+           f"{os.environ.get('AWS_RDS_HOST')}:" \
+           f"{os.environ.get('AWS_RDS_PORT')}/" \
+           f"{os.environ.get('AWS_RDS_DB')}"
+
+
+def _on_connect(dbapi_connection, connection_record) -> None:
+    with _pool_stats_lock:
+        _pool_stats.connections_opened += 1
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    with _pool_stats_lock:
+        _pool_stats.checkouts += 1
+
+
+def get_mysql_connection(pool_config: Optional[DbPoolConfig] = None) -> Engine:
+    """ Returns the process-wide engine, creating it on first use """
+    global _engine
+
+    if _engine is not None:
+        return _engine
+
+    with _engine_lock:
+        if _engine is None:
+            config = pool_config or DbPoolConfig.from_environment()
+            database_uri = _get_database_uri()
+            connect_args = ({"local_infile": True}
+                            if config.local_infile
+                            and database_uri.startswith("mysql") else {})
+            engine = create_engine(database_uri,
+                                   connect_args=connect_args,
+                                   pool_size=config.pool_size,
+                                   max_overflow=config.max_overflow,
+                                   pool_timeout=config.pool_timeout,
+                                   pool_recycle=config.pool_recycle,
+                                   pool_pre_ping=config.pool_pre_ping)
+            event.listen(engine, "connect", _on_connect)
+            event.listen(engine, "checkout", _on_checkout)
+            with _pool_stats_lock:
+                _pool_stats.engines_created += 1
+            _engine = engine
+            logger.info(f"Created database engine with pool size "
+                        f"{config.pool_size} and max overflow "
+                        f"{config.max_overflow}.")
+    return _engine
+
+
+def dispose_mysql_connection() -> None:
+    """ Closes every pooled connection; the next call creates a new engine """
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            return
+        _engine.dispose()
+        _engine = None
+    logger.info(f"Disposed database engine. Pool stats: "
+                f"{get_connection_pool_stats()}")
+
+
+def get_connection_pool_stats() -> PoolStats:
+    with _pool_stats_lock:
+        return replace(_pool_stats)
+
+
+def reset_connection_pool_stats() -> None:
+    global _pool_stats
+
+    with _pool_stats_lock:
+        _pool_stats = PoolStats()
+
+
+@contextmanager
+def _connect() -> Iterator[Any]:
+    engine = get_mysql_connection()
+    start = time.perf_counter()
+    connection = engine.connect()
+    wait_time = time.perf_counter() - start
+    with _pool_stats_lock:
+        _pool_stats.total_wait_time_seconds += wait_time
+        _pool_stats.max_wait_time_seconds = max(
+            _pool_stats.max_wait_time_seconds, wait_time)
+    try:
+        yield connection
+    finally:
+        connection.close()
 
-def get_all_traded_objects_from_db() -> Set[TradedObject]:
-    con = get_mysql_connection()
 
+def get_traded_object_rows() -> List[Tuple[str, str, str, str, str]]:
+    """ Returns the name, symbol, exchange, exchange short name and object
+    type name of the listed traded objects, without an object per row """
     query = """
                 SELECT
                     name,
@@ -34,12 +197,16 @@ def get_all_traded_objects_from_db() -> Set[TradedObject]:
                     exchange_short_name,
                     object_type
                 FROM traded_objects
+                WHERE delisted_at IS NULL
             """
 
-    with con.connect() as connection:
+    with _connect() as connection:
         result = connection.execute(text(query))
-        data_points = result.fetchall()
+        return [tuple(row) for row in result.fetchall()]
 
+
+def get_all_traded_objects_from_db() -> Set[TradedObject]:
+    """ Returns the listed traded objects; soft-deleted ones are left out """
     return {
         TradedObject(
             name=data[0],
@@ -47,14 +214,12 @@ def get_all_traded_objects_from_db() -> Set[TradedObject]:
             exchange=data[2],
             exchange_short_name=data[3],
             object_type=TradedObjectType.get_traded_object_type_from_name(data[4])
-        ) for data in data_points
+        ) for data in get_traded_object_rows()
     }
 
 
 def save_new_traded_objects_in_db(traded_objects: Set[TradedObject]) -> None:
 
-    con = get_mysql_connection()
-
     values = [
         {
             "name": traded_object.name,
@@ -78,19 +243,94 @@ def save_new_traded_objects_in_db(traded_objects: Set[TradedObject]) -> None:
     :name, :symbol, :exchange, :exchange_short_name, :object_type
     )""")
 
-    with con.connect() as connection:
+    with _connect() as connection:
         connection.execute(query, values)
         connection.commit()
 
 
+def _on_conflict_update(dialect_name: str, key_columns: List[str],
+                        update_columns: List[str],
+                        greatest_columns: Sequence[str] = ()) -> str:
+    """ Upsert clause of every INSERT in this module: ON CONFLICT on SQLite
+    and ON DUPLICATE KEY on MySQL. `update_columns` take the inserted value,
+    `greatest_columns` keep the larger of the stored and inserted values. """
+    if dialect_name == "sqlite":
+        assignments = [f"{column} = excluded.{column}" for column in update_columns]
+        assignments += [f"{column} = MAX({column}, excluded.{column})"
+                        for column in greatest_columns]
+        return (f"\n    ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET "
+                f"{', '.join(assignments)}")
+    assignments = [f"{column} = VALUES({column})" for column in update_columns]
+    assignments += [f"{column} = GREATEST({column}, VALUES({column}))"
+                    for column in greatest_columns]
+    return f"\n    ON DUPLICATE KEY UPDATE {', '.join(assignments)}"
+
+
+def apply_traded_objects_delta(upserted: Iterable[TradedObject],
+                               removed: Iterable[TradedObject],
+                               delisted_at: int,
+                               chunk_size: int = WRITE_CHUNK_SIZE_DEFAULT) -> None:
+    """ Upserts added and changed traded objects and soft-deletes removed ones
+    in one transaction; upserting a soft-deleted object lists it again """
+    upserted_values = [
+        {
+            "name": traded_object.name,
+            "symbol": traded_object.symbol,
+            "exchange": traded_object.exchange,
+            "exchange_short_name": traded_object.exchange_short_name,
+            "object_type": traded_object.object_type.name
+        }
+        for traded_object in upserted
+    ]
+    removed_values = [{"symbol": traded_object.symbol,
+                       "object_type": traded_object.object_type.name,
+                       "delisted_at": delisted_at}
+                      for traded_object in removed]
+
+    with _connect() as connection:
+        upsert_query = text(f"""
+    INSERT INTO traded_objects (
+    name,
+    symbol,
+    exchange,
+    exchange_short_name,
+    object_type,
+    delisted_at
+    )
+    VALUES (
+    :name, :symbol, :exchange, :exchange_short_name, :object_type, NULL
+    ){_on_conflict_update(connection.dialect.name, ["symbol", "object_type"],
+                          ["name", "exchange", "exchange_short_name",
+                           "delisted_at"])}""")
+        delete_query = text("""
+    UPDATE traded_objects
+    SET delisted_at = :delisted_at
+    WHERE symbol = :symbol AND object_type = :object_type""")
+
+        for start in range(0, len(upserted_values), chunk_size):
+            connection.execute(upsert_query, upserted_values[start:start + chunk_size])
+        for start in range(0, len(removed_values), chunk_size):
+            connection.execute(delete_query, removed_values[start:start + chunk_size])
+        connection.commit()
+
+
 def get_market_trade_data(symbols: List[str], period: YFinanceIntervals,
                           time_window: TradeTimeWindow) -> DataFrame:
 
-    con = get_mysql_connection()
-
     from_unix_time = int(time.time() - period.value.time_in_seconds)
+    return get_ohlcv_bars(symbols=symbols, time_window=time_window,
+                          start_open_date=from_unix_time + 1)
 
-    query = f"""
+
+def get_ohlcv_bars(symbols: List[str], time_window: TradeTimeWindow,
+                   start_open_date: Optional[int] = None,
+                   end_open_date: Optional[int] = None,
+                   chunk_size: int = READ_CHUNK_SIZE_DEFAULT) -> DataFrame:
+    """ Reads the stored bars of the symbols with open_date in
+    [start_open_date, end_open_date], querying chunk_size symbols at a time """
+    import pandas as pd
+
+    query = text("""
                 SELECT
                     symbol,
                     time_window,
@@ -101,53 +341,695 @@ def get_market_trade_data(symbols: List[str], period: YFinanceIntervals,
                     open,
                     volume
                 FROM ohlcv_table
-                WHERE time_window = '{time_window.value.yfinance_notation}'
-                AND open_date > {from_unix_time}
-                AND symbol in (\'{"','".join(symbols)}\')
-            """
+                WHERE time_window = :time_window
+                AND open_date >= :start_open_date
+                AND open_date <= :end_open_date
+                AND symbol IN :symbols
+            """).bindparams(bindparam("symbols", expanding=True))
+
+    parameters: Dict[str, Any] = {
+        "time_window": time_window.value.yfinance_notation,
+        "start_open_date": start_open_date if start_open_date is not None else 0,
+        "end_open_date": (end_open_date if end_open_date is not None
+                          else MAX_OPEN_DATE)
+    }
+
+    if not symbols:
+        return pd.DataFrame(columns=["symbol", "time_window", "open_date", "close",
+                                     "high", "low", "open", "volume"])
+
+    frames = []
+    with _connect() as connection:
+        for start in range(0, len(symbols), chunk_size):
+            frames.append(pd.read_sql(
+                query, connection,
+                params={**parameters, "symbols": symbols[start:start + chunk_size]}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_ohlcv_open_dates(symbols: List[str], time_window: TradeTimeWindow,
+                         start_open_date: Optional[int] = None,
+                         chunk_size: int = READ_CHUNK_SIZE_DEFAULT) -> DataFrame:
+    """ Reads only the symbol and open_date of the stored bars, which the
+    primary key answers without touching the rows """
+    import pandas as pd
+
+    query = text("""
+                SELECT
+                    symbol,
+                    open_date
+                FROM ohlcv_table
+                WHERE time_window = :time_window
+                AND open_date >= :start_open_date
+                AND symbol IN :symbols
+            """).bindparams(bindparam("symbols", expanding=True))
+
+    parameters: Dict[str, Any] = {
+        "time_window": time_window.value.yfinance_notation,
+        "start_open_date": start_open_date if start_open_date is not None else 0
+    }
+
+    if not symbols:
+        return pd.DataFrame(columns=["symbol", "open_date"])
+
+    frames = []
+    with _connect() as connection:
+        for start in range(0, len(symbols), chunk_size):
+            frames.append(pd.read_sql(
+                query, connection,
+                params={**parameters, "symbols": symbols[start:start + chunk_size]}))
+    return pd.concat(frames, ignore_index=True)
 
-    return pd.read_sql(query, con)
 
+def get_ohlcv_symbol_summary(time_window: TradeTimeWindow) -> DataFrame:
+    """ Returns the number of bars and last open_date stored per symbol """
+    import pandas as pd
 
-def save_trade_market_data_in_db(objects_list: List[DataTradedObject]) -> None:
+    query = text("""
+                SELECT
+                    symbol,
+                    COUNT(*) AS bars,
+                    MAX(open_date) AS last_open_date
+                FROM ohlcv_table
+                WHERE time_window = :time_window
+                GROUP BY symbol
+            """)
+
+    with _connect() as connection:
+        return pd.read_sql(query, connection, params={
+            "time_window": time_window.value.yfinance_notation})
+
+
+def get_ingestion_watermarks(symbols: List[str],
+                             time_window: TradeTimeWindow) -> Dict[str, int]:
+    """ Returns the last stored open_date of every symbol that has one """
+    if not symbols:
+        return {}
+
+    query = text("""
+                SELECT
+                    symbol,
+                    last_open_date
+                FROM ohlcv_watermarks
+                WHERE time_window = :time_window
+                AND symbol IN :symbols
+            """).bindparams(bindparam("symbols", expanding=True))
 
-    con = get_mysql_connection()
+    with _connect() as connection:
+        result = connection.execute(query, {
+            "time_window": time_window.value.yfinance_notation,
+            "symbols": symbols
+        })
+        return {row[0]: int(row[1]) for row in result.fetchall()}
 
+
+def _update_ingestion_watermarks(connection: Any, ohlcv_batch: OHLCVBatch) -> None:
+    time_window = ohlcv_batch.time_window.value.yfinance_notation
     values = [
-        {
-            "symbol": ohlcv.symbol,
-            "time_window": ohlcv.time_window.value.yfinance_notation,
-            "open": ohlcv.open,
-            "high": ohlcv.high,
-            "low": ohlcv.low,
-            "close": ohlcv.close,
-            "volume": ohlcv.volume,
-            "open_date": ohlcv.open_date
-        }
-        for data_list in objects_list for ohlcv in data_list.ohlcv_list
+        {"symbol": symbol, "time_window": time_window, "last_open_date": open_date}
+        for symbol, open_date in ohlcv_batch.last_open_dates().items()
     ]
+    if not values:
+        return
 
-    query = text(f"""
-    INSERT INTO ohlcv_table (
+    # A batch re-writing old bars never moves a watermark back
+    connection.execute(text(f"""
+    INSERT INTO ohlcv_watermarks (
     symbol,
     time_window,
-    open,
-    high,
-    low,
-    close,
-    volume,
-    open_date
+    last_open_date
+    )
+    VALUES (
+        :symbol, :time_window, :last_open_date
+    ){_on_conflict_update(connection.dialect.name, ["symbol", "time_window"], [],
+                          greatest_columns=["last_open_date"])}"""), values)
+
+
+def get_empty_refetches(symbols: List[str], time_window: TradeTimeWindow,
+                        chunk_size: int = READ_CHUNK_SIZE_DEFAULT) -> Dict[str, int]:
+    """ Returns the last open_date up to which a refetch found no bars, for
+    every symbol that has one """
+    if not symbols:
+        return {}
+
+    query = text("""
+                SELECT
+                    symbol,
+                    checked_until
+                FROM ohlcv_empty_refetches
+                WHERE time_window = :time_window
+                AND symbol IN :symbols
+            """).bindparams(bindparam("symbols", expanding=True))
+
+    checked_until = {}
+    with _connect() as connection:
+        for start in range(0, len(symbols), chunk_size):
+            result = connection.execute(query, {
+                "time_window": time_window.value.yfinance_notation,
+                "symbols": symbols[start:start + chunk_size]
+            })
+            checked_until.update({row[0]: int(row[1]) for row in result.fetchall()})
+    return checked_until
+
+
+def save_empty_refetches(symbols: List[str], time_window: TradeTimeWindow,
+                         checked_until: int) -> None:
+    """ Records that yfinance had no bars of the symbols up to checked_until """
+    values = [
+        {"symbol": symbol, "time_window": time_window.value.yfinance_notation,
+         "checked_until": checked_until}
+        for symbol in symbols
+    ]
+    if not values:
+        return
+
+    with _connect() as connection:
+        connection.execute(text(f"""
+        INSERT INTO ohlcv_empty_refetches (
+        symbol,
+        time_window,
+        checked_until
+        )
+        VALUES (
+            :symbol, :time_window, :checked_until
+        ){_on_conflict_update(connection.dialect.name, ["symbol", "time_window"], [],
+                              greatest_columns=["checked_until"])}"""), values)
+        connection.commit()
+
+
+def add_ohlcv_write_listener(listener: Callable[[OHLCVBatch], None]) -> None:
+    """ Registers a callback run with every batch written to ohlcv_table or
+    to an intraday table """
+    _ohlcv_write_listeners.append(listener)
+
+
+def remove_ohlcv_write_listener(listener: Callable[[OHLCVBatch], None]) -> None:
+    if listener in _ohlcv_write_listeners:
+        _ohlcv_write_listeners.remove(listener)
+
+
+def _notify_ohlcv_write_listeners(ohlcv_batch: OHLCVBatch) -> None:
+    for listener in list(_ohlcv_write_listeners):
+        try:
+            listener(ohlcv_batch)
+        except Exception as e:
+            logger.error(f"Error in ohlcv_table write listener: {e}")
+
+
+def save_trade_market_data_in_db(
+        ohlcv_batch: OHLCVBatch,
+        chunk_size: int = WRITE_CHUNK_SIZE_DEFAULT) -> None:
+
+    with _connect() as connection:
+        query = text(f"""
+    INSERT INTO ohlcv_table (
+    {OHLCV_TABLE_COLUMNS}
     )
     VALUES (
         :symbol, :time_window, :open, :high, :low, :close, :volume, :open_date
+    ){_on_conflict_update(connection.dialect.name, OHLCV_KEY_COLUMNS,
+                          OHLCV_PRICE_COLUMNS)}""")
+
+        for values in ohlcv_batch.iter_parameter_chunks(chunk_size):
+            connection.execute(query, values)
+        _update_ingestion_watermarks(connection, ohlcv_batch)
+        connection.commit()
+    _notify_ohlcv_write_listeners(ohlcv_batch)
+
+
+@dataclass
+class BulkLoadReport:
+    """ Outcome of a bulk load into ohlcv_table """
+    rows: int = 0
+    chunks: int = 0
+    transactions: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.rows / self.elapsed_seconds
+
+
+def _create_ohlcv_staging_table(connection: Any) -> None:
+    if connection.dialect.name == "sqlite":
+        connection.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS ohlcv_staging AS "
+            "SELECT * FROM ohlcv_table WHERE 0"))
+    else:
+        connection.execute(text(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS ohlcv_staging LIKE ohlcv_table"))
+    connection.execute(text("DELETE FROM ohlcv_staging"))
+
+
+def _stage_rows_with_inserts(connection: Any, ohlcv_batch: OHLCVBatch,
+                             chunk_size: int) -> int:
+    query = text(f"""
+    INSERT INTO ohlcv_staging (
+    {OHLCV_TABLE_COLUMNS}
     )
-    ON DUPLICATE KEY UPDATE 
-        open = VALUES(open),
-        high = VALUES(high),
-        low = VALUES(low),
-        close = VALUES(close),
-        volume = VALUES(volume)""")
-
-    with con.connect() as connection:
+    VALUES (
+        :symbol, :time_window, :open, :high, :low, :close, :volume, :open_date
+    )""")
+
+    chunks = 0
+    for values in ohlcv_batch.iter_parameter_chunks(chunk_size):
         connection.execute(query, values)
+        chunks += 1
+    return chunks
+
+
+def _stage_rows_with_load_data(connection: Any, ohlcv_batch: OHLCVBatch,
+                               chunk_size: int) -> int:
+    if connection.dialect.name != "mysql":
+        raise ValueError("LOAD DATA LOCAL INFILE is only supported on MySQL.")
+
+    query = text(f"""
+    LOAD DATA LOCAL INFILE :path INTO TABLE ohlcv_staging
+    FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' (
+    {OHLCV_TABLE_COLUMNS}
+    )""")
+
+    data = ohlcv_batch.to_frame()
+    chunks = 0
+    for start in range(0, len(ohlcv_batch), chunk_size):
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv") as csv_file:
+            data.iloc[start:start + chunk_size].to_csv(
+                csv_file, header=False, index=False,
+                columns=[column.strip() for column in
+                         OHLCV_TABLE_COLUMNS.split(",")],
+                lineterminator="\n")
+            csv_file.flush()
+            connection.execute(query, {"path": csv_file.name})
+        chunks += 1
+    return chunks
+
+
+def bulk_load_trade_market_data(
+        ohlcv_batch: OHLCVBatch,
+        write_mode: OHLCVWriteMode = OHLCVWriteMode.STAGING_TABLE,
+        chunk_size: int = BULK_CHUNK_SIZE_DEFAULT,
+        transaction_rows: int = BULK_TRANSACTION_ROWS_DEFAULT) -> BulkLoadReport:
+    """ Loads rows into a temporary staging table and merges them into
+    ohlcv_table with one set-based statement per transaction """
+
+    if write_mode == OHLCVWriteMode.EXECUTEMANY:
+        raise ValueError("Use save_trade_market_data_in_db for executemany writes.")
+
+    report = BulkLoadReport()
+    start_time = time.perf_counter()
+    transaction_rows = max(transaction_rows, chunk_size)
+
+    with _connect() as connection:
+        merge_query = text(f"""
+    INSERT INTO ohlcv_table (
+    {OHLCV_TABLE_COLUMNS}
+    )
+    SELECT {OHLCV_TABLE_COLUMNS} FROM ohlcv_staging WHERE 1 = 1
+    {_on_conflict_update(connection.dialect.name, OHLCV_KEY_COLUMNS,
+                          OHLCV_PRICE_COLUMNS)}""")
+
+        for start in range(0, len(ohlcv_batch), transaction_rows):
+            transaction_batch = ohlcv_batch.slice(start, start + transaction_rows)
+
+            _create_ohlcv_staging_table(connection)
+            if write_mode == OHLCVWriteMode.LOAD_DATA_INFILE:
+                report.chunks += _stage_rows_with_load_data(
+                    connection, transaction_batch, chunk_size)
+            else:
+                report.chunks += _stage_rows_with_inserts(
+                    connection, transaction_batch, chunk_size)
+            connection.execute(merge_query)
+            connection.execute(text("DELETE FROM ohlcv_staging"))
+            _update_ingestion_watermarks(connection, transaction_batch)
+            connection.commit()
+            _notify_ohlcv_write_listeners(transaction_batch)
+
+            report.rows += len(transaction_batch)
+            report.transactions += 1
+
+    report.elapsed_seconds = time.perf_counter() - start_time
+    logger.info(f"Bulk loaded {report.rows} rows in {report.chunks} chunks and "
+                f"{report.transactions} transactions "
+                f"({report.rows_per_second:,.0f} rows/s).")
+    return report
+
+
+def intraday_table_name(time_window: TradeTimeWindow) -> str:
+    """ Every intraday time window has its own table, e.g. ohlcv_5m """
+    if not time_window.is_intraday:
+        raise ValueError(f"{time_window.name} bars are stored in ohlcv_table.")
+    return f"ohlcv_{time_window.value.yfinance_notation}"
+
+
+def append_intraday_bars(
+        ohlcv_batch: OHLCVBatch,
+        chunk_size: int = INTRADAY_WRITE_CHUNK_SIZE_DEFAULT) -> None:
+    """ Appends bars to the table of their time window. Bars are only written
+    once they closed, so a bar that is stored already is left as it is
+    instead of being compared and updated """
+    table = intraday_table_name(ohlcv_batch.time_window)
+    with _connect() as connection:
+        insert = ("INSERT OR IGNORE" if connection.dialect.name == "sqlite"
+                  else "INSERT IGNORE")
+        query = text(f"""
+    {insert} INTO {table} (
+    {INTRADAY_TABLE_COLUMNS}
+    )
+    VALUES (
+        :symbol, :open_date, :open, :high, :low, :close, :volume
+    )""")
+
+        for values in ohlcv_batch.iter_parameter_chunks(chunk_size):
+            connection.execute(query, values)
+        _update_ingestion_watermarks(connection, ohlcv_batch)
+        connection.commit()
+    _notify_ohlcv_write_listeners(ohlcv_batch)
+
+
+def get_intraday_bars(symbols: List[str], time_window: TradeTimeWindow,
+                      start_open_date: Optional[int] = None,
+                      end_open_date: Optional[int] = None,
+                      chunk_size: int = READ_CHUNK_SIZE_DEFAULT) -> DataFrame:
+    """ Reads stored intraday bars in the layout of get_ohlcv_bars """
+    import pandas as pd
+
+    query = text(f"""
+                SELECT
+                    symbol,
+                    open_date,
+                    close,
+                    high,
+                    low,
+                    open,
+                    volume
+                FROM {intraday_table_name(time_window)}
+                WHERE open_date >= :start_open_date
+                AND open_date <= :end_open_date
+                AND symbol IN :symbols
+            """).bindparams(bindparam("symbols", expanding=True))
+
+    parameters: Dict[str, Any] = {
+        "start_open_date": start_open_date if start_open_date is not None else 0,
+        "end_open_date": (end_open_date if end_open_date is not None
+                          else MAX_OPEN_DATE)
+    }
+
+    if not symbols:
+        return pd.DataFrame(columns=["symbol", "time_window", "open_date", "close",
+                                     "high", "low", "open", "volume"])
+
+    frames = []
+    with _connect() as connection:
+        for start in range(0, len(symbols), chunk_size):
+            frames.append(pd.read_sql(
+                query, connection,
+                params={**parameters, "symbols": symbols[start:start + chunk_size]}))
+    data = pd.concat(frames, ignore_index=True)
+    data.insert(1, "time_window", time_window.value.yfinance_notation)
+    return data
+
+
+def _day_start(open_date: int) -> int:
+    return open_date - open_date % SECONDS_PER_DAY
+
+
+def _partition_start(open_date: int, by_month: bool) -> int:
+    if not by_month:
+        return _day_start(open_date)
+    day = time.gmtime(open_date)
+    return calendar.timegm((day.tm_year, day.tm_mon, 1, 0, 0, 0))
+
+
+def _next_partition_start(partition_start: int, by_month: bool) -> int:
+    if not by_month:
+        return partition_start + SECONDS_PER_DAY
+    # A day of the next month, whatever the length of this one
+    return _partition_start(partition_start + 32 * SECONDS_PER_DAY, by_month=True)
+
+
+def _intraday_partition_name(partition_start: int, by_month: bool) -> str:
+    return "p" + time.strftime("%Y%m" if by_month else "%Y%m%d",
+                               time.gmtime(partition_start))
+
+
+def _get_intraday_partition_bounds(connection: Any, table: str) -> Dict[str, int]:
+    """ Upper bound of every dated partition, leaving out the catch-all one """
+    result = connection.execute(text("""
+                SELECT
+                    PARTITION_NAME,
+                    PARTITION_DESCRIPTION
+                FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE()
+                AND TABLE_NAME = :table
+                AND PARTITION_NAME IS NOT NULL
+            """), {"table": table})
+    return {row[0]: int(row[1]) for row in result.fetchall()
+            if row[0] != INTRADAY_FUTURE_PARTITION}
+
+
+def _plan_intraday_partitions(bounds: Dict[str, int], from_open_date: int,
+                              until_open_date: int,
+                              by_month: bool) -> List[Tuple[str, int]]:
+    """ Names and upper bounds of the partitions to add after the existing
+    ones, up to the one holding until_open_date """
+    partition_start = (max(bounds.values()) if bounds
+                       else _partition_start(from_open_date, by_month))
+    partitions = []
+    while partition_start <= _partition_start(until_open_date, by_month):
+        next_start = _next_partition_start(partition_start, by_month)
+        partitions.append((_intraday_partition_name(partition_start, by_month),
+                           next_start))
+        partition_start = next_start
+    return partitions
+
+
+def create_intraday_partitions(time_window: TradeTimeWindow,
+                               from_open_date: int,
+                               until_open_date: int,
+                               by_month: bool = False) -> List[str]:
+    """ Splits one partition per UTC day, or per UTC month, off the catch-all
+    partition, up to the one holding until_open_date. A table without dated
+    partitions starts at from_open_date; its first partition also holds
+    anything older. Returns the partitions created; only MySQL tables are
+    partitioned. """
+    table = intraday_table_name(time_window)
+    with _connect() as connection:
+        if connection.dialect.name != "mysql":
+            return []
+        partitions = _plan_intraday_partitions(
+            _get_intraday_partition_bounds(connection, table),
+            from_open_date, until_open_date, by_month)
+        if not partitions:
+            return []
+        definitions = ",\n".join(
+            f"PARTITION {name} VALUES LESS THAN ({upper_bound})"
+            for name, upper_bound in partitions)
+        # The catch-all partition is empty unless bars arrived ahead of their
+        # partition, so reorganizing it moves little or no data
+        connection.execute(text(f"""
+    ALTER TABLE {table} REORGANIZE PARTITION {INTRADAY_FUTURE_PARTITION} INTO (
+    {definitions},
+    PARTITION {INTRADAY_FUTURE_PARTITION} VALUES LESS THAN MAXVALUE
+    )"""))
+    return [name for name, _ in partitions]
+
+
+def drop_intraday_partitions(time_window: TradeTimeWindow,
+                             before_open_date: int) -> List[str]:
+    """ Drops the partitions that ended by before_open_date. On MySQL this is
+    a metadata change whatever the number of bars; other databases delete
+    the rows of the days that ended. Returns the partitions dropped. """
+    table = intraday_table_name(time_window)
+    with _connect() as connection:
+        if connection.dialect.name != "mysql":
+            connection.execute(
+                text(f"DELETE FROM {table} WHERE open_date < :before_open_date"),
+                {"before_open_date": _day_start(before_open_date)})
+            connection.commit()
+            return []
+        expired = sorted(name for name, upper_bound in
+                         _get_intraday_partition_bounds(connection, table).items()
+                         if upper_bound <= before_open_date)
+        if expired:
+            connection.execute(text(
+                f"ALTER TABLE {table} DROP PARTITION {', '.join(expired)}"))
+    return expired
+
+
+def get_backfill_journal(run_id: str) -> DataFrame:
+    """ Returns the journal entries of a back fill run, one row per symbol """
+    import pandas as pd
+
+    query = text("""
+                SELECT
+                    symbol,
+                    status,
+                    attempts,
+                    last_error,
+                    next_attempt_at
+                FROM backfill_journal
+                WHERE run_id = :run_id
+            """)
+
+    with _connect() as connection:
+        return pd.read_sql(query, connection, params={"run_id": run_id})
+
+
+def add_backfill_journal_entries(run_id: str, symbols: List[str],
+                                 chunk_size: int = WRITE_CHUNK_SIZE_DEFAULT) -> None:
+    """ Adds the symbols to a back fill run as pending """
+    query = text("""
+    INSERT INTO backfill_journal (
+    run_id,
+    symbol,
+    status,
+    attempts,
+    last_error,
+    next_attempt_at,
+    updated_at
+    )
+    VALUES (
+        :run_id, :symbol, :status, 0, NULL, 0, :updated_at
+    )""")
+
+    updated_at = int(time.time())
+    with _connect() as connection:
+        for start in range(0, len(symbols), chunk_size):
+            connection.execute(query, [
+                {"run_id": run_id, "symbol": symbol, "updated_at": updated_at,
+                 "status": BackfillStatus.PENDING.value}
+                for symbol in symbols[start:start + chunk_size]])
+        connection.commit()
+
+
+def update_backfill_journal_entries(run_id: str, symbols: List[str],
+                                    status: BackfillStatus,
+                                    attempts: Optional[int] = None,
+                                    last_error: Optional[str] = None,
+                                    next_attempt_at: int = 0) -> None:
+    """ Sets the status of the symbols in a back fill run, keeping their
+    attempts unless given """
+    if not symbols:
+        return
+
+    query = text("""
+    UPDATE backfill_journal SET
+        status = :status,
+        attempts = COALESCE(:attempts, attempts),
+        last_error = :last_error,
+        next_attempt_at = :next_attempt_at,
+        updated_at = :updated_at
+    WHERE run_id = :run_id
+    AND symbol IN :symbols
+    """).bindparams(bindparam("symbols", expanding=True))
+
+    with _connect() as connection:
+        connection.execute(query, {
+            "run_id": run_id,
+            "symbols": symbols,
+            "status": status.value,
+            "attempts": attempts,
+            "last_error": last_error[:1024] if last_error else last_error,
+            "next_attempt_at": next_attempt_at,
+            "updated_at": int(time.time())
+        })
+        connection.commit()
+
+
+def delete_backfill_journal(run_id: str) -> None:
+    with _connect() as connection:
+        connection.execute(text("DELETE FROM backfill_journal WHERE run_id = :run_id"),
+                           {"run_id": run_id})
+        connection.commit()
+
+
+def get_indicator_states(symbols: List[str], time_window: TradeTimeWindow,
+                         chunk_size: int = READ_CHUNK_SIZE_DEFAULT) -> DataFrame:
+    """ Returns the persisted indicator states of the symbols """
+    import pandas as pd
+
+    if not symbols:
+        return pd.DataFrame(columns=["symbol", "indicator", "last_open_date", "state"])
+
+    query = text("""
+                SELECT
+                    symbol,
+                    indicator,
+                    last_open_date,
+                    state
+                FROM indicator_state
+                WHERE time_window = :time_window
+                AND symbol IN :symbols
+            """).bindparams(bindparam("symbols", expanding=True))
+
+    frames = []
+    with _connect() as connection:
+        for start in range(0, len(symbols), chunk_size):
+            frames.append(pd.read_sql(query, connection, params={
+                "time_window": time_window.value.yfinance_notation,
+                "symbols": symbols[start:start + chunk_size]}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def save_indicator_states(states: List[Dict[str, Any]], time_window: TradeTimeWindow,
+                          chunk_size: int = WRITE_CHUNK_SIZE_DEFAULT) -> None:
+    """ Upserts indicator states given as symbol, indicator, last_open_date
+    and state rows """
+    if not states:
+        return
+
+    time_window_notation = time_window.value.yfinance_notation
+    with _connect() as connection:
+        query = text(f"""
+    INSERT INTO indicator_state (
+    symbol,
+    time_window,
+    indicator,
+    last_open_date,
+    state
+    )
+    VALUES (
+        :symbol, :time_window, :indicator, :last_open_date, :state
+    ){_on_conflict_update(connection.dialect.name,
+                          ["symbol", "time_window", "indicator"],
+                          ["last_open_date", "state"])}""")
+        for start in range(0, len(states), chunk_size):
+            connection.execute(query, [{**state, "time_window": time_window_notation}
+                                       for state in states[start:start + chunk_size]])
+        connection.commit()
+
+
+def save_indicator_values(values: DataFrame, time_window: TradeTimeWindow,
+                          chunk_size: int = WRITE_CHUNK_SIZE_DEFAULT) -> None:
+    """ Upserts indicator values given as symbol, indicator, open_date and
+    value columns """
+    if values.shape[0] == 0:
+        return
+
+    time_window_notation = time_window.value.yfinance_notation
+    with _connect() as connection:
+        query = text(f"""
+    INSERT INTO indicator_values (
+    symbol,
+    time_window,
+    indicator,
+    open_date,
+    value
+    )
+    VALUES (
+        :symbol, :time_window, :indicator, :open_date, :value
+    ){_on_conflict_update(connection.dialect.name,
+                          ["symbol", "time_window", "indicator", "open_date"],
+                          ["value"])}""")
+        for start in range(0, values.shape[0], chunk_size):
+            chunk = values.iloc[start:start + chunk_size]
+            connection.execute(query, [
+                {"symbol": symbol, "time_window": time_window_notation,
+                 "indicator": indicator, "open_date": int(open_date),
+                 "value": float(value)}
+                for symbol, indicator, open_date, value in zip(
+                    chunk["symbol"], chunk["indicator"], chunk["open_date"],
+                    chunk["value"])])
         connection.commit()
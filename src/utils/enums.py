@@ -38,6 +38,12 @@ class TradedObjectType(Enum):
 
 class TradeTimeWindow(Enum):
     """ Time window of the market data point """
+    ONE_MINUTE = YFinanceTime(time_in_seconds=60,
+                              yfinance_notation="1m")
+    FIVE_MINUTES = YFinanceTime(time_in_seconds=60 * 5,
+                                yfinance_notation="5m")
+    ONE_HOUR = YFinanceTime(time_in_seconds=60 * 60,
+                            yfinance_notation="1h")
     DAILY = YFinanceTime(time_in_seconds=60 * 60 * 24,
                          yfinance_notation="1d")
     WEEKLY = YFinanceTime(time_in_seconds=60 * 60 * 24 * 7,
@@ -45,7 +51,7 @@ class TradeTimeWindow(Enum):
     MONTHLY = YFinanceTime(time_in_seconds=60 * 60 * 24 * 30,
                            yfinance_notation="1mo")
     THREE_MONTHS = YFinanceTime(time_in_seconds=60 * 60 * 24 * 30 * 3,
-                                yfinance_notation="1mo")
+                                yfinance_notation="3mo")
 
     @classmethod
     def get_trade_time_window_from_name(cls, trade_time_window_name: str):
@@ -56,6 +62,12 @@ class TradeTimeWindow(Enum):
 
         return TradeTimeWindow.DAILY
 
+    @property
+    def is_intraday(self) -> bool:
+        """ Intraday bars are stored apart from ohlcv_table """
+        return (self.value.time_in_seconds
+                < TradeTimeWindow.DAILY.value.time_in_seconds)
+
 
 class YFinanceIntervals(Enum):
     """ The different interval options to request data to yahoo finance """
@@ -79,3 +91,17 @@ class YFinanceIntervals(Enum):
                              yfinance_notation="10y")
     MAX = YFinanceTime(time_in_seconds=60 * 60 * 24 * 30 * 12 * 99,
                        yfinance_notation="max")
+
+
+class OHLCVWriteMode(Enum):
+    """ How market data points are written to ohlcv_table """
+    EXECUTEMANY = "executemany"
+    STAGING_TABLE = "staging_table"
+    LOAD_DATA_INFILE = "load_data_infile"
+
+
+class BackfillStatus(Enum):
+    """ State of a symbol in the back fill journal """
+    PENDING = "pending"
+    COMPLETED = "completed"
+    FAILED = "failed"
@@ -0,0 +1,158 @@
+import datetime as dt
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set
+from zoneinfo import ZoneInfo
+
+NYSE_TIMEZONE = ZoneInfo("America/New_York")
+REGULAR_OPEN_TIME = dt.time(9, 30)
+REGULAR_CLOSE_TIME = dt.time(16, 0)
+EARLY_CLOSE_TIME = dt.time(13, 0)
+# Closures announced for a single occasion, which no rule predicts
+NYSE_SPECIAL_CLOSURES: FrozenSet[dt.date] = frozenset({
+    dt.date(2001, 9, 11), dt.date(2001, 9, 12), dt.date(2001, 9, 13),
+    dt.date(2001, 9, 14),
+    dt.date(2004, 6, 11),
+    dt.date(2007, 1, 2),
+    dt.date(2012, 10, 29), dt.date(2012, 10, 30),
+    dt.date(2018, 12, 5),
+    dt.date(2025, 1, 9),
+})
+# Longest run of days without a session, holidays next to a weekend included
+_MAX_CLOSED_DAYS = 10
+
+
+@dataclass(frozen=True)
+class TradingSession:
+    """ Regular trading hours of one day, as epoch seconds """
+    date: dt.date
+    open_date: int
+    close_date: int
+
+    @property
+    def is_early_close(self) -> bool:
+        return self.close_date - self.open_date < 6.5 * 60 * 60
+
+
+def _observed(holiday: dt.date) -> dt.date:
+    """ Saturday holidays are taken on the Friday, Sunday ones on the Monday """
+    if holiday.weekday() == 5:
+        return holiday - dt.timedelta(days=1)
+    if holiday.weekday() == 6:
+        return holiday + dt.timedelta(days=1)
+    return holiday
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> dt.date:
+    """ n-th given weekday of a month, counted from the end when n is negative """
+    if n > 0:
+        first = dt.date(year, month, 1)
+        return first + dt.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = (dt.date(year + month // 12, month % 12 + 1, 1) - dt.timedelta(days=1))
+    return last - dt.timedelta(days=(last.weekday() - weekday) % 7 + 7 * (-n - 1))
+
+
+def _easter_sunday(year: int) -> dt.date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    m = (32 + 2 * e + 2 * i - h - k) % 7
+    n = (a + 11 * h + 22 * m) // 451
+    month, day = divmod(h + m - 7 * n + 114, 31)
+    return dt.date(year, month, day + 1)
+
+
+class MarketCalendar:
+    """ Trading sessions of the US equity exchanges, worked out offline.
+
+    Holidays and early closes follow the NYSE rules, which NASDAQ shares, so
+    no calendar service has to be reachable to tell whether a day should have
+    bars. Closures announced at short notice are listed in
+    `special_closures`; a closure missing there only shows up as a day
+    without bars.
+    """
+
+    def __init__(self, timezone: dt.tzinfo = NYSE_TIMEZONE,
+                 special_closures: FrozenSet[dt.date] = NYSE_SPECIAL_CLOSURES):
+        self.timezone = timezone
+        self.special_closures = special_closures
+        self._holidays: Dict[int, Set[dt.date]] = {}
+
+    def holidays(self, year: int) -> Set[dt.date]:
+        """ Weekdays of the year the exchanges are closed on """
+        holidays = self._holidays.get(year)
+        if holidays is None:
+            holidays = {
+                _nth_weekday(year, 2, 0, 3),
+                _easter_sunday(year) - dt.timedelta(days=2),
+                _nth_weekday(year, 5, 0, -1),
+                _observed(dt.date(year, 7, 4)),
+                _nth_weekday(year, 9, 0, 1),
+                _nth_weekday(year, 11, 3, 4),
+                _observed(dt.date(year, 12, 25)),
+            }
+            # A New Year's Day on a Saturday is not taken on the Friday before,
+            # which would close the last session of the previous year
+            new_years_day = dt.date(year, 1, 1)
+            if new_years_day.weekday() != 5:
+                holidays.add(_observed(new_years_day))
+            if year >= 1998:
+                holidays.add(_nth_weekday(year, 1, 0, 3))
+            if year >= 2022:
+                holidays.add(_observed(dt.date(year, 6, 19)))
+            holidays |= {closure for closure in self.special_closures
+                         if closure.year == year}
+            self._holidays[year] = holidays
+        return holidays
+
+    def is_trading_day(self, date: dt.date) -> bool:
+        return date.weekday() < 5 and date not in self.holidays(date.year)
+
+    def is_early_close(self, date: dt.date) -> bool:
+        """ The day before Independence Day, the day after Thanksgiving and
+        Christmas Eve close at 13:00 when they are trading days """
+        if not self.is_trading_day(date):
+            return False
+        return date in (dt.date(date.year, 7, 3),
+                        _nth_weekday(date.year, 11, 3, 4) + dt.timedelta(days=1),
+                        dt.date(date.year, 12, 24))
+
+    def session(self, date: dt.date) -> Optional[TradingSession]:
+        if not self.is_trading_day(date):
+            return None
+        close_time = EARLY_CLOSE_TIME if self.is_early_close(date) else REGULAR_CLOSE_TIME
+        return TradingSession(
+            date=date,
+            open_date=int(dt.datetime.combine(date, REGULAR_OPEN_TIME,
+                                              tzinfo=self.timezone).timestamp()),
+            close_date=int(dt.datetime.combine(date, close_time,
+                                               tzinfo=self.timezone).timestamp()))
+
+    def sessions(self, start: dt.date, end: dt.date) -> List[TradingSession]:
+        """ Sessions from start to end, both included """
+        sessions = []
+        date = start
+        while date <= end:
+            session = self.session(date)
+            if session is not None:
+                sessions.append(session)
+            date += dt.timedelta(days=1)
+        return sessions
+
+    def local_date(self, timestamp: float) -> dt.date:
+        return dt.datetime.fromtimestamp(timestamp, tz=self.timezone).date()
+
+    def next_session(self, timestamp: float) -> TradingSession:
+        """ The session in progress at the timestamp, or else the next one """
+        date = self.local_date(timestamp)
+        for offset in range(_MAX_CLOSED_DAYS + 1):
+            session = self.session(date + dt.timedelta(days=offset))
+            if session is not None and session.close_date > timestamp:
+                return session
+        raise ValueError(f"No session within {_MAX_CLOSED_DAYS} days of {date}.")
+
+    def is_open(self, timestamp: float) -> bool:
+        session = self.session(self.local_date(timestamp))
+        return session is not None and session.open_date <= timestamp < session.close_date
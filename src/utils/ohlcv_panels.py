@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from utils.data_models import OHLCVBatch, OHLCVPanel
+from utils.db_helpers import READ_CHUNK_SIZE_DEFAULT, add_ohlcv_write_listener, \
+    get_intraday_bars, get_ohlcv_bars, remove_ohlcv_write_listener
+from utils.enums import TradeTimeWindow
+from utils.ohlcv_store import OHLCVStore
+
+logger = logging.getLogger(__name__)
+
+PANEL_CACHE_MAX_BYTES_DEFAULT = 256 * 1024 * 1024
+
+PanelKey = Tuple[TradeTimeWindow, Tuple[str, ...], Optional[int], Optional[int]]
+
+
+@dataclass
+class _CachedPanel:
+    panel: OHLCVPanel
+    symbols: FrozenSet[str]
+    nbytes: int
+
+
+@dataclass
+class PanelCacheStats:
+    """ Hit and eviction counters of an OHLCVPanelReader """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    cached_bytes: int = 0
+
+
+class OHLCVPanelReader:
+    """ Loads date x symbol panels and keeps recent ones in an LRU cache.
+
+    Intraday panels are read from the table of their time window, the
+    others from the local store when there is one or from ohlcv_table.
+    The cache is bounded by the bytes of the panels it holds. Writes of bars
+    drop every cached panel of the same time window that shares a
+    symbol and overlaps the written dates. Cached panels are read only, as
+    they are handed to every caller asking for the same key.
+    """
+
+    def __init__(self, max_cache_bytes: int = PANEL_CACHE_MAX_BYTES_DEFAULT,
+                 ohlcv_store: Optional[OHLCVStore] = None,
+                 chunk_size: int = READ_CHUNK_SIZE_DEFAULT):
+        self.max_cache_bytes = max_cache_bytes
+        self.ohlcv_store = ohlcv_store
+        self.chunk_size = chunk_size
+        self.stats = PanelCacheStats()
+        self._cache: "OrderedDict[PanelKey, _CachedPanel]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a panel loaded meanwhile is not cached
+        self._generation = 0
+        add_ohlcv_write_listener(self.invalidate)
+
+    @classmethod
+    def from_environment(cls) -> "OHLCVPanelReader":
+        return cls(max_cache_bytes=int(os.environ.get(
+            "OHLCV_PANEL_CACHE_MAX_BYTES", PANEL_CACHE_MAX_BYTES_DEFAULT)),
+            ohlcv_store=OHLCVStore.from_environment())
+
+    def close(self) -> None:
+        remove_ohlcv_write_listener(self.invalidate)
+        self.clear()
+
+    def read_panel(self, symbols: List[str], time_window: TradeTimeWindow,
+                   start_open_date: Optional[int] = None,
+                   end_open_date: Optional[int] = None) -> OHLCVPanel:
+        key: PanelKey = (time_window, tuple(symbols), start_open_date, end_open_date)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats.hits += 1
+                return cached.panel
+            self.stats.misses += 1
+            generation = self._generation
+
+        panel = self._load(symbols, time_window, start_open_date, end_open_date)
+        for field in fields(panel):
+            value = getattr(panel, field.name)
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        self._put(key, _CachedPanel(panel=panel, symbols=frozenset(symbols),
+                                    nbytes=panel.nbytes), generation)
+        return panel
+
+    def invalidate(self, ohlcv_batch: OHLCVBatch) -> None:
+        """ Drops the cached panels a written batch makes stale """
+        if len(ohlcv_batch) == 0:
+            return
+        written_symbols = set(ohlcv_batch.symbols[np.unique(ohlcv_batch.symbol_codes)])
+        first_open_date = int(ohlcv_batch.open_date.min())
+        last_open_date = int(ohlcv_batch.open_date.max())
+        with self._lock:
+            self._generation += 1
+            stale_keys = [
+                key for key, cached in self._cache.items()
+                if key[0] == ohlcv_batch.time_window
+                and (key[2] is None or key[2] <= last_open_date)
+                and (key[3] is None or key[3] >= first_open_date)
+                and not cached.symbols.isdisjoint(written_symbols)]
+            for key in stale_keys:
+                self._drop(key)
+            self.stats.invalidations += len(stale_keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._cache):
+                self._drop(key)
+
+    def _load(self, symbols: List[str], time_window: TradeTimeWindow,
+              start_open_date: Optional[int],
+              end_open_date: Optional[int]) -> OHLCVPanel:
+        if time_window.is_intraday:
+            data = get_intraday_bars(symbols=symbols, time_window=time_window,
+                                     start_open_date=start_open_date,
+                                     end_open_date=end_open_date,
+                                     chunk_size=self.chunk_size)
+        elif self.ohlcv_store is not None:
+            data = self.ohlcv_store.read_through(symbols, time_window,
+                                                 start_open_date, end_open_date)
+        else:
+            data = get_ohlcv_bars(symbols=symbols, time_window=time_window,
+                                  start_open_date=start_open_date,
+                                  end_open_date=end_open_date,
+                                  chunk_size=self.chunk_size)
+        return OHLCVPanel.from_frame(data, symbols=symbols, time_window=time_window)
+
+    def _put(self, key: PanelKey, cached: _CachedPanel, generation: int) -> None:
+        if cached.nbytes > self.max_cache_bytes:
+            logger.info(f"Panel of {cached.nbytes} bytes exceeds the cache size, "
+                        f"not caching it.")
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._cache:
+                self._drop(key)
+            self._cache[key] = cached
+            self.stats.cached_bytes += cached.nbytes
+            while self.stats.cached_bytes > self.max_cache_bytes:
+                self._drop(next(iter(self._cache)))
+                self.stats.evictions += 1
+
+    def _drop(self, key: PanelKey) -> None:
+        self.stats.cached_bytes -= self._cache.pop(key).nbytes
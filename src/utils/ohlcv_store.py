@@ -0,0 +1,385 @@
+import argparse
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa  # type: ignore
+import pyarrow.compute as pc  # type: ignore
+import pyarrow.ipc as ipc  # type: ignore
+from pandas import DataFrame
+
+from utils.data_models import OHLCVBatch
+from utils.db_helpers import MAX_OPEN_DATE, get_ohlcv_bars, \
+    get_ohlcv_symbol_summary
+from utils.enums import TradeTimeWindow
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_BUCKETS_DEFAULT = 64
+MAX_PARTS_PER_BUCKET = 16
+MAX_LIST_ATTEMPTS = 3
+COVERAGE_FILE_NAME = "coverage.json"
+SORT_KEYS = [("symbol", "ascending"), ("open_date", "ascending")]
+
+OHLCV_STORE_SCHEMA = pa.schema([
+    ("symbol", pa.string()),
+    ("open_date", pa.int64()),
+    ("open", pa.float32()),
+    ("high", pa.float32()),
+    ("low", pa.float32()),
+    ("close", pa.float32()),
+    ("volume", pa.int64()),
+])
+
+OHLCV_STORE_COLUMNS = ["symbol", "time_window", "open_date", "close", "high",
+                       "low", "open", "volume"]
+
+
+@dataclass
+class StoreVerification:
+    """ Differences between the local store and ohlcv_table """
+    time_window: TradeTimeWindow
+    missing_symbols: List[str] = field(default_factory=list)
+    extra_symbols: List[str] = field(default_factory=list)
+    mismatched_symbols: List[str] = field(default_factory=list)
+
+    @property
+    def is_consistent(self) -> bool:
+        return not (self.missing_symbols or self.extra_symbols
+                    or self.mismatched_symbols)
+
+
+def symbol_bucket(symbol: str, number_of_buckets: int) -> int:
+    """ Stable across processes and hosts, unlike hash() """
+    return zlib.crc32(symbol.encode("utf-8")) % number_of_buckets
+
+
+class OHLCVStore:
+    """ Local columnar copy of ohlcv_table.
+
+    Bars are kept in uncompressed Arrow IPC files under
+    `<root>/time_window=<window>/bucket=<n>/`, so reads memory-map the files
+    instead of decoding them. Every write adds a new part file; when a bucket
+    has too many parts they are compacted into one, keeping the last version
+    of each (symbol, open_date).
+
+    `<root>/time_window=<window>/coverage.json` records, per symbol, the
+    open_date from which the store holds every bar of the database. Only sync
+    and read-through loads extend it; bars written by the collectors keep a
+    covered symbol up to date but do not make an uncovered one complete.
+    """
+
+    def __init__(self, root_path: str,
+                 number_of_buckets: int = SYMBOL_BUCKETS_DEFAULT):
+        self.root_path = Path(root_path)
+        self.number_of_buckets = number_of_buckets
+
+    @classmethod
+    def from_environment(cls) -> Optional["OHLCVStore"]:
+        root_path = os.environ.get("OHLCV_STORE_PATH")
+        if not root_path:
+            return None
+        return cls(root_path=root_path,
+                   number_of_buckets=int(os.environ.get(
+                       "OHLCV_STORE_BUCKETS", SYMBOL_BUCKETS_DEFAULT)))
+
+    def write(self, ohlcv_batch: OHLCVBatch) -> None:
+        if len(ohlcv_batch) == 0:
+            return
+        symbol_buckets = np.array([symbol_bucket(symbol, self.number_of_buckets)
+                                   for symbol in ohlcv_batch.symbols],
+                                  dtype=np.int32)
+        row_buckets = symbol_buckets[ohlcv_batch.symbol_codes]
+        for bucket in np.unique(row_buckets).tolist():
+            rows = np.flatnonzero(row_buckets == bucket)
+            table = self._to_table(ohlcv_batch, rows)
+            with self._bucket_lock(ohlcv_batch.time_window, bucket):
+                self._write_part(ohlcv_batch.time_window, bucket, table)
+                if len(self._list_parts(ohlcv_batch.time_window, bucket)) \
+                        > MAX_PARTS_PER_BUCKET:
+                    self._compact_locked(ohlcv_batch.time_window, bucket)
+
+    def read(self, symbols: List[str], time_window: TradeTimeWindow,
+             start_open_date: Optional[int] = None,
+             end_open_date: Optional[int] = None) -> DataFrame:
+        buckets: Dict[int, List[str]] = {}
+        for symbol in symbols:
+            buckets.setdefault(symbol_bucket(symbol, self.number_of_buckets),
+                               []).append(symbol)
+
+        tables = []
+        for bucket, bucket_symbols in buckets.items():
+            table = self._read_bucket(time_window, bucket)
+            if table is None:
+                continue
+            mask = pc.is_in(table["symbol"], value_set=pa.array(bucket_symbols))
+            if start_open_date is not None:
+                mask = pc.and_(mask, pc.greater_equal(table["open_date"],
+                                                      start_open_date))
+            if end_open_date is not None:
+                mask = pc.and_(mask, pc.less_equal(table["open_date"],
+                                                   end_open_date))
+            tables.append(table.filter(mask))
+        return self._to_frame(tables, time_window)
+
+    def read_through(self, symbols: List[str], time_window: TradeTimeWindow,
+                     start_open_date: Optional[int] = None,
+                     end_open_date: Optional[int] = None) -> DataFrame:
+        """ Reads from the store the symbols it holds every bar of back to
+        start_open_date, and loads the others from the database, keeping them
+        for the next read """
+        first_open_date = start_open_date if start_open_date is not None else 0
+        coverage = self.coverage(time_window)
+        missing_symbols = [symbol for symbol in symbols
+                           if coverage.get(symbol, MAX_OPEN_DATE) > first_open_date]
+        covered_symbols = sorted(set(symbols) - set(missing_symbols))
+        data = self.read(covered_symbols, time_window, start_open_date, end_open_date)
+        if missing_symbols:
+            logger.info(f"Loading {len(missing_symbols)} symbols the store does "
+                        f"not cover from the database.")
+            # Loaded up to the last bar, so the symbols are covered from
+            # first_open_date on whatever end_open_date is
+            stored = get_ohlcv_bars(symbols=missing_symbols, time_window=time_window,
+                                    start_open_date=start_open_date)
+            self.write(OHLCVBatch.from_frame(data=stored, time_window=time_window))
+            self._record_coverage(time_window, {symbol: first_open_date
+                                                for symbol in missing_symbols})
+            if end_open_date is not None:
+                stored = stored[stored["open_date"] <= end_open_date]
+            data = (pd.concat([data, stored[OHLCV_STORE_COLUMNS]],
+                              ignore_index=True)
+                    .sort_values(["symbol", "open_date"], ignore_index=True))
+        return data.reset_index(drop=True)
+
+    def sync(self, time_window: TradeTimeWindow) -> None:
+        """ Rebuilds every bucket of the time window from the database """
+        summary = get_ohlcv_symbol_summary(time_window)
+        buckets: Dict[int, List[str]] = {}
+        for symbol in summary["symbol"].tolist():
+            buckets.setdefault(symbol_bucket(symbol, self.number_of_buckets),
+                               []).append(symbol)
+
+        for bucket in range(self.number_of_buckets):
+            bucket_symbols = buckets.get(bucket, [])
+            # Locked before the database read: a write of the bucket in
+            # between would otherwise be unlinked with the parts it replaces.
+            # Writes waiting on the lock commit to the database first, so
+            # their parts land after this one and win over it.
+            with self._bucket_lock(time_window, bucket):
+                old_parts = self._list_parts(time_window, bucket)
+                stored = get_ohlcv_bars(symbols=bucket_symbols, time_window=time_window)
+                ohlcv_batch = OHLCVBatch.from_frame(data=stored, time_window=time_window)
+                table = self._to_table(ohlcv_batch, np.arange(len(ohlcv_batch)))
+                if table.num_rows:
+                    self._write_part(time_window, bucket, table)
+                for part in old_parts:
+                    part.unlink()
+            logger.info(f"Synced bucket {bucket + 1} of {self.number_of_buckets} "
+                        f"with {table.num_rows} bars.")
+        self._record_coverage(time_window, {symbol: 0 for symbol
+                                            in summary["symbol"].tolist()},
+                              replace=True)
+
+    def coverage(self, time_window: TradeTimeWindow) -> Dict[str, int]:
+        """ First open_date from which the store holds every bar, per symbol """
+        coverage_path = self._time_window_path(time_window) / COVERAGE_FILE_NAME
+        if not coverage_path.exists():
+            return {}
+        with open(coverage_path) as coverage_file:
+            return json.load(coverage_file)
+
+    def verify(self, time_window: TradeTimeWindow) -> StoreVerification:
+        """ Compares bar counts and last open_date per symbol with the database """
+        database_summary = get_ohlcv_symbol_summary(time_window).set_index("symbol")
+        store_summary = self.summary(time_window)
+
+        verification = StoreVerification(time_window=time_window)
+        verification.missing_symbols = sorted(
+            set(database_summary.index) - set(store_summary.index))
+        verification.extra_symbols = sorted(
+            set(store_summary.index) - set(database_summary.index))
+        common = database_summary.index.intersection(store_summary.index)
+        mismatched = (
+            (database_summary.loc[common, "bars"].to_numpy()
+             != store_summary.loc[common, "bars"].to_numpy())
+            | (database_summary.loc[common, "last_open_date"].to_numpy()
+               != store_summary.loc[common, "last_open_date"].to_numpy()))
+        verification.mismatched_symbols = sorted(common[mismatched].tolist())
+        return verification
+
+    def summary(self, time_window: TradeTimeWindow) -> DataFrame:
+        tables = [table for bucket in range(self.number_of_buckets)
+                  if (table := self._read_bucket(time_window, bucket)) is not None]
+        frame = self._to_frame(tables, time_window)
+        return frame.groupby("symbol").agg(bars=("open_date", "count"),
+                                           last_open_date=("open_date", "max"))
+
+    def compact(self, time_window: TradeTimeWindow) -> None:
+        for bucket in range(self.number_of_buckets):
+            with self._bucket_lock(time_window, bucket):
+                self._compact_locked(time_window, bucket)
+
+    def _time_window_path(self, time_window: TradeTimeWindow) -> Path:
+        return self.root_path / f"time_window={time_window.value.yfinance_notation}"
+
+    def _bucket_path(self, time_window: TradeTimeWindow, bucket: int) -> Path:
+        return self._time_window_path(time_window) / f"bucket={bucket:03d}"
+
+    def _record_coverage(self, time_window: TradeTimeWindow,
+                         first_open_dates: Dict[str, int],
+                         replace: bool = False) -> None:
+        """ Extends the coverage of the symbols back to the given open_dates,
+        or replaces the whole manifest """
+        time_window_path = self._time_window_path(time_window)
+        time_window_path.mkdir(parents=True, exist_ok=True)
+        with open(time_window_path / ".coverage.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                coverage = {} if replace else self.coverage(time_window)
+                for symbol, first_open_date in first_open_dates.items():
+                    coverage[symbol] = min(coverage.get(symbol, first_open_date),
+                                           int(first_open_date))
+                temporary_path = time_window_path / f".{COVERAGE_FILE_NAME}.tmp"
+                with open(temporary_path, "w") as coverage_file:
+                    json.dump(coverage, coverage_file)
+                os.replace(temporary_path, time_window_path / COVERAGE_FILE_NAME)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _bucket_lock(self, time_window: TradeTimeWindow,
+                     bucket: int) -> Iterator[None]:
+        # flock works across threads and processes writing the same bucket
+        bucket_path = self._bucket_path(time_window, bucket)
+        bucket_path.mkdir(parents=True, exist_ok=True)
+        with open(bucket_path / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _list_parts(self, time_window: TradeTimeWindow, bucket: int) -> List[Path]:
+        bucket_path = self._bucket_path(time_window, bucket)
+        if not bucket_path.exists():
+            return []
+        # Part names start with a nanosecond timestamp, so they sort by age
+        return sorted(bucket_path.glob("part-*.arrow"))
+
+    def _write_part(self, time_window: TradeTimeWindow, bucket: int,
+                    table: pa.Table) -> None:
+        bucket_path = self._bucket_path(time_window, bucket)
+        part_name = f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.arrow"
+        temporary_path = bucket_path / f".{part_name}.tmp"
+        with pa.OSFile(str(temporary_path), "wb") as sink:
+            with ipc.new_file(sink, OHLCV_STORE_SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(temporary_path, bucket_path / part_name)
+
+    def _compact_locked(self, time_window: TradeTimeWindow, bucket: int) -> None:
+        parts = self._list_parts(time_window, bucket)
+        if len(parts) <= 1:
+            return
+        table = self._read_bucket(time_window, bucket)
+        if table is not None:
+            self._write_part(time_window, bucket, table)
+        for part in parts:
+            part.unlink()
+
+    def _read_bucket(self, time_window: TradeTimeWindow,
+                     bucket: int) -> Optional[pa.Table]:
+        tables: List[pa.Table] = []
+        for attempt in range(MAX_LIST_ATTEMPTS):
+            parts = self._list_parts(time_window, bucket)
+            try:
+                tables = [ipc.open_file(pa.memory_map(str(part), "r")).read_all()
+                          for part in parts]
+                break
+            except FileNotFoundError:
+                # A compaction removed a part between listing and reading
+                if attempt == MAX_LIST_ATTEMPTS - 1:
+                    raise
+        if not tables:
+            return None
+        if len(tables) == 1:
+            return tables[0]
+        return self._deduplicate(pa.concat_tables(tables)).sort_by(SORT_KEYS)
+
+    @staticmethod
+    def _deduplicate(table: pa.Table) -> pa.Table:
+        """ Keeps the last written version of every (symbol, open_date) """
+        frame = pa.table({"symbol": table["symbol"],
+                          "open_date": table["open_date"]}).to_pandas()
+        keep = ~frame.duplicated(subset=["symbol", "open_date"], keep="last")
+        return table.filter(pa.array(keep.to_numpy()))
+
+    @staticmethod
+    def _to_table(ohlcv_batch: OHLCVBatch, rows: np.ndarray) -> pa.Table:
+        return pa.table({
+            "symbol": pa.array(ohlcv_batch.symbols[ohlcv_batch.symbol_codes[rows]]
+                               if len(rows) else [], type=pa.string()),
+            "open_date": pa.array(ohlcv_batch.open_date[rows], type=pa.int64()),
+            "open": pa.array(ohlcv_batch.open[rows].astype(np.float32, copy=False)),
+            "high": pa.array(ohlcv_batch.high[rows].astype(np.float32, copy=False)),
+            "low": pa.array(ohlcv_batch.low[rows].astype(np.float32, copy=False)),
+            "close": pa.array(ohlcv_batch.close[rows].astype(np.float32, copy=False)),
+            "volume": pa.array(ohlcv_batch.volume[rows], type=pa.int64()),
+        }, schema=OHLCV_STORE_SCHEMA).sort_by(SORT_KEYS)
+
+    @staticmethod
+    def _to_frame(tables: List[pa.Table], time_window: TradeTimeWindow) -> DataFrame:
+        table = (pa.concat_tables(tables) if tables
+                 else OHLCV_STORE_SCHEMA.empty_table())
+        # Buckets are sorted by symbol and open_date on their own; rows of a
+        # symbol stay contiguous but symbols are not ordered across buckets.
+        frame = table.to_pandas()
+        frame["time_window"] = time_window.value.yfinance_notation
+        return frame[OHLCV_STORE_COLUMNS]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Synchronise or verify the local OHLCV store.")
+    parser.add_argument("command", choices=["sync", "verify", "compact"])
+    parser.add_argument("--time-window", default="1d",
+                        help="yfinance notation of the time window, e.g. 1d")
+    parser.add_argument("--path", default=os.environ.get("OHLCV_STORE_PATH"),
+                        required=not os.environ.get("OHLCV_STORE_PATH"))
+    args = parser.parse_args()
+
+    store = OHLCVStore(root_path=args.path)
+    time_window = TradeTimeWindow.get_trade_time_window_from_name(args.time_window)
+
+    if args.command == "sync":
+        store.sync(time_window)
+    elif args.command == "compact":
+        store.compact(time_window)
+    else:
+        verification = store.verify(time_window)
+        if verification.is_consistent:
+            logger.info("Store is consistent with the database.")
+        else:
+            logger.error(f"Store differs from the database: "
+                         f"{len(verification.missing_symbols)} missing, "
+                         f"{len(verification.extra_symbols)} extra and "
+                         f"{len(verification.mismatched_symbols)} mismatched "
+                         f"symbols.")
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
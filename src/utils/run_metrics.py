@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import sentry_sdk
+
+logger = logging.getLogger(__name__)
+
+METRICS_SAMPLE_RATE_DEFAULT = 0.05
+METRIC_PREFIX = "ingestion"
+# Sampled spans kept for the JSON summary; later ones are only aggregated
+MAX_SPAN_RECORDS = 10_000
+
+_active = threading.local()
+
+
+@dataclass
+class StageTiming:
+    """ Aggregated wall time of one stage over a run """
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    errors: int = 0
+
+
+@dataclass
+class SpanRecord:
+    """ One sampled stage of one batch """
+    batch_index: int
+    stage: str
+    offset_seconds: float
+    duration_seconds: float
+    failed: bool
+
+
+class RunMetrics:
+    """ Stage timings and counters of an ingestion run.
+
+    Every span adds to the aggregated timing of its stage, which costs two
+    clock reads. Only a sampled share of batches keeps per-span records and
+    is traced in Sentry, as one transaction per batch with a child span per
+    stage, so the sample rate bounds the tracing overhead. The transaction is
+    sent once the caller finishes the batch. Summaries are written as JSON
+    and as a Prometheus textfile for the node exporter to pick up.
+    """
+
+    def __init__(self, run_name: str,
+                 sample_rate: float = METRICS_SAMPLE_RATE_DEFAULT,
+                 output_dir: Optional[str] = None,
+                 random_source: Callable[[], float] = random.random,
+                 clock: Callable[[], float] = time.perf_counter):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1.")
+        self.run_name = run_name
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self._random = random_source
+        self._clock = clock
+        self._started_at = clock()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StageTiming] = {}
+        self._counters: Dict[str, int] = {}
+        self._sampled_batches: Dict[int, bool] = {}
+        self._transactions: Dict[int, Any] = {}
+        self._spans: List[SpanRecord] = []
+
+    @classmethod
+    def from_environment(cls, run_name: str) -> "RunMetrics":
+        return cls(run_name=run_name,
+                   sample_rate=float(os.environ.get(
+                       "INGESTION_METRICS_SAMPLE_RATE",
+                       METRICS_SAMPLE_RATE_DEFAULT)),
+                   output_dir=os.environ.get("INGESTION_METRICS_DIR"))
+
+    def is_sampled(self, batch_index: int) -> bool:
+        """ Samples a batch on first sight and keeps the decision for its
+        later stages """
+        with self._lock:
+            sampled = self._sampled_batches.get(batch_index)
+            if sampled is None:
+                sampled = self._random() < self.sample_rate
+                self._sampled_batches[batch_index] = sampled
+            return sampled
+
+    @contextmanager
+    def span(self, stage: str, batch_index: Optional[int] = None) -> Iterator[None]:
+        """ Times a stage; counters and retries recorded inside are this run's """
+        sampled = batch_index is not None and self.is_sampled(batch_index)
+        previous, _active.metrics = getattr(_active, "metrics", None), self
+        started_at = self._clock()
+        failed = False
+        try:
+            if sampled:
+                with self._batch_transaction(batch_index or 0).start_child(
+                        op=f"{METRIC_PREFIX}.{stage}", name=stage):
+                    yield
+            else:
+                yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            _active.metrics = previous
+            duration = self._clock() - started_at
+            with self._lock:
+                timing = self._stages.setdefault(stage, StageTiming())
+                timing.count += 1
+                timing.total_seconds += duration
+                timing.max_seconds = max(timing.max_seconds, duration)
+                timing.errors += failed
+                if sampled and len(self._spans) < MAX_SPAN_RECORDS:
+                    self._spans.append(SpanRecord(
+                        batch_index=batch_index or 0, stage=stage,
+                        offset_seconds=started_at - self._started_at,
+                        duration_seconds=duration, failed=failed))
+
+    def finish_batch(self, batch_index: int) -> None:
+        """ Sends the transaction of a sampled batch after its last stage """
+        with self._lock:
+            transaction = self._transactions.pop(batch_index, None)
+        if transaction is not None:
+            transaction.finish()
+
+    def _batch_transaction(self, batch_index: int) -> Any:
+        # The stages of a batch may run on different threads, so the
+        # transaction is kept here rather than on the Sentry scope
+        with self._lock:
+            transaction = self._transactions.get(batch_index)
+            if transaction is None:
+                transaction = sentry_sdk.start_transaction(
+                    op=f"{METRIC_PREFIX}.batch", name=f"{self.run_name} batch",
+                    sampled=True)
+                transaction.set_tag("batch_index", batch_index)
+                self._transactions[batch_index] = transaction
+            return transaction
+
+    def increment(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + int(value)
+
+    def counter(self, counter: str) -> int:
+        with self._lock:
+            return self._counters.get(counter, 0)
+
+    def stage_timing(self, stage: str) -> StageTiming:
+        with self._lock:
+            return StageTiming(**asdict(self._stages.get(stage, StageTiming())))
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "run_name": self.run_name,
+                "elapsed_seconds": self._clock() - self._started_at,
+                "sample_rate": self.sample_rate,
+                "stages": {stage: asdict(timing)
+                           for stage, timing in sorted(self._stages.items())},
+                "counters": dict(sorted(self._counters.items())),
+                "sampled_spans": [asdict(span) for span in self._spans]
+            }
+
+    def to_prometheus(self) -> str:
+        """ Renders the run in the Prometheus text exposition format """
+        summary = self.summary()
+        labels = f'run="{self.run_name}"'
+        lines = [
+            f"# HELP {METRIC_PREFIX}_run_elapsed_seconds Wall time of the run.",
+            f"# TYPE {METRIC_PREFIX}_run_elapsed_seconds gauge",
+            f"{METRIC_PREFIX}_run_elapsed_seconds{{{labels}}} "
+            f"{summary['elapsed_seconds']:.6f}",
+            f"# HELP {METRIC_PREFIX}_run_finished_timestamp_seconds "
+            f"Time the summary was written.",
+            f"# TYPE {METRIC_PREFIX}_run_finished_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_run_finished_timestamp_seconds{{{labels}}} "
+            f"{time.time():.0f}"
+        ]
+        for field, name, metric_type, help_text in (
+                ("total_seconds", "stage_seconds_total", "counter",
+                 "Wall time spent in a stage."),
+                ("count", "stage_spans_total", "counter",
+                 "Spans recorded for a stage."),
+                ("errors", "stage_errors_total", "counter",
+                 "Spans of a stage that raised."),
+                ("max_seconds", "stage_max_seconds", "gauge",
+                 "Longest span of a stage.")):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            lines.extend(f'{METRIC_PREFIX}_{name}{{{labels},stage="{stage}"}} '
+                         f'{timing[field]}'
+                         for stage, timing in summary["stages"].items())
+        for counter, value in summary["counters"].items():
+            name = f"{METRIC_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self) -> None:
+        """ Writes <run_name>.json and <run_name>.prom to the output directory """
+        if self.output_dir is None:
+            return
+        output_dir = Path(self.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for suffix, content in (
+                ("json", json.dumps(self.summary(), indent=2)),
+                ("prom", self.to_prometheus())):
+            path = output_dir / f"{self.run_name}.{suffix}"
+            # The textfile collector may read at any time, so never expose a
+            # half written file
+            temporary_path = path.with_name(f".{path.name}.tmp")
+            temporary_path.write_text(content)
+            os.replace(temporary_path, path)
+        logger.info(f"Wrote run metrics of {self.run_name} to {output_dir}.")
+
+    def log_summary(self) -> None:
+        summary = self.summary()
+        stages = ", ".join(f"{stage} {timing['total_seconds']:.1f}s"
+                           for stage, timing in summary["stages"].items())
+        logger.info(f"Run {self.run_name} took {summary['elapsed_seconds']:.1f}s: "
+                    f"{stages}. Counters: {summary['counters']}.")
+
+
+def count_retry(retry_state: Any) -> None:
+    """ tenacity before_sleep hook counting retries in the active run """
+    metrics: Optional[RunMetrics] = getattr(_active, "metrics", None)
+    if metrics is not None:
+        metrics.increment("retries")
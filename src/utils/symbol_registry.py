@@ -0,0 +1,132 @@
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from utils.data_models import TradedObject
+from utils.enums import TradedObjectType
+
+_OBJECT_TYPES = list(TradedObjectType)
+
+
+def _interned(values: Iterable[Optional[str]]) -> np.ndarray:
+    return np.array([sys.intern(value or "") for value in values], dtype=object)
+
+
+class SymbolRegistry:
+    """ Dense integer IDs for the symbols of the traded universe.
+
+    The attributes of every symbol are kept in arrays indexed by its ID rather
+    than in one object per symbol. Strings are interned, so an exchange name
+    shared by tens of thousands of symbols is stored once, and lookups of
+    many symbols at a time go through one hash index.
+    """
+
+    def __init__(self, symbols: Sequence[str],
+                 names: Optional[Sequence[Optional[str]]] = None,
+                 exchanges: Optional[Sequence[Optional[str]]] = None,
+                 exchange_short_names: Optional[Sequence[Optional[str]]] = None,
+                 object_type_codes: Optional[np.ndarray] = None):
+        self.symbols = _interned(symbols)
+        self.names = _interned(names if names is not None else [""] * len(symbols))
+        self.exchanges = _interned(exchanges if exchanges is not None
+                                   else [""] * len(symbols))
+        self.exchange_short_names = _interned(
+            exchange_short_names if exchange_short_names is not None
+            else [""] * len(symbols))
+        self.object_type_codes = (np.asarray(object_type_codes, dtype=np.int8)
+                                  if object_type_codes is not None
+                                  else np.zeros(len(symbols), dtype=np.int8))
+        self._index = pd.Index(self.symbols)
+        if not self._index.is_unique:
+            raise ValueError("Symbols of a registry must be unique.")
+
+    @classmethod
+    def from_traded_objects(cls, traded_objects: Iterable[TradedObject]
+                            ) -> "SymbolRegistry":
+        return cls._from_records(
+            (traded_object.symbol, _OBJECT_TYPES.index(traded_object.object_type),
+             traded_object.name, traded_object.exchange,
+             traded_object.exchange_short_name)
+            for traded_object in traded_objects)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Optional[str]]]) -> "SymbolRegistry":
+        """ Registers the (name, symbol, exchange, exchange_short_name,
+        object_type) rows of traded_objects as they are read, without a
+        TradedObject per row """
+        type_codes: Dict[Optional[str], int] = {}
+
+        def type_code(type_name: Optional[str]) -> int:
+            if type_name not in type_codes:
+                type_codes[type_name] = _OBJECT_TYPES.index(
+                    TradedObjectType.get_traded_object_type_from_name(type_name or ""))
+            return type_codes[type_name]
+
+        return cls._from_records(
+            (symbol, type_code(type_name), name, exchange, exchange_short_name)
+            for name, symbol, exchange, exchange_short_name, type_name in rows)
+
+    @classmethod
+    def _from_records(cls, records: Iterable[Tuple[Any, ...]]) -> "SymbolRegistry":
+        """ Registers (symbol, object type code, name, exchange, exchange short
+        name) records in sorted order, so IDs are the same for the same
+        universe; a symbol listed under several object types keeps the first """
+        ordered = sorted(records, key=lambda record: (record[0], record[1]))
+        unique = [record for index, record in enumerate(ordered)
+                  if index == 0 or record[0] != ordered[index - 1][0]]
+        return cls(symbols=[record[0] for record in unique],
+                   names=[record[2] for record in unique],
+                   exchanges=[record[3] for record in unique],
+                   exchange_short_names=[record[4] for record in unique],
+                   object_type_codes=np.array([record[1] for record in unique],
+                                              dtype=np.int8))
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, symbol: object) -> bool:
+        return symbol in self._index
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.arange(len(self), dtype=np.int32)
+
+    def id_of(self, symbol: str) -> int:
+        """ Raises KeyError for a symbol that is not registered """
+        return int(self._index.get_loc(symbol))
+
+    def ids_of(self, symbols: Union[Sequence[str], np.ndarray, pd.Series]
+               ) -> np.ndarray:
+        """ IDs of many symbols at once, -1 for the ones not registered """
+        return self._index.get_indexer(symbols).astype(np.int32, copy=False)
+
+    def symbols_of(self, ids: np.ndarray) -> List[str]:
+        return self.symbols[ids].tolist()
+
+    def traded_object(self, symbol_id: int) -> TradedObject:
+        return TradedObject(name=self.names[symbol_id],
+                            symbol=self.symbols[symbol_id],
+                            exchange=self.exchanges[symbol_id],
+                            exchange_short_name=self.exchange_short_names[symbol_id],
+                            object_type=_OBJECT_TYPES[self.object_type_codes[symbol_id]])
+
+    def select(self, ids: np.ndarray) -> "SymbolRegistry":
+        """ Registry of a subset of the symbols, with IDs renumbered densely """
+        ids = np.sort(np.asarray(ids, dtype=np.int64))
+        return SymbolRegistry(symbols=self.symbols[ids], names=self.names[ids],
+                              exchanges=self.exchanges[ids],
+                              exchange_short_names=self.exchange_short_names[ids],
+                              object_type_codes=self.object_type_codes[ids])
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the arrays plus every distinct string they point to """
+        distinct_strings = {id(value): value for column in (
+            self.symbols, self.names, self.exchanges, self.exchange_short_names)
+            for value in column}
+        return int(sum(column.nbytes for column in (
+            self.symbols, self.names, self.exchanges, self.exchange_short_names,
+            self.object_type_codes))
+            + sum(sys.getsizeof(value) for value in distinct_strings.values()))